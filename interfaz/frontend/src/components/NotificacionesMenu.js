@@ -9,10 +9,14 @@ import {
   Divider,
   Box,
   CircularProgress,
-  Alert
+  Alert,
+  Button
 } from '@mui/material';
 import NotificationsIcon from '@mui/icons-material/Notifications';
 import apiClient from '../services/apiClient.js';
+import CONFIG from '../config.js';
+
+const TAMANO_PAGINA = 20;
 
 const NotificacionesMenu = () => {
   const [anchorEl, setAnchorEl] = useState(null);
@@ -20,17 +24,37 @@ const NotificacionesMenu = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [unreadCount, setUnreadCount] = useState(0);
+  const [siguiente, setSiguiente] = useState(null);
+  const [cargandoMas, setCargandoMas] = useState(false);
+  const [archivadas, setArchivadas] = useState(false);
 
   const open = Boolean(anchorEl);
 
-  // Cargar notificaciones
-  const cargarNotificaciones = async () => {
+  // Contador de la campana (no descarga las notificaciones)
+  const cargarNoLeidas = async () => {
+    try {
+      const res = await apiClient.get('/api/mis-notificaciones/no-leidas/count/');
+      setUnreadCount(res.data.no_leidas);
+    } catch (err) {
+      console.error('Error al cargar el contador de notificaciones:', err);
+    }
+  };
+
+  // Las archivadas son siempre leídas; el servidor no devuelve el campo
+  const marcarArchivadas = (lista, verArchivadas) =>
+    verArchivadas ? lista.map(n => ({ ...n, leida: true })) : lista;
+
+  // Cargar la primera página de notificaciones (más recientes primero)
+  const cargarNotificaciones = async (verArchivadas = archivadas) => {
     try {
       setLoading(true);
-      const res = await apiClient.get('/api/mis-notificaciones/');
-      setNotificaciones(res.data);
-      const noLeidas = res.data.filter(n => !n.leida).length;
-      setUnreadCount(noLeidas);
+      setError('');
+      const url = verArchivadas ? '/api/mis-notificaciones/archivadas/' : '/api/mis-notificaciones/';
+      const res = await apiClient.get(url, {
+        params: { page_size: TAMANO_PAGINA }
+      });
+      setNotificaciones(marcarArchivadas(res.data.results, verArchivadas));
+      setSiguiente(res.data.next);
     } catch (err) {
       setError('No se pudieron cargar las notificaciones.');
       console.error(err);
@@ -39,11 +63,29 @@ const NotificacionesMenu = () => {
     }
   };
 
+  // Cargar la página siguiente con el cursor que devolvió el servidor
+  const cargarMas = async () => {
+    if (!siguiente) return;
+    try {
+      setCargandoMas(true);
+      const res = await apiClient.get(siguiente);
+      setNotificaciones(prev => [...prev, ...marcarArchivadas(res.data.results, archivadas)]);
+      setSiguiente(res.data.next);
+    } catch (err) {
+      setError('No se pudieron cargar más notificaciones.');
+      console.error(err);
+    } finally {
+      setCargandoMas(false);
+    }
+  };
+
   // Abrir menú
   const handleClick = (event) => {
     setAnchorEl(event.currentTarget);
     if (!open) {
-      cargarNotificaciones();
+      setArchivadas(false);
+      cargarNotificaciones(false);
+      cargarNoLeidas();
     }
   };
 
@@ -52,17 +94,21 @@ const NotificacionesMenu = () => {
     setAnchorEl(null);
   };
 
+  // Alternar entre la bandeja y las leídas antiguas que se archivaron
+  const alternarArchivadas = () => {
+    setArchivadas(!archivadas);
+    cargarNotificaciones(!archivadas);
+  };
+
   // Marcar como leída al hacer clic
   const handleNotificacionClick = async (notificacion) => {
     if (!notificacion.leida) {
       try {
-        await apiClient.patch(`/api/notificaciones/${notificacion.id}/marcar-leida/`, {
-          leida: true
-        });
+        const res = await apiClient.patch(`/api/notificaciones/${notificacion.id}/marcar-leida/`);
         setNotificaciones(prev =>
           prev.map(n => n.id === notificacion.id ? { ...n, leida: true } : n)
         );
-        setUnreadCount(prev => prev - 1);
+        setUnreadCount(res.data.no_leidas);
       } catch (err) {
         console.error('Error al marcar como leída:', err);
       }
@@ -71,12 +117,64 @@ const NotificacionesMenu = () => {
     setAnchorEl(null);
   };
 
-  // Cargar al montar
+  // Marcar como leídas todas hasta la más reciente mostrada (un solo UPDATE)
+  const marcarTodasLeidas = async () => {
+    if (notificaciones.length === 0) return;
+    try {
+      const res = await apiClient.post('/api/mis-notificaciones/marcar-leidas/', {
+        hasta: notificaciones[0].fecha
+      });
+      setNotificaciones(prev => prev.map(n => ({ ...n, leida: true })));
+      setUnreadCount(res.data.no_leidas);
+    } catch (err) {
+      console.error('Error al marcar todas como leídas:', err);
+    }
+  };
+
+  // Eventos en tiempo real: el servidor avisa de cada notificación nueva
   useEffect(() => {
-    cargarNotificaciones();
-    // Actualizar cada 30 segundos
-    const interval = setInterval(cargarNotificaciones, 30000);
-    return () => clearInterval(interval);
+    let fuente = null;
+    let reintento = null;
+
+    let cerrado = false;
+
+    const conectar = async () => {
+      if (!localStorage.getItem('access_token')) return;
+      // EventSource no permite cabeceras: se pide un ticket de un solo uso
+      // para la URL, así el access token no queda en los logs
+      let ticket;
+      try {
+        const res = await apiClient.post('/api/eventos/ticket/');
+        ticket = res.data.ticket;
+      } catch (err) {
+        console.error('No se pudo abrir el canal de eventos:', err);
+        reintento = setTimeout(conectar, 30000);
+        return;
+      }
+      if (cerrado) return;
+      fuente = new EventSource(`${CONFIG.API_BASE_URL}/api/eventos/?ticket=${encodeURIComponent(ticket)}`);
+      // Al (re)conectar y si se perdieron eventos, se relee el contador
+      fuente.addEventListener('conectado', cargarNoLeidas);
+      fuente.addEventListener('recargar', cargarNoLeidas);
+      fuente.addEventListener('notificacion', () => setUnreadCount(prev => prev + 1));
+      // Leídas desde otra pestaña o dispositivo
+      fuente.addEventListener('no_leidas', (e) => setUnreadCount(JSON.parse(e.data).no_leidas));
+      // Conexión vencida o caída: reconectar con un ticket nuevo
+      const reconectar = () => {
+        fuente.close();
+        clearTimeout(reintento);
+        reintento = setTimeout(conectar, 5000);
+      };
+      fuente.addEventListener('expirado', reconectar);
+      fuente.onerror = reconectar;
+    };
+
+    conectar();
+    return () => {
+      cerrado = true;
+      clearTimeout(reintento);
+      if (fuente) fuente.close();
+    };
   }, []);
 
   return (
@@ -107,8 +205,11 @@ const NotificacionesMenu = () => {
           horizontal: 'right',
         }}
       >
-        <Box sx={{ p: 2, borderBottom: 1, borderColor: 'divider' }}>
-          <Typography variant="h6">Notificaciones</Typography>
+        <Box sx={{ p: 2, borderBottom: 1, borderColor: 'divider', display: 'flex', alignItems: 'center', justifyContent: 'space-between' }}>
+          <Typography variant="h6">{archivadas ? 'Archivadas' : 'Notificaciones'}</Typography>
+          <Button size="small" onClick={marcarTodasLeidas} disabled={archivadas || unreadCount === 0 || notificaciones.length === 0}>
+            Marcar todas como leídas
+          </Button>
         </Box>
 
         {error && (
@@ -122,7 +223,7 @@ const NotificacionesMenu = () => {
         ) : notificaciones.length === 0 ? (
           <Box sx={{ p: 3 }}>
             <Typography color="text.secondary" align="center">
-              No tienes notificaciones
+              {archivadas ? 'No tienes notificaciones archivadas' : 'No tienes notificaciones'}
             </Typography>
           </Box>
         ) : (
@@ -150,11 +251,22 @@ const NotificacionesMenu = () => {
           ))
         )}
 
+        {!loading && siguiente && (
+          <Box sx={{ p: 1, textAlign: 'center' }}>
+            <Button size="small" onClick={cargarMas} disabled={cargandoMas}>
+              {cargandoMas ? <CircularProgress size={16} /> : 'Ver más'}
+            </Button>
+          </Box>
+        )}
+
         <Divider />
-        <Box sx={{ p: 1, textAlign: 'center' }}>
+        <Box sx={{ p: 1, display: 'flex', alignItems: 'center', justifyContent: 'space-between' }}>
           <Typography variant="caption" color="text.secondary">
             Mostrando {notificaciones.length} notificación(es)
           </Typography>
+          <Button size="small" onClick={alternarArchivadas}>
+            {archivadas ? 'Volver a la bandeja' : 'Ver archivadas'}
+          </Button>
         </Box>
       </Menu>
     </>
@@ -105,28 +105,32 @@ const AgendarConsulta = () => {
   useEffect(() => {
     if (selected.medico && selectedDate) {
       setLoadingHorarios(true);
-      // Simulación de horarios disponibles (en producción: consulta API real)
-      setTimeout(() => {
-        const horas = ['08:00', '09:00', '10:00', '11:00', '14:00', '15:00', '16:00', '17:00'];
-        const eventos = horas.map((hora) => {
-          const [h, m] = hora.split(':');
-          const start = new Date(selectedDate);
-          start.setHours(parseInt(h), parseInt(m), 0);
-          const end = new Date(start);
-          end.setMinutes(end.getMinutes() + 45);
-
-          return {
+      const dia = [
+        selectedDate.getFullYear(),
+        String(selectedDate.getMonth() + 1).padStart(2, '0'),
+        String(selectedDate.getDate()).padStart(2, '0'),
+      ].join('-');
+      apiClient
+        .get(`/api/medicos/${selected.medico}/disponibilidad/`, {
+          params: { desde: dia, hasta: dia }
+        })
+        .then((res) => {
+          const eventos = res.data.turnos.map((turno) => ({
             title: 'Disponible',
-            start: start.toISOString(),
-            end: end.toISOString(),
+            start: turno.inicio,
+            end: turno.fin,
             backgroundColor: theme.palette.success.light,
             borderColor: theme.palette.success.main,
             allDay: false,
-          };
+          }));
+          setHorarios(eventos);
+          setLoadingHorarios(false);
+        })
+        .catch((err) => {
+          console.error('Error al cargar horarios:', err);
+          setError('No se pudieron cargar los horarios disponibles.');
+          setLoadingHorarios(false);
         });
-        setHorarios(eventos);
-        setLoadingHorarios(false);
-      }, 500);
     } else {
       setHorarios([]);
     }
@@ -29,10 +29,14 @@ import interactionPlugin from '@fullcalendar/interaction';
 import esLocale from '@fullcalendar/core/locales/es';
 import apiClient from '../services/apiClient.js';
 
+// Cada cuánto se piden los cambios de citas (/api/citas/cambios/)
+const INTERVALO_SINCRONIZACION_MS = 15000;
+
 const CalendarioCitas = () => {
   const theme = useTheme();
   const isMobile = useMediaQuery(theme.breakpoints.down('sm'));
   const calendarRef = useRef(null);
+  const tokenCambios = useRef(null);
   const [error, setError] = useState('');
   const [medicoFiltro, setMedicoFiltro] = useState('');
   const [medicos, setMedicos] = useState([]);
@@ -120,7 +124,12 @@ const CalendarioCitas = () => {
       };
       if (medicoFiltro) params.medico_id = medicoFiltro;
 
+      // El token se pide antes de cargar la ventana: ningún cambio queda entre ambos
+      const sincronizacion = await apiClient.get('/api/citas/cambios/', {
+        params: medicoFiltro ? { medico_id: medicoFiltro } : {},
+      });
       const response = await apiClient.get('/api/citas/medico/', { params });
+      tokenCambios.current = sincronizacion.data.token;
       successCallback(response.data);
     } catch (err) {
       console.error('Error al cargar citas:', err);
@@ -130,6 +139,34 @@ const CalendarioCitas = () => {
     }
   };
 
+  // Aplica al calendario solo lo que cambió desde la última sincronización
+  useEffect(() => {
+    const intervalo = setInterval(async () => {
+      if (!tokenCambios.current || !calendarRef.current) return;
+      try {
+        const params = { desde: tokenCambios.current };
+        if (medicoFiltro) params.medico_id = medicoFiltro;
+        const res = await apiClient.get('/api/citas/cambios/', { params });
+        const calendarApi = calendarRef.current.getApi();
+        res.data.eliminadas.forEach((id) => calendarApi.getEventById(String(id))?.remove());
+        res.data.citas.forEach((evento) => {
+          calendarApi.getEventById(String(evento.id))?.remove();
+          calendarApi.addEvent(evento);
+        });
+        tokenCambios.current = res.data.token;
+      } catch (err) {
+        if (err.response?.status === 410) {
+          // Demasiado atrasado: se recarga la ventana completa (y con ella el token)
+          tokenCambios.current = null;
+          calendarRef.current?.getApi().refetchEvents();
+        } else {
+          console.error('Error al sincronizar citas:', err);
+        }
+      }
+    }, INTERVALO_SINCRONIZACION_MS);
+    return () => clearInterval(intervalo);
+  }, [medicoFiltro]);
+
   // Al hacer clic en un slot vacío
   const handleDateSelect = (selectInfo) => {
     setSelectedDate(selectInfo);
@@ -176,6 +213,34 @@ const CalendarioCitas = () => {
     setFormCita({ ...formCita, [e.target.name]: e.target.value });
   };
 
+  // Las ocurrencias de una serie no tienen fila propia: al editarlas, moverlas
+  // o cancelarlas se guardan como cita con la fecha que reemplazan
+  const actualizarCita = (id, extendedProps, data) => {
+    if (extendedProps?.fecha_original) {
+      return apiClient.post(`/api/citas/series/${extendedProps.serie_id}/ocurrencias/`, {
+        ...data,
+        fecha_original: extendedProps.fecha_original,
+      });
+    }
+    return apiClient.put(`/api/citas/${id}/`, data, { headers: siNoCambio(extendedProps) });
+  };
+
+  // If-Match con la versión que se está viendo: si otro usuario cambió la
+  // cita entretanto, el servidor responde 412 en vez de pisar su cambio
+  const siNoCambio = (extendedProps) =>
+    extendedProps?.version ? { 'If-Match': `"${extendedProps.version}"` } : {};
+
+  // URL .ics para suscribir la agenda en Google Calendar, Outlook o el móvil
+  const copiarSuscripcion = async () => {
+    try {
+      const { data } = await apiClient.get('/api/citas/suscripcion/');
+      await navigator.clipboard.writeText(data.url);
+      showSnackbar('📋 Enlace del calendario copiado. Agrégalo como calendario por URL.', 'success');
+    } catch (err) {
+      showSnackbar('❌ No se pudo obtener el enlace del calendario.', 'error');
+    }
+  };
+
   const showSnackbar = (message, severity = 'success') => {
     setSnackbar({ open: true, message, severity });
   };
@@ -226,7 +291,7 @@ const CalendarioCitas = () => {
 
       if (isEditing && selectedEvent) {
         // Actualizar cita
-        response = await apiClient.put(`/api/citas/${selectedEvent.id}/`, data);
+        response = await actualizarCita(selectedEvent.id, selectedEvent.extendedProps, data);
         // Notificar al paciente si fue editada 
         await notificarPaciente(
           formCita.paciente,
@@ -244,6 +309,7 @@ const CalendarioCitas = () => {
             estado: response.data.estado,
             paciente_id: response.data.paciente,
             medico_id: response.data.medico,
+            version: response.data.version,
           },
           backgroundColor: response.data.estado === 'confirmada' ? '#4CAF50' : '#FF9800',
           borderColor: '#000',
@@ -297,7 +363,11 @@ const CalendarioCitas = () => {
 
   const handleDeleteCita = async () => {
     try {
-      await apiClient.delete(`/api/citas/${selectedEvent.id}/`);
+      if (selectedEvent.extendedProps?.fecha_original) {
+        await actualizarCita(selectedEvent.id, selectedEvent.extendedProps, { estado: 'cancelada' });
+      } else {
+        await apiClient.delete(`/api/citas/${selectedEvent.id}/`, { headers: siNoCambio(selectedEvent.extendedProps) });
+      }
       // Remover del calendario
       const calendarApi = calendarRef.current.getApi();
       const event = calendarApi.getEventById(selectedEvent.id);
@@ -353,7 +423,8 @@ const CalendarioCitas = () => {
         paciente: event.extendedProps.paciente_id,
       };
 
-      const response = await apiClient.put(`/api/citas/${citaId}/`, data);
+      const response = await actualizarCita(citaId, event.extendedProps, data);
+      if (response.data.version) event.setExtendedProp('version', response.data.version);
 
       // ✅ Notificar al paciente
       await notificarPaciente(
@@ -393,7 +464,7 @@ const CalendarioCitas = () => {
       const citas = res.data;
 
       for (const cita of citas) {
-        const citaFecha = new Date(cita.fecha_hora_propuesta);
+        const citaFecha = new Date(cita.start);
         const citaFin = new Date(citaFecha.getTime() + duracionMinutos * 60000);
 
         if (cita.id.toString() !== selectedEvent?.id?.toString()) { // No comparar con sí misma
@@ -445,6 +516,11 @@ const CalendarioCitas = () => {
         >
           🗓️ Agenda Médica
         </Typography>
+        {(userRole === 'medico' || userRole === 'paciente') && (
+          <Button variant="outlined" color="primary" onClick={copiarSuscripcion} sx={{ borderRadius: 2, ml: 'auto' }}>
+            Suscribirse
+          </Button>
+        )}
         <Button
           variant="contained"
           color="primary"
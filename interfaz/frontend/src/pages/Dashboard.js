@@ -29,25 +29,13 @@ export default function Dashboard() {
   useEffect(() => {
     const cargarStats = async () => {
       try {
-       
-        const [pacientesRes, medicosRes, citasRes, consultasRes] = await Promise.all([
-          apiClient.get(`${CONFIG.API_BASE_URL}/api/pacientes/`),
-          apiClient.get(`${CONFIG.API_BASE_URL}/api/medicos/`),
-          apiClient.get(`${CONFIG.API_BASE_URL}/api/citas/todas/`),
-          apiClient.get(`${CONFIG.API_BASE_URL}/api/consultas/`),
-        ]);
-        
-        console.log('Datos cargados:', {
-          pacientes: pacientesRes.data.length,
-          medicos: medicosRes.data.length,
-          citas: citasRes.data.length,
-          consultas: consultasRes.data.length,
-        });
+        // Totales calculados en el servidor (contadores), sin descargar las listas completas
+        const res = await apiClient.get(`${CONFIG.API_BASE_URL}/api/estadisticas/`);
         setStats({
-          pacientes: pacientesRes.data.length,
-          medicos: medicosRes.data.length,
-          citas: citasRes.data.length,
-          consultas: consultasRes.data.length,
+          pacientes: res.data.pacientes,
+          medicos: res.data.medicos,
+          citas: res.data.citas,
+          consultas: res.data.consultas,
         });
       } catch (err) {
         console.error('Error al cargar estadísticas:', err);
@@ -60,9 +60,19 @@ const DashboardMedico = () => {
 
     const cargarDatos = async () => {
       try {
-        // ✅ 1. Obtener citas del médico
-        const citasRes = await apiClient.get(`${CONFIG.API_BASE_URL}/api/citas/medico/`);
-        const citas = Array.isArray(citasRes.data) ? citasRes.data : [];
+        // ✅ 1. Resumen de la agenda (de hoy a 30 días): una fila por día, sin descargar las citas
+        const aISO = (fecha) => {
+          const local = new Date(fecha.getTime() - fecha.getTimezoneOffset() * 60000);
+          return local.toISOString().split('T')[0];
+        };
+        const inicioHoy = new Date();
+        const finVentana = new Date(inicioHoy.getTime() + 30 * 24 * 60 * 60 * 1000);
+        const resumenRes = await apiClient.get(`${CONFIG.API_BASE_URL}/api/citas/resumen/`, {
+          params: { desde: aISO(inicioHoy), hasta: aISO(finVentana) },
+        });
+        const periodos = resumenRes.data?.periodos || [];
+        // Las canceladas no ocupan la agenda
+        const activas = (periodo) => periodo.total - (periodo.por_estado?.cancelada || 0);
 
         // ✅ 2. Obtener consultas del médico
         const consultasRes = await apiClient.get(`${CONFIG.API_BASE_URL}/api/consultas/`);
@@ -78,10 +88,10 @@ const DashboardMedico = () => {
         const pacientesIds = new Set(consultas.map(c => c.paciente));
         const totalPacientes = pacientesIds.size;
 
-        // ✅ 4. Filtrar citas por fecha
-        const hoy = new Date().toISOString().split('T')[0];
-        const citasHoy = citas.filter(c => c.fecha_hora_propuesta?.includes(hoy)).length;
-        const proximasCitas = citas.filter(c => c.fecha_hora_propuesta > hoy).length;
+        // ✅ 4. Citas de hoy y de los próximos 30 días
+        const hoy = aISO(inicioHoy);
+        const citasHoy = periodos.filter(p => p.fecha === hoy).reduce((suma, p) => suma + activas(p), 0);
+        const proximasCitas = periodos.reduce((suma, p) => suma + activas(p), 0);
 
         // ✅ 5. Últimas 3 consultas
         const ultimasConsultas = consultas
@@ -0,0 +1,286 @@
+# api/busqueda.py
+import math
+import re
+import threading
+import time
+import unicodedata
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Paciente
+
+# Umbral de similitud (fracción de trigramas de la búsqueda presentes en el
+# paciente). 0.5 tolera una o dos letras cambiadas en apellidos comunes.
+UMBRAL_SIMILITUD = 0.5
+LIMITE_RESULTADOS = 20
+
+# Índice GIN de trigramas sobre una sola expresión con todos los campos
+# buscables (migraciones 0014 y 0028). Si pg_trgm no está instalado el índice
+# no existe y se usa el índice en memoria de más abajo. translate() quita los
+# acentos igual que normalizar() y, a diferencia de unaccent(), es IMMUTABLE y
+# no necesita otra extensión. Debe coincidir carácter a carácter con la
+# expresión de la migración 0028 para que el planificador use el índice.
+INDICE_TRGM = 'paciente_busqueda_trgm_idx'
+EXPRESION_BUSQUEDA = (
+    "translate(lower(nombre || ' ' || apellido || ' ' || dni || ' ' || coalesce(telefono, '')), "
+    "'ÁÀÂÄÃÅÉÈÊËÍÌÎÏÓÒÔÖÕÚÙÛÜÝÑÇáàâäãåéèêëíìîïóòôöõúùûüýÿñç', "
+    "'aaaaaaeeeeiiiiooooouuuuyncaaaaaaeeeeiiiiooooouuuuyync')"
+)
+
+CLAVE_VERSION_INDICE = 'busqueda:pacientes:version'
+# Paciente cambiado en cada versión: los procesos rezagados los releen en vez
+# de reconstruir el índice. Si falta alguno (expiró, o fue una invalidación
+# masiva) se reconstruye.
+CLAVE_CAMBIO_INDICE = 'busqueda:pacientes:cambio:{}'
+DURACION_CAMBIO = 24 * 60 * 60
+MAX_CAMBIOS_PENDIENTES = 5000
+
+
+_NO_ALFANUMERICO = re.compile(r'[\W_]+')
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y solo letras/dígitos separados por espacios."""
+    texto = texto or ''
+    if not texto.isascii():
+        texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+    return _NO_ALFANUMERICO.sub(' ', texto.lower()).strip()
+
+
+@lru_cache(maxsize=50_000)
+def _trigramas_palabra(palabra):
+    palabra = f'  {palabra} '
+    return frozenset(palabra[i:i + 3] for i in range(len(palabra) - 2))
+
+
+def trigramas(texto, normalizado=False):
+    """Trigramas al estilo de pg_trgm: cada palabra se rellena con dos espacios delante y uno detrás."""
+    palabras = (texto if normalizado else normalizar(texto)).split()
+    return set().union(*map(_trigramas_palabra, palabras))
+
+
+# === PostgreSQL con pg_trgm ===
+
+_trgm_disponible = {}
+
+
+def trgm_disponible():
+    """Indica (una vez por proceso) si existe el índice de trigramas en la base de datos."""
+    alias = connection.alias
+    if alias not in _trgm_disponible:
+        disponible = False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [INDICE_TRGM])
+                disponible = cursor.fetchone() is not None
+        _trgm_disponible[alias] = disponible
+    return _trgm_disponible[alias]
+
+
+def _buscar_trgm(texto, limite):
+    # Misma normalización que el índice en memoria: sin acentos ni signos
+    consulta = normalizar(texto)
+    if not consulta:
+        return []
+    dni = texto.strip().lower()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # SET LOCAL: el umbral vale solo para esta transacción
+            cursor.execute(
+                "SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(UMBRAL_SIMILITUD)]
+            )
+        # `<%` usa el índice GIN; el DNI exacto va siempre primero
+        return list(Paciente.objects.raw(
+            f"""
+            SELECT *, word_similarity(%s, {EXPRESION_BUSQUEDA})
+                      + CASE WHEN lower(dni) = %s THEN 1 ELSE 0 END AS similitud
+            FROM api_paciente
+            WHERE %s <%% {EXPRESION_BUSQUEDA}
+            ORDER BY similitud DESC, id
+            LIMIT %s
+            """,
+            [consulta, dni, consulta, limite],
+        ))
+
+
+# === Índice de n-gramas en memoria (SQLite / PostgreSQL sin pg_trgm) ===
+
+class IndicePacientes:
+    """
+    Índice invertido trigrama → ids de pacientes.
+
+    Las listas de ids solo sirven para elegir candidatos: pueden contener ids
+    de pacientes editados o eliminados, y la puntuación final se calcula con
+    los datos vigentes de ``documentos``.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.postings = {}
+        self.documentos = {}  # id → (palabras, dni, trigramas)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def construir(cls, version):
+        indice = cls(version)
+        filas = Paciente.objects.values_list('id', 'nombre', 'apellido', 'dni', 'telefono')
+        for fila in filas.iterator(chunk_size=5000):
+            indice._agregar(*fila)
+        return indice
+
+    def _agregar(self, paciente_id, nombre, apellido, dni, telefono):
+        dni = normalizar(dni)
+        texto = f'{normalizar(nombre)} {normalizar(apellido)} {dni} {normalizar(telefono)}'
+        grupos = trigramas(texto, normalizado=True)
+        anterior = self.documentos.get(paciente_id)
+        nuevos = grupos - anterior[2] if anterior else grupos
+        postings = self.postings
+        for grupo in nuevos:
+            lista = postings.get(grupo)
+            if lista is None:
+                postings[grupo] = [paciente_id]
+            else:
+                lista.append(paciente_id)
+        self.documentos[paciente_id] = (texto.split(), dni, grupos)
+
+    def actualizar(self, paciente):
+        with self.lock:
+            self._agregar(paciente.pk, paciente.nombre, paciente.apellido, paciente.dni, paciente.telefono)
+
+    def eliminar(self, paciente_id):
+        with self.lock:
+            self.documentos.pop(paciente_id, None)
+
+    def aplicar(self, ids, version):
+        """Relee los pacientes que cambiaron en otros procesos y deja el índice en ``version``."""
+        vigentes = {
+            fila[0]: fila
+            for fila in Paciente.objects.filter(pk__in=ids).values_list('id', 'nombre', 'apellido', 'dni', 'telefono')
+        }
+        with self.lock:
+            for paciente_id in ids:
+                if paciente_id in vigentes:
+                    self._agregar(*vigentes[paciente_id])
+                else:
+                    self.documentos.pop(paciente_id, None)
+            self.version = version
+
+    def buscar(self, texto, limite):
+        dni_consulta = normalizar(texto)
+        consulta = trigramas(dni_consulta, normalizado=True)
+        if not consulta:
+            return []
+        palabras_consulta = dni_consulta.split()
+        minimo = math.ceil(UMBRAL_SIMILITUD * len(consulta))
+
+        with self.lock:
+            # Quien comparta `minimo` trigramas con la búsqueda aparece en al menos
+            # una de las (total - minimo + 1) listas más cortas: las listas de
+            # trigramas muy comunes ("  m", "ez ") nunca se recorren.
+            listas = sorted((self.postings.get(grupo, ()) for grupo in consulta), key=len)
+            candidatos = set()
+            for lista in listas[:len(consulta) - minimo + 1]:
+                candidatos.update(lista)
+
+            resultados = []
+            for paciente_id in candidatos:
+                documento = self.documentos.get(paciente_id)
+                if documento is None:
+                    continue
+                palabras, dni, grupos = documento
+                similitud = len(consulta & grupos) / len(consulta)
+                if similitud < UMBRAL_SIMILITUD:
+                    continue
+                # Los prefijos exactos pesan más que las coincidencias aproximadas
+                if all(any(p.startswith(q) for p in palabras) for q in palabras_consulta):
+                    similitud += 0.5
+                if dni == dni_consulta:
+                    similitud += 1
+                resultados.append((-similitud, paciente_id))
+
+        resultados.sort()
+        return [(paciente_id, -puntaje) for puntaje, paciente_id in resultados[:limite]]
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def _version_indice():
+    version = cache.get(CLAVE_VERSION_INDICE)
+    if version is None:
+        cache.add(CLAVE_VERSION_INDICE, time.time_ns(), timeout=None)
+        version = cache.get(CLAVE_VERSION_INDICE)
+    return version
+
+
+def _ponerse_al_dia(indice, version):
+    """Aplica al índice los cambios registrados entre su versión y ``version``, si están todos."""
+    pendientes = version - indice.version
+    if not 0 < pendientes <= MAX_CAMBIOS_PENDIENTES:
+        return
+    claves = [CLAVE_CAMBIO_INDICE.format(v) for v in range(indice.version + 1, version + 1)]
+    cambios = cache.get_many(claves)
+    if len(cambios) == len(claves):
+        indice.aplicar(set(cambios.values()), version)
+
+
+def indice_pacientes():
+    """
+    Índice en memoria del proceso. Si otro proceso cambió pacientes, se
+    releen solo esos; se reconstruye entero únicamente tras una operación
+    masiva o si los cambios pendientes ya no están en el caché.
+    """
+    global _indice
+    version = _version_indice()
+    with _indice_lock:
+        if _indice is not None and _indice.version != version:
+            _ponerse_al_dia(_indice, version)
+        if _indice is None or _indice.version != version:
+            _indice = IndicePacientes.construir(version)
+        return _indice
+
+
+def invalidar_indice_pacientes(paciente=None, eliminado=False):
+    """
+    Incrementa la versión del índice y registra qué ``paciente`` cambió, para
+    que los demás procesos lo relean. Si el índice de este proceso estaba al
+    día, se le aplica el cambio directamente. Sin ``paciente`` (p. ej. tras un
+    bulk_create) todos los procesos lo reconstruyen.
+    """
+    try:
+        nueva = cache.incr(CLAVE_VERSION_INDICE)
+    except ValueError:
+        cache.set(CLAVE_VERSION_INDICE, time.time_ns(), timeout=None)
+        return
+    if paciente is not None:
+        cache.set(CLAVE_CAMBIO_INDICE.format(nueva), paciente.pk, timeout=DURACION_CAMBIO)
+    indice = _indice
+    if paciente is None or indice is None or indice.version != nueva - 1:
+        return
+    if eliminado:
+        indice.eliminar(paciente.pk)
+    else:
+        indice.actualizar(paciente)
+    indice.version = nueva
+
+
+def buscar_pacientes(texto, limite=LIMITE_RESULTADOS):
+    """
+    Búsqueda aproximada por nombre, apellido, DNI y teléfono, ordenada por
+    similitud. Devuelve pacientes con el atributo ``similitud``.
+    """
+    if trgm_disponible():
+        return _buscar_trgm(texto, limite)
+
+    ranking = indice_pacientes().buscar(texto, limite)
+    pacientes = Paciente.objects.in_bulk([paciente_id for paciente_id, _ in ranking])
+    resultado = []
+    for paciente_id, similitud in ranking:
+        paciente = pacientes.get(paciente_id)
+        if paciente is not None:
+            paciente.similitud = similitud
+            resultado.append(paciente)
+    return resultado
@@ -0,0 +1,232 @@
+# api/busqueda_clinica.py
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db import connection, connections, transaction
+from django.db.models import F, Q, TextField, Value
+
+from .models import AntecedenteMedico, Cita, Consulta, Diagnostico, DocumentoClinico, Medico, Paciente, Tratamiento
+
+CONFIGURACION = 'spanish'  # Incluida en PostgreSQL: quita acentos y reduce a la raíz
+INDICE_GIN = 'documento_vector_gin_idx'
+LONGITUD_FRAGMENTO = 160
+
+CAMPOS_ANTECEDENTE = [
+    ('enfermedades_cronicas', 'Enfermedades crónicas'),
+    ('cirugias_previas', 'Cirugías previas'),
+    ('alergias', 'Alergias'),
+    ('medicamentos_actuales', 'Medicamentos actuales'),
+    ('antecedentes_familiares', 'Antecedentes familiares'),
+]
+
+
+def texto_completo_disponible():
+    return connection.vendor == 'postgresql'
+
+
+# === Texto de cada tipo de documento ===
+
+def _unir(*partes):
+    return '\n'.join(parte for parte in partes if parte)
+
+
+def texto_tratamiento(descripcion, indicaciones):
+    return _unir(descripcion, indicaciones)
+
+
+def texto_antecedente(valores):
+    return _unir(*(f'{etiqueta}: {valores[campo]}' for campo, etiqueta in CAMPOS_ANTECEDENTE if valores.get(campo)))
+
+
+def documento_consulta(consulta):
+    return {
+        'paciente_id': consulta.paciente_id, 'medico_id': consulta.medico_id,
+        'consulta_id': consulta.pk, 'fecha': consulta.fecha, 'texto': consulta.motivo or '',
+    }
+
+
+def documento_diagnostico(diagnostico):
+    consulta = diagnostico.consulta
+    return {
+        'paciente_id': consulta.paciente_id, 'medico_id': consulta.medico_id,
+        'consulta_id': consulta.pk, 'fecha': diagnostico.fecha, 'texto': diagnostico.descripcion or '',
+    }
+
+
+def documento_tratamiento(tratamiento):
+    consulta = Consulta.objects.filter(diagnosticos__id=tratamiento.diagnostico_id).values(
+        'id', 'paciente_id', 'medico_id'
+    ).first()
+    return {
+        'paciente_id': consulta['paciente_id'], 'medico_id': consulta['medico_id'],
+        'consulta_id': consulta['id'], 'fecha': tratamiento.fecha_inicio,
+        'texto': texto_tratamiento(tratamiento.descripcion, tratamiento.indicaciones),
+    }
+
+
+def documento_antecedente(antecedente):
+    valores = {campo: getattr(antecedente, campo) for campo, _ in CAMPOS_ANTECEDENTE}
+    return {
+        'paciente_id': antecedente.paciente_id, 'medico_id': None, 'consulta_id': None,
+        'fecha': antecedente.fecha_registro.date(), 'texto': texto_antecedente(valores),
+    }
+
+
+DOCUMENTO_POR_TIPO = {
+    'consulta': documento_consulta,
+    'diagnostico': documento_diagnostico,
+    'tratamiento': documento_tratamiento,
+    'antecedente': documento_antecedente,
+}
+
+
+# === Mantenimiento del índice ===
+
+def indexar(tipo, instancia):
+    """Crea o actualiza el documento de ``instancia`` (misma transacción que el guardado)."""
+    datos = DOCUMENTO_POR_TIPO[tipo](instancia)
+    if texto_completo_disponible():
+        datos['vector'] = SearchVector(Value(datos['texto'], output_field=TextField()), config=CONFIGURACION)
+    DocumentoClinico.objects.update_or_create(tipo=tipo, objeto_id=instancia.pk, defaults=datos)
+
+
+def desindexar(tipo, objeto_id):
+    DocumentoClinico.objects.filter(tipo=tipo, objeto_id=objeto_id).delete()
+
+
+def _filas_por_tipo(using):
+    """Genera (tipo, objeto_id, datos) leyendo las tablas de origen con values_list."""
+    for pk, paciente_id, medico_id, fecha, motivo in Consulta.objects.using(using).values_list(
+        'id', 'paciente_id', 'medico_id', 'fecha', 'motivo'
+    ).iterator(chunk_size=5000):
+        yield 'consulta', pk, (paciente_id, medico_id, pk, fecha, motivo or '')
+
+    diagnosticos = Diagnostico.objects.using(using).values_list(
+        'id', 'consulta_id', 'consulta__paciente_id', 'consulta__medico_id', 'fecha', 'descripcion'
+    )
+    for pk, consulta_id, paciente_id, medico_id, fecha, descripcion in diagnosticos.iterator(chunk_size=5000):
+        yield 'diagnostico', pk, (paciente_id, medico_id, consulta_id, fecha, descripcion or '')
+
+    tratamientos = Tratamiento.objects.using(using).values_list(
+        'id', 'diagnostico__consulta_id', 'diagnostico__consulta__paciente_id',
+        'diagnostico__consulta__medico_id', 'fecha_inicio', 'descripcion', 'indicaciones',
+    )
+    for pk, consulta_id, paciente_id, medico_id, fecha, *texto in tratamientos.iterator(chunk_size=5000):
+        yield 'tratamiento', pk, (paciente_id, medico_id, consulta_id, fecha, texto_tratamiento(*texto))
+
+    campos = [campo for campo, _ in CAMPOS_ANTECEDENTE]
+    antecedentes = AntecedenteMedico.objects.using(using).values('id', 'paciente_id', 'fecha_registro', *campos)
+    for valores in antecedentes.iterator(chunk_size=5000):
+        yield 'antecedente', valores['id'], (
+            valores['paciente_id'], None, None, valores['fecha_registro'].date(), texto_antecedente(valores),
+        )
+
+
+def reconstruir_documentos(lote=5000, using='default'):
+    """
+    Vuelve a generar toda la tabla de documentos desde las tablas de origen.
+    Necesario tras cargas masivas (bulk_create no dispara señales).
+    """
+    totales = {tipo: 0 for tipo, _ in DocumentoClinico.TIPO_CHOICES}
+    with transaction.atomic(using=using):
+        DocumentoClinico.objects.using(using).all().delete()
+        filas = []
+        for tipo, objeto_id, (paciente_id, medico_id, consulta_id, fecha, texto) in _filas_por_tipo(using):
+            filas.append(DocumentoClinico(
+                tipo=tipo, objeto_id=objeto_id, paciente_id=paciente_id, medico_id=medico_id,
+                consulta_id=consulta_id, fecha=fecha, texto=texto,
+            ))
+            totales[tipo] += 1
+            if len(filas) >= lote:
+                DocumentoClinico.objects.using(using).bulk_create(filas)
+                filas = []
+        DocumentoClinico.objects.using(using).bulk_create(filas)
+
+        # Un solo UPDATE calcula todos los tsvector en la base de datos
+        if connections[using].vendor == 'postgresql':
+            DocumentoClinico.objects.using(using).update(vector=SearchVector('texto', config=CONFIGURACION))
+    return totales
+
+
+# === Búsqueda ===
+
+def documentos_visibles(usuario):
+    """
+    Documentos que puede ver ``usuario``: todo para administradores; para un
+    médico, los de los pacientes que ha atendido o tiene agendados; para un
+    paciente, solo los suyos. None si no tiene acceso.
+    """
+    documentos = DocumentoClinico.objects.all()
+    if usuario.is_staff:
+        return documentos
+    try:
+        medico = usuario.medico
+    except Medico.DoesNotExist:
+        pass
+    else:
+        atendidos = Consulta.objects.filter(medico=medico).values('paciente_id')
+        agendados = Cita.objects.filter(medico=medico).values('paciente_id')
+        return documentos.filter(Q(paciente_id__in=atendidos) | Q(paciente_id__in=agendados))
+    try:
+        return documentos.filter(paciente=usuario.paciente)
+    except Paciente.DoesNotExist:
+        return None
+
+
+def buscar_documentos(documentos, texto):
+    """
+    Filtra ``documentos`` por ``texto`` y anota ``relevancia`` y ``fragmento``.
+
+    En PostgreSQL usa el tsvector con índice GIN y la sintaxis de
+    websearch_to_tsquery ("frase exacta", -excluir, or). En otros motores
+    exige que cada palabra aparezca en el texto, sin raíces.
+    """
+    if texto_completo_disponible():
+        consulta = SearchQuery(texto, config=CONFIGURACION, search_type='websearch')
+        return documentos.filter(vector=consulta).annotate(
+            relevancia=SearchRank(F('vector'), consulta),
+            fragmento=SearchHeadline(
+                'texto', consulta, config=CONFIGURACION, start_sel='<b>', stop_sel='</b>',
+                max_words=25, min_words=10,
+            ),
+        )
+
+    palabras = re.findall(r'\w+', texto)
+    for palabra in palabras:
+        documentos = documentos.filter(texto__icontains=palabra)
+    return documentos.annotate(relevancia=Value(1.0), fragmento=F('texto'))
+
+
+def serializar_resultados(documentos, texto):
+    palabras = re.findall(r'\w+', texto)
+    resultados = []
+    for documento in documentos:
+        fragmento = documento.fragmento
+        if not texto_completo_disponible():
+            fragmento = recortar_fragmento(fragmento, palabras)
+        resultados.append({
+            'tipo': documento.tipo,
+            'objeto_id': documento.objeto_id,
+            'paciente': {
+                'id': documento.paciente_id,
+                'nombre': documento.paciente.nombre,
+                'apellido': documento.paciente.apellido,
+            },
+            'medico': documento.medico_id,
+            'consulta': documento.consulta_id,
+            'fecha': documento.fecha,
+            'fragmento': fragmento,
+            'relevancia': round(documento.relevancia, 4),
+        })
+    return resultados
+
+
+def recortar_fragmento(texto, palabras, longitud=LONGITUD_FRAGMENTO):
+    """Fragmento alrededor de la primera palabra encontrada (motores sin ts_headline)."""
+    if len(texto) <= longitud:
+        return texto
+    posiciones = [texto.lower().find(palabra.lower()) for palabra in palabras]
+    posiciones = [posicion for posicion in posiciones if posicion >= 0]
+    inicio = max(min(posiciones, default=0) - longitud // 4, 0)
+    fragmento = texto[inicio:inicio + longitud]
+    return ('…' if inicio else '') + fragmento + ('…' if inicio + longitud < len(texto) else '')
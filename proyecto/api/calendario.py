@@ -0,0 +1,146 @@
+# api/calendario.py
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .series import filas_de_ocurrencias, ocurrencias
+
+# Ventana máxima: una vista de mes de FullCalendar pide 6 semanas, la de lista
+# puede pedir un trimestre. Sin ventana el calendario crecía con el historial.
+MAX_DIAS_VENTANA = 93
+
+COLOR_ESTADO = {
+    'confirmada': '#4CAF50',
+    'solicitada': '#FF9800',
+    'cancelada': '#F44336',
+}
+COLOR_POR_DEFECTO = '#9E9E9E'
+
+CAMPOS_EVENTO = (
+    'id', 'fecha_hora_propuesta', 'motivo', 'estado',
+    'paciente_id', 'paciente__nombre', 'paciente__apellido',
+    'medico_id', 'medico__nombre', 'medico__apellido', 'serie_id', 'version',
+)
+
+
+class VentanaInvalida(ValueError):
+    pass
+
+
+def _parsear_fecha(valor, nombre):
+    fecha = parse_datetime(valor)
+    if fecha is None:
+        dia = parse_date(valor)
+        if dia is None:
+            raise VentanaInvalida(
+                f'Formato de {nombre} inválido. Usa ISO 8601 (ej: 2025-08-01T08:00:00).'
+            )
+        fecha = datetime.combine(dia, time.min)
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
+def ventana_desde_parametros(params):
+    """
+    Lee la ventana visible [inicio, fin) de ``fecha_inicio``/``fecha_fin`` (o
+    ``start``/``end``, los nombres que envía FullCalendar). Ambas son
+    obligatorias; lanza VentanaInvalida con el mensaje para el cliente.
+    """
+    inicio = params.get('fecha_inicio') or params.get('start')
+    fin = params.get('fecha_fin') or params.get('end')
+    if not inicio or not fin:
+        raise VentanaInvalida('Los parámetros fecha_inicio y fecha_fin son obligatorios.')
+
+    inicio = _parsear_fecha(inicio, 'fecha_inicio')
+    fin = _parsear_fecha(fin, 'fecha_fin')
+    if fin <= inicio:
+        raise VentanaInvalida('fecha_fin debe ser posterior a fecha_inicio.')
+    if fin - inicio > timedelta(days=MAX_DIAS_VENTANA):
+        raise VentanaInvalida(f'La ventana no puede superar {MAX_DIAS_VENTANA} días.')
+    return inicio, fin
+
+
+def _evento_medico(cita, paciente, medico):
+    return paciente, {
+        'motivo': cita['motivo'] or 'Sin motivo',
+        'estado': cita['estado'],
+        'paciente_id': cita['paciente_id'],
+        'paciente_nombre': paciente,
+        'medico_id': cita['medico_id'],
+        'medico_nombre': medico,
+    }
+
+
+def _evento_paciente(cita, paciente, medico):
+    return f'Dr. {medico}', {
+        'motivo': cita['motivo'],
+        'estado': cita['estado'],
+        'medico_id': cita['medico_id'],
+    }
+
+
+def _evento_admin(cita, paciente, medico):
+    return paciente, {
+        'motivo': cita['motivo'],
+        'estado': cita['estado'],
+        'paciente_id': cita['paciente_id'],
+        'medico_id': cita['medico_id'],
+        'medico_nombre': medico,
+    }
+
+
+FORMATO_POR_VISTA = {
+    'medico': _evento_medico,
+    'paciente': _evento_paciente,
+    'admin': _evento_admin,
+}
+
+
+def eventos_calendario(citas, inicio, fin, vista, series=None):
+    """
+    Eventos de FullCalendar para las citas de ``citas`` dentro de [inicio, fin).
+
+    ``citas`` ya viene filtrado por rol (médico, paciente o ninguno); el filtro
+    de rango y el orden usan los índices (medico|paciente, fecha_hora_propuesta).
+    Se proyecta con values(): una sola consulta y sin instanciar modelos.
+    Con ``series`` (filtrado igual) se añaden sus ocurrencias de la ventana,
+    calculadas al vuelo (ver api/series.py).
+    """
+    filas = list(citas.filter(
+        fecha_hora_propuesta__gte=inicio, fecha_hora_propuesta__lt=fin
+    ).order_by('fecha_hora_propuesta', 'id').values(*CAMPOS_EVENTO))
+    if series is not None:
+        virtuales = filas_de_ocurrencias(ocurrencias(series, inicio, fin))
+        if virtuales:
+            filas = sorted(filas + virtuales, key=lambda fila: fila['fecha_hora_propuesta'])
+    return eventos_desde_filas(filas, vista)
+
+
+def eventos_desde_filas(filas, vista):
+    """Convierte filas values(*CAMPOS_EVENTO) en eventos con el formato de ``vista``."""
+    formato = FORMATO_POR_VISTA[vista]
+    eventos = []
+    for cita in filas:
+        paciente = f"{cita['paciente__nombre']} {cita['paciente__apellido']}"
+        medico = f"{cita['medico__nombre']} {cita['medico__apellido']}"
+        titulo, propiedades = formato(cita, paciente, medico)
+        inicio_cita = cita['fecha_hora_propuesta'].isoformat()
+        if cita.get('version'):
+            propiedades['version'] = cita['version']  # para If-Match al editarla
+        if cita.get('serie_id'):
+            propiedades['serie_id'] = cita['serie_id']
+            if isinstance(cita['id'], str):  # ocurrencia sin fila propia
+                propiedades['fecha_original'] = inicio_cita
+        eventos.append({
+            'id': cita['id'],
+            'title': titulo,
+            'start': inicio_cita,
+            'end': inicio_cita,
+            'extendedProps': propiedades,
+            'backgroundColor': COLOR_ESTADO.get(cita['estado'], COLOR_POR_DEFECTO),
+            'borderColor': '#000',
+            'textColor': '#fff',
+        })
+    return eventos
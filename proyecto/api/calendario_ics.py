@@ -0,0 +1,292 @@
+# api/calendario_ics.py
+import calendar
+import secrets
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .calendario import CAMPOS_EVENTO
+from .models import Cita, SuscripcionCalendario
+from .series import CAMPOS_SERIE
+
+# Las aplicaciones de calendario suelen mostrar unas semanas hacia atrás; el
+# historial completo haría crecer el feed sin límite.
+DIAS_HISTORIAL = 90
+# Citas por viaje al cursor del servidor
+TAMANO_BLOQUE = 200
+
+ESTADO_ICS = {
+    'solicitada': 'TENTATIVE',
+    'confirmada': 'CONFIRMED',
+    'completada': 'CONFIRMED',
+}
+
+CAMPOS_ICS = CAMPOS_EVENTO + ('duracion_minutos', 'fecha_actualizacion')
+
+FRECUENCIA_RRULE = {'semanal': 'WEEKLY', 'mensual': 'MONTHLY'}
+
+
+def token_calendario(usuario, regenerar=False):
+    """Token de la URL .ics del usuario; se crea la primera vez o al regenerar."""
+    if not regenerar:
+        suscripcion = SuscripcionCalendario.objects.filter(usuario=usuario).only('token').first()
+        if suscripcion is not None:
+            return suscripcion.token
+    token = secrets.token_urlsafe(32)
+    SuscripcionCalendario.objects.update_or_create(usuario=usuario, defaults={'token': token})
+    return token
+
+
+def ventana_del_feed(citas, ahora=None):
+    """Citas desde hace DIAS_HISTORIAL días, canceladas incluidas (índice medico|paciente + fecha)."""
+    desde = (ahora or timezone.now()) - timedelta(days=DIAS_HISTORIAL)
+    return citas.filter(fecha_hora_propuesta__gte=desde)
+
+
+def citas_del_feed(citas, ahora=None):
+    """Citas no canceladas de la ventana del feed: las que se publican."""
+    return ventana_del_feed(citas, ahora).exclude(estado='cancelada')
+
+
+def series_del_feed(series, ahora=None):
+    """Series que siguen vigentes dentro del historial del feed."""
+    desde = (ahora or timezone.now()) - timedelta(days=DIAS_HISTORIAL)
+    return series.filter(Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=timezone.localdate(desde)))
+
+
+def version_feed(ventana, eliminadas, series):
+    """
+    (etag, last_modified) del feed sin generarlo. Cualquier cambio que altere
+    el contenido mueve el número de citas publicadas o de series, la última
+    fecha_actualizacion o la última marca de borrado del dueño; el feed solo
+    se genera si cambió. ``ventana`` incluye las canceladas: una cita que se
+    cancela sale del feed, y su fecha_actualizacion debe mover Last-Modified
+    para quien solo envía If-Modified-Since.
+    """
+    resumen = ventana.aggregate(
+        total=Count('id', filter=~Q(estado='cancelada')), ultima=Max('fecha_actualizacion'),
+    )
+    resumen_series = series.aggregate(total=Count('id'), ultima=Max('fecha_actualizacion'))
+    borrada = eliminadas.aggregate(ultima=Max('fecha_eliminacion'))['ultima']
+    fechas = [fecha for fecha in (resumen['ultima'], resumen_series['ultima'], borrada) if fecha is not None]
+    ultima = max(fechas) if fechas else None
+    marca = int(ultima.timestamp() * 1_000_000) if ultima else 0
+    return f'"ics-{resumen["total"]}-{resumen_series["total"]}-{marca}"', ultima
+
+
+def _fecha_ics(fecha):
+    return fecha.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _texto(valor):
+    """Escapa un valor TEXT (RFC 5545 §3.3.11)."""
+    return (
+        valor.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n')
+    )
+
+
+def _linea(propiedad, valor):
+    """
+    Línea de contenido terminada en CRLF y plegada a 75 octetos, sin partir
+    caracteres UTF-8 (RFC 5545 §3.1).
+    """
+    datos = f'{propiedad}:{valor}'.encode('utf-8')
+    partes = []
+    limite = 75
+    while len(datos) > limite:
+        corte = limite
+        while corte and (datos[corte] & 0xC0) == 0x80:  # byte de continuación
+            corte -= 1
+        partes.append(datos[:corte])
+        datos = datos[corte:]
+        limite = 74  # las líneas de continuación empiezan con un espacio
+    partes.append(datos)
+    return b'\r\n '.join(partes) + b'\r\n'
+
+
+def _resumen(fila, vista):
+    if vista == 'medico':
+        return f"Cita: {fila['paciente__nombre']} {fila['paciente__apellido']}"
+    return f"Cita con Dr. {fila['medico__nombre']} {fila['medico__apellido']}"
+
+
+def _evento(cita, vista, dominio):
+    inicio = cita['fecha_hora_propuesta']
+    lineas = [
+        b'BEGIN:VEVENT\r\n',
+        _linea('UID', f"cita-{cita['id']}@{dominio}"),
+        _linea('DTSTAMP', _fecha_ics(cita['fecha_actualizacion'])),
+        _linea('LAST-MODIFIED', _fecha_ics(cita['fecha_actualizacion'])),
+        _linea('DTSTART', _fecha_ics(inicio)),
+        _linea('DTEND', _fecha_ics(inicio + timedelta(minutes=cita['duracion_minutos']))),
+        _linea('SUMMARY', _texto(_resumen(cita, vista))),
+        _linea('STATUS', ESTADO_ICS.get(cita['estado'], 'CONFIRMED')),
+    ]
+    if cita['motivo']:
+        lineas.append(_linea('DESCRIPTION', _texto(cita['motivo'])))
+    lineas.append(b'END:VEVENT\r\n')
+    return b''.join(lineas)
+
+
+def _fecha_local(fecha):
+    return timezone.localtime(fecha).strftime('%Y%m%dT%H%M%S')
+
+
+def _desfase(minutos):
+    signo = '-' if minutos < 0 else '+'
+    return f'{signo}{abs(minutos) // 60:02d}{abs(minutos) % 60:02d}'
+
+
+def _minutos(zona, instante):
+    return int(instante.astimezone(zona).utcoffset().total_seconds() // 60)
+
+
+def _transiciones(zona, anio):
+    """(instante UTC, minutos antes, minutos después) de los cambios de hora de ``anio``."""
+    cambios = []
+    dia = datetime(anio, 1, 1, tzinfo=dt_timezone.utc)
+    for _ in range(366):
+        siguiente = dia + timedelta(days=1)
+        if _minutos(zona, dia) != _minutos(zona, siguiente):
+            inicio, fin = dia, siguiente
+            while fin - inicio > timedelta(minutes=1):  # búsqueda binaria hasta el minuto
+                medio = inicio + (fin - inicio) / 2
+                if _minutos(zona, medio) == _minutos(zona, inicio):
+                    inicio = medio
+                else:
+                    fin = medio
+            fin = fin.replace(second=0, microsecond=0)
+            cambios.append((fin, _minutos(zona, dia), _minutos(zona, siguiente)))
+        dia = siguiente
+    return cambios
+
+
+def _dia_regla(anio, mes, semana, dia_semana):
+    """Fecha del ``semana``-ésimo ``dia_semana`` del mes (-1: el último)."""
+    dias = [d for d in calendar.Calendar().itermonthdates(anio, mes) if d.month == mes and d.weekday() == dia_semana]
+    return dias[semana - 1] if semana > 0 else dias[-1]
+
+
+@lru_cache
+def vtimezone(nombre, anio):
+    """
+    VTIMEZONE de ``nombre`` con las reglas vigentes en ``anio``, que exige
+    RFC 5545 §3.6.5 para usar TZID=. Cada cambio de hora del año se publica
+    como regla anual (n-ésimo o último día de la semana del mes), como en la
+    base tz; una zona sin cambios de hora lleva un único STANDARD. Basta con
+    las reglas actuales: el feed solo cubre desde hace DIAS_HISTORIAL días.
+    """
+    zona = ZoneInfo(nombre)
+    lineas = [b'BEGIN:VTIMEZONE\r\n', _linea('TZID', nombre)]
+    cambios = _transiciones(zona, anio)
+    if not cambios:
+        referencia = datetime(anio, 1, 1, tzinfo=dt_timezone.utc).astimezone(zona)
+        desfase = _desfase(_minutos(zona, referencia))
+        lineas += [
+            b'BEGIN:STANDARD\r\n', b'DTSTART:19700101T000000\r\n',
+            _linea('TZOFFSETFROM', desfase), _linea('TZOFFSETTO', desfase),
+            _linea('TZNAME', referencia.tzname()), b'END:STANDARD\r\n',
+        ]
+    for instante, antes, despues in cambios:
+        local = (instante + timedelta(minutes=antes)).replace(tzinfo=None)  # hora de pared antes del cambio
+        semana = -1 if local.day + 7 > calendar.monthrange(anio, local.month)[1] else (local.day - 1) // 7 + 1
+        inicio = datetime.combine(_dia_regla(1970, local.month, semana, local.weekday()), local.time())
+        componente = 'DAYLIGHT' if despues > antes else 'STANDARD'
+        dia_ics = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')[local.weekday()]
+        lineas += [
+            f'BEGIN:{componente}\r\n'.encode(),
+            _linea('DTSTART', inicio.strftime('%Y%m%dT%H%M%S')),
+            _linea('RRULE', f'FREQ=YEARLY;BYMONTH={local.month};BYDAY={semana}{dia_ics}'),
+            _linea('TZOFFSETFROM', _desfase(antes)), _linea('TZOFFSETTO', _desfase(despues)),
+            _linea('TZNAME', instante.astimezone(zona).tzname()),
+            f'END:{componente}\r\n'.encode(),
+        ]
+    lineas.append(b'END:VTIMEZONE\r\n')
+    return b''.join(lineas)
+
+
+def _evento_serie(serie, excepciones, vista, dominio):
+    """
+    Una serie como un único VEVENT con RRULE: el cliente calcula las
+    ocurrencias. Las horas van en la zona de la clínica para que la hora local
+    se mantenga en todas; las ocurrencias con Cita propia van en EXDATE.
+    """
+    inicio = serie['fecha_hora_inicio']
+    zona = f'TZID={settings.TIME_ZONE}'
+
+    regla = f"FREQ={FRECUENCIA_RRULE[serie['frecuencia']]};INTERVAL={serie['intervalo']}"
+    if serie['ocurrencias'] is not None:
+        regla += f";COUNT={serie['ocurrencias']}"
+    if serie['fecha_fin'] is not None:
+        ultimo = timezone.make_aware(datetime.combine(serie['fecha_fin'], time(23, 59, 59)))
+        regla += f';UNTIL={_fecha_ics(ultimo)}'
+
+    lineas = [
+        b'BEGIN:VEVENT\r\n',
+        _linea('UID', f"serie-{serie['id']}@{dominio}"),
+        _linea('DTSTAMP', _fecha_ics(serie['fecha_actualizacion'])),
+        _linea('LAST-MODIFIED', _fecha_ics(serie['fecha_actualizacion'])),
+        _linea(f'DTSTART;{zona}', _fecha_local(inicio)),
+        _linea(f'DTEND;{zona}', _fecha_local(inicio + timedelta(minutes=serie['duracion_minutos']))),
+        _linea('RRULE', regla),
+        _linea('SUMMARY', _texto(_resumen(serie, vista))),
+        _linea('STATUS', ESTADO_ICS.get(serie['estado'], 'CONFIRMED')),
+    ]
+    if excepciones:
+        lineas.append(_linea(f'EXDATE;{zona}', ','.join(_fecha_local(fecha) for fecha in sorted(excepciones))))
+    if serie['motivo']:
+        lineas.append(_linea('DESCRIPTION', _texto(serie['motivo'])))
+    lineas.append(b'END:VEVENT\r\n')
+    return b''.join(lineas)
+
+
+def _eventos_series(series, vista, dominio):
+    filas = list(series.order_by('id').values(*CAMPOS_SERIE, 'fecha_actualizacion'))
+    if not filas:
+        return b''
+    excepciones = defaultdict(list)
+    for serie_id, fecha in Cita.objects.filter(serie_id__in=[fila['id'] for fila in filas]).values_list(
+        'serie_id', 'fecha_original'
+    ):
+        excepciones[serie_id].append(fecha)
+    return b''.join(_evento_serie(fila, excepciones[fila['id']], vista, dominio) for fila in filas)
+
+
+def generar_ics(citas, nombre, vista, dominio, series=None):
+    """
+    Genera el VCALENDAR de ``citas`` (y de ``series``, con RRULE) por bloques
+    de bytes, para un StreamingHttpResponse. Las filas se leen con
+    iterator(): en PostgreSQL es un cursor del servidor, así que la memoria
+    no crece con la agenda.
+    """
+    cabecera = [
+        b'BEGIN:VCALENDAR\r\n',
+        b'VERSION:2.0\r\n',
+        _linea('PRODID', '-//Sistema Medico//Citas//ES'),
+        b'CALSCALE:GREGORIAN\r\n',
+        b'METHOD:PUBLISH\r\n',
+        _linea('X-WR-CALNAME', _texto(nombre)),
+        b'REFRESH-INTERVAL;VALUE=DURATION:PT15M\r\n',
+        b'X-PUBLISHED-TTL:PT15M\r\n',
+    ]
+    if series is not None:
+        # Las series van con TZID= en la zona de la clínica
+        cabecera.append(vtimezone(settings.TIME_ZONE, timezone.localdate().year))
+    yield b''.join(cabecera)
+    filas = citas.order_by('fecha_hora_propuesta', 'id').values(*CAMPOS_ICS).iterator(chunk_size=TAMANO_BLOQUE)
+    bloque = []
+    for cita in filas:
+        bloque.append(_evento(cita, vista, dominio))
+        if len(bloque) == TAMANO_BLOQUE:
+            yield b''.join(bloque)
+            bloque = []
+    if series is not None:
+        bloque.append(_eventos_series(series, vista, dominio))
+    bloque.append(b'END:VCALENDAR\r\n')
+    yield b''.join(bloque)
@@ -0,0 +1,198 @@
+# api/citas_lote.py
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .disponibilidad import MAX_DURACION_CITA, CitaSolapada, intervalos_de_series
+from .estadisticas import ajustar_contadores, clave_cita_estado
+from .eventos import publicar_citas
+from .lista_espera import turno_liberado
+from .models import Cita, Medico
+from .resumen_agenda import dia_agenda, recalcular_dias
+
+# Una agenda diaria completa de recepción cabe de sobra
+MAX_CITAS_LOTE = 200
+MAX_DESPLAZAMIENTO_MINUTOS = 60 * 24 * 90
+
+ESTADOS_VALIDOS = {estado for estado, _ in Cita.ESTADO_CHOICES}
+
+
+class LoteInvalido(ValueError):
+    pass
+
+
+def leer_lote(datos):
+    """
+    Valida el cuerpo {"ids": [...], "estado": ...} o {"ids": [...],
+    "desplazar_minutos": ...}. Devuelve (ids sin repetir, estado,
+    desplazamiento); lanza LoteInvalido con el mensaje para el cliente.
+    """
+    ids = datos.get('ids')
+    if not isinstance(ids, list) or not ids:
+        raise LoteInvalido('El campo ids debe ser una lista no vacía.')
+    if len(ids) > MAX_CITAS_LOTE:
+        raise LoteInvalido(f'No se pueden procesar más de {MAX_CITAS_LOTE} citas por lote.')
+    if not all(isinstance(cita_id, int) and not isinstance(cita_id, bool) for cita_id in ids):
+        raise LoteInvalido('Los ids deben ser números enteros.')
+
+    estado = datos.get('estado')
+    minutos = datos.get('desplazar_minutos')
+    if (estado is None) == (minutos is None):
+        raise LoteInvalido('Indica estado o desplazar_minutos (solo uno).')
+    if estado is not None and estado not in ESTADOS_VALIDOS:
+        raise LoteInvalido(f'Estado inválido. Opciones: {", ".join(sorted(ESTADOS_VALIDOS))}.')
+    desplazamiento = None
+    if minutos is not None:
+        if not isinstance(minutos, int) or isinstance(minutos, bool) or not minutos:
+            raise LoteInvalido('desplazar_minutos debe ser un entero distinto de cero.')
+        if abs(minutos) > MAX_DESPLAZAMIENTO_MINUTOS:
+            raise LoteInvalido('El desplazamiento no puede superar 90 días.')
+        desplazamiento = timedelta(minutes=minutos)
+    return list(dict.fromkeys(ids)), estado, desplazamiento
+
+
+def _puede_editar(usuario, fila):
+    # Mismas reglas que gestionar_cita: admin, el médico de la cita o su paciente
+    return usuario.is_staff or usuario.pk in (fila['medico__usuario_id'], fila['paciente__usuario_id'])
+
+
+def _final(fila, estado, desplazamiento):
+    """(inicio, estado) de la cita si se aplica el cambio."""
+    return fila['fecha_hora_propuesta'] + (desplazamiento or timedelta()), estado or fila['estado']
+
+
+def _conflictos(filas, estado, desplazamiento):
+    """
+    Citas del lote que quedarían solapadas con otra cita activa de su médico
+    o con una ocurrencia de sus series, {id: CitaSolapada}. Las citas del lote cuentan en su posición final; si una
+    se rechaza vuelve a su posición original, así que se repite hasta que no
+    aparezcan conflictos nuevos.
+    """
+    reclaman = {}
+    for cita_id, fila in filas.items():
+        inicio, estado_final = _final(fila, estado, desplazamiento)
+        if estado_final != 'cancelada' and (fila['estado'] == 'cancelada' or desplazamiento):
+            reclaman[cita_id] = fila
+    if not reclaman:
+        return {}
+
+    # Mismo bloqueo que reserva_de_turno, en orden de id para no cruzarse con otro lote
+    medicos = sorted({fila['medico_id'] for fila in reclaman.values()})
+    list(Medico.objects.select_for_update(no_key=True).filter(pk__in=medicos).order_by('pk').values_list('pk', flat=True))
+
+    inicios = [_final(fila, estado, desplazamiento)[0] for fila in reclaman.values()]
+    # médico → [(cita_id, inicio, fin, serie_id)] de citas activas fuera del lote y ocurrencias de series
+    fijas = defaultdict(list)
+    otras = Cita.objects.filter(
+        medico_id__in=medicos,
+        fecha_hora_propuesta__gt=min(inicios) - MAX_DURACION_CITA,
+        fecha_hora_propuesta__lt=max(inicios) + MAX_DURACION_CITA,
+    ).exclude(estado='cancelada').exclude(pk__in=list(filas)).values_list(
+        'id', 'medico_id', 'fecha_hora_propuesta', 'duracion_minutos'
+    )
+    for cita_id, medico_id, inicio, duracion in otras:
+        fijas[medico_id].append((cita_id, inicio, inicio + timedelta(minutes=duracion), None))
+    series = intervalos_de_series(medicos, min(inicios), max(inicios) + MAX_DURACION_CITA)
+    for medico_id, intervalos in series.items():
+        fijas[medico_id].extend((None, inicio, fin, serie_id) for serie_id, inicio, fin in intervalos)
+
+    conflictos = {}
+    while True:
+        ocupacion = defaultdict(list, {medico_id: list(intervalos) for medico_id, intervalos in fijas.items()})
+        for cita_id, fila in filas.items():
+            if cita_id in conflictos:
+                inicio, estado_cita = fila['fecha_hora_propuesta'], fila['estado']
+            else:
+                inicio, estado_cita = _final(fila, estado, desplazamiento)
+            if estado_cita != 'cancelada':
+                ocupacion[fila['medico_id']].append(
+                    (cita_id, inicio, inicio + timedelta(minutes=fila['duracion_minutos']), None)
+                )
+
+        nuevos = 0
+        for cita_id, fila in reclaman.items():
+            if cita_id in conflictos:
+                continue
+            inicio, _ = _final(fila, estado, desplazamiento)
+            fin = inicio + timedelta(minutes=fila['duracion_minutos'])
+            for otra_id, otra_inicio, otra_fin, serie_id in ocupacion[fila['medico_id']]:
+                if otra_id != cita_id and otra_inicio < fin and otra_fin > inicio:
+                    conflictos[cita_id] = CitaSolapada(otra_id, otra_inicio, serie_id=serie_id)
+                    nuevos += 1
+                    break
+        if not nuevos:
+            return conflictos
+
+
+def aplicar_lote(usuario, ids, estado=None, desplazamiento=None):
+    """
+    Cambia el estado de las citas ``ids`` o las desplaza ``desplazamiento``.
+
+    Los permisos se comprueban con una sola consulta (las filas quedan
+    bloqueadas hasta el final) y las citas aceptadas se modifican con un único
+    UPDATE en la misma transacción, que también sube su versión (ver
+    api/concurrencia.py). Como update() no dispara señales, los
+    contadores por estado, el resumen de la agenda, los eventos en tiempo
+    real y la lista de espera de los turnos cancelados se atienden aquí. Devuelve el resultado de cada id
+    en el orden recibido: actualizada, sin_cambios, no_encontrada,
+    sin_permiso o conflicto.
+    """
+    with transaction.atomic():
+        filas = {
+            fila['id']: fila
+            for fila in Cita.objects.select_for_update(of=('self',)).filter(pk__in=ids).values(
+                'id', 'estado', 'fecha_hora_propuesta', 'duracion_minutos', 'medico_id', 'paciente_id',
+                'medico__usuario_id', 'paciente__usuario_id',
+            )
+        }
+
+        resultados = {}
+        for cita_id in ids:
+            fila = filas.get(cita_id)
+            if fila is None:
+                resultados[cita_id] = {'id': cita_id, 'resultado': 'no_encontrada'}
+            elif not _puede_editar(usuario, fila):
+                resultados[cita_id] = {'id': cita_id, 'resultado': 'sin_permiso'}
+            elif estado is not None and fila['estado'] == estado:
+                resultados[cita_id] = {'id': cita_id, 'resultado': 'sin_cambios'}
+        aplicables = {cita_id: fila for cita_id, fila in filas.items() if cita_id not in resultados}
+
+        for cita_id, error in _conflictos(aplicables, estado, desplazamiento).items():
+            resultados[cita_id] = {
+                'id': cita_id, 'resultado': 'conflicto', 'error': str(error), **error.detalle(),
+            }
+            del aplicables[cita_id]
+
+        if aplicables:
+            citas = Cita.objects.filter(pk__in=list(aplicables))
+            ahora = timezone.now()  # update() no aplica auto_now
+            if estado is not None:
+                citas.update(estado=estado, fecha_actualizacion=ahora, version=F('version') + 1)
+                deltas = Counter({clave_cita_estado(estado): len(aplicables)})
+                for anterior, cantidad in Counter(fila['estado'] for fila in aplicables.values()).items():
+                    deltas[clave_cita_estado(anterior)] -= cantidad
+                ajustar_contadores(deltas)
+                publicar_citas(list(aplicables))
+            else:
+                citas.update(
+                    fecha_hora_propuesta=F('fecha_hora_propuesta') + desplazamiento, fecha_actualizacion=ahora,
+                    version=F('version') + 1,
+                    recordatorio_enviado=None,  # reprogramadas: vuelven a recibir recordatorios
+                )
+            recalcular_dias(
+                [dia_agenda(fila['medico_id'], fila['fecha_hora_propuesta']) for fila in aplicables.values()]
+                + [dia_agenda(fila['medico_id'], _final(fila, estado, desplazamiento)[0]) for fila in aplicables.values()]
+            )
+        for cita_id in aplicables:
+            resultados[cita_id] = {'id': cita_id, 'resultado': 'actualizada'}
+
+    if estado == 'cancelada':
+        for fila in aplicables.values():
+            turno_liberado(Cita(
+                pk=fila['id'], medico_id=fila['medico_id'], paciente_id=fila['paciente_id'],
+                fecha_hora_propuesta=fila['fecha_hora_propuesta'], duracion_minutos=fila['duracion_minutos'],
+            ))
+    return [resultados[cita_id] for cita_id in ids]
@@ -0,0 +1,103 @@
+# api/concurrencia.py
+from django.db import transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class VersionObsoleta(Exception):
+    """El registro cambió desde la versión que el cliente editaba."""
+
+    def __init__(self, actual):
+        super().__init__(actual)
+        self.actual = actual
+
+
+def etag_version(version):
+    return f'"{version}"'
+
+
+def version_esperada(request, instancia):
+    """
+    Versión sobre la que el cliente hace el cambio. Con If-Match debe ser la
+    actual (si no, VersionObsoleta); sin la cabecera es la recién leída, así
+    que la escritura condicional aún detecta otra edición entre la lectura y
+    el guardado.
+    """
+    if_match = request.META.get('HTTP_IF_MATCH', '').strip()
+    if if_match and if_match != '*':
+        etiquetas = [etiqueta.strip().removeprefix('W/') for etiqueta in if_match.split(',')]
+        if etag_version(instancia.version) not in etiquetas:
+            raise VersionObsoleta(instancia.version)
+    return instancia.version
+
+
+def avanzar_version(instancia, version):
+    """
+    UPDATE ... SET version = version + 1 WHERE id = pk AND version = ``version``.
+    Si ninguna fila coincide, otra edición se adelantó: lanza VersionObsoleta.
+    Va dentro de la transacción del guardado; el UPDATE bloquea la fila solo
+    hasta el final de esa transacción, y el save() siguiente escribe la
+    versión nueva sin volver a subirla.
+    """
+    modelo = type(instancia)
+    if not modelo.objects.filter(pk=instancia.pk, version=version).update(version=F('version') + 1):
+        raise VersionObsoleta(modelo.objects.filter(pk=instancia.pk).values_list('version', flat=True).first())
+    instancia.version = version + 1
+    instancia._version_avanzada = True
+
+
+def respuesta_version_obsoleta(error, recurso='El registro'):
+    """412 con la versión actual, para que el cliente recargue antes de reintentar."""
+    response = Response(
+        {
+            'error': f'{recurso} cambió después de cargarse. Recarga e inténtalo de nuevo.',
+            'version': error.actual,
+        },
+        status=status.HTTP_412_PRECONDITION_FAILED,
+    )
+    if error.actual is not None:
+        response['ETag'] = etag_version(error.actual)
+    return response
+
+
+class EdicionVersionadaMixin:
+    """
+    Para vistas RetrieveUpdateDestroy de modelos con ``version``: ETag en
+    GET, If-Match en PUT/PATCH/DELETE y escritura condicional por versión
+    (412 si otro cambio se adelantó). Sin bloqueos entre lectura y escritura.
+    """
+    recurso_versionado = 'El registro'
+
+    def retrieve(self, request, *args, **kwargs):
+        instancia = self.get_object()
+        response = Response(self.get_serializer(instancia).data)
+        response['ETag'] = etag_version(instancia.version)
+        return response
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        instancia = self.get_object()
+        try:
+            version = version_esperada(request, instancia)
+            serializer = self.get_serializer(instancia, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                avanzar_version(instancia, version)
+                self.perform_update(serializer)
+        except VersionObsoleta as e:
+            return respuesta_version_obsoleta(e, self.recurso_versionado)
+        response = Response(serializer.data)
+        response['ETag'] = etag_version(instancia.version)
+        return response
+
+    def destroy(self, request, *args, **kwargs):
+        instancia = self.get_object()
+        try:
+            version = version_esperada(request, instancia)
+            with transaction.atomic():
+                avanzar_version(instancia, version)
+                self.perform_destroy(instancia)
+        except VersionObsoleta as e:
+            return respuesta_version_obsoleta(e, self.recurso_versionado)
+        return Response(status=status.HTTP_204_NO_CONTENT)
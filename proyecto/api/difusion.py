@@ -0,0 +1,199 @@
+# api/difusion.py
+import re
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .eventos import publicar_notificaciones
+from .models import Cita, Difusion, Notificacion, Paciente, Usuario
+
+TAMANO_LOTE = 1000
+# Hasta este número de destinatarios se envía durante la petición; más grandes
+# quedan pendientes para `manage.py enviar_difusiones`
+MAX_INMEDIATA = 2000
+AUDIENCIAS = ('pacientes_medico', 'rol', 'citas_fecha')
+# Datos de cada destinatario que se pueden usar en las plantillas
+CAMPOS_DESTINATARIO = ('nombre', 'apellido')
+MARCADOR = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+
+
+class DifusionInvalida(Exception):
+    """Datos de la difusión con un error que se devuelve al cliente."""
+
+
+def _entero(valor, nombre):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise DifusionInvalida(f'{nombre} debe ser un número.')
+
+
+def leer_audiencia(datos):
+    """
+    Valida ``audiencia``: {"tipo": "pacientes_medico", "medico_id": 3},
+    {"tipo": "rol", "rol": "paciente"} o {"tipo": "citas_fecha", "fecha":
+    "2030-01-07"} (opcionalmente con medico_id). Devuelve la versión limpia
+    que se guarda en Difusion.audiencia.
+    """
+    if not isinstance(datos, dict) or datos.get('tipo') not in AUDIENCIAS:
+        raise DifusionInvalida(f"audiencia.tipo debe ser uno de: {', '.join(AUDIENCIAS)}.")
+    tipo = datos['tipo']
+    if tipo == 'rol':
+        if not datos.get('rol'):
+            raise DifusionInvalida('Indica el código del rol en audiencia.rol.')
+        return {'tipo': tipo, 'rol': str(datos['rol'])}
+    if tipo == 'pacientes_medico':
+        return {'tipo': tipo, 'medico_id': _entero(datos.get('medico_id'), 'audiencia.medico_id')}
+
+    try:
+        fecha = parse_date(datos.get('fecha') or '')
+    except ValueError:
+        fecha = None
+    if fecha is None:
+        raise DifusionInvalida('audiencia.fecha es obligatoria, con formato YYYY-MM-DD.')
+    audiencia = {'tipo': tipo, 'fecha': fecha.isoformat()}
+    if datos.get('medico_id') is not None:
+        audiencia['medico_id'] = _entero(datos['medico_id'], 'audiencia.medico_id')
+    return audiencia
+
+
+def destinatarios(audiencia):
+    """
+    (usuario_id, nombre, apellido) de cada destinatario, en orden de
+    usuario_id, y el nombre del campo para continuar tras el último. Es una
+    sola consulta: los pacientes se filtran con EXISTS sobre sus citas, sin
+    traer las citas ni repetir pacientes.
+    """
+    if audiencia['tipo'] == 'rol':
+        usuarios = Usuario.objects.filter(is_active=True, rol__codigo=audiencia['rol'])
+        return usuarios.order_by('id').values_list('id', 'nombre', 'apellido'), 'id'
+
+    citas = Cita.objects.filter(paciente=OuterRef('pk'))
+    if audiencia.get('medico_id') is not None:
+        citas = citas.filter(medico_id=audiencia['medico_id'])
+    if audiencia['tipo'] == 'citas_fecha':
+        inicio = timezone.make_aware(datetime.combine(parse_date(audiencia['fecha']), time.min))
+        citas = citas.filter(
+            fecha_hora_propuesta__gte=inicio, fecha_hora_propuesta__lt=inicio + timedelta(days=1),
+        ).exclude(estado='cancelada')
+    pacientes = Paciente.objects.filter(usuario__isnull=False, usuario__is_active=True).filter(Exists(citas))
+    return pacientes.order_by('usuario_id').values_list('usuario_id', 'nombre', 'apellido'), 'usuario_id'
+
+
+def validar_plantilla(texto, campo, variables):
+    """
+    Las plantillas solo admiten marcadores {{ nombre }}: datos del
+    destinatario o de ``variables``. No es el motor de plantillas de Django,
+    así que quien escribe la difusión no puede usar etiquetas como
+    {% debug %} o {% include %} para leer datos del servidor.
+    """
+    permitidos = set(CAMPOS_DESTINATARIO) | set(variables)
+    desconocidos = sorted({nombre for nombre in MARCADOR.findall(texto) if nombre not in permitidos})
+    if desconocidos:
+        raise DifusionInvalida(f"Plantilla de {campo} con variables sin valor: {', '.join(desconocidos)}.")
+    resto = MARCADOR.sub('', texto)
+    if any(simbolo in resto for simbolo in ('{{', '}}', '{%', '%}', '{#', '#}')):
+        raise DifusionInvalida(
+            f'Plantilla de {campo} inválida: solo se admiten marcadores como {{{{ nombre }}}}.'
+        )
+
+
+def rellenar(texto, valores):
+    """Sustituye cada {{ marcador }} por su valor, sin interpretar nada más."""
+    return MARCADOR.sub(lambda m: valores.get(m.group(1), m.group(0)), texto)
+
+
+def crear_difusion(autor, tipo, titulo, mensaje, audiencia, variables=None):
+    """
+    Valida las plantillas y la audiencia, cuenta los destinatarios y guarda
+    la Difusion pendiente. Lanza DifusionInvalida.
+    """
+    if not titulo or not mensaje:
+        raise DifusionInvalida('titulo y mensaje son obligatorios.')
+    variables = variables or {}
+    if not isinstance(variables, dict):
+        raise DifusionInvalida('variables debe ser un objeto.')
+    if any(isinstance(valor, (dict, list)) for valor in variables.values()):
+        raise DifusionInvalida('Los valores de variables deben ser texto o números.')
+    variables = {str(nombre): '' if valor is None else str(valor) for nombre, valor in variables.items()}
+    validar_plantilla(titulo, 'titulo', variables)
+    validar_plantilla(mensaje, 'mensaje', variables)
+    audiencia = leer_audiencia(audiencia)
+    filas, _ = destinatarios(audiencia)
+    return Difusion.objects.create(
+        autor=autor, tipo=(tipo or 'aviso')[:20], titulo=titulo, mensaje=mensaje, variables=variables,
+        audiencia=audiencia, total=filas.count(),
+    )
+
+
+def enviar_lote(difusion_id, tamano=TAMANO_LOTE):
+    """
+    Envía el siguiente lote de ``difusion_id``: una consulta de
+    destinatarios tras el cursor, un bulk_create y el avance, todo en una
+    transacción. Si el proceso muere a mitad, el lote no queda a medias ni se
+    repite. La fila se bloquea con SKIP LOCKED, así dos procesos no envían la
+    misma difusión a la vez. Devuelve la Difusion actualizada, o None si no
+    queda nada que enviar (o la tiene otro proceso).
+    """
+    with transaction.atomic():
+        difusion = Difusion.objects.select_for_update(skip_locked=True).filter(
+            pk=difusion_id, estado__in=('pendiente', 'enviando'),
+        ).first()
+        if difusion is None:
+            return None
+
+        filas, campo = destinatarios(difusion.audiencia)
+        if difusion.ultimo_usuario_id is not None:
+            filas = filas.filter(**{f'{campo}__gt': difusion.ultimo_usuario_id})
+        filas = list(filas[:tamano])
+
+        notificaciones = []
+        for usuario_id, nombre, apellido in filas:
+            valores = {**difusion.variables, 'nombre': nombre, 'apellido': apellido}
+            notificaciones.append(Notificacion(
+                usuario_id=usuario_id, tipo=difusion.tipo,
+                titulo=rellenar(difusion.titulo, valores)[:100], mensaje=rellenar(difusion.mensaje, valores),
+                metadata={'difusion_id': difusion.pk},
+            ))
+        Notificacion.objects.bulk_create(notificaciones)
+        publicar_notificaciones(notificaciones)
+
+        difusion.enviadas += len(filas)
+        if filas:
+            difusion.ultimo_usuario_id = filas[-1][0]
+        if len(filas) < tamano:
+            difusion.estado = 'completada'
+            difusion.fecha_fin = timezone.now()
+        else:
+            difusion.estado = 'enviando'
+        difusion.save(update_fields=['enviadas', 'ultimo_usuario_id', 'estado', 'fecha_fin'])
+    return difusion
+
+
+def procesar_difusion(difusion_id, tamano=TAMANO_LOTE, al_avanzar=None):
+    """
+    Envía la difusión lote a lote hasta completarla. ``al_avanzar`` recibe
+    la Difusion tras cada lote, para informar del progreso. Devuelve la
+    última Difusion procesada, o None si no había nada que enviar.
+    """
+    difusion = None
+    while True:
+        lote = enviar_lote(difusion_id, tamano)
+        if lote is None:
+            return difusion
+        difusion = lote
+        if al_avanzar:
+            al_avanzar(difusion)
+        if difusion.estado == 'completada':
+            return difusion
+
+
+def procesar_pendientes(tamano=TAMANO_LOTE, al_avanzar=None):
+    """Procesa las difusiones pendientes o interrumpidas, de la más antigua a la más nueva."""
+    ids = Difusion.objects.filter(estado__in=('pendiente', 'enviando')).order_by('fecha_creacion', 'id').values_list(
+        'id', flat=True,
+    )
+    return [difusion for difusion in (procesar_difusion(pk, tamano, al_avanzar) for pk in ids) if difusion]
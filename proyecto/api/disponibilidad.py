@@ -0,0 +1,334 @@
+# api/disponibilidad.py
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Cita, ExcepcionHorario, HorarioMedico, Medico, SerieCita
+from .series import fechas_serie, ocurrencias, regla
+
+# Un mes completo más holgura; el resumen de muchos médicos recorre
+# (médicos × días × turnos) y se mantiene acotado.
+MAX_DIAS_DISPONIBILIDAD = 62
+
+# Duración máxima de una cita que se tiene en cuenta al buscar las que empiezan
+# antes de la ventana y aún la ocupan.
+MAX_DURACION_CITA = timedelta(hours=12)
+
+# Al crear una serie se comprueban solapes en este horizonte; más allá sus
+# ocurrencias cuentan como ocupadas cuando alguien reserva encima.
+HORIZONTE_SERIES = timedelta(days=366)
+
+
+class RangoInvalido(ValueError):
+    pass
+
+
+class CitaSolapada(Exception):
+    """
+    El turno pedido choca con otra cita activa del mismo médico, guardada
+    (``cita_id``) u ocurrencia de una serie (``serie_id``).
+    """
+
+    def __init__(self, cita_id, fecha, serie_id=None):
+        self.cita_id = cita_id
+        self.serie_id = serie_id
+        fecha = timezone.localtime(fecha)
+        super().__init__(
+            f'El médico ya tiene una cita el {fecha:%d/%m/%Y} a las {fecha:%H:%M} que se solapa con este horario.'
+        )
+
+    def detalle(self):
+        """Campos de la respuesta 409 que identifican con qué se choca."""
+        if self.serie_id is None:
+            return {'cita_en_conflicto': self.cita_id}
+        return {'cita_en_conflicto': None, 'serie_en_conflicto': self.serie_id}
+
+
+def rango_desde_parametros(params, max_dias=MAX_DIAS_DISPONIBILIDAD):
+    """
+    Lee ``desde`` y ``hasta`` (fechas ISO, ambas incluidas, a lo sumo
+    ``max_dias`` días). Lanza RangoInvalido con el mensaje para el cliente.
+    """
+    desde = params.get('desde')
+    hasta = params.get('hasta')
+    if not desde or not hasta:
+        raise RangoInvalido('Los parámetros desde y hasta son obligatorios.')
+    try:
+        desde, hasta = parse_date(desde), parse_date(hasta)
+    except ValueError:
+        desde = hasta = None
+    if desde is None or hasta is None:
+        raise RangoInvalido('Formato de fecha inválido. Usa YYYY-MM-DD.')
+    if hasta < desde:
+        raise RangoInvalido('hasta no puede ser anterior a desde.')
+    if (hasta - desde).days + 1 > max_dias:
+        raise RangoInvalido(f'El rango no puede superar {max_dias} días.')
+    return desde, hasta
+
+
+def _instante(dia, hora, zona):
+    """Segundos epoch de ``dia`` a ``hora`` en ``zona``."""
+    return datetime.combine(dia, hora, tzinfo=zona).timestamp()
+
+
+class _Instantes(dict):
+    """(dia, hora) → segundos epoch. Todos los médicos comparten las mismas horas de bloque."""
+
+    def __init__(self, zona):
+        super().__init__()
+        self.zona = zona
+
+    def __missing__(self, clave):
+        valor = self[clave] = _instante(*clave, self.zona)
+        return valor
+
+
+def _fusionar(intervalos):
+    """Ordena y une intervalos [inicio, fin) solapados o contiguos."""
+    intervalos.sort()
+    inicios, fines = [], []
+    for inicio, fin in intervalos:
+        if fines and inicio <= fines[-1]:
+            if fin > fines[-1]:
+                fines[-1] = fin
+        else:
+            inicios.append(inicio)
+            fines.append(fin)
+    return inicios, fines
+
+
+def _ocupaciones(medico_ids, desde, hasta, instantes):
+    """
+    Intervalos ocupados por médico en segundos epoch: citas no canceladas
+    (índice medico+fecha), ocurrencias de series y excepciones de horario.
+    """
+    inicio_ventana = timezone.make_aware(datetime.combine(desde, time.min))
+    fin_ventana = timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min))
+
+    ocupado = defaultdict(list)
+    citas = Cita.objects.filter(
+        medico_id__in=medico_ids,
+        fecha_hora_propuesta__gte=inicio_ventana - MAX_DURACION_CITA,
+        fecha_hora_propuesta__lt=fin_ventana,
+    ).exclude(estado='cancelada').values_list('medico_id', 'fecha_hora_propuesta', 'duracion_minutos')
+    for medico_id, fecha, duracion in citas:
+        inicio = fecha.timestamp()
+        ocupado[medico_id].append((inicio, inicio + duracion * 60))
+
+    for medico_id, intervalos in intervalos_de_series(medico_ids, inicio_ventana, fin_ventana).items():
+        ocupado[medico_id].extend((inicio.timestamp(), fin.timestamp()) for _, inicio, fin in intervalos)
+
+    excepciones = ExcepcionHorario.objects.filter(
+        medico_id__in=medico_ids, fecha__gte=desde, fecha__lte=hasta,
+    ).values_list('medico_id', 'fecha', 'hora_inicio', 'hora_fin')
+    for medico_id, fecha, hora_inicio, hora_fin in excepciones:
+        if hora_inicio is None or hora_fin is None:
+            ocupado[medico_id].append((instantes[fecha, time.min], instantes[fecha + timedelta(days=1), time.min]))
+        else:
+            ocupado[medico_id].append((instantes[fecha, hora_inicio], instantes[fecha, hora_fin]))
+
+    return {medico_id: _fusionar(intervalos) for medico_id, intervalos in ocupado.items()}
+
+
+def turnos_libres(medico_ids, desde, hasta, ahora=None):
+    """
+    Turnos libres por médico entre las fechas ``desde`` y ``hasta`` (incluidas).
+
+    Devuelve {medico_id: [(dia, inicio, fin), ...]} con inicio/fin en segundos
+    epoch, en orden cronológico. Los turnos salen de la rejilla de cada bloque
+    de HorarioMedico y se descartan los que solapan un intervalo ocupado (citas
+    , series y excepciones fusionadas, búsqueda binaria) o ya empezaron. Son
+    cinco consultas como mucho, sin importar cuántos médicos o días se pidan.
+    """
+    medico_ids = list(medico_ids)
+    ahora = (ahora or timezone.now()).timestamp()
+
+    bloques = defaultdict(lambda: defaultdict(list))
+    horarios = HorarioMedico.objects.filter(medico_id__in=medico_ids).values_list(
+        'medico_id', 'dia_semana', 'hora_inicio', 'hora_fin', 'duracion_cita'
+    ).order_by('hora_inicio')
+    for medico_id, dia_semana, hora_inicio, hora_fin, duracion in horarios:
+        bloques[medico_id][dia_semana].append((hora_inicio, hora_fin, duracion * 60))
+    if not bloques:
+        return {medico_id: [] for medico_id in medico_ids}
+
+    instantes = _Instantes(timezone.get_current_timezone())
+    ocupado = _ocupaciones(list(bloques), desde, hasta, instantes)
+    dias = [desde + timedelta(days=n) for n in range((hasta - desde).days + 1)]
+
+    resultado = {}
+    for medico_id in medico_ids:
+        libres = []
+        semana = bloques.get(medico_id, {})
+        inicios, fines = ocupado.get(medico_id, ([], []))
+        for dia in dias:
+            for hora_inicio, hora_fin, paso in semana.get(dia.weekday(), ()):
+                turno = instantes[dia, hora_inicio]
+                fin_bloque = instantes[dia, hora_fin]
+                while turno + paso <= fin_bloque:
+                    fin_turno = turno + paso
+                    if turno >= ahora:
+                        # Primer intervalo ocupado que termina después del inicio del turno
+                        i = bisect_right(fines, turno)
+                        if i == len(inicios) or inicios[i] >= fin_turno:
+                            libres.append((dia, turno, fin_turno))
+                    turno = fin_turno
+        resultado[medico_id] = libres
+    return resultado
+
+
+def _iso(segundos, zona):
+    return datetime.fromtimestamp(segundos, zona).isoformat()
+
+
+def serializar_turnos(turnos):
+    zona = timezone.get_current_timezone()
+    return [{'inicio': _iso(inicio, zona), 'fin': _iso(fin, zona)} for _, inicio, fin in turnos]
+
+
+def resumen_por_dia(turnos):
+    """Turnos libres por fecha y el primero disponible (para listar muchos médicos)."""
+    por_dia = defaultdict(int)
+    for dia, _, _ in turnos:
+        por_dia[dia] += 1
+    primero = _iso(turnos[0][1], timezone.get_current_timezone()) if turnos else None
+    return {
+        'total': len(turnos),
+        'primer_turno': primero,
+        'por_dia': {dia.isoformat(): cantidad for dia, cantidad in por_dia.items()},
+    }
+
+
+# === Reservas sin solapes ===
+
+def ocupa_turno_nuevo(cita, anterior=None):
+    """
+    Indica si guardar ``cita`` ocupa tiempo del médico que ``anterior`` (la
+    versión guardada, o None al crear) no ocupaba. Cambiar solo el motivo o
+    cancelar no necesita comprobación.
+    """
+    if cita.estado == 'cancelada':
+        return False
+    if anterior is None or anterior.estado == 'cancelada':
+        return True
+    return (cita.medico_id, cita.fecha_hora_propuesta, cita.duracion_minutos) != (
+        anterior.medico_id, anterior.fecha_hora_propuesta, anterior.duracion_minutos
+    )
+
+
+def intervalos_de_series(medico_ids, inicio, fin, excluir=None):
+    """
+    {medico_id: [(serie_id, inicio, fin)]} de las ocurrencias de series de los
+    médicos que ocupan algún momento de [inicio, fin). ``excluir`` es la
+    ocurrencia (serie_id, fecha_original) que se está reemplazando.
+    """
+    ocupado = defaultdict(list)
+    series = SerieCita.objects.filter(medico_id__in=medico_ids)
+    for fila, fecha in ocurrencias(series, inicio - MAX_DURACION_CITA, fin, excluir=excluir):
+        final = fecha + timedelta(minutes=fila['duracion_minutos'])
+        if final > inicio:
+            ocupado[fila['medico_id']].append((fila['id'], fecha, final))
+    return ocupado
+
+
+def comprobar_turno_libre(cita):
+    """
+    Lanza CitaSolapada si [inicio, inicio + duración) pisa otra cita no
+    cancelada del médico o una ocurrencia de sus series.
+    """
+    inicio = cita.fecha_hora_propuesta
+    fin = inicio + timedelta(minutes=cita.duracion_minutos)
+    candidatas = Cita.objects.filter(
+        medico_id=cita.medico_id,
+        fecha_hora_propuesta__gt=inicio - MAX_DURACION_CITA,
+        fecha_hora_propuesta__lt=fin,
+    ).exclude(estado='cancelada')
+    if cita.pk:
+        candidatas = candidatas.exclude(pk=cita.pk)
+    for cita_id, fecha, duracion in candidatas.order_by('fecha_hora_propuesta').values_list(
+        'id', 'fecha_hora_propuesta', 'duracion_minutos'
+    ):
+        if fecha + timedelta(minutes=duracion) > inicio:
+            raise CitaSolapada(cita_id, fecha)
+
+    excluir = (cita.serie_id, cita.fecha_original) if cita.serie_id else None
+    choques = intervalos_de_series([cita.medico_id], inicio, fin, excluir=excluir)[cita.medico_id]
+    if choques:
+        serie_id, fecha, _ = choques[0]
+        raise CitaSolapada(None, fecha, serie_id=serie_id)
+
+
+@contextmanager
+def reserva_de_turno(cita, anterior=None):
+    """
+    Bloque para guardar ``cita`` sin solapes. Si ocupa un turno nuevo, abre
+    una transacción, bloquea la fila del médico (SELECT ... FOR NO KEY
+    UPDATE) y comprueba la agenda antes de ceder el control: dos reservas del
+    mismo médico se ejecutan una tras otra y la segunda ve la cita de la
+    primera. Las reservas de médicos distintos no se esperan entre sí, y NO
+    KEY no frena las inserciones que solo referencian al médico (consultas).
+
+        with reserva_de_turno(cita):
+            cita.save()
+    """
+    if not ocupa_turno_nuevo(cita, anterior):
+        yield
+        return
+    with transaction.atomic():
+        list(Medico.objects.select_for_update(no_key=True).filter(pk=cita.medico_id).values_list('pk', flat=True))
+        comprobar_turno_libre(cita)
+        yield
+
+
+def comprobar_serie_libre(serie):
+    """
+    Lanza CitaSolapada si alguna ocurrencia de ``serie`` (aún sin guardar)
+    dentro de HORIZONTE_SERIES pisa una cita activa u otra serie del médico.
+    Las ocupaciones se ordenan y cada ocurrencia busca por bisección las que
+    empiezan cerca: dos o tres consultas para todo el horizonte.
+    """
+    inicio = serie.fecha_hora_inicio
+    propias = fechas_serie(regla(serie), inicio, inicio + HORIZONTE_SERIES)
+    if not propias:
+        return
+    duracion = timedelta(minutes=serie.duracion_minutos)
+    fin = propias[-1] + duracion
+
+    ocupados = [
+        (fecha, fecha + timedelta(minutes=minutos), cita_id, None)
+        for cita_id, fecha, minutos in Cita.objects.filter(
+            medico_id=serie.medico_id,
+            fecha_hora_propuesta__gt=inicio - MAX_DURACION_CITA,
+            fecha_hora_propuesta__lt=fin,
+        ).exclude(estado='cancelada').values_list('id', 'fecha_hora_propuesta', 'duracion_minutos')
+    ]
+    ocupados += [
+        (fecha, final, None, serie_id)
+        for serie_id, fecha, final in intervalos_de_series([serie.medico_id], inicio, fin)[serie.medico_id]
+        if serie_id != serie.pk
+    ]
+    ocupados.sort(key=lambda ocupado: ocupado[0])
+    comienzos = [ocupado[0] for ocupado in ocupados]
+
+    for fecha in propias:
+        final = fecha + duracion
+        i = bisect_left(comienzos, fecha - MAX_DURACION_CITA)
+        while i < len(ocupados) and ocupados[i][0] < final:
+            otra_inicio, otra_fin, cita_id, serie_id = ocupados[i]
+            if otra_fin > fecha:
+                raise CitaSolapada(cita_id, otra_inicio, serie_id=serie_id)
+            i += 1
+
+
+@contextmanager
+def reserva_de_serie(serie):
+    """Como reserva_de_turno, para guardar una serie nueva sin solapes."""
+    with transaction.atomic():
+        list(Medico.objects.select_for_update(no_key=True).filter(pk=serie.medico_id).values_list('pk', flat=True))
+        comprobar_serie_libre(serie)
+        yield
@@ -0,0 +1,108 @@
+# api/estadisticas.py
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Cita, Consulta, ContadorEstadistica, ExamenMedico, Medico, Paciente
+
+# Contadores que se mantienen de forma incremental, al confirmar cada
+# transacción. Las operaciones masivas (queryset.update(), bulk_create) no
+# disparan señales: después de usarlas hay que ajustar los contadores a mano
+# o ejecutar `manage.py recalcular_estadisticas`.
+CONTADORES_MODELO = {
+    'pacientes': Paciente,
+    'medicos': Medico,
+    'citas': Cita,
+    'consultas': Consulta,
+}
+
+ESTADOS_EXAMEN_PENDIENTE = ['solicitado', 'en_proceso']
+
+
+def clave_cita_estado(estado):
+    return f'citas_{estado}'
+
+
+def ajustar_contadores(deltas):
+    """
+    Suma a cada contador su delta ({clave: delta}) cuando se confirme la
+    transacción actual; si se deshace, no se suma nada. Los contadores son
+    filas compartidas por todas las citas: sumando al confirmar, cada fila
+    queda bloqueada solo lo que dura su UPDATE y no toda la transacción que
+    guarda la cita, así las reservas de distintos médicos no esperan unas a
+    otras.
+    """
+    deltas = {clave: delta for clave, delta in deltas.items() if delta}
+    if deltas:
+        transaction.on_commit(lambda: _aplicar_deltas(deltas))
+
+
+def ajustar_contador(clave, delta):
+    ajustar_contadores({clave: delta})
+
+
+def _aplicar_deltas(deltas):
+    # Siempre en el mismo orden de claves: dos ajustes opuestos (A→B y B→A)
+    # no se bloquean en orden inverso
+    with transaction.atomic():
+        faltan = [
+            clave for clave in sorted(deltas)
+            if not ContadorEstadistica.objects.filter(clave=clave).update(valor=F('valor') + deltas[clave])
+        ]
+        if faltan:
+            # El contador todavía no existe: se calcula una vez desde la tabla
+            recalcular_contadores(faltan)
+
+
+def recalcular_contadores(claves=None):
+    """
+    Recalcula los contadores desde las tablas. Si ``claves`` es None se
+    recalculan todos.
+    """
+    valores = {}
+    for clave, modelo in CONTADORES_MODELO.items():
+        if claves is None or clave in claves:
+            valores[clave] = modelo.objects.count()
+
+    if claves is None or any(clave.startswith('citas_') for clave in claves):
+        por_estado = dict(Cita.objects.values_list('estado').annotate(total=Count('id')).order_by())
+        for estado, _ in Cita.ESTADO_CHOICES:
+            valores[clave_cita_estado(estado)] = por_estado.get(estado, 0)
+
+    for clave, valor in valores.items():
+        ContadorEstadistica.objects.update_or_create(clave=clave, defaults={'valor': valor})
+    return valores
+
+
+def obtener_estadisticas(hoy=None):
+    """
+    Estadísticas del panel de administración.
+
+    Los totales salen de ContadorEstadistica (una consulta). Las consultas del
+    mes y los exámenes pendientes son conteos acotados sobre columnas indexadas.
+    """
+    hoy = hoy or timezone.localdate()
+    contadores = dict(ContadorEstadistica.objects.values_list('clave', 'valor'))
+
+    inicio_mes = hoy.replace(day=1)
+    if inicio_mes.month == 12:
+        inicio_siguiente = inicio_mes.replace(year=inicio_mes.year + 1, month=1)
+    else:
+        inicio_siguiente = inicio_mes.replace(month=inicio_mes.month + 1)
+
+    return {
+        'pacientes': contadores.get('pacientes', 0),
+        'medicos': contadores.get('medicos', 0),
+        'citas': contadores.get('citas', 0),
+        'consultas': contadores.get('consultas', 0),
+        'citas_por_estado': {
+            estado: contadores.get(clave_cita_estado(estado), 0)
+            for estado, _ in Cita.ESTADO_CHOICES
+        },
+        'consultas_mes': Consulta.objects.filter(
+            fecha__gte=inicio_mes, fecha__lt=inicio_siguiente
+        ).count(),
+        'examenes_pendientes': ExamenMedico.objects.filter(
+            estado__in=ESTADOS_EXAMEN_PENDIENTE
+        ).count(),
+    }
@@ -0,0 +1,318 @@
+# api/eventos.py
+import asyncio
+import json
+import logging
+import secrets
+import select
+import threading
+import time
+from collections import defaultdict
+from functools import cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from .models import Cita, Usuario
+
+logger = logging.getLogger(__name__)
+
+# Eventos pendientes por conexión; si el cliente no los lee a tiempo se le pide recargar
+TAMANO_COLA = 100
+# Comentario cada LATIDO segundos para que proxies y navegadores no cierren la conexión
+LATIDO = 25
+# Espera del navegador antes de reconectar (campo retry de SSE), en milisegundos
+REINTENTO_MS = 5000
+# Vigencia del ticket para abrir el stream: solo tiene que llegar a la conexión
+DURACION_TICKET = 60
+SAL_TICKET = 'api.eventos.ticket'
+
+
+class Suscripcion:
+    """
+    Cola de eventos de una conexión abierta. Vive en el event loop del
+    stream: una conexión inactiva es una corrutina esperando, no un hilo.
+    """
+
+    def __init__(self, canal, usuario_id):
+        self.canal = canal
+        self.usuario_id = usuario_id
+        self.loop = asyncio.get_running_loop()
+        self.cola = asyncio.Queue(maxsize=TAMANO_COLA)
+        self.desbordada = False
+
+    def _poner(self, evento):
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.desbordada = True
+
+    def entregar(self, evento):
+        # Se llama desde cualquier hilo: vistas síncronas o la escucha de PostgreSQL
+        try:
+            self.loop.call_soon_threadsafe(self._poner, evento)
+        except RuntimeError:
+            pass  # el loop ya se cerró; la suscripción se retira en su finally
+
+    async def siguiente(self, espera):
+        """Próximo evento, o None si pasan ``espera`` segundos sin ninguno."""
+        try:
+            return await asyncio.wait_for(self.cola.get(), espera)
+        except asyncio.TimeoutError:
+            return None
+
+    def cerrar(self):
+        self.canal.desuscribir(self)
+
+
+class MemoriaEventos:
+    """
+    Pub/sub dentro del proceso. Basta con un único worker ASGI, porque las
+    vistas síncronas corren en hilos del mismo proceso. Con varios workers
+    cada uno solo ve lo que publica él mismo: usar PostgresEventos.
+    """
+
+    def __init__(self):
+        self._suscripciones = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def suscribir(self, usuario_id):
+        suscripcion = Suscripcion(self, usuario_id)
+        with self._lock:
+            self._suscripciones[usuario_id].add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion):
+        with self._lock:
+            abiertas = self._suscripciones.get(suscripcion.usuario_id)
+            if abiertas is not None:
+                abiertas.discard(suscripcion)
+                if not abiertas:
+                    del self._suscripciones[suscripcion.usuario_id]
+
+    def conectados(self):
+        with self._lock:
+            return len(self._suscripciones)
+
+    def publicar(self, usuario_ids, tipo, datos):
+        self.repartir(usuario_ids, {'tipo': tipo, 'datos': datos})
+
+    def repartir(self, usuario_ids, evento):
+        """Entrega ``evento`` a las conexiones abiertas en este proceso."""
+        with self._lock:
+            destinos = [s for usuario_id in set(usuario_ids) for s in self._suscripciones.get(usuario_id, ())]
+        for suscripcion in destinos:
+            suscripcion.entregar(evento)
+
+
+class PostgresEventos(MemoriaEventos):
+    """
+    Reparte entre workers con LISTEN/NOTIFY: publicar() hace un NOTIFY y cada
+    proceso con conexiones abiertas tiene un hilo (uno por proceso, no por
+    conexión) que escucha el canal y entrega a sus colas. NOTIFY admite hasta
+    8000 bytes, por eso los eventos llevan ids y campos cortos.
+    """
+    canal = 'sistema_medico_eventos'
+    # Destinatarios por NOTIFY: con ids de hasta 7 cifras la carga queda bajo 8000 bytes
+    usuarios_por_aviso = 500
+
+    def __init__(self, alias='default'):
+        super().__init__()
+        self.alias = alias
+        self._escucha = None
+        self._detener = threading.Event()
+        self.escuchando = threading.Event()
+
+    def publicar(self, usuario_ids, tipo, datos):
+        usuario_ids = sorted(set(usuario_ids))
+        with connections[self.alias].cursor() as cursor:
+            for inicio in range(0, len(usuario_ids), self.usuarios_por_aviso):
+                carga = json.dumps(
+                    {'usuarios': usuario_ids[inicio:inicio + self.usuarios_por_aviso], 'tipo': tipo, 'datos': datos},
+                    cls=DjangoJSONEncoder, separators=(',', ':'),
+                )
+                cursor.execute('SELECT pg_notify(%s, %s)', [self.canal, carga])
+
+    def suscribir(self, usuario_id):
+        with self._lock:
+            if self._escucha is None or not self._escucha.is_alive():
+                self._detener.clear()
+                self._escucha = threading.Thread(target=self._escuchar, name='eventos-postgres', daemon=True)
+                self._escucha.start()
+        return super().suscribir(usuario_id)
+
+    def detener(self):
+        """Cierra la escucha de este proceso (al apagarlo, o en las pruebas)."""
+        self._detener.set()
+        if self._escucha is not None:
+            self._escucha.join()
+
+    def _escuchar(self):
+        base = connections[self.alias]
+        while not self._detener.is_set():
+            conexion = None
+            try:
+                conexion = base.get_new_connection(base.get_connection_params())
+                conexion.autocommit = True
+                with conexion.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.canal}')
+                self.escuchando.set()
+                while not self._detener.is_set():
+                    # Espera corta solo para poder detenerse; los avisos despiertan al instante
+                    if not select.select([conexion], [], [], 1)[0]:
+                        continue
+                    conexion.poll()
+                    while conexion.notifies:
+                        carga = json.loads(conexion.notifies.pop(0).payload)
+                        self.repartir(carga['usuarios'], {'tipo': carga['tipo'], 'datos': carga['datos']})
+            except Exception:
+                logger.exception('Se perdió la escucha de eventos en PostgreSQL; reconectando')
+                self.escuchando.clear()
+                # Los avisos de mientras se perdieron: los clientes recargan lo que muestran
+                with self._lock:
+                    usuarios = list(self._suscripciones)
+                self.repartir(usuarios, {'tipo': 'recargar', 'datos': {}})
+                self._detener.wait(1)
+            finally:
+                if conexion is not None:
+                    conexion.close()
+        self.escuchando.clear()
+
+
+@cache
+def canal_eventos():
+    """Backend configurado en settings.EVENTOS_BACKEND, uno por proceso."""
+    return import_string(settings.EVENTOS_BACKEND)()
+
+
+def publicar(usuario_ids, tipo, datos):
+    """
+    Envía un evento a las conexiones de ``usuario_ids`` cuando la transacción
+    actual se confirme, para que el cliente que recargue ya vea el cambio.
+    """
+    usuario_ids = [usuario_id for usuario_id in usuario_ids if usuario_id is not None]
+    if usuario_ids:
+        transaction.on_commit(lambda: canal_eventos().publicar(usuario_ids, tipo, datos))
+
+
+def publicar_notificacion(notificacion):
+    publicar([notificacion.usuario_id], 'notificacion', {
+        'id': notificacion.pk, 'tipo': notificacion.tipo, 'titulo': notificacion.titulo, 'fecha': notificacion.fecha,
+    })
+
+
+def publicar_notificaciones(notificaciones):
+    """
+    Para las notificaciones creadas con bulk_create, que no disparan
+    señales: un evento por tipo y título con todos sus destinatarios.
+    """
+    destinatarios, fechas = defaultdict(list), {}
+    for notificacion in notificaciones:
+        clave = notificacion.tipo, notificacion.titulo
+        destinatarios[clave].append(notificacion.usuario_id)
+        fechas[clave] = notificacion.fecha
+    for (tipo, titulo), usuario_ids in destinatarios.items():
+        publicar(usuario_ids, 'notificacion', {'tipo': tipo, 'titulo': titulo, 'fecha': fechas[tipo, titulo]})
+
+
+def publicar_citas(cita_ids):
+    """
+    Avisa al médico y al paciente de las citas ``cita_ids`` que cambiaron de
+    estado. Los datos se leen al confirmar la transacción, con una consulta
+    para todas las citas.
+    """
+    def enviar():
+        for cita in Cita.objects.filter(pk__in=cita_ids).values(
+            'id', 'estado', 'fecha_hora_propuesta', 'version', 'medico__usuario_id', 'paciente__usuario_id',
+        ):
+            usuarios = [cita.pop('medico__usuario_id'), cita.pop('paciente__usuario_id')]
+            canal_eventos().publicar([u for u in usuarios if u is not None], 'cita', cita)
+
+    if cita_ids:
+        transaction.on_commit(enviar)
+
+
+def emitir_ticket(usuario):
+    """
+    Ticket firmado para abrir /api/eventos/ desde EventSource, que no
+    permite cabeceras. Sirve solo para el stream, caduca a los
+    DURACION_TICKET segundos y se acepta una vez; así lo que quede en los
+    logs de acceso no vale como access token.
+    """
+    return signing.dumps({'usuario': usuario.pk, 'uso': secrets.token_urlsafe(12)}, salt=SAL_TICKET)
+
+
+async def usuario_del_ticket(ticket):
+    """
+    Usuario activo del ticket, o None si es inválido, caducó o ya se usó.
+    El uso se anota en la caché por defecto: con varios workers debe ser una
+    caché compartida para que el ticket no valga una vez en cada uno.
+    """
+    try:
+        datos = signing.loads(ticket, salt=SAL_TICKET, max_age=DURACION_TICKET)
+    except signing.BadSignature:
+        return None
+    if not await caches['default'].aadd(f"eventos-ticket:{datos['uso']}", True, DURACION_TICKET):
+        return None
+    return await Usuario.objects.filter(pk=datos['usuario'], is_active=True).afirst()
+
+
+async def usuario_del_stream(request):
+    """
+    Usuario de la conexión y el timestamp en que debe cerrarse, o (None,
+    None). Con ``?ticket=`` el stream dura lo que un access token; con el
+    access token en la cabecera Authorization, hasta que este venza.
+    """
+    ticket = request.GET.get('ticket')
+    if ticket:
+        usuario = await usuario_del_ticket(ticket)
+        duracion = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+        return (usuario, time.time() + duracion) if usuario else (None, None)
+
+    autenticador = JWTAuthentication()
+    cabecera = autenticador.get_header(request)
+    crudo = cabecera and autenticador.get_raw_token(cabecera)
+    if not crudo:
+        return None, None
+    try:
+        token = autenticador.get_validated_token(crudo)
+        return await sync_to_async(autenticador.get_user)(token), token.get('exp')
+    except (InvalidToken, AuthenticationFailed):
+        return None, None
+
+
+def _evento_sse(tipo, datos):
+    return f'event: {tipo}\ndata: {json.dumps(datos, cls=DjangoJSONEncoder)}\n\n'
+
+
+async def flujo_eventos(usuario_id, expira=None):
+    """
+    Cuerpo text/event-stream de una conexión. Termina en ``expira``
+    (timestamp): el cliente reconecta con un ticket nuevo.
+    """
+    suscripcion = canal_eventos().suscribir(usuario_id)
+    try:
+        yield f'retry: {REINTENTO_MS}\n\n'
+        yield _evento_sse('conectado', {'usuario_id': usuario_id})
+        while True:
+            espera = LATIDO if expira is None else min(LATIDO, expira - time.time())
+            if espera <= 0:
+                yield _evento_sse('expirado', {})
+                return
+            evento = await suscripcion.siguiente(espera)
+            if suscripcion.desbordada:
+                suscripcion.desbordada = False
+                yield _evento_sse('recargar', {})
+            if evento is None:
+                yield ': latido\n\n'
+            else:
+                yield _evento_sse(evento['tipo'], evento['datos'])
+    finally:
+        suscripcion.cerrar()
@@ -0,0 +1,163 @@
+# api/historia.py
+import time
+
+from django.core.cache import cache
+
+from .models import Consulta, Diagnostico, Paciente, Tratamiento
+
+HISTORIA_CACHE_TIMEOUT = 60 * 60 * 24
+# Los datos del médico van embebidos en cada consulta: al cambiar un médico se
+# incrementa esta versión global y se invalidan todas las historias a la vez.
+CLAVE_VERSION_GLOBAL = 'historia:version:global'
+_SIN_HISTORIA = 'sin-historia'
+
+
+def construir_historia_clinica(paciente_id):
+    """
+    Arma el documento anidado de la historia clínica de un paciente
+    (paciente → consultas → diagnósticos → tratamientos).
+
+    Cada nivel se obtiene con su propia consulta filtrada por claves foráneas
+    indexadas, en vez de un único JOIN que multiplica las filas
+    (consultas × diagnósticos × tratamientos). El anidado se hace con
+    diccionarios por id, en tiempo lineal.
+
+    Devuelve None si el paciente no existe o no tiene consultas.
+    """
+    paciente = Paciente.objects.filter(pk=paciente_id).values(
+        'id', 'nombre', 'apellido', 'dni', 'fecha_nacimiento', 'telefono', 'direccion',
+        'historiaclinica__id', 'historiaclinica__fecha_inicio', 'historiaclinica__observaciones',
+    ).first()
+    if paciente is None:
+        return None
+
+    consultas = Consulta.objects.filter(paciente_id=paciente_id).order_by('-fecha', '-id').values(
+        'id', 'fecha', 'motivo', 'medico_id', 'medico__nombre', 'medico__apellido',
+        'medico__dni', 'medico__telefono', 'medico__especialidad_id',
+    )
+    if not consultas:
+        return None
+
+    paciente_data = {
+        'id': paciente['id'],
+        'nombre': paciente['nombre'] or '',
+        'apellido': paciente['apellido'] or '',
+        'dni': paciente['dni'] or '',
+        'fecha_nacimiento': paciente['fecha_nacimiento'],
+        'telefono': paciente['telefono'] or '',
+        'direccion': paciente['direccion'] or '',
+    }
+
+    consultas_data = []
+    diagnosticos_por_consulta = {}
+    for con in consultas:
+        diagnosticos = []
+        diagnosticos_por_consulta[con['id']] = diagnosticos
+        consultas_data.append({
+            'id': con['id'],
+            'paciente': paciente['id'],
+            'medico': con['medico_id'],
+            'fecha': con['fecha'],
+            'motivo': con['motivo'] or '',
+            'paciente_detalle': paciente_data,
+            'medico_detalle': {
+                'id': con['medico_id'],
+                'nombre': con['medico__nombre'] or '',
+                'apellido': con['medico__apellido'] or '',
+                'dni': con['medico__dni'] or '',
+                'telefono': con['medico__telefono'] or '',
+                'especialidad': con['medico__especialidad_id'],
+            },
+            'diagnosticos': diagnosticos,
+        })
+
+    tratamientos_por_diagnostico = {}
+    diagnosticos = Diagnostico.objects.filter(consulta__paciente_id=paciente_id).order_by('-fecha', '-id').values(
+        'id', 'consulta_id', 'descripcion', 'fecha',
+    )
+    for diag in diagnosticos:
+        tratamientos = []
+        tratamientos_por_diagnostico[diag['id']] = tratamientos
+        diagnosticos_por_consulta[diag['consulta_id']].append({
+            'id': diag['id'],
+            'descripcion': diag['descripcion'] or '',
+            'fecha': diag['fecha'],
+            'tratamientos': tratamientos,
+        })
+
+    tratamientos = Tratamiento.objects.filter(
+        diagnostico__consulta__paciente_id=paciente_id
+    ).order_by('-fecha_inicio', '-id').values(
+        'id', 'diagnostico_id', 'descripcion', 'indicaciones', 'duracion_dias', 'fecha_inicio',
+    )
+    for trat in tratamientos:
+        tratamientos_por_diagnostico[trat['diagnostico_id']].append({
+            'id': trat['id'],
+            'descripcion': trat['descripcion'] or '',
+            'indicaciones': trat['indicaciones'] or '',
+            'duracion_dias': trat['duracion_dias'],
+            'fecha_inicio': trat['fecha_inicio'],
+        })
+
+    return {
+        'id': paciente['historiaclinica__id'],
+        'fecha_inicio': paciente['historiaclinica__fecha_inicio'],
+        'observaciones': paciente['historiaclinica__observaciones'] or '',
+        'paciente_detalle': paciente_data,
+        'consultas': consultas_data,
+    }
+
+
+# === Caché versionada ===
+
+def _clave_version(paciente_id):
+    return f'historia:version:{paciente_id}'
+
+
+def _version_nueva():
+    # Si la versión se perdió del caché (expiró, reinicio), se parte de un valor
+    # que no puede coincidir con ningún ETag entregado antes.
+    return time.time_ns()
+
+
+def version_historia(paciente_id):
+    """
+    Versión actual de la historia del paciente. Solo consulta el caché, nunca
+    la base de datos, para poder responder 304 sin reconstruir nada.
+    """
+    claves = [CLAVE_VERSION_GLOBAL, _clave_version(paciente_id)]
+    valores = cache.get_many(claves)
+    for clave in claves:
+        if clave not in valores:
+            cache.add(clave, _version_nueva(), timeout=None)
+            valores[clave] = cache.get(clave)
+    return f'{valores[claves[0]]}.{valores[claves[1]]}'
+
+
+def invalidar_historia(paciente_id=None):
+    """
+    Incrementa la versión de la historia de ``paciente_id`` (o la global si es
+    None). Los documentos cacheados con la versión anterior quedan huérfanos y
+    expiran solos.
+    """
+    clave = CLAVE_VERSION_GLOBAL if paciente_id is None else _clave_version(paciente_id)
+    try:
+        cache.incr(clave)
+    except ValueError:
+        cache.set(clave, _version_nueva(), timeout=None)
+
+
+def obtener_historia_clinica(paciente_id, version=None):
+    """
+    Devuelve (version, documento) usando el caché; el documento es None si el
+    paciente no tiene historia clínica.
+    """
+    version = version or version_historia(paciente_id)
+    clave = f'historia:documento:{paciente_id}:{version}'
+    documento = cache.get(clave)
+    if documento is None:
+        documento = construir_historia_clinica(paciente_id)
+        cache.set(clave, _SIN_HISTORIA if documento is None else documento, HISTORIA_CACHE_TIMEOUT)
+    elif documento == _SIN_HISTORIA:
+        documento = None
+    return version, documento
@@ -0,0 +1,124 @@
+# api/lista_espera.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .disponibilidad import CitaSolapada, reserva_de_turno
+from .models import Cita, EsperaCita, Notificacion
+
+# Tiempo que se guarda un turno ofrecido antes de pasar al siguiente de la cola
+DURACION_OFERTA = timedelta(hours=2)
+# Un turno que empieza antes no se ofrece: nadie llegaría a aceptarlo a tiempo
+MARGEN_MINIMO = timedelta(minutes=30)
+
+ORDEN_COLA = ('prioridad', 'fecha_solicitud', 'id')
+
+
+def _notificar_oferta(espera, reserva):
+    usuario_id = espera.paciente.usuario_id
+    if usuario_id is None:
+        return
+    fecha = timezone.localtime(reserva.fecha_hora_propuesta)
+    expira = timezone.localtime(espera.oferta_expira)
+    Notificacion.objects.create(
+        usuario_id=usuario_id, tipo='cita', titulo='Turno disponible',
+        mensaje=(
+            f"Se liberó un turno con Dr. {espera.medico.nombre} {espera.medico.apellido} "
+            f"el {fecha:%d/%m/%Y} a las {fecha:%H:%M}. Acéptalo antes de las {expira:%H:%M}."
+        ),
+        metadata={'cita_id': reserva.pk, 'espera_id': espera.pk},
+    )
+
+
+def ofrecer_turno(cita, ahora=None):
+    """
+    Ofrece el turno de ``cita`` (recién cancelada) al primero de la lista de
+    espera de su médico. El siguiente paciente es la primera fila de
+    espera_cola_idx, así que el coste es O(log n) sin importar cuántos
+    esperan; SKIP LOCKED deja que dos cancelaciones simultáneas tomen
+    pacientes distintos. El turno se reserva con una Cita 'solicitada' del
+    paciente. Devuelve la EsperaCita ofrecida, o None.
+    """
+    ahora = ahora or timezone.now()
+    if cita.fecha_hora_propuesta < ahora + MARGEN_MINIMO:
+        return None
+    with transaction.atomic():
+        espera = EsperaCita.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+            medico_id=cita.medico_id, estado='esperando',
+        ).exclude(paciente_id=cita.paciente_id).select_related('paciente', 'medico').order_by(*ORDEN_COLA).first()
+        if espera is None:
+            return None
+
+        reserva = Cita(
+            paciente_id=espera.paciente_id, medico_id=cita.medico_id, estado='solicitada',
+            fecha_hora_propuesta=cita.fecha_hora_propuesta, duracion_minutos=cita.duracion_minutos,
+            motivo=espera.motivo,
+        )
+        try:
+            with reserva_de_turno(reserva):
+                reserva.save()
+        except CitaSolapada:
+            return None  # otra reserva ocupó el turno antes
+
+        espera.estado = 'ofrecida'
+        espera.cita = reserva
+        espera.oferta_expira = min(ahora + DURACION_OFERTA, cita.fecha_hora_propuesta)
+        espera.save(update_fields=['estado', 'cita', 'oferta_expira'])
+        _notificar_oferta(espera, reserva)
+    return espera
+
+
+def turno_liberado(cita):
+    """
+    Llamada al cancelar ``cita``. Si era un turno ofrecido, la oferta queda
+    rechazada; en cualquier caso el turno pasa al siguiente de la cola.
+    """
+    EsperaCita.objects.filter(cita=cita, estado='ofrecida').update(estado='rechazada')
+    return ofrecer_turno(cita)
+
+
+def cerrar_oferta(espera, estado):
+    """
+    Cierra la oferta de ``espera`` con ``estado`` (aceptada, rechazada,
+    vencida o retirada). Al aceptarla la cita se confirma; en los demás casos
+    se cancela y el turno se ofrece al siguiente.
+
+    El cierre es un UPDATE condicionado al estado activo: si la respuesta
+    del paciente y `manage.py vencer_ofertas_espera` llegan a la vez, solo
+    uno cierra la oferta y el otro no toca la cita. La cita se vuelve a leer
+    bloqueada, así que un cambio hecho por otra vía no se pisa; si ya estaba
+    confirmada, una oferta vencida cuenta como aceptada. Devuelve el estado
+    final, o None si la oferta ya estaba cerrada.
+    """
+    activos = ('esperando', 'ofrecida') if estado == 'retirada' else ('ofrecida',)
+    with transaction.atomic():
+        if not EsperaCita.objects.filter(pk=espera.pk, estado__in=activos).update(estado=estado):
+            return None
+        espera.estado = estado
+        cita = Cita.objects.select_for_update().filter(
+            pk=EsperaCita.objects.filter(pk=espera.pk).values('cita_id')[:1],
+        ).first()
+        espera.cita = cita
+        if cita is None:
+            return estado
+        if estado == 'vencida' and cita.estado in ('confirmada', 'completada'):
+            EsperaCita.objects.filter(pk=espera.pk).update(estado='aceptada')
+            espera.estado = 'aceptada'
+        elif cita.estado == 'solicitada':
+            cita.estado = 'confirmada' if estado == 'aceptada' else 'cancelada'
+            cita.save()
+    return espera.estado
+
+
+def vencer_ofertas(ahora=None):
+    """
+    Cierra las ofertas cuyo plazo terminó (el turno pasa al siguiente de la
+    cola). Si el paciente ya confirmó la cita por otra vía, la oferta cuenta
+    como aceptada. Devuelve cuántas ofertas vencieron.
+    """
+    ahora = ahora or timezone.now()
+    vencidas = 0
+    for espera in EsperaCita.objects.filter(estado='ofrecida', oferta_expira__lte=ahora):
+        vencidas += cerrar_oferta(espera, 'vencida') == 'vencida'
+    return vencidas
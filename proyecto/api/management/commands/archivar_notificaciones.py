@@ -0,0 +1,43 @@
+# api/management/commands/archivar_notificaciones.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.retencion import TAMANO_LOTE, archivar_notificaciones
+
+
+class Command(BaseCommand):
+    help = 'Mueve a NotificacionArchivada, por lotes, las notificaciones leídas más antiguas que la retención'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias', type=int, default=None,
+            help='Antigüedad mínima en días (por defecto NOTIFICACIONES_DIAS_RETENCION)'
+        )
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Notificaciones por transacción')
+        parser.add_argument(
+            '--intervalo', type=int, default=0,
+            help='Segundos entre pasadas; 0 hace una sola pasada (para cron)'
+        )
+
+    def progreso(self, total):
+        self.stdout.write(f"  Archivadas hasta ahora: {total}")
+
+    def handle(self, *args, **options):
+        dias = options['dias'] if options['dias'] is not None else settings.NOTIFICACIONES_DIAS_RETENCION
+        if dias < 0:
+            raise CommandError('--dias no puede ser negativo.')
+        if options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que cero.')
+        if options['intervalo'] < 0:
+            raise CommandError('--intervalo no puede ser negativo.')
+
+        while True:
+            total = archivar_notificaciones(dias=dias, tamano=options['lote'], al_avanzar=self.progreso)
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Notificaciones archivadas: {total} (leídas hace más de {dias} días)."
+            ))
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
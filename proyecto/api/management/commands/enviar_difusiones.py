@@ -0,0 +1,37 @@
+# api/management/commands/enviar_difusiones.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.difusion import TAMANO_LOTE, procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = 'Envía por lotes las difusiones de notificaciones pendientes o interrumpidas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Notificaciones por transacción')
+        parser.add_argument(
+            '--intervalo', type=int, default=0,
+            help='Segundos entre pasadas; 0 hace una sola pasada (para cron)'
+        )
+
+    def progreso(self, difusion):
+        porcentaje = 100 * difusion.enviadas // difusion.total if difusion.total else 100
+        self.stdout.write(f"  Difusión {difusion.pk}: {difusion.enviadas}/{difusion.total} ({porcentaje}%)")
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que cero.')
+        if options['intervalo'] < 0:
+            raise CommandError('--intervalo no puede ser negativo.')
+
+        while True:
+            difusiones = procesar_pendientes(tamano=options['lote'], al_avanzar=self.progreso)
+            enviadas = sum(difusion.enviadas for difusion in difusiones)
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Difusiones procesadas: {len(difusiones)} ({enviadas} notificaciones en total)."
+            ))
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
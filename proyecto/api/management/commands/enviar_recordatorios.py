@@ -0,0 +1,31 @@
+# api/management/commands/enviar_recordatorios.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.recordatorios import TAMANO_LOTE, enviar_recordatorios
+
+
+class Command(BaseCommand):
+    help = 'Crea las notificaciones de recordatorio (24 h y 2 h antes) de las citas confirmadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Citas por transacción')
+        parser.add_argument(
+            '--intervalo', type=int, default=0,
+            help='Segundos entre pasadas; 0 hace una sola pasada (para cron)'
+        )
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote debe ser mayor que cero.')
+        if options['intervalo'] < 0:
+            raise CommandError('--intervalo no puede ser negativo.')
+
+        while True:
+            enviados = enviar_recordatorios(tamano=options['lote'])
+            resumen = ', '.join(f'{horas} h: {cantidad}' for horas, cantidad in sorted(enviados.items(), reverse=True))
+            self.stdout.write(self.style.SUCCESS(f"✅ Recordatorios enviados ({resumen})."))
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,331 @@
+# api/management/commands/generar_datos.py
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from operator import attrgetter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.busqueda import invalidar_indice_pacientes
+from api.busqueda_clinica import reconstruir_documentos
+from api.estadisticas import recalcular_contadores
+from api.resumen_agenda import recalcular_resumen_agenda
+from api.historia import invalidar_historia
+from api.models import (
+    AntecedenteMedico, Cita, Consulta, Diagnostico, Especialidad, ExamenMedico, HistoriaClinica,
+    Medico, Notificacion, Paciente, Rol, TipoExamen, Tratamiento, Usuario,
+)
+
+# Volúmenes con --escala 1 (tamaño de producción)
+VOLUMENES = {
+    'pacientes': 100_000,
+    'medicos': 500,
+    'citas': 1_000_000,
+    'consultas': 300_000,
+    'examenes': 150_000,
+    'notificaciones': 500_000,
+}
+
+FECHA_BASE = date(2030, 1, 1)
+
+NOMBRES = [
+    'María', 'José', 'Luis', 'Ana', 'Carlos', 'Carmen', 'Juan', 'Rosa', 'Pedro', 'Luisa', 'Miguel',
+    'Elena', 'Jorge', 'Isabel', 'Andrés', 'Gabriela', 'Rafael', 'Daniela', 'Fernando', 'Valentina',
+    'Ricardo', 'Patricia', 'Alejandro', 'Sofía', 'Manuel', 'Lucía', 'Francisco', 'Mariana',
+]
+APELLIDOS = [
+    'González', 'Rodríguez', 'Pérez', 'Hernández', 'García', 'Martínez', 'López', 'Díaz', 'Sánchez',
+    'Romero', 'Torres', 'Ramírez', 'Flores', 'Rojas', 'Morales', 'Castillo', 'Gutiérrez', 'Mendoza',
+    'Silva', 'Suárez', 'Medina', 'Vargas', 'Blanco', 'Castro', 'Rivas', 'Salazar', 'Marcano',
+]
+MOTIVOS = [
+    'Control de rutina', 'Dolor de cabeza persistente', 'Fiebre y malestar general', 'Dolor abdominal',
+    'Control de tensión arterial', 'Tos seca de varios días', 'Dolor lumbar', 'Revisión de exámenes',
+    'Control de glicemia', 'Mareos ocasionales', 'Dolor en el pecho al esfuerzo', 'Erupción en la piel',
+]
+DIAGNOSTICOS = [
+    'Hipertensión arterial esencial', 'Diabetes mellitus tipo 2', 'Infección respiratoria alta',
+    'Gastritis aguda', 'Migraña sin aura', 'Lumbalgia mecánica', 'Rinitis alérgica',
+    'Dermatitis de contacto', 'Asma bronquial leve', 'Infección urinaria no complicada',
+    'Hipotiroidismo', 'Ansiedad generalizada',
+]
+TRATAMIENTOS = [
+    ('Losartán 50 mg', 'Una tableta diaria en la mañana'),
+    ('Metformina 850 mg', 'Una tableta con el almuerzo y la cena'),
+    ('Acetaminofén 500 mg', 'Cada 8 horas si hay dolor o fiebre'),
+    ('Omeprazol 20 mg', 'En ayunas por 14 días'),
+    ('Ibuprofeno 400 mg', 'Cada 8 horas después de comer por 5 días'),
+    ('Loratadina 10 mg', 'Una tableta diaria'),
+    ('Amoxicilina 500 mg', 'Cada 8 horas por 7 días'),
+    ('Salbutamol inhalador', 'Dos inhalaciones si hay dificultad respiratoria'),
+]
+TIPOS_EXAMEN = [
+    'Hematología completa', 'Perfil lipídico', 'Glicemia en ayunas', 'Uroanálisis',
+    'Radiografía de tórax', 'Electrocardiograma', 'Perfil tiroideo', 'Ecografía abdominal',
+]
+
+
+@contextmanager
+def sin_auto_now_add(modelo, campo):
+    """Permite fijar a mano un campo auto_now_add durante la carga (fechas realistas)."""
+    field = modelo._meta.get_field(campo)
+    original = field.auto_now_add
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = original
+
+
+class Command(BaseCommand):
+    help = 'Genera un conjunto de datos sintético y reproducible para pruebas de rendimiento'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--semilla', type=int, default=42, help='Semilla del generador aleatorio')
+        parser.add_argument(
+            '--escala', type=float, default=1.0,
+            help='Factor sobre los volúmenes base (1 = 100k pacientes, 1M citas, 300k consultas...)'
+        )
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por bulk_create/transacción')
+        parser.add_argument(
+            '--fecha-base', type=date.fromisoformat, default=FECHA_BASE,
+            help='Día que hace de "hoy" para todas las fechas generadas (AAAA-MM-DD)'
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['semilla'])
+        self.lote = options['lote']
+        self.prefijo = f"s{options['semilla']}"
+        escala = options['escala']
+        if escala <= 0:
+            raise CommandError('La escala debe ser mayor que cero.')
+        if Paciente.objects.filter(dni__startswith=f'{self.prefijo}-').exists():
+            raise CommandError(f"Ya existen datos generados con la semilla {options['semilla']}.")
+
+        volumen = {clave: max(1, round(base * escala)) for clave, base in VOLUMENES.items()}
+        # Todas las fechas salen de la fecha base y no del reloj: misma semilla, mismos datos cualquier día
+        self.hoy = options['fecha_base']
+        self.ahora = timezone.make_aware(datetime.combine(self.hoy, datetime.min.time()))
+        self.clave = make_password('clave123')  # Un solo hash: calcularlo por usuario tomaría horas
+        inicio = time.perf_counter()
+
+        roles = self.roles()
+        especialidades = self.especialidades()
+        medicos = self.medicos(volumen['medicos'], especialidades, roles['medico'])
+        pacientes, usuarios_pacientes = self.pacientes(volumen['pacientes'], roles['paciente'])
+        consultas = self.consultas(volumen['consultas'], pacientes, medicos)
+        diagnosticos = self.diagnosticos(consultas)
+        self.tratamientos(diagnosticos)
+        self.citas(volumen['citas'], pacientes, medicos)
+        self.examenes(volumen['examenes'], pacientes, medicos, diagnosticos)
+        self.notificaciones(volumen['notificaciones'], usuarios_pacientes + [u for _, u in medicos])
+
+        # bulk_create no dispara señales: se recalculan contadores e invalidan cachés e índices
+        recalcular_contadores()
+        recalcular_resumen_agenda()
+        invalidar_historia()
+        invalidar_indice_pacientes()
+        reconstruir_documentos()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"✅ Datos generados en {time.perf_counter() - inicio:.1f} s.")
+        )
+
+    # === Utilidades ===
+
+    def insertar(self, modelo, filas, etiqueta=None, conservar=None):
+        """
+        Inserta las filas (iterable perezoso) en lotes, cada lote en su transacción.
+        Solo se guarda ``conservar(fila)`` de cada fila creada, y solo si se pide:
+        sin ``conservar`` devuelve la cantidad y ningún lote sobrevive a su inserción.
+        """
+        etiqueta = etiqueta or modelo._meta.verbose_name_plural
+        inicio = time.perf_counter()
+        total, conservados, lote = 0, [], []
+        for fila in filas:
+            lote.append(fila)
+            if len(lote) >= self.lote:
+                total += self._insertar_lote(modelo, lote, conservar, conservados)
+                lote = []
+        if lote:
+            total += self._insertar_lote(modelo, lote, conservar, conservados)
+        self.stdout.write(f"  {etiqueta}: {total} en {time.perf_counter() - inicio:.1f} s")
+        return conservados if conservar else total
+
+    def _insertar_lote(self, modelo, lote, conservar, conservados):
+        with transaction.atomic():
+            creados = modelo.objects.bulk_create(lote, batch_size=self.lote)
+        if conservar:
+            conservados.extend(conservar(fila) for fila in creados)
+        return len(creados)
+
+    def nombre(self):
+        return self.rng.choice(NOMBRES), f'{self.rng.choice(APELLIDOS)} {self.rng.choice(APELLIDOS)}'
+
+    def fecha_hora_laboral(self, dia):
+        hora = datetime.combine(dia, datetime.min.time()) + timedelta(hours=8, minutes=30 * self.rng.randrange(18))
+        return timezone.make_aware(hora)
+
+    # === Modelos ===
+
+    def roles(self):
+        roles = {}
+        for codigo, nombre in (('admin', 'Administrador'), ('medico', 'Médico'), ('paciente', 'Paciente')):
+            roles[codigo], _ = Rol.objects.get_or_create(codigo=codigo, defaults={'nombre': nombre})
+        return roles
+
+    def especialidades(self):
+        existentes = list(Especialidad.objects.values_list('id', flat=True))
+        if existentes:
+            return existentes
+        return self.insertar(Especialidad, (
+            Especialidad(nombre=nombre) for nombre in (
+                'Medicina Interna', 'Cardiología', 'Pediatría', 'Dermatología',
+                'Ginecología y Obstetricia', 'Neurología', 'Endocrinología', 'Traumatología',
+            )
+        ), conservar=attrgetter('id'))
+
+    def medicos(self, cantidad, especialidades, rol):
+        datos = [self.nombre() for _ in range(cantidad)]
+        usuarios = self.insertar(Usuario, (
+            Usuario(
+                correo=f'medico{i}.{self.prefijo}@demo.clinica', nombre=nombre, apellido=apellido,
+                password=self.clave, rol=rol,
+            )
+            for i, (nombre, apellido) in enumerate(datos)
+        ), 'usuarios médicos', conservar=attrgetter('id'))
+        medicos = self.insertar(Medico, (
+            Medico(
+                usuario_id=usuario_id, nombre=datos[i][0], apellido=datos[i][1],
+                dni=f'{self.prefijo}-M{i:06d}', telefono=f'0414-{self.rng.randrange(10**7):07d}',
+                especialidad_id=self.rng.choice(especialidades),
+            )
+            for i, usuario_id in enumerate(usuarios)
+        ), conservar=attrgetter('id'))
+        return list(zip(medicos, usuarios))
+
+    def pacientes(self, cantidad, rol):
+        # Aproximadamente un tercio de los pacientes tiene usuario en el portal
+        con_usuario = set(self.rng.sample(range(cantidad), cantidad // 3))
+        datos = [self.nombre() for _ in range(cantidad)]
+        usuarios = self.insertar(Usuario, (
+            Usuario(
+                correo=f'paciente{i}.{self.prefijo}@demo.clinica', nombre=datos[i][0], apellido=datos[i][1],
+                password=self.clave, rol=rol,
+            )
+            for i in sorted(con_usuario)
+        ), 'usuarios pacientes', conservar=attrgetter('id'))
+        usuario_de = dict(zip(sorted(con_usuario), usuarios))
+        pacientes = self.insertar(Paciente, (
+            Paciente(
+                usuario_id=usuario_de.get(i), nombre=nombre, apellido=apellido, dni=f'{self.prefijo}-P{i:08d}',
+                fecha_nacimiento=date(1940, 1, 1) + timedelta(days=self.rng.randrange(30000)),
+                telefono=f'0412-{self.rng.randrange(10**7):07d}', direccion=f'Calle {self.rng.randrange(1, 200)}',
+            )
+            for i, (nombre, apellido) in enumerate(datos)
+        ), conservar=attrgetter('id'))
+        self.insertar(AntecedenteMedico, (
+            AntecedenteMedico(
+                paciente_id=paciente_id, alergias=self.rng.choice(['', 'Penicilina', 'Mariscos', 'AINES']),
+                enfermedades_cronicas=self.rng.choice(['', 'Hipertensión', 'Diabetes tipo 2', 'Asma']),
+                fuma=self.rng.random() < 0.2,
+            )
+            for paciente_id in pacientes if self.rng.random() < 0.4
+        ))
+        return pacientes, usuarios
+
+    def consultas(self, cantidad, pacientes, medicos):
+        # Distribución sesgada: pocos pacientes crónicos concentran muchas consultas
+        def elegir():
+            if self.rng.random() < 0.2:
+                return pacientes[min(int(self.rng.paretovariate(1.2)) - 1, len(pacientes) - 1)]
+            return self.rng.choice(pacientes)
+        elegidos = [elegir() for _ in range(cantidad)]
+        self.insertar(HistoriaClinica, (
+            HistoriaClinica(paciente_id=paciente_id, observaciones='Historia clínica creada automáticamente.')
+            for paciente_id in sorted(set(elegidos))
+        ))
+        medico_ids = [medico_id for medico_id, _ in medicos]
+        return self.insertar(Consulta, (
+            Consulta(
+                paciente_id=paciente_id, medico_id=self.rng.choice(medico_ids),
+                fecha=self.hoy - timedelta(days=self.rng.randrange(3 * 365)), motivo=self.rng.choice(MOTIVOS),
+            )
+            for paciente_id in elegidos
+        ), conservar=attrgetter('id', 'fecha'))
+
+    def diagnosticos(self, consultas):
+        with sin_auto_now_add(Diagnostico, 'fecha'):
+            return self.insertar(Diagnostico, (
+                Diagnostico(consulta_id=consulta_id, descripcion=self.rng.choice(DIAGNOSTICOS), fecha=fecha)
+                for consulta_id, fecha in consultas
+                for _ in range(self.rng.choice((0, 1, 1, 1, 2)))
+            ), conservar=attrgetter('id', 'fecha'))
+
+    def tratamientos(self, diagnosticos):
+        def filas():
+            for diagnostico_id, fecha in diagnosticos:
+                for _ in range(self.rng.choice((1, 1, 2, 3))):
+                    descripcion, indicaciones = self.rng.choice(TRATAMIENTOS)
+                    yield Tratamiento(
+                        diagnostico_id=diagnostico_id, descripcion=descripcion, indicaciones=indicaciones,
+                        duracion_dias=self.rng.choice((5, 7, 14, 30)), fecha_inicio=fecha,
+                    )
+        self.insertar(Tratamiento, filas())
+
+    def citas(self, cantidad, pacientes, medicos):
+        medico_ids = [medico_id for medico_id, _ in medicos]
+
+        def filas():
+            for _ in range(cantidad):
+                # Un año hacia atrás y seis meses hacia adelante
+                dia = self.hoy + timedelta(days=self.rng.randrange(-365, 180))
+                if dia < self.hoy:
+                    estado = self.rng.choices(['completada', 'cancelada'], weights=[85, 15])[0]
+                else:
+                    estado = self.rng.choices(['solicitada', 'confirmada', 'cancelada'], weights=[30, 60, 10])[0]
+                fecha_hora = self.fecha_hora_laboral(dia)
+                yield Cita(
+                    paciente_id=self.rng.choice(pacientes), medico_id=self.rng.choice(medico_ids),
+                    fecha_hora_propuesta=fecha_hora, motivo=self.rng.choice(MOTIVOS), estado=estado,
+                    fecha_solicitud=fecha_hora - timedelta(days=self.rng.randrange(1, 30), hours=self.rng.randrange(24)),
+                )
+        with sin_auto_now_add(Cita, 'fecha_solicitud'):
+            self.insertar(Cita, filas())
+
+    def examenes(self, cantidad, pacientes, medicos, diagnosticos):
+        tipos = [TipoExamen.objects.get_or_create(nombre=nombre)[0].id for nombre in TIPOS_EXAMEN]
+        medico_ids = [medico_id for medico_id, _ in medicos]
+
+        def filas():
+            for _ in range(cantidad):
+                dias = self.rng.randrange(365)
+                estado = 'completado' if dias > 15 else self.rng.choice(['solicitado', 'en_proceso', 'completado'])
+                yield ExamenMedico(
+                    paciente_id=self.rng.choice(pacientes), medico_id=self.rng.choice(medico_ids),
+                    tipo_examen_id=self.rng.choice(tipos), estado=estado,
+                    diagnostico_relacionado_id=(
+                        self.rng.choice(diagnosticos)[0] if diagnosticos and self.rng.random() < 0.3 else None
+                    ),
+                    fecha_solicitud=self.ahora - timedelta(days=dias),
+                    fecha_resultado=self.hoy - timedelta(days=max(dias - 3, 0)) if estado == 'completado' else None,
+                )
+        with sin_auto_now_add(ExamenMedico, 'fecha_solicitud'):
+            self.insertar(ExamenMedico, filas())
+
+    def notificaciones(self, cantidad, usuarios):
+        def filas():
+            for _ in range(cantidad):
+                dias = self.rng.randrange(365)
+                yield Notificacion(
+                    usuario_id=self.rng.choice(usuarios), tipo=self.rng.choice(['cita', 'diagnostico', 'tratamiento']),
+                    titulo='Recordatorio de cita', mensaje='Tiene una cita programada próximamente.',
+                    leida=dias > 7 or self.rng.random() < 0.5,
+                    fecha=self.ahora - timedelta(days=dias, minutes=self.rng.randrange(1440)),
+                )
+        with sin_auto_now_add(Notificacion, 'fecha'):
+            self.insertar(Notificacion, filas())
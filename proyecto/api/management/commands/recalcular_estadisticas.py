@@ -0,0 +1,16 @@
+# api/management/commands/recalcular_estadisticas.py
+from django.core.management.base import BaseCommand
+from api.estadisticas import recalcular_contadores
+from api.resumen_agenda import recalcular_resumen_agenda
+
+class Command(BaseCommand):
+    help = 'Recalcula desde las tablas los contadores del panel y el resumen de agendas (tras cargas masivas)'
+
+    def handle(self, *args, **options):
+        valores = recalcular_contadores()
+        for clave, valor in sorted(valores.items()):
+            self.stdout.write(f"{clave}: {valor}")
+        self.stdout.write(f"resumen_agenda: {recalcular_resumen_agenda()} filas")
+        self.stdout.write(
+            self.style.SUCCESS("✅ Contadores recalculados.")
+        )
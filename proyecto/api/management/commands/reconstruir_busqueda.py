@@ -0,0 +1,14 @@
+# api/management/commands/reconstruir_busqueda.py
+from django.core.management.base import BaseCommand
+from api.busqueda_clinica import reconstruir_documentos
+
+class Command(BaseCommand):
+    help = 'Regenera los documentos de la búsqueda clínica (tras cargas masivas)'
+
+    def handle(self, *args, **options):
+        totales = reconstruir_documentos()
+        for tipo, total in totales.items():
+            self.stdout.write(f"{tipo}: {total}")
+        self.stdout.write(
+            self.style.SUCCESS("✅ Documentos de búsqueda regenerados.")
+        )
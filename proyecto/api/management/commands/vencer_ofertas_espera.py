@@ -0,0 +1,27 @@
+# api/management/commands/vencer_ofertas_espera.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.lista_espera import vencer_ofertas
+
+
+class Command(BaseCommand):
+    help = 'Cierra los turnos ofrecidos de la lista de espera cuyo plazo terminó y los pasa al siguiente'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo', type=int, default=0,
+            help='Segundos entre pasadas; 0 hace una sola pasada (para cron)'
+        )
+
+    def handle(self, *args, **options):
+        if options['intervalo'] < 0:
+            raise CommandError('--intervalo no puede ser negativo.')
+
+        while True:
+            vencidas = vencer_ofertas()
+            self.stdout.write(self.style.SUCCESS(f"✅ Ofertas vencidas: {vencidas}."))
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_alter_especialidad_options_especialidad_descripcion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['fecha', 'id'], name='consulta_fecha_id_idx'),
+        ),
+    ]
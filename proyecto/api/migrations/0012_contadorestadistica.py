@@ -0,0 +1,50 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:07
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def inicializar_contadores(apps, schema_editor):
+    """Carga los contadores con los totales actuales de cada tabla."""
+    ContadorEstadistica = apps.get_model('api', 'ContadorEstadistica')
+    Cita = apps.get_model('api', 'Cita')
+    valores = {
+        'pacientes': apps.get_model('api', 'Paciente').objects.count(),
+        'medicos': apps.get_model('api', 'Medico').objects.count(),
+        'citas': Cita.objects.count(),
+        'consultas': apps.get_model('api', 'Consulta').objects.count(),
+    }
+    for estado in ('solicitada', 'confirmada', 'cancelada', 'completada'):
+        valores[f'citas_{estado}'] = 0
+    for estado, total in Cita.objects.values_list('estado').annotate(total=Count('id')).order_by():
+        valores[f'citas_{estado}'] = total
+    ContadorEstadistica.objects.bulk_create([
+        ContadorEstadistica(clave=clave, valor=valor) for clave, valor in valores.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_consulta_fecha_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorEstadistica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=50, unique=True)),
+                ('valor', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de Estadística',
+                'verbose_name_plural': 'Contadores de Estadísticas',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='examenmedico',
+            index=models.Index(fields=['estado'], name='examen_estado_idx'),
+        ),
+        migrations.RunPython(inicializar_contadores, migrations.RunPython.noop),
+    ]
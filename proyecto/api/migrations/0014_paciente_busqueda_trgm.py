@@ -0,0 +1,42 @@
+from django.db import DatabaseError, migrations, transaction
+
+INDICE = 'paciente_busqueda_trgm_idx'
+EXPRESION = "lower(nombre || ' ' || apellido || ' ' || dni || ' ' || coalesce(telefono, ''))"
+
+
+def crear_indice_trigramas(apps, schema_editor):
+    """
+    Crea el índice GIN de trigramas para /api/pacientes/buscar/. Solo en
+    PostgreSQL y si pg_trgm se puede instalar; si no, la búsqueda usa el
+    índice en memoria de api/busqueda.py.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError:
+            return  # Sin permisos para instalar extensiones
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {INDICE} ON api_paciente USING gin (({EXPRESION}) gin_trgm_ops)'
+        )
+
+
+def borrar_indice_trigramas(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDICE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_tratamiento_related_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice_trigramas, borrar_indice_trigramas),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:31
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+# Copias de api.busqueda_clinica tal como estaban al crear la tabla: la
+# migración no debe cambiar si el módulo cambia después.
+CONFIGURACION = 'spanish'
+INDICE_GIN = 'documento_vector_gin_idx'
+LOTE = 5000
+CAMPOS_ANTECEDENTE = [
+    ('enfermedades_cronicas', 'Enfermedades crónicas'),
+    ('cirugias_previas', 'Cirugías previas'),
+    ('alergias', 'Alergias'),
+    ('medicamentos_actuales', 'Medicamentos actuales'),
+    ('antecedentes_familiares', 'Antecedentes familiares'),
+]
+
+
+def _unir(*partes):
+    return '\n'.join(parte for parte in partes if parte)
+
+
+def _filas(apps, using):
+    """Genera los DocumentoClinico de consultas, diagnósticos, tratamientos y antecedentes."""
+    Documento = apps.get_model('api', 'DocumentoClinico')
+    Consulta = apps.get_model('api', 'Consulta')
+    for pk, paciente_id, medico_id, fecha, motivo in Consulta.objects.using(using).values_list(
+        'id', 'paciente_id', 'medico_id', 'fecha', 'motivo'
+    ).iterator(chunk_size=LOTE):
+        yield Documento(
+            tipo='consulta', objeto_id=pk, paciente_id=paciente_id, medico_id=medico_id,
+            consulta_id=pk, fecha=fecha, texto=motivo or '',
+        )
+
+    Diagnostico = apps.get_model('api', 'Diagnostico')
+    diagnosticos = Diagnostico.objects.using(using).values_list(
+        'id', 'consulta_id', 'consulta__paciente_id', 'consulta__medico_id', 'fecha', 'descripcion'
+    )
+    for pk, consulta_id, paciente_id, medico_id, fecha, descripcion in diagnosticos.iterator(chunk_size=LOTE):
+        yield Documento(
+            tipo='diagnostico', objeto_id=pk, paciente_id=paciente_id, medico_id=medico_id,
+            consulta_id=consulta_id, fecha=fecha, texto=descripcion or '',
+        )
+
+    Tratamiento = apps.get_model('api', 'Tratamiento')
+    tratamientos = Tratamiento.objects.using(using).values_list(
+        'id', 'diagnostico__consulta_id', 'diagnostico__consulta__paciente_id',
+        'diagnostico__consulta__medico_id', 'fecha_inicio', 'descripcion', 'indicaciones',
+    )
+    for pk, consulta_id, paciente_id, medico_id, fecha, descripcion, indicaciones in tratamientos.iterator(
+        chunk_size=LOTE
+    ):
+        yield Documento(
+            tipo='tratamiento', objeto_id=pk, paciente_id=paciente_id, medico_id=medico_id,
+            consulta_id=consulta_id, fecha=fecha, texto=_unir(descripcion, indicaciones),
+        )
+
+    AntecedenteMedico = apps.get_model('api', 'AntecedenteMedico')
+    campos = [campo for campo, _ in CAMPOS_ANTECEDENTE]
+    antecedentes = AntecedenteMedico.objects.using(using).values('id', 'paciente_id', 'fecha_registro', *campos)
+    for valores in antecedentes.iterator(chunk_size=LOTE):
+        yield Documento(
+            tipo='antecedente', objeto_id=valores['id'], paciente_id=valores['paciente_id'],
+            fecha=valores['fecha_registro'].date(),
+            texto=_unir(*(f'{etiqueta}: {valores[campo]}' for campo, etiqueta in CAMPOS_ANTECEDENTE if valores[campo])),
+        )
+
+
+def crear_indice_gin(apps, schema_editor):
+    """Índice GIN sobre el tsvector; solo en PostgreSQL."""
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX {INDICE_GIN} ON api_documentoclinico USING gin (vector)')
+
+
+def borrar_indice_gin(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDICE_GIN}')
+
+
+def cargar_documentos(apps, schema_editor):
+    """Indexa lo que ya existía: bulk_create por lotes y un solo UPDATE para los tsvector."""
+    using = schema_editor.connection.alias
+    Documento = apps.get_model('api', 'DocumentoClinico')
+    filas = []
+    for documento in _filas(apps, using):
+        filas.append(documento)
+        if len(filas) >= LOTE:
+            Documento.objects.using(using).bulk_create(filas)
+            filas = []
+    Documento.objects.using(using).bulk_create(filas)
+    if schema_editor.connection.vendor == 'postgresql':
+        Documento.objects.using(using).update(vector=SearchVector('texto', config=CONFIGURACION))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_paciente_busqueda_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentoClinico',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('consulta', 'Consulta'), ('diagnostico', 'Diagnóstico'), ('tratamiento', 'Tratamiento'), ('antecedente', 'Antecedente')], max_length=15)),
+                ('objeto_id', models.PositiveIntegerField()),
+                ('fecha', models.DateField()),
+                ('texto', models.TextField()),
+                ('vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('consulta', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.consulta')),
+                ('medico', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.medico')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='documentos_clinicos', to='api.paciente')),
+            ],
+            options={
+                'verbose_name': 'Documento Clínico',
+                'verbose_name_plural': 'Documentos Clínicos',
+                'indexes': [models.Index(fields=['fecha', 'id'], name='documento_fecha_id_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'objeto_id'), name='documento_tipo_objeto_unico')],
+            },
+        ),
+        migrations.RunPython(crear_indice_gin, borrar_indice_gin),
+        migrations.RunPython(cargar_documentos, migrations.RunPython.noop),
+    ]
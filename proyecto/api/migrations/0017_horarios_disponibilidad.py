@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_cita_indices_calendario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='duracion_minutos',
+            field=models.PositiveSmallIntegerField(default=30),
+        ),
+        migrations.CreateModel(
+            name='ExcepcionHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('hora_inicio', models.TimeField(blank=True, null=True)),
+                ('hora_fin', models.TimeField(blank=True, null=True)),
+                ('motivo', models.CharField(blank=True, max_length=200)),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='excepciones_horario', to='api.medico')),
+            ],
+            options={
+                'verbose_name': 'Excepción de Horario',
+                'verbose_name_plural': 'Excepciones de Horario',
+                'ordering': ['fecha', 'hora_inicio'],
+                'indexes': [models.Index(fields=['medico', 'fecha'], name='excepcion_medico_fecha_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HorarioMedico',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fin', models.TimeField()),
+                ('duracion_cita', models.PositiveSmallIntegerField(default=30)),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='horarios', to='api.medico')),
+            ],
+            options={
+                'verbose_name': 'Horario de Médico',
+                'verbose_name_plural': 'Horarios de Médicos',
+                'ordering': ['medico', 'dia_semana', 'hora_inicio'],
+                'constraints': [models.CheckConstraint(condition=models.Q(('hora_fin__gt', models.F('hora_inicio'))), name='horario_fin_posterior')],
+            },
+        ),
+    ]
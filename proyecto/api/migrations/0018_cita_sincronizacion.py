@@ -0,0 +1,48 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_horarios_disponibilidad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CitaEliminada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cita_id', models.PositiveIntegerField()),
+                ('medico_id', models.PositiveIntegerField()),
+                ('paciente_id', models.PositiveIntegerField()),
+                ('fecha_eliminacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Cita Eliminada',
+                'verbose_name_plural': 'Citas Eliminadas',
+            },
+        ),
+        migrations.AddField(
+            model_name='cita',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['fecha_actualizacion'], name='cita_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['medico', 'fecha_actualizacion'], name='cita_medico_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='citaeliminada',
+            index=models.Index(fields=['fecha_eliminacion'], name='eliminada_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='citaeliminada',
+            index=models.Index(fields=['medico_id', 'fecha_eliminacion'], name='eliminada_medico_fecha_idx'),
+        ),
+    ]
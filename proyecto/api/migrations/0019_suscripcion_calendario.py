@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_cita_sincronizacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuscripcionCalendario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, unique=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now=True)),
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='suscripcion_calendario', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Suscripción de Calendario',
+                'verbose_name_plural': 'Suscripciones de Calendario',
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_suscripcion_calendario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='fecha_original',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='SerieCita',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_hora_inicio', models.DateTimeField()),
+                ('frecuencia', models.CharField(choices=[('semanal', 'Semanal'), ('mensual', 'Mensual')], max_length=10)),
+                ('intervalo', models.PositiveSmallIntegerField(default=1)),
+                ('ocurrencias', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('fecha_fin', models.DateField(blank=True, null=True)),
+                ('duracion_minutos', models.PositiveSmallIntegerField(default=30)),
+                ('motivo', models.TextField(blank=True, null=True)),
+                ('estado', models.CharField(choices=[('solicitada', 'Solicitada'), ('confirmada', 'Confirmada')], default='confirmada', max_length=15)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_citas', to='api.medico')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_citas', to='api.paciente')),
+            ],
+            options={
+                'verbose_name': 'Serie de Citas',
+                'verbose_name_plural': 'Series de Citas',
+            },
+        ),
+        migrations.AddField(
+            model_name='cita',
+            name='serie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='excepciones', to='api.seriecita'),
+        ),
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=models.UniqueConstraint(fields=('serie', 'fecha_original'), name='cita_ocurrencia_unica'),
+        ),
+        migrations.AddIndex(
+            model_name='seriecita',
+            index=models.Index(fields=['medico', 'fecha_fin'], name='serie_medico_fin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seriecita',
+            index=models.Index(fields=['paciente', 'fecha_fin'], name='serie_paciente_fin_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='seriecita',
+            constraint=models.CheckConstraint(condition=models.Q(('intervalo__gte', 1)), name='serie_intervalo_positivo'),
+        ),
+    ]
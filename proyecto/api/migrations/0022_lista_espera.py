@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_recordatorios_citas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EsperaCita',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prioridad', models.PositiveSmallIntegerField(choices=[(1, 'Urgente'), (2, 'Alta'), (3, 'Normal')], default=3)),
+                ('motivo', models.TextField(blank=True, null=True)),
+                ('estado', models.CharField(choices=[('esperando', 'Esperando'), ('ofrecida', 'Turno ofrecido'), ('aceptada', 'Aceptada'), ('rechazada', 'Rechazada'), ('vencida', 'Oferta vencida'), ('retirada', 'Retirada')], default='esperando', max_length=15)),
+                ('fecha_solicitud', models.DateTimeField(auto_now_add=True)),
+                ('oferta_expira', models.DateTimeField(blank=True, null=True)),
+                ('cita', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ofertas_espera', to='api.cita')),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lista_espera', to='api.medico')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='esperas', to='api.paciente')),
+            ],
+            options={
+                'verbose_name': 'Entrada de Lista de Espera',
+                'verbose_name_plural': 'Lista de Espera',
+                'indexes': [models.Index(fields=['medico', 'estado', 'prioridad', 'fecha_solicitud', 'id'], name='espera_cola_idx'), models.Index(fields=['estado', 'oferta_expira'], name='espera_oferta_expira_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('estado__in', ['esperando', 'ofrecida'])), fields=('paciente', 'medico'), name='espera_activa_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:19
+
+import zoneinfo
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+from django.db.models.functions import TruncDate
+
+
+def inicializar_resumen(apps, schema_editor):
+    """Carga el resumen con las citas actuales (por día en la hora de la clínica)."""
+    Cita = apps.get_model('api', 'Cita')
+    ResumenAgenda = apps.get_model('api', 'ResumenAgenda')
+    filas = Cita.objects.annotate(
+        fecha=TruncDate('fecha_hora_propuesta', tzinfo=zoneinfo.ZoneInfo(settings.TIME_ZONE)),
+    ).values('medico_id', 'fecha', 'estado').annotate(
+        total=Count('id'), primera=Min('fecha_hora_propuesta'), ultima=Max('fecha_hora_propuesta'),
+    ).order_by()
+    ResumenAgenda.objects.bulk_create([ResumenAgenda(**fila) for fila in filas.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_lista_espera'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('estado', models.CharField(choices=[('solicitada', 'Solicitada'), ('confirmada', 'Confirmada'), ('cancelada', 'Cancelada'), ('completada', 'Completada')], max_length=15)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('primera', models.DateTimeField()),
+                ('ultima', models.DateTimeField()),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumen_agenda', to='api.medico')),
+            ],
+            options={
+                'verbose_name': 'Resumen de Agenda',
+                'verbose_name_plural': 'Resúmenes de Agenda',
+                'indexes': [models.Index(fields=['fecha'], name='resumen_fecha_idx')],
+                'constraints': [models.UniqueConstraint(fields=('medico', 'fecha', 'estado'), name='resumen_medico_fecha_estado')],
+            },
+        ),
+        migrations.RunPython(inicializar_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_resumen_agenda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cita',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='examenmedico',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
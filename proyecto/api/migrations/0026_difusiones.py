@@ -0,0 +1,38 @@
+# Generated by Django 5.2.1 on 2026-10-18 23:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_indices_notificaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Difusion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(default='aviso', max_length=20)),
+                ('titulo', models.CharField(max_length=100)),
+                ('mensaje', models.TextField()),
+                ('variables', models.JSONField(blank=True, default=dict)),
+                ('audiencia', models.JSONField()),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviando', 'Enviando'), ('completada', 'Completada')], default='pendiente', max_length=20)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('enviadas', models.PositiveIntegerField(default=0)),
+                ('ultimo_usuario_id', models.BigIntegerField(blank=True, null=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('autor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='difusiones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Difusión',
+                'verbose_name_plural': 'Difusiones',
+                'indexes': [models.Index(fields=['estado', 'fecha_creacion'], name='difusion_estado_fecha_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+INDICE = 'paciente_busqueda_trgm_idx'
+CAMPOS = "nombre || ' ' || apellido || ' ' || dni || ' ' || coalesce(telefono, '')"
+EXPRESION_ANTERIOR = f"lower({CAMPOS})"
+# Copia de api.busqueda.EXPRESION_BUSQUEDA: quita los acentos igual que normalizar()
+EXPRESION = (
+    f"translate(lower({CAMPOS}), "
+    "'ÁÀÂÄÃÅÉÈÊËÍÌÎÏÓÒÔÖÕÚÙÛÜÝÑÇáàâäãåéèêëíìîïóòôöõúùûüýÿñç', "
+    "'aaaaaaeeeeiiiiooooouuuuyncaaaaaaeeeeiiiiooooouuuuyync')"
+)
+
+
+def _recrear_indice(schema_editor, expresion):
+    """Rehace el índice de trigramas con ``expresion``, solo si la 0014 lo pudo crear."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [INDICE])
+        if cursor.fetchone() is None:
+            return
+        cursor.execute(f'DROP INDEX {INDICE}')
+        cursor.execute(f'CREATE INDEX {INDICE} ON api_paciente USING gin (({expresion}) gin_trgm_ops)')
+
+
+def indexar_sin_acentos(apps, schema_editor):
+    _recrear_indice(schema_editor, EXPRESION)
+
+
+def indexar_con_acentos(apps, schema_editor):
+    _recrear_indice(schema_editor, EXPRESION_ANTERIOR)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_notificaciones_archivadas'),
+    ]
+
+    operations = [
+        migrations.RunPython(indexar_sin_acentos, indexar_con_acentos),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-19 00:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_paciente_busqueda_sin_acentos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordatorioSerie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_original', models.DateTimeField()),
+                ('enviado', models.PositiveSmallIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Recordatorio de Serie',
+                'verbose_name_plural': 'Recordatorios de Series',
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='cita',
+            name='cita_estado_fecha_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(condition=models.Q(('estado', 'confirmada'), models.Q(('recordatorio_enviado__isnull', True), ('recordatorio_enviado__gt', 2), _connector='OR')), fields=['fecha_hora_propuesta'], name='cita_recordatorio_idx'),
+        ),
+        migrations.AddField(
+            model_name='recordatorioserie',
+            name='serie',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recordatorios', to='api.seriecita'),
+        ),
+        migrations.AddIndex(
+            model_name='recordatorioserie',
+            index=models.Index(fields=['fecha_original'], name='recordatorio_serie_fecha_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recordatorioserie',
+            constraint=models.UniqueConstraint(fields=('serie', 'fecha_original'), name='recordatorio_serie_unico'),
+        ),
+    ]
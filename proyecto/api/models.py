@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, router
+from django.contrib.postgres.search import SearchVectorField
+from django.dispatch import Signal
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 
 class UsuarioManager(BaseUserManager):
@@ -88,6 +90,12 @@ class Consulta(models.Model):
     fecha = models.DateField()
     motivo = models.TextField()
 
+    class Meta:
+        indexes = [
+            # Paginación por cursor de /api/consultas/ (más recientes primero)
+            models.Index(fields=['fecha', 'id'], name='consulta_fecha_id_idx'),
+        ]
+
 # En models.py
 class Diagnostico(models.Model):
     consulta = models.ForeignKey(Consulta, on_delete=models.CASCADE, related_name='diagnosticos')
@@ -97,16 +105,88 @@ class Diagnostico(models.Model):
     def __str__(self):
         return f"Diagnóstico - {self.consulta.paciente.nombre}"
 
+# Se envía tras borrar tratamientos con Tratamiento.objects...delete() o
+# tratamiento.delete(), con ``filas`` = [(id, paciente_id), ...]. No se envía en
+# cascada: ver api/signals.py.
+tratamientos_eliminados = Signal()
+
+
+class TratamientoQuerySet(models.QuerySet):
+    def delete(self):
+        # Una sola consulta antes de borrar; el DELETE sigue sin cargar las filas
+        filas = list(self.values_list('id', 'diagnostico__consulta__paciente_id'))
+        resultado = super().delete()
+        if filas:
+            tratamientos_eliminados.send(sender=Tratamiento, filas=filas)
+        return resultado
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Tratamiento(models.Model):
-    diagnostico = models.ForeignKey(Diagnostico, on_delete=models.CASCADE)
+    diagnostico = models.ForeignKey(Diagnostico, on_delete=models.CASCADE, related_name='tratamientos')
     descripcion = models.TextField()  # Esto será el tratamiento (ej: "Acetaminofén")
     indicaciones = models.TextField(blank=True, null=True)  # Esto serán las indicaciones (ej: "Cada 8 horas por 5 días")
     duracion_dias = models.IntegerField(blank=True, null=True)
     fecha_inicio = models.DateField()
     
+    objects = TratamientoQuerySet.as_manager()
+
     def __str__(self):
         return f"Tratamiento - {self.descripcion}"
 
+    def delete(self, using=None, keep_parents=False):
+        # Pasa por TratamientoQuerySet.delete() para avisar igual que el borrado masivo
+        using = using or router.db_for_write(self.__class__, instance=self)
+        resultado = Tratamiento.objects.using(using).filter(pk=self.pk).delete()
+        self.pk = None
+        return resultado
+
+class SerieCita(models.Model):
+    """
+    Citas periódicas de un paciente con un médico (p. ej. cada lunes a las
+    09:00). Las ocurrencias no se guardan: se calculan para la ventana que se
+    consulta (ver api/series.py). Solo las ocurrencias movidas o canceladas
+    existen como filas de Cita, con ``serie`` y ``fecha_original``.
+    """
+    FRECUENCIA_CHOICES = [
+        ('semanal', 'Semanal'),
+        ('mensual', 'Mensual'),
+    ]
+    ESTADO_CHOICES = [
+        ('solicitada', 'Solicitada'),
+        ('confirmada', 'Confirmada'),
+    ]
+
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='series_citas')
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='series_citas')
+    fecha_hora_inicio = models.DateTimeField()  # primera ocurrencia
+    frecuencia = models.CharField(max_length=10, choices=FRECUENCIA_CHOICES)
+    intervalo = models.PositiveSmallIntegerField(default=1)  # cada cuántas semanas o meses
+    ocurrencias = models.PositiveSmallIntegerField(null=True, blank=True)  # total, o sin límite
+    fecha_fin = models.DateField(null=True, blank=True)  # última fecha posible, incluida
+    duracion_minutos = models.PositiveSmallIntegerField(default=30)
+    motivo = models.TextField(blank=True, null=True)
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='confirmada')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Serie {self.frecuencia} de {self.paciente_id} con {self.medico_id} desde {self.fecha_hora_inicio}"
+
+    class Meta:
+        verbose_name = "Serie de Citas"
+        verbose_name_plural = "Series de Citas"
+        indexes = [
+            models.Index(fields=['medico', 'fecha_fin'], name='serie_medico_fin_idx'),
+            models.Index(fields=['paciente', 'fecha_fin'], name='serie_paciente_fin_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(intervalo__gte=1), name='serie_intervalo_positivo'),
+        ]
+
+
 class Cita(models.Model):
     """
     Modelo para representar una cita solicitada por un paciente con un médico.
@@ -124,6 +204,15 @@ class Cita(models.Model):
     motivo = models.TextField(blank=True, null=True)
     estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='solicitada')
     fecha_solicitud = models.DateTimeField(auto_now_add=True)
+    duracion_minutos = models.PositiveSmallIntegerField(default=30)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    # Ocurrencia de una serie movida o cancelada: reemplaza a la de fecha_original
+    serie = models.ForeignKey(SerieCita, on_delete=models.CASCADE, null=True, blank=True, related_name='excepciones')
+    fecha_original = models.DateTimeField(null=True, blank=True)
+    # Menor anticipación (en horas) del recordatorio ya enviado; None si ninguno (api/recordatorios.py)
+    recordatorio_enviado = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    # Control de concurrencia optimista: sube en cada edición (ver api/concurrencia.py)
+    version = models.PositiveIntegerField(default=1, editable=False)
     # Opcional: Puedes agregar campos para fecha de confirmación, notas del médico, etc.
 
     def __str__(self):
@@ -133,6 +222,197 @@ class Cita(models.Model):
         verbose_name = "Cita"
         verbose_name_plural = "Citas"
         ordering = ['fecha_hora_propuesta']
+        indexes = [
+            # Feed del calendario (api/calendario.py): rango de fechas por rol
+            models.Index(fields=['medico', 'fecha_hora_propuesta'], name='cita_medico_fecha_idx'),
+            models.Index(fields=['paciente', 'fecha_hora_propuesta'], name='cita_paciente_fecha_idx'),
+            models.Index(fields=['fecha_hora_propuesta'], name='cita_fecha_idx'),
+            # Sincronización por deltas (api/sincronizacion.py)
+            models.Index(fields=['fecha_actualizacion'], name='cita_actualizacion_idx'),
+            models.Index(fields=['medico', 'fecha_actualizacion'], name='cita_medico_actualizacion_idx'),
+            # Recordatorios: solo las citas confirmadas que aún pueden recibir alguno
+            # (2 = menor anticipación de api/recordatorios.py). Las ya avisadas no
+            # ocupan el índice ni hay que filtrarlas en la tabla.
+            models.Index(
+                fields=['fecha_hora_propuesta'], name='cita_recordatorio_idx',
+                condition=models.Q(estado='confirmada') & (
+                    models.Q(recordatorio_enviado__isnull=True) | models.Q(recordatorio_enviado__gt=2)
+                ),
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['serie', 'fecha_original'], name='cita_ocurrencia_unica'),
+        ]
+
+
+class RecordatorioSerie(models.Model):
+    """
+    Recordatorio ya enviado de una ocurrencia virtual de una serie (las que no
+    son filas de Cita). Cumple el papel de Cita.recordatorio_enviado; se borra
+    cuando la ocurrencia pasa (api/recordatorios.py).
+    """
+    serie = models.ForeignKey(SerieCita, on_delete=models.CASCADE, related_name='recordatorios')
+    fecha_original = models.DateTimeField()
+    enviado = models.PositiveSmallIntegerField()  # Menor anticipación enviada, en horas
+
+    def __str__(self):
+        return f"Recordatorio {self.enviado} h de la serie {self.serie_id} el {self.fecha_original}"
+
+    class Meta:
+        verbose_name = "Recordatorio de Serie"
+        verbose_name_plural = "Recordatorios de Series"
+        indexes = [
+            models.Index(fields=['fecha_original'], name='recordatorio_serie_fecha_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['serie', 'fecha_original'], name='recordatorio_serie_unico'),
+        ]
+
+
+class CitaEliminada(models.Model):
+    """
+    Marca de una cita borrada (o que dejó de pertenecer a un médico o
+    paciente), para que /api/citas/cambios/ la informe a los calendarios que
+    sincronizan por deltas. Se guardan los ids sueltos: la cita ya no existe.
+    """
+    cita_id = models.PositiveIntegerField()
+    medico_id = models.PositiveIntegerField()
+    paciente_id = models.PositiveIntegerField()
+    fecha_eliminacion = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Cita {self.cita_id} eliminada el {self.fecha_eliminacion}"
+
+    class Meta:
+        verbose_name = "Cita Eliminada"
+        verbose_name_plural = "Citas Eliminadas"
+        indexes = [
+            models.Index(fields=['fecha_eliminacion'], name='eliminada_fecha_idx'),
+            models.Index(fields=['medico_id', 'fecha_eliminacion'], name='eliminada_medico_fecha_idx'),
+        ]
+
+class SuscripcionCalendario(models.Model):
+    """
+    Token secreto de la URL .ics con la que un médico o paciente suscribe su
+    agenda en una aplicación de calendario (que no envía el JWT). Regenerarlo
+    invalida la URL anterior.
+    """
+    usuario = models.OneToOneField(Usuario, on_delete=models.CASCADE, related_name='suscripcion_calendario')
+    token = models.CharField(max_length=64, unique=True)
+    fecha_creacion = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Calendario de {self.usuario}"
+
+    class Meta:
+        verbose_name = "Suscripción de Calendario"
+        verbose_name_plural = "Suscripciones de Calendario"
+
+
+class EsperaCita(models.Model):
+    """
+    Paciente en la lista de espera de un médico. Cuando se cancela una cita
+    futura del médico, el primero de la cola (prioridad y antigüedad) recibe
+    el turno como una Cita 'solicitada' reservada hasta ``oferta_expira``
+    (ver api/lista_espera.py).
+    """
+    PRIORIDAD_CHOICES = [
+        (1, 'Urgente'),
+        (2, 'Alta'),
+        (3, 'Normal'),
+    ]
+    ESTADO_CHOICES = [
+        ('esperando', 'Esperando'),
+        ('ofrecida', 'Turno ofrecido'),
+        ('aceptada', 'Aceptada'),
+        ('rechazada', 'Rechazada'),
+        ('vencida', 'Oferta vencida'),
+        ('retirada', 'Retirada'),
+    ]
+
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='esperas')
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='lista_espera')
+    prioridad = models.PositiveSmallIntegerField(choices=PRIORIDAD_CHOICES, default=3)
+    motivo = models.TextField(blank=True, null=True)
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='esperando')
+    fecha_solicitud = models.DateTimeField(auto_now_add=True)
+    # Turno ofrecido (la cita que lo reserva) y hasta cuándo se guarda
+    cita = models.ForeignKey(Cita, on_delete=models.SET_NULL, null=True, blank=True, related_name='ofertas_espera')
+    oferta_expira = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Espera de {self.paciente_id} con {self.medico_id} ({self.estado})"
+
+    class Meta:
+        verbose_name = "Entrada de Lista de Espera"
+        verbose_name_plural = "Lista de Espera"
+        indexes = [
+            # La cola: el siguiente paciente de un médico es la primera fila del índice
+            models.Index(fields=['medico', 'estado', 'prioridad', 'fecha_solicitud', 'id'], name='espera_cola_idx'),
+            models.Index(fields=['estado', 'oferta_expira'], name='espera_oferta_expira_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['paciente', 'medico'], condition=models.Q(estado__in=['esperando', 'ofrecida']),
+                name='espera_activa_unica',
+            ),
+        ]
+
+class HorarioMedico(models.Model):
+    """
+    Bloque semanal de atención de un médico (p. ej. lunes de 08:00 a 12:00 en
+    citas de 30 minutos). Un médico puede tener varios bloques por día.
+    """
+    DIA_SEMANA_CHOICES = [
+        (0, 'Lunes'),
+        (1, 'Martes'),
+        (2, 'Miércoles'),
+        (3, 'Jueves'),
+        (4, 'Viernes'),
+        (5, 'Sábado'),
+        (6, 'Domingo'),
+    ]
+
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='horarios')
+    dia_semana = models.PositiveSmallIntegerField(choices=DIA_SEMANA_CHOICES)
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+    duracion_cita = models.PositiveSmallIntegerField(default=30)  # Minutos por turno
+
+    def __str__(self):
+        return f"{self.get_dia_semana_display()} {self.hora_inicio}-{self.hora_fin} ({self.medico_id})"
+
+    class Meta:
+        verbose_name = "Horario de Médico"
+        verbose_name_plural = "Horarios de Médicos"
+        ordering = ['medico', 'dia_semana', 'hora_inicio']
+        constraints = [
+            models.CheckConstraint(condition=models.Q(hora_fin__gt=models.F('hora_inicio')), name='horario_fin_posterior'),
+        ]
+
+
+class ExcepcionHorario(models.Model):
+    """
+    Ausencia puntual de un médico (vacaciones, congreso...). Sin horas bloquea
+    el día completo; con horas, solo ese tramo.
+    """
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='excepciones_horario')
+    fecha = models.DateField()
+    hora_inicio = models.TimeField(null=True, blank=True)
+    hora_fin = models.TimeField(null=True, blank=True)
+    motivo = models.CharField(max_length=200, blank=True)
+
+    def __str__(self):
+        return f"{self.fecha} ({self.medico_id}): {self.motivo}"
+
+    class Meta:
+        verbose_name = "Excepción de Horario"
+        verbose_name_plural = "Excepciones de Horario"
+        ordering = ['fecha', 'hora_inicio']
+        indexes = [
+            models.Index(fields=['medico', 'fecha'], name='excepcion_medico_fecha_idx'),
+        ]
+
 
 class TipoExamen(models.Model):
     nombre = models.CharField(max_length=100)
@@ -169,6 +449,7 @@ class ExamenMedico(models.Model):
     observaciones = models.TextField(blank=True, null=True)
     interpretacion_medica = models.TextField(blank=True, null=True)  # Análisis del médico
     archivo_resultado = models.FileField(upload_to='examenes/', null=True, blank=True)  # PDF, JPG, etc.
+    version = models.PositiveIntegerField(default=1, editable=False)  # Ver api/concurrencia.py
     
     def __str__(self):
         return f"{self.tipo_examen.nombre} - {self.paciente.nombre} {self.paciente.apellido}"
@@ -177,6 +458,9 @@ class ExamenMedico(models.Model):
         verbose_name = "Examen Médico"
         verbose_name_plural = "Exámenes Médicos"
         ordering = ['-fecha_solicitud']
+        indexes = [
+            models.Index(fields=['estado'], name='examen_estado_idx'),  # Exámenes pendientes
+        ]
 
 class AntecedenteMedico(models.Model):
     paciente = models.OneToOneField(Paciente, on_delete=models.CASCADE, related_name='antecedentes')
@@ -234,4 +518,159 @@ class Notificacion(models.Model):
     class Meta:
         ordering = ['-fecha']
         verbose_name = "Notificación"
-        verbose_name_plural = "Notificaciones"
\ No newline at end of file
+        verbose_name_plural = "Notificaciones"
+        indexes = [
+            # Bandeja del usuario, más recientes primero (paginación por cursor)
+            models.Index(fields=['usuario', '-fecha', '-id'], name='notificacion_bandeja_idx'),
+            # Contador de la campana: solo las no leídas ocupan sitio en el índice
+            models.Index(fields=['usuario'], condition=models.Q(leida=False), name='notificacion_no_leidas_idx'),
+            # Candidatas a archivar (api/retencion.py), de la más antigua a la más nueva
+            models.Index(fields=['fecha', 'id'], condition=models.Q(leida=True), name='notificacion_leidas_fecha_idx'),
+        ]
+
+
+class NotificacionArchivada(models.Model):
+    """
+    Notificaciones leídas y antiguas que `manage.py archivar_notificaciones`
+    saca de Notificacion, para que la tabla activa no crezca sin límite.
+    Conservan el id original.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='notificaciones_archivadas')
+    tipo = models.CharField(max_length=20)
+    titulo = models.CharField(max_length=100)
+    mensaje = models.TextField()
+    metadata = models.JSONField(null=True, blank=True)
+    fecha = models.DateTimeField()
+    fecha_archivo = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.titulo} - {self.usuario_id} (archivada)"
+
+    class Meta:
+        verbose_name = "Notificación Archivada"
+        verbose_name_plural = "Notificaciones Archivadas"
+        indexes = [
+            models.Index(fields=['usuario', '-fecha', '-id'], name='archivada_bandeja_idx'),
+        ]
+
+
+class Difusion(models.Model):
+    """
+    Envío de una notificación con plantilla a una audiencia (pacientes de un
+    médico, usuarios de un rol, pacientes con citas en una fecha). Se
+    procesa por lotes en api/difusion.py; ``ultimo_usuario_id`` es el cursor
+    del último lote confirmado, así un envío interrumpido sigue donde quedó.
+    """
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('enviando', 'Enviando'),
+        ('completada', 'Completada'),
+    ]
+
+    autor = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True, related_name='difusiones')
+    tipo = models.CharField(max_length=20, default='aviso')
+    titulo = models.CharField(max_length=100)  # Marcadores {{ nombre }}, {{ apellido }} y las variables
+    mensaje = models.TextField()
+    variables = models.JSONField(default=dict, blank=True)
+    audiencia = models.JSONField()
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    total = models.PositiveIntegerField(default=0)
+    enviadas = models.PositiveIntegerField(default=0)
+    ultimo_usuario_id = models.BigIntegerField(null=True, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.titulo} ({self.enviadas}/{self.total})"
+
+    class Meta:
+        verbose_name = "Difusión"
+        verbose_name_plural = "Difusiones"
+        indexes = [
+            models.Index(fields=['estado', 'fecha_creacion'], name='difusion_estado_fecha_idx'),
+        ]
+
+
+class ContadorEstadistica(models.Model):
+    """
+    Contadores del panel de administración (pacientes, médicos, citas por estado...).
+    Se mantienen al guardar/eliminar mediante señales (ver api/signals.py), así el
+    panel lee unas pocas filas sin importar el tamaño de las tablas.
+    """
+    clave = models.CharField(max_length=50, unique=True)
+    valor = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.clave}: {self.valor}"
+
+    class Meta:
+        verbose_name = "Contador de Estadística"
+        verbose_name_plural = "Contadores de Estadísticas"
+
+
+class ResumenAgenda(models.Model):
+    """
+    Citas de un médico en un día (hora de la clínica) y estado: total y
+    primer/último turno. Se mantiene al guardar/eliminar citas (ver
+    api/resumen_agenda.py), así los gráficos de mes o año leen una fila por
+    día en vez de contar citas.
+    """
+    medico = models.ForeignKey(Medico, on_delete=models.CASCADE, related_name='resumen_agenda')
+    fecha = models.DateField()
+    estado = models.CharField(max_length=15, choices=Cita.ESTADO_CHOICES)
+    total = models.PositiveIntegerField(default=0)
+    primera = models.DateTimeField()
+    ultima = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.medico_id} {self.fecha} {self.estado}: {self.total}"
+
+    class Meta:
+        verbose_name = "Resumen de Agenda"
+        verbose_name_plural = "Resúmenes de Agenda"
+        constraints = [
+            models.UniqueConstraint(fields=['medico', 'fecha', 'estado'], name='resumen_medico_fecha_estado'),
+        ]
+        indexes = [
+            # Informes de toda la clínica (sin médico)
+            models.Index(fields=['fecha'], name='resumen_fecha_idx'),
+        ]
+
+
+class DocumentoClinico(models.Model):
+    """
+    Texto clínico (motivos, diagnósticos, tratamientos y antecedentes) copiado a
+    una sola tabla para la búsqueda de texto completo. Se mantiene al guardar
+    cada registro de origen (ver api/signals.py y api/busqueda_clinica.py).
+    """
+    TIPO_CHOICES = [
+        ('consulta', 'Consulta'),
+        ('diagnostico', 'Diagnóstico'),
+        ('tratamiento', 'Tratamiento'),
+        ('antecedente', 'Antecedente'),
+    ]
+
+    tipo = models.CharField(max_length=15, choices=TIPO_CHOICES)
+    objeto_id = models.PositiveIntegerField()  # id en la tabla de origen
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='documentos_clinicos')
+    medico = models.ForeignKey(Medico, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    consulta = models.ForeignKey(Consulta, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    fecha = models.DateField()
+    texto = models.TextField()
+    # tsvector con la configuración 'spanish'; solo se llena en PostgreSQL
+    vector = SearchVectorField(null=True, editable=False)
+
+    def __str__(self):
+        return f"{self.tipo} {self.objeto_id}"
+
+    class Meta:
+        verbose_name = "Documento Clínico"
+        verbose_name_plural = "Documentos Clínicos"
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'objeto_id'], name='documento_tipo_objeto_unico'),
+        ]
+        indexes = [
+            # Resultados de búsqueda paginados por cursor (más recientes primero)
+            models.Index(fields=['fecha', 'id'], name='documento_fecha_id_idx'),
+        ]
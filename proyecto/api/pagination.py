@@ -0,0 +1,140 @@
+# api/pagination.py
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorPaginacion(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre columnas indexadas.
+
+    Solo se activa cuando el cliente envía ``cursor`` o ``page_size``; sin esos
+    parámetros la vista devuelve la lista completa como hasta ahora, para no
+    romper las pantallas que todavía esperan un arreglo.
+
+    Con ``opcional = False`` pagina siempre (búsquedas, donde la lista completa
+    no tiene sentido).
+
+    El orden se toma de ``cursor_ordering`` en la vista (por defecto ``-id``).
+    El último campo debe ser único: así cada página empieza justo después de la
+    fila anterior y las inserciones concurrentes no duplican ni saltan filas.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 500
+    ordering = ('-id',)
+    invalid_cursor_message = 'Cursor inválido.'
+    opcional = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.opcional and self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = tuple(getattr(view, 'cursor_ordering', self.ordering))
+        campos = [self._campo(queryset.model, orden) for orden in self.ordering]
+
+        queryset = queryset.order_by(*self.ordering)
+        posicion = self.decode_cursor(request, campos)
+        if posicion is not None:
+            queryset = queryset.filter(self._filtro_despues_de(posicion))
+
+        # Se pide una fila de más para saber si existe una página siguiente
+        resultados = list(queryset[:self.page_size + 1])
+        self.has_next = len(resultados) > self.page_size
+        self.page = resultados[:self.page_size]
+
+        self.next_position = None
+        if self.has_next:
+            ultimo = self.page[-1]
+            self.next_position = [getattr(ultimo, campo.attname) for campo in campos]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, posicion):
+        """El cursor es opaco para el cliente: JSON en base64 url-safe."""
+        crudo = json.dumps(posicion, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(crudo.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request, campos):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            relleno = '=' * (-len(cursor) % 4)
+            valores = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode('utf-8'))
+            if not isinstance(valores, list) or len(valores) != len(campos):
+                raise ValueError
+            return [campo.to_python(valor) for campo, valor in zip(campos, valores)]
+        except (ValueError, TypeError, UnicodeDecodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _campo(self, model, orden):
+        nombre = orden.lstrip('-')
+        if nombre == 'pk':
+            return model._meta.pk
+        return model._meta.get_field(nombre)
+
+    def _filtro_despues_de(self, posicion):
+        """
+        Construye ``(a, b) > (x, y)`` respetando la dirección de cada campo.
+
+        Se añade ``a >= x`` (o ``<=``) como condición redundante para que la base
+        de datos pueda buscar directamente en el índice en lugar de recorrerlo
+        desde el principio y filtrar.
+        """
+        nombres = []
+        filtro = Q()
+        for orden, valor in zip(self.ordering, posicion):
+            nombre = orden.lstrip('-')
+            lookup = 'lt' if orden.startswith('-') else 'gt'
+            igual_previos = Q(**{n: v for n, v in zip(nombres, posicion)})
+            filtro |= igual_previos & Q(**{f'{nombre}__{lookup}': valor})
+            nombres.append(nombre)
+
+        primero = self.ordering[0]
+        acotado = 'lte' if primero.startswith('-') else 'gte'
+        return Q(**{f'{primero.lstrip("-")}__{acotado}': posicion[0]}) & filtro
+
@@ -0,0 +1,130 @@
+# api/recordatorios.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .eventos import publicar_notificaciones
+from .models import Cita, Notificacion, Paciente, RecordatorioSerie, SerieCita
+from .series import ocurrencias
+
+# Horas de anticipación de cada recordatorio, de la menor a la mayor
+ANTICIPACIONES = (2, 24)
+TAMANO_LOTE = 500
+
+
+def _mensaje(fila, horas, fecha=None):
+    fecha = timezone.localtime(fecha or fila['fecha_hora_propuesta'])
+    cuando = 'mañana' if horas == 24 else 'en unas horas'
+    return (
+        f"Recuerda tu cita {cuando} con Dr. {fila['medico__nombre']} {fila['medico__apellido']} "
+        f"el {fecha:%d/%m/%Y} a las {fecha:%H:%M}."
+    )
+
+
+def _enviar_lote(horas, ahora, tamano):
+    """
+    Un lote de citas confirmadas que empiezan dentro de ``horas`` y aún no
+    recibieron este recordatorio (ni uno más cercano). Las filas se bloquean
+    con SKIP LOCKED: varios procesos pueden correr a la vez sin repetir
+    avisos. Devuelve cuántas citas se marcaron.
+    """
+    with transaction.atomic():
+        filas = list(
+            Cita.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                estado='confirmada',
+                fecha_hora_propuesta__gte=ahora,
+                fecha_hora_propuesta__lte=ahora + timedelta(hours=horas),
+            ).filter(
+                Q(recordatorio_enviado__isnull=True) | Q(recordatorio_enviado__gt=horas)
+            ).order_by('fecha_hora_propuesta', 'id').values(
+                'id', 'fecha_hora_propuesta', 'paciente__usuario_id', 'medico__nombre', 'medico__apellido',
+            )[:tamano]
+        )
+        if not filas:
+            return 0
+        notificaciones = Notificacion.objects.bulk_create([
+            Notificacion(
+                usuario_id=fila['paciente__usuario_id'], tipo='cita', titulo='Recordatorio de cita',
+                mensaje=_mensaje(fila, horas), metadata={'cita_id': fila['id'], 'recordatorio': f'{horas}h'},
+            )
+            for fila in filas if fila['paciente__usuario_id']
+        ])
+        publicar_notificaciones(notificaciones)  # bulk_create no dispara señales
+        # update() no toca fecha_actualizacion: los calendarios no ven un cambio
+        Cita.objects.filter(pk__in=[fila['id'] for fila in filas]).update(recordatorio_enviado=horas)
+    return len(filas)
+
+
+def _enviar_series(horas, ahora):
+    """
+    Recordatorios de las ocurrencias virtuales de series confirmadas que
+    empiezan dentro de ``horas`` (las movidas o canceladas son filas de Cita
+    y las cubre _enviar_lote). Lo enviado se anota en RecordatorioSerie. Las
+    series se bloquean con SKIP LOCKED, como las citas; cada una tiene a lo
+    sumo una ocurrencia por día, así que no hace falta repartir en lotes.
+    Devuelve cuántas ocurrencias se marcaron.
+    """
+    with transaction.atomic():
+        series = SerieCita.objects.select_for_update(skip_locked=True, of=('self',)).filter(estado='confirmada')
+        # +1 µs: la ventana incluye su extremo, como la de las citas
+        pares = ocurrencias(series, ahora, ahora + timedelta(hours=horas, microseconds=1))
+        if not pares:
+            return 0
+        anotados = {
+            (serie_id, fecha): (pk, enviado)
+            for pk, serie_id, fecha, enviado in RecordatorioSerie.objects.filter(
+                serie_id__in={fila['id'] for fila, _ in pares}, fecha_original__in={fecha for _, fecha in pares},
+            ).values_list('id', 'serie_id', 'fecha_original', 'enviado')
+        }
+        pendientes = []
+        for fila, fecha in pares:
+            pk, enviado = anotados.get((fila['id'], fecha), (None, None))
+            if enviado is None or enviado > horas:
+                pendientes.append((fila, fecha, pk))
+        if not pendientes:
+            return 0
+
+        usuarios = dict(Paciente.objects.filter(
+            pk__in={fila['paciente_id'] for fila, _, _ in pendientes}
+        ).values_list('id', 'usuario_id'))
+        notificaciones = Notificacion.objects.bulk_create([
+            Notificacion(
+                usuario_id=usuarios[fila['paciente_id']], tipo='cita', titulo='Recordatorio de cita',
+                mensaje=_mensaje(fila, horas, fecha),
+                metadata={'serie_id': fila['id'], 'fecha_original': fecha.isoformat(), 'recordatorio': f'{horas}h'},
+            )
+            for fila, fecha, _ in pendientes if usuarios.get(fila['paciente_id'])
+        ])
+        publicar_notificaciones(notificaciones)
+        RecordatorioSerie.objects.filter(pk__in=[pk for _, _, pk in pendientes if pk]).update(enviado=horas)
+        RecordatorioSerie.objects.bulk_create([
+            RecordatorioSerie(serie_id=fila['id'], fecha_original=fecha, enviado=horas)
+            for fila, fecha, pk in pendientes if pk is None
+        ])
+    return len(pendientes)
+
+
+def enviar_recordatorios(ahora=None, tamano=TAMANO_LOTE):
+    """
+    Crea los recordatorios pendientes, de citas y de ocurrencias de series.
+    Primero el más cercano: una cita que ya está a menos de 2 h solo recibe
+    ese. Cada tramo recorre el índice parcial cita_recordatorio_idx (solo
+    citas confirmadas con algún recordatorio pendiente) en lotes de
+    ``tamano``, así que el coste depende de las citas por avisar y no del
+    total de la tabla. Devuelve {horas: citas y ocurrencias avisadas}.
+    """
+    ahora = ahora or timezone.now()
+    # Una ocurrencia pasada ya no entra en ninguna ventana: su anotación sobra
+    RecordatorioSerie.objects.filter(fecha_original__lt=ahora).delete()
+    enviados = {}
+    for horas in ANTICIPACIONES:
+        total = _enviar_series(horas, ahora)
+        while True:
+            cantidad = _enviar_lote(horas, ahora, tamano)
+            total += cantidad
+            if cantidad < tamano:
+                break
+        enviados[horas] = total
+    return enviados
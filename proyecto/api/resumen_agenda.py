@@ -0,0 +1,176 @@
+# api/resumen_agenda.py
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from operator import itemgetter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateTimeField, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Greatest, Least, TruncDate, TruncMonth
+from django.utils import timezone
+
+from .disponibilidad import RangoInvalido, rango_desde_parametros
+from .models import Cita, Medico, ResumenAgenda
+
+# Un año completo día a día; para más, agrupar por mes
+MAX_DIAS_RESUMEN = 366
+AGRUPACIONES = ('dia', 'mes')
+
+
+def _fecha_hora(valor):
+    # Una cita recién creada puede traer la fecha como texto ISO
+    valor = Cita._meta.get_field('fecha_hora_propuesta').to_python(valor)
+    return timezone.make_aware(valor) if timezone.is_naive(valor) else valor
+
+
+def dia_agenda(medico_id, fecha_hora):
+    """(medico_id, día en la hora de la clínica) de una cita."""
+    return medico_id, timezone.localdate(_fecha_hora(fecha_hora))
+
+
+def _limites_dia(fecha):
+    inicio = timezone.make_aware(datetime.combine(fecha, time.min))
+    return inicio, timezone.make_aware(datetime.combine(fecha + timedelta(days=1), time.min))
+
+
+def _por_dia_y_estado(citas):
+    return citas.annotate(
+        fecha=TruncDate('fecha_hora_propuesta', tzinfo=timezone.get_current_timezone()),
+    ).values('medico_id', 'fecha', 'estado').annotate(
+        total=Count('id'), primera=Min('fecha_hora_propuesta'), ultima=Max('fecha_hora_propuesta'),
+    ).order_by()
+
+
+def bloquear_agendas(medico_ids):
+    """
+    Bloquea las filas de los médicos (SELECT ... FOR NO KEY UPDATE, en orden
+    de id), el mismo bloqueo que toma reserva_de_turno. Toda escritura en
+    ResumenAgenda lo toma antes: recalcular_dias lee el agregado de las
+    citas confirmadas y luego lo escribe, y sin el bloqueo un sumar_cita
+    concurrente (aún sin confirmar) quedaría pisado por el total viejo.
+    Debe llamarse dentro de una transacción.
+    """
+    list(
+        Medico.objects.select_for_update(no_key=True).filter(pk__in=set(medico_ids)).order_by('pk')
+        .values_list('pk', flat=True)
+    )
+
+
+def _sumar(fila, fecha_hora):
+    fecha_hora = Value(fecha_hora, output_field=DateTimeField())
+    return fila.update(total=F('total') + 1, primera=Least('primera', fecha_hora), ultima=Greatest('ultima', fecha_hora))
+
+
+def sumar_cita(medico_id, fecha_hora, estado):
+    """
+    Suma una cita nueva a su fila con un UPDATE atómico (total = total + 1)
+    bajo el bloqueo de la agenda del médico; la fila se crea con la primera
+    cita del día.
+    """
+    fecha_hora = _fecha_hora(fecha_hora)
+    _, fecha = dia_agenda(medico_id, fecha_hora)
+    fila = ResumenAgenda.objects.filter(medico_id=medico_id, fecha=fecha, estado=estado)
+    with transaction.atomic():
+        bloquear_agendas([medico_id])
+        if _sumar(fila, fecha_hora):
+            return
+        try:
+            with transaction.atomic():
+                ResumenAgenda.objects.create(
+                    medico_id=medico_id, fecha=fecha, estado=estado, total=1, primera=fecha_hora, ultima=fecha_hora,
+                )
+        except IntegrityError:
+            _sumar(fila, fecha_hora)  # otra transacción creó la fila entre medias
+
+
+def recalcular_dias(dias):
+    """
+    Recalcula desde Cita las filas de los días ``dias`` ((medico_id,
+    fecha)), con las citas ya modificadas: una cita que cambia de estado o
+    de día, o se elimina, puede llevarse el primer o último turno. Son tres
+    consultas para cualquier número de días (agregado, upsert y borrado de
+    los estados que quedaron vacíos), más el bloqueo de las agendas de los
+    médicos (ver bloquear_agendas); cada día es un rango de
+    cita_medico_fecha_idx.
+    """
+    if not dias:
+        return
+    dias = sorted(set(dias))  # mismo orden de bloqueo en todas las transacciones
+    with transaction.atomic():
+        bloquear_agendas(medico_id for medico_id, _ in dias)
+        rango = Q()
+        for medico_id, fecha in dias:
+            inicio, fin = _limites_dia(fecha)
+            rango |= Q(medico_id=medico_id, fecha_hora_propuesta__gte=inicio, fecha_hora_propuesta__lt=fin)
+        filas = sorted(_por_dia_y_estado(Cita.objects.filter(rango)), key=itemgetter('medico_id', 'fecha', 'estado'))
+        if filas:
+            ResumenAgenda.objects.bulk_create(
+                [ResumenAgenda(**fila) for fila in filas], update_conflicts=True,
+                unique_fields=['medico', 'fecha', 'estado'], update_fields=['total', 'primera', 'ultima'],
+            )
+
+        vigentes = defaultdict(list)
+        for fila in filas:
+            vigentes[fila['medico_id'], fila['fecha']].append(fila['estado'])
+        vacias = Q()
+        for medico_id, fecha in dias:
+            vacias |= Q(medico_id=medico_id, fecha=fecha) & ~Q(estado__in=vigentes[medico_id, fecha])
+        ResumenAgenda.objects.filter(vacias).delete()
+
+
+def recalcular_resumen_agenda():
+    """
+    Rehace ResumenAgenda desde Cita. Necesario tras operaciones masivas que
+    no disparan señales (bulk_create, queryset.update()); lo ejecuta
+    `manage.py recalcular_estadisticas`. Devuelve el número de filas.
+    """
+    with transaction.atomic():
+        ResumenAgenda.objects.all().delete()
+        creadas = ResumenAgenda.objects.bulk_create(
+            [ResumenAgenda(**fila) for fila in _por_dia_y_estado(Cita.objects.all()).iterator()], batch_size=1000
+        )
+    return len(creadas)
+
+
+def parametros_resumen(params):
+    """
+    Lee ``desde`` y ``hasta`` (fechas ISO, ambas incluidas) y ``agrupar``
+    (dia o mes). Lanza RangoInvalido con el mensaje para el cliente.
+    """
+    desde, hasta = rango_desde_parametros(params, max_dias=MAX_DIAS_RESUMEN)
+    agrupar = params.get('agrupar', 'dia')
+    if agrupar not in AGRUPACIONES:
+        raise RangoInvalido(f'agrupar debe ser {" o ".join(AGRUPACIONES)}.')
+    return desde, hasta, agrupar
+
+
+def leer_resumen(desde, hasta, medico_id=None, agrupar='dia'):
+    """
+    Citas por día (o mes) y estado entre ``desde`` y ``hasta``, de un médico
+    o de toda la clínica. Lee una fila por médico, día y estado: el coste
+    depende de los días del rango, no de las citas. El primer y último turno
+    son los de citas no canceladas.
+    """
+    filas = ResumenAgenda.objects.filter(fecha__gte=desde, fecha__lte=hasta)
+    if medico_id is not None:
+        filas = filas.filter(medico_id=medico_id)
+    periodo = TruncMonth('fecha') if agrupar == 'mes' else F('fecha')
+    filas = filas.annotate(periodo=periodo).values('periodo', 'estado').annotate(
+        total=Sum('total'), primera=Min('primera'), ultima=Max('ultima'),
+    ).order_by('periodo', 'estado')
+
+    periodos = {}
+    for fila in filas:
+        resumen = periodos.setdefault(fila['periodo'], {
+            'fecha': fila['periodo'].isoformat(), 'total': 0, 'por_estado': {}, 'primera': None, 'ultima': None,
+        })
+        resumen['por_estado'][fila['estado']] = fila['total']
+        resumen['total'] += fila['total']
+        if fila['estado'] != 'cancelada':
+            resumen['primera'] = min(filter(None, (resumen['primera'], fila['primera'])))
+            resumen['ultima'] = max(filter(None, (resumen['ultima'], fila['ultima'])))
+
+    for resumen in periodos.values():
+        for campo in ('primera', 'ultima'):
+            if resumen[campo] is not None:
+                resumen[campo] = timezone.localtime(resumen[campo]).isoformat()
+    return list(periodos.values())
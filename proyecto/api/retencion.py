@@ -0,0 +1,57 @@
+# api/retencion.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Notificacion, NotificacionArchivada
+
+TAMANO_LOTE = 1000
+CAMPOS = ('id', 'usuario_id', 'tipo', 'titulo', 'mensaje', 'metadata', 'fecha')
+
+
+def archivar_lote(limite, tamano=TAMANO_LOTE):
+    """
+    Mueve a NotificacionArchivada hasta ``tamano`` notificaciones leídas
+    anteriores a ``limite``: una lectura por notificacion_leidas_fecha_idx,
+    un bulk_create y un DELETE por id, en una transacción corta. Solo se
+    bloquean las filas del lote, y con SKIP LOCKED: la que otra transacción
+    tiene tomada se deja para la siguiente pasada en vez de esperarla.
+    Devuelve cuántas se archivaron.
+    """
+    with transaction.atomic():
+        filas = list(
+            Notificacion.objects.select_for_update(skip_locked=True)
+            .filter(leida=True, fecha__lt=limite)
+            .order_by('fecha', 'id')
+            .values(*CAMPOS)[:tamano]
+        )
+        if not filas:
+            return 0
+        # ignore_conflicts: si una pasada anterior murió tras copiar, no se duplica
+        NotificacionArchivada.objects.bulk_create(
+            [NotificacionArchivada(**fila) for fila in filas], ignore_conflicts=True,
+        )
+        Notificacion.objects.filter(pk__in=[fila['id'] for fila in filas]).delete()
+    return len(filas)
+
+
+def archivar_notificaciones(dias=None, tamano=TAMANO_LOTE, ahora=None, al_avanzar=None):
+    """
+    Archiva lote a lote las notificaciones leídas con más de ``dias`` días
+    (por defecto settings.NOTIFICACIONES_DIAS_RETENCION). Las no leídas se
+    quedan en la bandeja sin importar su antigüedad. ``al_avanzar`` recibe
+    el total archivado tras cada lote. Devuelve el total.
+    """
+    if dias is None:
+        dias = settings.NOTIFICACIONES_DIAS_RETENCION
+    limite = (ahora or timezone.now()) - timedelta(days=dias)
+    total = 0
+    while True:
+        archivadas = archivar_lote(limite, tamano)
+        total += archivadas
+        if archivadas and al_avanzar:
+            al_avanzar(total)
+        if archivadas < tamano:
+            return total
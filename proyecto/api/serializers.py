@@ -1,6 +1,8 @@
 from datetime import date
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import *
+from .series import SerieInvalida, validar_regla
 
 class EspecialidadSerializer(serializers.ModelSerializer):
     class Meta:
@@ -38,11 +40,11 @@ class TratamientoSerializer(serializers.ModelSerializer):
         return value
 
 class DiagnosticoSerializer(serializers.ModelSerializer):
-    tratamiento = TratamientoSerializer(many=True, read_only=True)
+    tratamientos = TratamientoSerializer(many=True, read_only=True)
 
     class Meta:
         model = Diagnostico
-        fields = ['id', 'consulta', 'descripcion', 'fecha', 'tratamiento']
+        fields = ['id', 'consulta', 'descripcion', 'fecha', 'tratamientos']
 
     def validate_fecha(self, value):
         if isinstance(value, str):
@@ -53,7 +55,7 @@ class DiagnosticoSerializer(serializers.ModelSerializer):
         return value
 
 class ConsultaSerializer(serializers.ModelSerializer):
-    diagnosticos = DiagnosticoSerializer(many=True, read_only=True, source='diagnostico_set')
+    diagnosticos = DiagnosticoSerializer(many=True, read_only=True)
     paciente_detalle = PacienteSerializer(source='paciente', read_only=True)
     medico_detalle = MedicoSerializer(source='medico', read_only=True)
 
@@ -64,6 +66,17 @@ class ConsultaSerializer(serializers.ModelSerializer):
             'paciente_detalle', 'medico_detalle', 'diagnosticos'
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Carga en bloque todo lo que anida el serializer (paciente, médico con su
+        especialidad, diagnósticos y sus tratamientos): número fijo de consultas
+        SQL sin importar cuántas consultas se serialicen.
+        """
+        return queryset.select_related(
+            'paciente', 'medico__especialidad'
+        ).prefetch_related('diagnosticos__tratamientos')
+
     def validate_fecha(self, value):
         """
         Asegura que el valor sea un objeto `date`, no `datetime`.
@@ -114,6 +127,13 @@ class HistoriaClinicaSerializer(serializers.ModelSerializer):
         model = HistoriaClinica
         fields = ['id', 'fecha_inicio', 'observaciones', 'paciente_detalle', 'consultas']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        consultas = ConsultaSerializer.setup_eager_loading(Consulta.objects.all())
+        return queryset.select_related('paciente').prefetch_related(
+            Prefetch('paciente__consulta_set', queryset=consultas)
+        )
+
 # serializers.py - agrega este serializer
 class RegistroSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -160,12 +180,83 @@ class CitaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cita
         fields = '__all__'
-        read_only_fields = ('fecha_solicitud',)  # Solo esto es inmutable
+        read_only_fields = ('fecha_solicitud', 'serie', 'fecha_original')  # Solo esto es inmutable
 
     def update(self, instance, validated_data):
         # Permitimos actualización de todos los campos permitidos por la vista
         return super().update(instance, validated_data)
 
+class HorarioMedicoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = HorarioMedico
+        fields = ('id', 'dia_semana', 'hora_inicio', 'hora_fin', 'duracion_cita')
+
+    def validate_duracion_cita(self, value):
+        if value < 5:
+            raise serializers.ValidationError("La duración mínima de una cita es de 5 minutos.")
+        return value
+
+    def validate(self, data):
+        if data['hora_fin'] <= data['hora_inicio']:
+            raise serializers.ValidationError("La hora de fin debe ser posterior a la de inicio.")
+        return data
+
+
+class ExcepcionHorarioSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExcepcionHorario
+        fields = ('id', 'fecha', 'hora_inicio', 'hora_fin', 'motivo')
+
+    def validate(self, data):
+        hora_inicio, hora_fin = data.get('hora_inicio'), data.get('hora_fin')
+        if (hora_inicio is None) != (hora_fin is None):
+            raise serializers.ValidationError("Indica ambas horas o ninguna (día completo).")
+        if hora_inicio is not None and hora_fin <= hora_inicio:
+            raise serializers.ValidationError("La hora de fin debe ser posterior a la de inicio.")
+        return data
+
+class SerieCitaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SerieCita
+        fields = (
+            'id', 'paciente', 'medico', 'fecha_hora_inicio', 'frecuencia', 'intervalo', 'ocurrencias',
+            'fecha_fin', 'duracion_minutos', 'motivo', 'estado', 'fecha_creacion',
+        )
+        read_only_fields = ('fecha_creacion',)
+
+    def validate_duracion_minutos(self, value):
+        if not 5 <= value <= 720:
+            raise serializers.ValidationError("La duración debe estar entre 5 minutos y 12 horas.")
+        return value
+
+    def validate(self, data):
+        try:
+            validar_regla(
+                data['frecuencia'], data.get('intervalo', 1), data['fecha_hora_inicio'],
+                ocurrencias=data.get('ocurrencias'), fecha_fin=data.get('fecha_fin'),
+            )
+        except SerieInvalida as e:
+            raise serializers.ValidationError(str(e))
+        return data
+
+class EsperaCitaSerializer(serializers.ModelSerializer):
+    paciente_nombre = serializers.SerializerMethodField()
+
+    class Meta:
+        model = EsperaCita
+        fields = (
+            'id', 'paciente', 'paciente_nombre', 'medico', 'prioridad', 'motivo', 'estado',
+            'fecha_solicitud', 'cita', 'oferta_expira',
+        )
+        read_only_fields = ('estado', 'fecha_solicitud', 'cita', 'oferta_expira')
+        # Según quién se apunta, la vista completa el paciente o el médico y
+        # comprueba que no haya otra entrada activa (espera_activa_unica)
+        extra_kwargs = {'paciente': {'required': False}, 'medico': {'required': False}}
+        validators = []
+
+    def get_paciente_nombre(self, obj):
+        return f"{obj.paciente.nombre} {obj.paciente.apellido}"
+
 class TipoExamenSerializer(serializers.ModelSerializer):
     class Meta:
         model = TipoExamen
@@ -210,7 +301,7 @@ class ExamenMedicoSerializer(serializers.ModelSerializer):
             'tipo_examen', 'tipo_examen_id', 'diagnostico_relacionado',
             'diagnostico_relacionado_id', 'fecha_solicitud', 'fecha_realizacion',
             'fecha_resultado', 'estado', 'observaciones', 'interpretacion_medica',
-            'archivo_resultado', 'archivo_resultado_url'
+            'archivo_resultado', 'archivo_resultado_url', 'version'
         ]
 
     def get_archivo_resultado_url(self, obj):
@@ -228,4 +319,20 @@ class NotificacionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notificacion
         fields = ['id', 'tipo', 'titulo', 'mensaje', 'leida', 'fecha', 'metadata']
-        read_only_fields = ['id', 'fecha']
\ No newline at end of file
+        read_only_fields = ['id', 'fecha']
+
+
+class DifusionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Difusion
+        fields = [
+            'id', 'autor', 'tipo', 'titulo', 'mensaje', 'variables', 'audiencia', 'estado', 'total', 'enviadas',
+            'fecha_creacion', 'fecha_fin',
+        ]
+        read_only_fields = ['autor', 'estado', 'total', 'enviadas', 'fecha_creacion', 'fecha_fin']
+
+
+class NotificacionArchivadaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NotificacionArchivada
+        fields = ['id', 'tipo', 'titulo', 'mensaje', 'metadata', 'fecha', 'fecha_archivo']
\ No newline at end of file
@@ -0,0 +1,146 @@
+# api/series.py
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Cita
+
+CAMPOS_SERIE = (
+    'id', 'fecha_hora_inicio', 'frecuencia', 'intervalo', 'ocurrencias', 'fecha_fin',
+    'duracion_minutos', 'motivo', 'estado',
+    'paciente_id', 'paciente__nombre', 'paciente__apellido',
+    'medico_id', 'medico__nombre', 'medico__apellido',
+)
+
+
+class SerieInvalida(ValueError):
+    pass
+
+
+def validar_regla(frecuencia, intervalo, fecha_hora_inicio, ocurrencias=None, fecha_fin=None):
+    """Lanza SerieInvalida si la regla no genera ocurrencias bien definidas."""
+    if intervalo < 1:
+        raise SerieInvalida('El intervalo debe ser al menos 1.')
+    # Así cada mes tiene su ocurrencia y coincide con RRULE del feed .ics
+    if frecuencia == 'mensual' and timezone.localtime(fecha_hora_inicio).day > 28:
+        raise SerieInvalida('Las series mensuales deben empezar entre el día 1 y el 28.')
+    if ocurrencias is not None and ocurrencias < 1:
+        raise SerieInvalida('ocurrencias debe ser al menos 1.')
+    if fecha_fin is not None and fecha_fin < timezone.localdate(fecha_hora_inicio):
+        raise SerieInvalida('fecha_fin no puede ser anterior al inicio de la serie.')
+
+
+def _ocurrencia(base, frecuencia, intervalo, k):
+    """Hora local (naive) de la ocurrencia número ``k`` (la primera es 0)."""
+    if frecuencia == 'semanal':
+        return base + timedelta(weeks=intervalo * k)
+    meses = base.month - 1 + intervalo * k
+    return base.replace(year=base.year + meses // 12, month=meses % 12 + 1)
+
+
+def _primer_indice(base, frecuencia, intervalo, desde):
+    """Índice de una ocurrencia no posterior a ``desde`` (o 0), sin recorrer las anteriores."""
+    if desde <= base:
+        return 0
+    if frecuencia == 'semanal':
+        k = (desde - base) // timedelta(weeks=intervalo)
+    else:
+        k = ((desde.year - base.year) * 12 + desde.month - base.month) // intervalo
+    return max(k - 1, 0)  # un paso de margen por los cambios de horario
+
+
+def fechas_serie(serie, inicio, fin):
+    """
+    Inicios de las ocurrencias de ``serie`` (fila de CAMPOS_SERIE) en
+    [inicio, fin). Se salta directamente a la primera ocurrencia de la
+    ventana: el coste depende de la ventana, no de la antigüedad de la serie.
+    La hora local se mantiene aunque cambie el horario de verano.
+    """
+    zona = timezone.get_current_timezone()
+    base = timezone.localtime(serie['fecha_hora_inicio'], zona).replace(tzinfo=None)
+    frecuencia, intervalo = serie['frecuencia'], serie['intervalo']
+    desde = timezone.localtime(inicio, zona).replace(tzinfo=None)
+
+    fechas = []
+    k = _primer_indice(base, frecuencia, intervalo, desde)
+    while serie['ocurrencias'] is None or k < serie['ocurrencias']:
+        local = _ocurrencia(base, frecuencia, intervalo, k)
+        if serie['fecha_fin'] is not None and local.date() > serie['fecha_fin']:
+            break
+        fecha = timezone.make_aware(local, zona)
+        if fecha >= fin:
+            break
+        if fecha >= inicio:
+            fechas.append(fecha)
+        k += 1
+    return fechas
+
+
+def series_en_ventana(series, inicio, fin):
+    """Series de ``series`` que pueden tener ocurrencias en [inicio, fin)."""
+    return series.filter(fecha_hora_inicio__lt=fin).filter(
+        Q(fecha_fin__isnull=True) | Q(fecha_fin__gte=timezone.localdate(inicio))
+    )
+
+
+def ocurrencias(series, inicio, fin, excluir=None):
+    """
+    Ocurrencias virtuales de ``series`` (queryset de SerieCita) que empiezan
+    en [inicio, fin): lista de (fila de la serie, inicio) en orden
+    cronológico. Se omiten las que ya tienen una Cita de excepción (movida o
+    cancelada) y la ocurrencia ``excluir`` = (serie_id, fecha_original).
+    Son dos consultas, o una si no hay series en la ventana.
+    """
+    filas = list(series_en_ventana(series, inicio, fin).values(*CAMPOS_SERIE))
+    if not filas:
+        return []
+    reemplazadas = set(
+        Cita.objects.filter(
+            serie_id__in=[fila['id'] for fila in filas], fecha_original__gte=inicio, fecha_original__lt=fin,
+        ).values_list('serie_id', 'fecha_original')
+    )
+    if excluir is not None:
+        reemplazadas.add(excluir)
+
+    resultado = [
+        (fila, fecha)
+        for fila in filas
+        for fecha in fechas_serie(fila, inicio, fin)
+        if (fila['id'], fecha) not in reemplazadas
+    ]
+    resultado.sort(key=lambda par: (par[1], par[0]['id']))
+    return resultado
+
+
+def id_ocurrencia(serie_id, fecha):
+    """Id del evento virtual en el calendario, p. ej. "serie-3-1894017600"."""
+    return f'serie-{serie_id}-{int(fecha.timestamp())}'
+
+
+def filas_de_ocurrencias(pares):
+    """(serie, inicio) → filas con la forma de CAMPOS_EVENTO para api/calendario.py."""
+    return [
+        {
+            **{campo: fila[campo] for campo in (
+                'motivo', 'estado', 'paciente_id', 'paciente__nombre', 'paciente__apellido',
+                'medico_id', 'medico__nombre', 'medico__apellido',
+            )},
+            'id': id_ocurrencia(fila['id'], fecha),
+            'fecha_hora_propuesta': fecha,
+            'serie_id': fila['id'],
+        }
+        for fila, fecha in pares
+    ]
+
+
+def regla(serie):
+    """Campos de la regla de una instancia de SerieCita, como los recibe fechas_serie."""
+    return {campo: getattr(serie, campo) for campo in (
+        'fecha_hora_inicio', 'frecuencia', 'intervalo', 'ocurrencias', 'fecha_fin',
+    )}
+
+
+def es_ocurrencia(serie, fecha):
+    """Indica si ``fecha`` es una ocurrencia de ``serie`` (instancia de SerieCita)."""
+    return fecha in fechas_serie(regla(serie), fecha, fecha + timedelta(seconds=1))
@@ -0,0 +1,314 @@
+# api/signals.py
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .busqueda import invalidar_indice_pacientes
+from .busqueda_clinica import desindexar, indexar
+from .estadisticas import CONTADORES_MODELO, ajustar_contador, ajustar_contadores, clave_cita_estado
+from .eventos import publicar_citas, publicar_notificacion
+from .historia import invalidar_historia
+from .lista_espera import turno_liberado
+from .resumen_agenda import dia_agenda, recalcular_dias, sumar_cita
+from .sincronizacion import registrar_eliminada
+from .models import (
+    AntecedenteMedico, Cita, Consulta, Diagnostico, DocumentoClinico, ExamenMedico, HistoriaClinica, Medico, Notificacion,
+    Paciente, SerieCita, Tratamiento, tratamientos_eliminados,
+)
+
+# === Contadores del panel de administración ===
+
+_CLAVE_POR_MODELO = {modelo: clave for clave, modelo in CONTADORES_MODELO.items()}
+
+
+def _contar_alta(sender, instance, created, **kwargs):
+    if created and not kwargs.get('raw'):
+        ajustar_contador(_CLAVE_POR_MODELO[sender], 1)
+
+
+def _contar_baja(sender, instance, **kwargs):
+    ajustar_contador(_CLAVE_POR_MODELO[sender], -1)
+
+
+for _modelo in CONTADORES_MODELO.values():
+    post_save.connect(_contar_alta, sender=_modelo, dispatch_uid=f'contador_alta_{_modelo.__name__}')
+    post_delete.connect(_contar_baja, sender=_modelo, dispatch_uid=f'contador_baja_{_modelo.__name__}')
+
+
+@receiver(post_init, sender=Cita)
+def recordar_estado_cita(sender, instance, **kwargs):
+    # Se lee de __dict__ para no disparar una consulta si el campo está diferido
+    instance._estado_guardado = instance.__dict__.get('estado')
+    instance._duenos_guardados = (instance.__dict__.get('medico_id'), instance.__dict__.get('paciente_id'))
+    instance._fecha_guardada = instance.__dict__.get('fecha_hora_propuesta')
+    instance._agenda_guardada = (
+        instance.__dict__.get('medico_id'), instance._fecha_guardada, instance._estado_guardado,
+    )
+
+
+@receiver(post_save, sender=Cita)
+def contar_estado_cita(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        ajustar_contador(clave_cita_estado(instance.estado), 1)
+    elif instance._estado_guardado not in (None, instance.estado):
+        ajustar_contadores({clave_cita_estado(instance._estado_guardado): -1, clave_cita_estado(instance.estado): 1})
+    instance._estado_guardado = instance.estado
+
+
+@receiver(post_delete, sender=Cita)
+def descontar_estado_cita(sender, instance, **kwargs):
+    estado = instance._estado_guardado or instance.__dict__.get('estado')
+    if estado:
+        ajustar_contador(clave_cita_estado(estado), -1)
+
+
+# === Caché de la historia clínica ===
+
+def _invalidar_al_confirmar(paciente_id):
+    # Se invalida al confirmar la transacción: si se hiciera antes, otra petición
+    # podría cachear datos aún sin confirmar con la versión nueva.
+    if paciente_id is not None:
+        transaction.on_commit(lambda: invalidar_historia(paciente_id))
+
+
+def _borrado_directo(origin, modelo):
+    """
+    Indica si el borrado empezó en una instancia o queryset de ``modelo`` y no
+    llegó en cascada desde otro objeto (``origin`` de pre/post_delete).
+    """
+    if origin is None:
+        return True
+    return issubclass(origin.model if isinstance(origin, QuerySet) else type(origin), modelo)
+
+
+def _paciente_de_diagnostico(diagnostico):
+    if Diagnostico.consulta.is_cached(diagnostico):
+        return diagnostico.consulta.paciente_id
+    return Consulta.objects.filter(pk=diagnostico.consulta_id).values_list('paciente_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Paciente)
+def historia_por_paciente(sender, instance, **kwargs):
+    _invalidar_al_confirmar(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=HistoriaClinica)
+@receiver([post_save, post_delete], sender=Consulta)
+def historia_por_consulta(sender, instance, **kwargs):
+    _invalidar_al_confirmar(instance.paciente_id)
+
+
+@receiver(post_save, sender=Diagnostico)
+def historia_por_diagnostico(sender, instance, **kwargs):
+    _invalidar_al_confirmar(_paciente_de_diagnostico(instance))
+
+
+@receiver(post_save, sender=Tratamiento)
+def historia_por_tratamiento(sender, instance, **kwargs):
+    if Tratamiento.diagnostico.is_cached(instance):
+        paciente_id = _paciente_de_diagnostico(instance.diagnostico)
+    else:
+        paciente_id = Diagnostico.objects.filter(pk=instance.diagnostico_id).values_list(
+            'consulta__paciente_id', flat=True
+        ).first()
+    _invalidar_al_confirmar(paciente_id)
+
+
+# Tratamiento no tiene receptores de borrado: así Django los borra en cascada
+# con un solo DELETE, sin cargarlos. Quien empieza el borrado (consulta,
+# paciente o diagnóstico) invalida la historia y quita los documentos; el
+# borrado directo llega por TratamientoQuerySet.delete() (api/models.py).
+
+@receiver(tratamientos_eliminados, sender=Tratamiento)
+def historia_por_tratamientos_eliminados(sender, filas, **kwargs):
+    for paciente_id in {paciente_id for _, paciente_id in filas}:
+        _invalidar_al_confirmar(paciente_id)
+    DocumentoClinico.objects.filter(tipo='tratamiento', objeto_id__in=[pk for pk, _ in filas]).delete()
+
+
+@receiver(pre_delete, sender=Diagnostico)
+def diagnostico_eliminado(sender, instance, origin=None, **kwargs):
+    # En cascada desde la consulta, su receptor ya invalida la historia y los
+    # documentos caen con ella: no se consulta nada por cada diagnóstico.
+    if not _borrado_directo(origin, Diagnostico):
+        return
+    _invalidar_al_confirmar(_paciente_de_diagnostico(instance))
+    DocumentoClinico.objects.filter(
+        Q(tipo='diagnostico', objeto_id=instance.pk)
+        | Q(tipo='tratamiento', objeto_id__in=instance.tratamientos.values('id'))
+    ).delete()
+
+
+@receiver([post_save, post_delete], sender=Medico)
+def historia_por_medico(sender, instance, **kwargs):
+    transaction.on_commit(invalidar_historia)
+
+
+# === Índice de búsqueda de pacientes ===
+
+@receiver(post_save, sender=Paciente)
+def indexar_paciente(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: invalidar_indice_pacientes(instance))
+
+
+@receiver(post_delete, sender=Paciente)
+def desindexar_paciente(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidar_indice_pacientes(instance, eliminado=True))
+
+
+# === Búsqueda de texto clínico ===
+
+_TIPO_DOCUMENTO = {
+    Consulta: 'consulta',
+    Diagnostico: 'diagnostico',
+    Tratamiento: 'tratamiento',
+    AntecedenteMedico: 'antecedente',
+}
+
+
+def _indexar_documento(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    indexar(_TIPO_DOCUMENTO[sender], instance)
+    if sender is Consulta and not created:
+        # Los diagnósticos y tratamientos copian paciente y médico de su consulta
+        DocumentoClinico.objects.filter(consulta_id=instance.pk).exclude(tipo='consulta').update(
+            paciente_id=instance.paciente_id, medico_id=instance.medico_id
+        )
+
+
+def _desindexar_documento(sender, instance, origin=None, **kwargs):
+    # En cascada (desde el paciente o el médico) el documento cae con
+    # DocumentoClinico.paciente o DocumentoClinico.consulta
+    if _borrado_directo(origin, sender):
+        desindexar(_TIPO_DOCUMENTO[sender], instance.pk)
+
+
+for _modelo in _TIPO_DOCUMENTO:
+    post_save.connect(_indexar_documento, sender=_modelo, dispatch_uid=f'indexar_{_modelo.__name__}')
+
+# Diagnóstico y tratamiento se desindexan en diagnostico_eliminado
+for _modelo in (Consulta, AntecedenteMedico):
+    post_delete.connect(_desindexar_documento, sender=_modelo, dispatch_uid=f'desindexar_{_modelo.__name__}')
+
+
+# === Sincronización de calendarios (marcas de borrado) ===
+
+@receiver(post_save, sender=Cita)
+def marcar_cita_reasignada(sender, instance, created, raw=False, **kwargs):
+    # Si cambia de médico o paciente, para el anterior es como si se hubiera borrado
+    medico_id, paciente_id = instance._duenos_guardados
+    if not (created or raw) and None not in (medico_id, paciente_id) and (
+        medico_id != instance.medico_id or paciente_id != instance.paciente_id
+    ):
+        registrar_eliminada(instance.pk, medico_id, paciente_id)
+    instance._duenos_guardados = (instance.medico_id, instance.paciente_id)
+
+
+@receiver(post_delete, sender=Cita)
+def marcar_cita_eliminada(sender, instance, **kwargs):
+    registrar_eliminada(instance.pk, instance.medico_id, instance.paciente_id)
+
+
+def _serie_cambiada(serie_id):
+    # Aparece o desaparece una ocurrencia calculada: los calendarios recargan la ventana
+    SerieCita.objects.filter(pk=serie_id).update(fecha_actualizacion=timezone.now())
+
+
+@receiver(post_save, sender=Cita)
+def marcar_serie_con_excepcion(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.serie_id:
+        _serie_cambiada(instance.serie_id)
+
+
+@receiver(post_delete, sender=Cita)
+def marcar_serie_sin_excepcion(sender, instance, **kwargs):
+    if instance.serie_id:
+        _serie_cambiada(instance.serie_id)
+
+
+# === Recordatorios ===
+
+@receiver(pre_save, sender=Cita)
+def reiniciar_recordatorio(sender, instance, raw=False, **kwargs):
+    # Una cita reprogramada vuelve a recibir sus recordatorios (api/recordatorios.py)
+    if not raw and instance._fecha_guardada not in (None, instance.fecha_hora_propuesta):
+        instance.recordatorio_enviado = None
+    instance._fecha_guardada = instance.fecha_hora_propuesta
+
+
+# === Lista de espera ===
+
+@receiver(pre_save, sender=Cita)
+def detectar_cancelacion(sender, instance, raw=False, **kwargs):
+    # Se calcula antes de guardar: en post_save _estado_guardado ya es el nuevo
+    instance._recien_cancelada = (
+        not raw and instance.estado == 'cancelada' and instance._estado_guardado not in (None, 'cancelada')
+    )
+
+
+@receiver(post_save, sender=Cita)
+def ofrecer_turno_cancelado(sender, instance, raw=False, **kwargs):
+    if not raw and instance.__dict__.pop('_recien_cancelada', False):
+        turno_liberado(instance)
+
+
+# === Resumen diario de la agenda ===
+
+@receiver(post_save, sender=Cita)
+def resumir_cita_guardada(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    actual = (instance.medico_id, instance.fecha_hora_propuesta, instance.estado)
+    anterior = instance._agenda_guardada
+    if created:
+        sumar_cita(*actual)
+    elif None in anterior:
+        # Cargada con campos diferidos: no se sabe de dónde venía, se recalcula donde está
+        recalcular_dias([dia_agenda(*actual[:2])])
+    elif anterior != actual:
+        recalcular_dias([dia_agenda(*anterior[:2]), dia_agenda(*actual[:2])])
+    instance._agenda_guardada = actual
+
+
+@receiver(post_delete, sender=Cita)
+def resumir_cita_eliminada(sender, instance, **kwargs):
+    recalcular_dias([dia_agenda(instance.medico_id, instance.fecha_hora_propuesta)])
+
+
+# === Control de versiones (api/concurrencia.py) ===
+
+@receiver(pre_save, sender=Cita)
+@receiver(pre_save, sender=ExamenMedico)
+def subir_version(sender, instance, raw=False, **kwargs):
+    # Toda edición sube la versión, para que un cliente con la anterior reciba 412.
+    # Si avanzar_version ya la subió con el UPDATE condicional, no se repite.
+    if raw or instance._state.adding:
+        return
+    if not instance.__dict__.pop('_version_avanzada', False):
+        instance.version += 1
+
+
+# === Eventos en tiempo real (api/eventos.py) ===
+
+@receiver(post_save, sender=Notificacion)
+def avisar_notificacion(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        publicar_notificacion(instance)
+
+
+@receiver(pre_save, sender=Cita)
+def detectar_cambio_estado(sender, instance, raw=False, **kwargs):
+    # Como detectar_cancelacion: en post_save _estado_guardado ya es el nuevo
+    instance._estado_cambiado = not raw and instance.estado != instance._estado_guardado
+
+
+@receiver(post_save, sender=Cita)
+def avisar_cambio_estado(sender, instance, raw=False, **kwargs):
+    if instance.__dict__.pop('_estado_cambiado', False):
+        publicar_citas([instance.pk])
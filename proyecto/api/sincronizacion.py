@@ -0,0 +1,93 @@
+# api/sincronizacion.py
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .calendario import CAMPOS_EVENTO, eventos_desde_filas
+from .models import CitaEliminada
+
+# fecha_actualizacion se fija al guardar, antes de confirmar la transacción:
+# una escritura puede hacerse visible con una fecha algo anterior al momento
+# en que se lee. El token se atrasa este margen para no perderla; el cliente
+# puede recibir un cambio dos veces y lo aplica igual (por id).
+MARGEN_TRANSACCIONES = timedelta(seconds=10)
+
+# Pasado este tiempo las marcas de borrado se purgan y el cliente debe recargar
+RETENCION_ELIMINADAS = timedelta(days=7)
+LIMITE_CAMBIOS = 500
+
+CLAVE_PURGA = 'sincronizacion:citas:purga'
+
+DEMASIADOS_CAMBIOS = 'Hay demasiados cambios pendientes; recarga el calendario.'
+
+
+class TokenInvalido(ValueError):
+    pass
+
+
+class SincronizacionExpirada(Exception):
+    """El cliente está demasiado atrasado: debe recargar la ventana completa."""
+
+
+def nuevo_token(ahora=None):
+    return ((ahora or timezone.now()) - MARGEN_TRANSACCIONES).isoformat()
+
+
+def leer_token(valor):
+    fecha = parse_datetime(valor or '')
+    if fecha is None:
+        raise TokenInvalido('Token de sincronización inválido.')
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
+def cambios_citas(citas, eliminadas, desde, vista, series=None):
+    """
+    Citas de ``citas`` creadas o modificadas después de ``desde`` (como
+    eventos de FullCalendar) e ids de ``eliminadas`` borradas después de
+    ``desde``. Ambas consultas recorren los índices sobre la fecha de cambio:
+    sin cambios no devuelven filas.
+
+    El cliente aplica primero ``eliminadas`` y luego ``citas``: una cita que
+    cambió de médico deja una marca para el médico anterior y vuelve a
+    aparecer en ``citas`` si sigue siendo visible.
+
+    Las ocurrencias de ``series`` no son filas: si una serie visible cambió
+    (nueva, terminada o con una ocurrencia movida) el cliente recarga la
+    ventana, como cuando hay demasiados cambios.
+    """
+    ahora = timezone.now()
+    token = nuevo_token(ahora)
+    if desde < ahora - RETENCION_ELIMINADAS:
+        raise SincronizacionExpirada(DEMASIADOS_CAMBIOS)
+    if series is not None and series.filter(fecha_actualizacion__gt=desde).exists():
+        raise SincronizacionExpirada('Cambió una serie de citas; recarga el calendario.')
+
+    filas = list(
+        citas.filter(fecha_actualizacion__gt=desde).order_by('fecha_actualizacion', 'id').values(*CAMPOS_EVENTO)[
+            :LIMITE_CAMBIOS + 1
+        ]
+    )
+    borradas = list(
+        eliminadas.filter(fecha_eliminacion__gt=desde).order_by('fecha_eliminacion').values_list('cita_id', flat=True)[
+            :LIMITE_CAMBIOS + 1
+        ]
+    )
+    if len(filas) > LIMITE_CAMBIOS or len(borradas) > LIMITE_CAMBIOS:
+        raise SincronizacionExpirada(DEMASIADOS_CAMBIOS)
+
+    return {
+        'token': token,
+        'citas': eventos_desde_filas(filas, vista),
+        'eliminadas': list(dict.fromkeys(borradas)),
+    }
+
+
+def registrar_eliminada(cita_id, medico_id, paciente_id):
+    CitaEliminada.objects.create(cita_id=cita_id, medico_id=medico_id, paciente_id=paciente_id)
+    # Como mucho una purga por hora, en la misma transacción que el borrado
+    if cache.add(CLAVE_PURGA, 1, timeout=3600):
+        CitaEliminada.objects.filter(fecha_eliminacion__lt=timezone.now() - RETENCION_ELIMINADAS).delete()
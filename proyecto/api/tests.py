@@ -1,3 +1,2860 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import date, datetime, time as hora, timedelta, timezone as dt_timezone
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from django.urls.resolvers import RegexPattern
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_http_date
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from consultorio.models import Consultorio
+
+from . import busqueda
+from .busqueda_clinica import reconstruir_documentos
+from .calendario_ics import _linea, vtimezone
+from .concurrencia import VersionObsoleta, avanzar_version
+from .difusion import crear_difusion, destinatarios, enviar_lote, procesar_difusion
+from .estadisticas import recalcular_contadores
+from .eventos import DURACION_TICKET, MemoriaEventos, PostgresEventos, canal_eventos, flujo_eventos
+from .lista_espera import cerrar_oferta, ofrecer_turno, vencer_ofertas
+from .recordatorios import ANTICIPACIONES, enviar_recordatorios
+from .resumen_agenda import recalcular_resumen_agenda
+from .retencion import archivar_lote, archivar_notificaciones
+from .series import fechas_serie
+from .management.commands.generar_datos import APELLIDOS, NOMBRES
+from .serializers import HistoriaClinicaSerializer
+from .models import (
+    AntecedenteMedico, Cita, CitaEliminada, Consulta, ContadorEstadistica, Diagnostico, Difusion, DocumentoClinico, Especialidad,
+    ExamenMedico, EsperaCita, ExcepcionHorario, HistoriaClinica, HorarioMedico, Medico, Notificacion,
+    NotificacionArchivada, Paciente, RecordatorioSerie, ResumenAgenda,
+    Rol, SerieCita, SuscripcionCalendario, TipoExamen, Tratamiento, Usuario,
+)
+
+
+# === Datos de prueba ===
+
+def crear_medico(n=1, especialidad=None):
+    especialidad = especialidad or Especialidad.objects.create(nombre='Medicina Interna')
+    usuario = Usuario.objects.create_user(
+        correo=f'medico{n}@clinica.com', nombre='Médico', apellido=str(n), password='clave123'
+    )
+    return Medico.objects.create(
+        usuario=usuario, nombre='Médico', apellido=str(n), dni=f'M{n}', especialidad=especialidad
+    )
+
+
+def crear_admin():
+    return Usuario.objects.create_superuser(
+        correo='admin@clinica.com', nombre='Admin', apellido='Sistema', password='clave123'
+    )
+
+
+def crear_pacientes(cantidad, inicio=0):
+    return Paciente.objects.bulk_create([
+        Paciente(
+            nombre=f'Paciente{i}', apellido=f'Apellido{i}', dni=f'P{i}',
+            fecha_nacimiento=date(1980, 1, 1) + timedelta(days=i % 9000),
+        )
+        for i in range(inicio, inicio + cantidad)
+    ])
+
+
+def crear_historial(paciente, medico, consultas, diagnosticos=1, tratamientos=1):
+    """Crea consultas con sus diagnósticos y tratamientos usando bulk_create."""
+    hoy = date(2025, 1, 1)
+    lista_consultas = Consulta.objects.bulk_create([
+        Consulta(paciente=paciente, medico=medico, fecha=hoy - timedelta(days=i), motivo=f'Motivo {i}')
+        for i in range(consultas)
+    ])
+    lista_diagnosticos = Diagnostico.objects.bulk_create([
+        Diagnostico(consulta=consulta, descripcion=f'Diagnóstico {consulta.id}-{j}')
+        for consulta in lista_consultas for j in range(diagnosticos)
+    ])
+    Tratamiento.objects.bulk_create([
+        Tratamiento(
+            diagnostico=diag, descripcion=f'Tratamiento {diag.id}-{k}', indicaciones='Cada 8 horas',
+            duracion_dias=5, fecha_inicio=hoy - timedelta(days=k),
+        )
+        for diag in lista_diagnosticos for k in range(tratamientos)
+    ])
+    return lista_consultas
+
+
+def recorrer_paginas(client, url, page_size):
+    """Sigue los enlaces ``next`` y devuelve (ids, respuestas)."""
+    ids, respuestas = [], []
+    siguiente = f'{url}?page_size={page_size}'
+    while siguiente:
+        response = client.get(siguiente)
+        respuestas.append(response)
+        ids.extend(item['id'] for item in response.data['results'])
+        siguiente = response.data['next']
+    return ids, respuestas
+
+
+# === Paginación por cursor ===
+
+class CursorPaginacionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico()
+
+    def test_sin_parametros_devuelve_lista_completa(self):
+        crear_pacientes(5)
+        response = self.client.get('/api/pacientes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+    def test_recorre_todas_las_filas_sin_repetir(self):
+        pacientes = crear_pacientes(23)
+        ids, respuestas = recorrer_paginas(self.client, '/api/pacientes/', 5)
+        self.assertEqual(ids, [p.id for p in pacientes])
+        self.assertEqual(len(respuestas), 5)
+        self.assertIsNone(respuestas[-1].data['next'])
+
+    def test_cursor_es_opaco(self):
+        crear_pacientes(3)
+        response = self.client.get('/api/pacientes/?page_size=2')
+        siguiente = response.data['next']
+        self.assertIn('cursor=', siguiente)
+        self.assertFalse(siguiente.split('cursor=')[1].split('&')[0].isdigit())
+
+    def test_consultas_estables_ante_inserciones_concurrentes(self):
+        paciente = crear_pacientes(1)[0]
+        hoy = date(2025, 6, 1)
+        # Varias consultas el mismo día para ejercitar el desempate por id
+        Consulta.objects.bulk_create([
+            Consulta(paciente=paciente, medico=self.medico, fecha=hoy - timedelta(days=i // 3), motivo=str(i))
+            for i in range(12)
+        ])
+        esperado = list(Consulta.objects.order_by('-fecha', '-id').values_list('id', flat=True))
+
+        primera = self.client.get('/api/consultas/?page_size=4')
+        # Llegan consultas nuevas mientras el cliente pagina
+        Consulta.objects.create(paciente=paciente, medico=self.medico, fecha=hoy + timedelta(days=1), motivo='nueva')
+        Consulta.objects.create(paciente=paciente, medico=self.medico, fecha=hoy, motivo='mismo día')
+
+        ids = [c['id'] for c in primera.data['results']]
+        siguiente = primera.data['next']
+        while siguiente:
+            response = self.client.get(siguiente)
+            ids.extend(c['id'] for c in response.data['results'])
+            siguiente = response.data['next']
+
+        self.assertEqual(ids, esperado)
+
+    def test_cursor_invalido(self):
+        response = self.client.get('/api/pacientes/?cursor=no-es-un-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_medicos_paginados(self):
+        for n in range(2, 5):
+            crear_medico(n, especialidad=self.medico.especialidad)
+        ids, _ = recorrer_paginas(self.client, '/api/medicos/', 2)
+        self.assertEqual(ids, sorted(Medico.objects.values_list('id', flat=True)))
+
+
+@tag('benchmark')
+class CursorPaginacionBenchmark(TestCase):
+    """
+    La última página debe costar lo mismo que la primera: cada página es una
+    búsqueda en el índice, no un OFFSET.
+
+        python manage.py test api --tag benchmark
+    """
+    total = 20000
+    page_size = 100
+
+    def test_latencia_plana_de_primera_a_ultima_pagina(self):
+        for inicio in range(0, self.total, 5000):
+            crear_pacientes(5000, inicio=inicio)
+        client = APIClient()
+        siguiente = f'/api/pacientes/?page_size={self.page_size}'
+        paginas, consultas = 0, set()
+        while siguiente:
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(siguiente)
+            paginas += 1
+            consultas.add(len(ctx.captured_queries))
+            for consulta in ctx.captured_queries:
+                self.assertNotIn('OFFSET', consulta['sql'].upper())
+            siguiente = response.data['next']
+
+        self.assertEqual(paginas, self.total // self.page_size)
+        self.assertEqual(len(consultas), 1)
+
+
+# === Estadísticas del panel ===
+
+class EstadisticasTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = crear_admin()
+        self.client.force_authenticate(self.admin)
+        self.medico = crear_medico()
+        self.paciente = Paciente.objects.create(
+            nombre='Ana', apellido='Pérez', dni='V1', fecha_nacimiento=date(1990, 1, 1)
+        )
+        recalcular_contadores()
+
+    def contador(self, clave):
+        return ContadorEstadistica.objects.get(clave=clave).valor
+
+    def confirmar(self):
+        # Los contadores se ajustan al confirmar la transacción
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def test_contadores_se_mantienen_al_crear_y_eliminar(self):
+        with self.confirmar():
+            consulta = Consulta.objects.create(
+                paciente=self.paciente, medico=self.medico, fecha=date.today(), motivo='Control'
+            )
+        self.assertEqual(self.contador('pacientes'), 1)
+        self.assertEqual(self.contador('medicos'), 1)
+        self.assertEqual(self.contador('consultas'), 1)
+        with self.confirmar():
+            consulta.delete()
+        self.assertEqual(self.contador('consultas'), 0)
+
+    def test_contadores_de_citas_siguen_los_cambios_de_estado(self):
+        with self.confirmar():
+            cita = Cita.objects.create(
+                paciente=self.paciente, medico=self.medico, fecha_hora_propuesta='2030-01-01T10:00:00Z'
+            )
+        self.assertEqual(self.contador('citas_solicitada'), 1)
+
+        cita = Cita.objects.get(pk=cita.pk)
+        cita.estado = 'confirmada'
+        with self.confirmar():
+            cita.save()
+            # Dentro de la transacción no se toca la fila compartida
+            self.assertEqual(self.contador('citas_solicitada'), 1)
+        self.assertEqual(self.contador('citas_solicitada'), 0)
+        self.assertEqual(self.contador('citas_confirmada'), 1)
+
+        with self.confirmar():
+            cita.save()  # Guardar sin cambios no altera los contadores
+        self.assertEqual(self.contador('citas_confirmada'), 1)
+
+        # Una transacción deshecha no ajusta nada
+        with self.confirmar() as callbacks:
+            try:
+                with transaction.atomic():
+                    cita.estado = 'cancelada'
+                    cita.save()
+                    raise ValueError('deshacer')
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+
+        # Eliminar el paciente elimina sus citas en cascada
+        with self.confirmar():
+            self.paciente.delete()
+        self.assertEqual(self.contador('citas'), 0)
+        self.assertEqual(self.contador('citas_confirmada'), 0)
+        self.assertEqual(self.contador('pacientes'), 0)
+
+    def test_recalcular_coincide_con_los_contadores_incrementales(self):
+        with self.confirmar():
+            for hora in range(3):
+                Cita.objects.create(
+                    paciente=self.paciente, medico=self.medico,
+                    fecha_hora_propuesta=f'2030-01-01T1{hora}:00:00Z', estado='confirmada'
+                )
+        incrementales = dict(ContadorEstadistica.objects.values_list('clave', 'valor'))
+        self.assertEqual(recalcular_contadores(), incrementales)
+
+    def test_endpoint_estadisticas(self):
+        Consulta.objects.create(paciente=self.paciente, medico=self.medico, fecha=date.today(), motivo='Hoy')
+        Consulta.objects.create(paciente=self.paciente, medico=self.medico, fecha=date(2000, 1, 1), motivo='Antigua')
+        tipo = TipoExamen.objects.create(nombre='Hematología')
+        for estado in ('solicitado', 'en_proceso', 'completado'):
+            ExamenMedico.objects.create(paciente=self.paciente, medico=self.medico, tipo_examen=tipo, estado=estado)
+        Cita.objects.create(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta='2030-01-01T10:00:00Z')
+        recalcular_contadores()
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/estadisticas/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pacientes'], 1)
+        self.assertEqual(response.data['consultas'], 2)
+        self.assertEqual(response.data['consultas_mes'], 1)
+        self.assertEqual(response.data['examenes_pendientes'], 2)
+        self.assertEqual(response.data['citas_por_estado']['solicitada'], 1)
+        self.assertEqual(response.data['citas_por_estado']['cancelada'], 0)
+        self.assertLessEqual(len(ctx.captured_queries), 3)
+
+    def test_solo_admin(self):
+        self.client.force_authenticate(self.medico.usuario)
+        self.assertEqual(self.client.get('/api/estadisticas/').status_code, 403)
+
+
+# === Historia clínica ===
+
+class HistoriaClinicaDetallesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.medico = crear_medico()
+        self.paciente = Paciente.objects.create(
+            nombre='Ana', apellido='Pérez', dni='V1', fecha_nacimiento=date(1990, 1, 1)
+        )
+
+    def url(self, paciente_id):
+        return f'/api/historia-clinica/paciente/{paciente_id}/'
+
+    def test_sin_consultas_devuelve_404(self):
+        self.assertEqual(self.client.get(self.url(self.paciente.id)).status_code, 404)
+        self.assertEqual(self.client.get(self.url(999999)).status_code, 404)
+
+    def test_forma_del_documento(self):
+        historia = HistoriaClinica.objects.create(paciente=self.paciente, observaciones='Alérgica')
+        crear_historial(self.paciente, self.medico, consultas=2, diagnosticos=2, tratamientos=3)
+        Consulta.objects.create(paciente=self.paciente, medico=self.medico, fecha=date(2025, 2, 1), motivo='Sin diagnóstico')
+
+        response = self.client.get(self.url(self.paciente.id))
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['id'], historia.id)
+        self.assertEqual(data['observaciones'], 'Alérgica')
+        self.assertEqual(data['paciente_detalle']['dni'], 'V1')
+        self.assertEqual(data['paciente_detalle']['telefono'], '')
+
+        consultas = data['consultas']
+        self.assertEqual([c['fecha'] for c in consultas], sorted((c['fecha'] for c in consultas), reverse=True))
+        self.assertEqual(consultas[0]['motivo'], 'Sin diagnóstico')
+        self.assertEqual(consultas[0]['diagnosticos'], [])
+
+        consulta = consultas[1]
+        self.assertEqual(set(consulta), {
+            'id', 'paciente', 'medico', 'fecha', 'motivo', 'paciente_detalle', 'medico_detalle', 'diagnosticos'
+        })
+        self.assertEqual(consulta['medico_detalle']['especialidad'], self.medico.especialidad_id)
+        self.assertEqual(len(consulta['diagnosticos']), 2)
+        diagnostico = consulta['diagnosticos'][0]
+        self.assertEqual(set(diagnostico), {'id', 'descripcion', 'fecha', 'tratamientos'})
+        self.assertEqual(len(diagnostico['tratamientos']), 3)
+        self.assertEqual(
+            set(diagnostico['tratamientos'][0]),
+            {'id', 'descripcion', 'indicaciones', 'duracion_dias', 'fecha_inicio'}
+        )
+
+    def test_numero_de_consultas_sql_constante(self):
+        crear_historial(self.paciente, self.medico, consultas=3)
+        with CaptureQueriesContext(connection) as pocas:
+            self.client.get(self.url(self.paciente.id))
+        crear_historial(self.paciente, self.medico, consultas=30, diagnosticos=2, tratamientos=2)
+        cache.clear()  # bulk_create no dispara las señales que invalidan el caché
+        with CaptureQueriesContext(connection) as muchas:
+            self.client.get(self.url(self.paciente.id))
+        self.assertEqual(len(pocas.captured_queries), len(muchas.captured_queries))
+
+
+class HistoriaClinicaCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.medico = crear_medico()
+        self.paciente = Paciente.objects.create(
+            nombre='Ana', apellido='Pérez', dni='V1', fecha_nacimiento=date(1990, 1, 1)
+        )
+        self.consulta = crear_historial(self.paciente, self.medico, consultas=2)[0]
+        self.url = f'/api/historia-clinica/paciente/{self.paciente.id}/'
+
+    def test_documento_cacheado_y_304_sin_tocar_la_base(self):
+        primera = self.client.get(self.url)
+        etag = primera['ETag']
+        with self.assertNumQueries(0):
+            segunda = self.client.get(self.url)
+        self.assertEqual(segunda.data, primera.data)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_escrituras_invalidan_la_version(self):
+        etag = self.client.get(self.url)['ETag']
+        escrituras = [
+            lambda: Diagnostico.objects.create(consulta=self.consulta, descripcion='Nuevo'),
+            lambda: Tratamiento.objects.create(
+                diagnostico=self.consulta.diagnosticos.first(), descripcion='Reposo', fecha_inicio=date.today()
+            ),
+            lambda: Tratamiento.objects.latest('id').delete(),
+            lambda: HistoriaClinica.objects.create(paciente=self.paciente, observaciones='Abierta'),
+            lambda: Consulta.objects.filter(pk=self.consulta.pk).first().delete(),
+            lambda: self.paciente.save(),
+            lambda: self.medico.save(),
+        ]
+        for escribir in escrituras:
+            with self.captureOnCommitCallbacks(execute=True):
+                escribir()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_contenido_actualizado_tras_invalidar(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Diagnostico.objects.create(consulta=self.consulta, descripcion='Hipertensión')
+        consultas = self.client.get(self.url).data['consultas']
+        descripciones = [d['descripcion'] for c in consultas for d in c['diagnosticos']]
+        self.assertIn('Hipertensión', descripciones)
+
+    def test_borrar_consulta_no_consulta_por_diagnostico_ni_tratamiento(self):
+        chica = crear_historial(self.paciente, self.medico, consultas=1)[0]
+        grande = crear_historial(self.paciente, self.medico, consultas=1, diagnosticos=5, tratamientos=3)[0]
+        reconstruir_documentos()
+        etag = self.client.get(self.url)['ETag']
+
+        consultas = []
+        for consulta in (chica, grande):
+            with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+                consulta.delete()
+            consultas.append(ctx.captured_queries)
+        self.assertEqual(len(consultas[0]), len(consultas[1]))
+        # Los tratamientos se borran con un DELETE en cascada, sin cargarlos
+        self.assertFalse([q for q in consultas[1] if q['sql'].startswith('SELECT') and 'api_tratamiento' in q['sql']])
+        self.assertFalse(DocumentoClinico.objects.filter(consulta_id__in=[chica.id, grande.id]).exists())
+        self.assertNotEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_borrar_diagnostico_suelto(self):
+        diagnostico = self.consulta.diagnosticos.get()
+        tratamiento = diagnostico.tratamientos.get()
+        reconstruir_documentos()
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Diagnostico.objects.get(pk=diagnostico.pk).delete()
+        self.assertNotEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertFalse(DocumentoClinico.objects.filter(
+            Q(tipo='diagnostico', objeto_id=diagnostico.id) | Q(tipo='tratamiento', objeto_id=tratamiento.id)
+        ).exists())
+        self.assertTrue(DocumentoClinico.objects.filter(tipo='consulta', objeto_id=self.consulta.id).exists())
+
+    def test_borrar_tratamientos_con_queryset(self):
+        otro = Paciente.objects.create(nombre='Luis', apellido='Gil', dni='V2', fecha_nacimiento=date(1985, 1, 1))
+        crear_historial(otro, self.medico, consultas=1)
+        reconstruir_documentos()
+        etag = self.client.get(self.url)['ETag']
+        url_otro = f'/api/historia-clinica/paciente/{otro.id}/'
+        etag_otro = self.client.get(url_otro)['ETag']
+        ids = list(Tratamiento.objects.values_list('id', flat=True))
+        with self.assertNumQueries(3), self.captureOnCommitCallbacks(execute=True):
+            Tratamiento.objects.filter(diagnostico__consulta__medico=self.medico).delete()
+        self.assertNotEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(self.client.get(url_otro, HTTP_IF_NONE_MATCH=etag_otro).status_code, 304)
+        self.assertFalse(DocumentoClinico.objects.filter(tipo='tratamiento', objeto_id__in=ids).exists())
+
+    def test_la_version_no_depende_de_otros_pacientes(self):
+        etag = self.client.get(self.url)['ETag']
+        otro = Paciente.objects.create(nombre='Luis', apellido='Gil', dni='V2', fecha_nacimiento=date(1985, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            crear_historial(otro, self.medico, consultas=1)
+            Consulta.objects.create(paciente=otro, medico=self.medico, fecha=date.today(), motivo='Otro')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class ConsultaSerializerConsultasSQLTests(TestCase):
+    """El número de consultas SQL no debe crecer con el número de filas (N+1)."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico()
+        self.otro_medico = crear_medico(2, especialidad=Especialidad.objects.create(nombre='Pediatría'))
+        self.paciente = Paciente.objects.create(
+            nombre='Ana', apellido='Pérez', dni='V1', fecha_nacimiento=date(1990, 1, 1)
+        )
+        HistoriaClinica.objects.create(paciente=self.paciente)
+
+    def contar(self, funcion):
+        with CaptureQueriesContext(connection) as ctx:
+            funcion()
+        return len(ctx.captured_queries)
+
+    def crecer(self):
+        crear_historial(self.paciente, self.medico, consultas=10, diagnosticos=3, tratamientos=2)
+        crear_historial(self.paciente, self.otro_medico, consultas=10, diagnosticos=2, tratamientos=3)
+
+    def test_listado_de_consultas(self):
+        crear_historial(self.paciente, self.medico, consultas=1)
+        pocas = self.contar(lambda: self.client.get('/api/consultas/'))
+        self.crecer()
+        response = self.client.get('/api/consultas/')
+        self.assertEqual(self.contar(lambda: self.client.get('/api/consultas/')), pocas)
+        self.assertEqual(self.contar(lambda: self.client.get('/api/consultas/?page_size=5')), pocas)
+
+        consulta = min(response.data, key=lambda c: c['id'])  # La del primer historial (sin orden fijo)
+        self.assertEqual(len(consulta['diagnosticos']), 1)
+        self.assertEqual(len(consulta['diagnosticos'][0]['tratamientos']), 1)
+        self.assertEqual(consulta['medico_detalle']['especialidad']['nombre'], 'Medicina Interna')
+
+    def test_detalle_de_consulta(self):
+        consulta = crear_historial(self.paciente, self.medico, consultas=1, diagnosticos=1)[0]
+        pocas = self.contar(lambda: self.client.get(f'/api/consultas/{consulta.id}/'))
+        Diagnostico.objects.bulk_create([Diagnostico(consulta=consulta, descripcion=str(i)) for i in range(8)])
+        response = self.client.get(f'/api/consultas/{consulta.id}/')
+        self.assertEqual(len(response.data['diagnosticos']), 9)
+        self.assertEqual(self.contar(lambda: self.client.get(f'/api/consultas/{consulta.id}/')), pocas)
+
+    def test_historia_clinica_serializer(self):
+        crear_historial(self.paciente, self.medico, consultas=1)
+
+        def serializar():
+            historia = HistoriaClinicaSerializer.setup_eager_loading(HistoriaClinica.objects.all()).get()
+            return HistoriaClinicaSerializer(historia).data
+
+        pocas = self.contar(serializar)
+        self.crecer()
+        self.assertEqual(self.contar(serializar), pocas)
+        self.assertEqual(len(serializar()['consultas']), 21)
+
+    def test_relacion_inversa_de_tratamientos(self):
+        consulta = crear_historial(self.paciente, self.medico, consultas=1, tratamientos=2)[0]
+        diagnostico = consulta.diagnosticos.get()
+        self.assertEqual(diagnostico.tratamientos.count(), 2)
+
+
+@tag('benchmark')
+class HistoriaClinicaBenchmark(TestCase):
+    """Paciente crónico con más de mil consultas."""
+
+    def test_paciente_con_1500_consultas(self):
+        cache.clear()
+        medico = crear_medico()
+        paciente = Paciente.objects.create(
+            nombre='Crónico', apellido='Pérez', dni='V1', fecha_nacimiento=date(1950, 1, 1)
+        )
+        HistoriaClinica.objects.create(paciente=paciente)
+        crear_historial(paciente, medico, consultas=1500, diagnosticos=2, tratamientos=2)
+
+        client = APIClient()
+        cache.clear()  # Se mide la construcción del documento, no el caché
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(f'/api/historia-clinica/paciente/{paciente.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['consultas']), 1500)
+        self.assertEqual(sum(len(c['diagnosticos']) for c in response.data['consultas']), 3000)
+        self.assertLessEqual(len(ctx.captured_queries), 4)
+
+
+# === Presupuestos de rendimiento por endpoint ===
+
+ARCHIVO_PRESUPUESTOS = Path(__file__).with_name('presupuestos_rendimiento.json')
+
+
+class GenerarDatosTests(TestCase):
+    def generar(self, semilla=7, **opciones):
+        call_command('generar_datos', semilla=semilla, escala=0.0005, lote=100, stdout=StringIO(), **opciones)
+
+    def huella(self):
+        return (
+            list(Paciente.objects.order_by('dni').values_list('dni', 'nombre', 'apellido', 'fecha_nacimiento')),
+            list(Cita.objects.order_by('id').values_list('paciente__dni', 'fecha_hora_propuesta', 'estado')),
+            list(Consulta.objects.order_by('id').values_list('fecha', flat=True)),
+            list(ExamenMedico.objects.order_by('id').values_list('fecha_solicitud', 'fecha_resultado')),
+            list(Notificacion.objects.order_by('id').values_list('fecha', 'leida')),
+        )
+
+    def test_genera_el_grafo_completo_y_recalcula_contadores(self):
+        self.generar()
+
+        self.assertEqual(Paciente.objects.count(), 50)
+        self.assertEqual(Cita.objects.count(), 500)
+        self.assertEqual(Consulta.objects.count(), 150)
+        for modelo in (Medico, Diagnostico, Tratamiento, ExamenMedico, Notificacion, HistoriaClinica):
+            self.assertTrue(modelo.objects.exists(), modelo.__name__)
+        # bulk_create no dispara señales: el comando deja los contadores al día
+        contadores = dict(ContadorEstadistica.objects.values_list('clave', 'valor'))
+        self.assertEqual(contadores['pacientes'], 50)
+        self.assertEqual(contadores['citas'], 500)
+
+    def test_misma_semilla_mismos_datos(self):
+        with transaction.atomic():
+            self.generar()
+            primera = self.huella()
+            transaction.set_rollback(True)
+        # Otro día de ejecución no cambia nada: las fechas salen de --fecha-base
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(days=40)):
+            self.generar()
+        self.assertEqual(self.huella(), primera)
+
+    def test_fecha_base(self):
+        self.generar(fecha_base=date(2031, 6, 1))
+        self.assertLessEqual(max(Consulta.objects.values_list('fecha', flat=True)), date(2031, 6, 1))
+        self.assertTrue(Consulta.objects.filter(fecha__gt=date(2030, 1, 1)).exists())
+
+    def test_no_duplica_una_semilla_ya_generada(self):
+        self.generar()
+        with self.assertRaises(CommandError):
+            self.generar()
+        self.generar(semilla=8)
+        self.assertEqual(Paciente.objects.count(), 100)
+
+
+class BusquedaPacientesTests(TestCase):
+    def setUp(self):
+        cache.clear()  # Nueva versión del índice en memoria para cada prueba
+        self.client = APIClient()
+        self.client.force_authenticate(crear_admin())
+        self.gonzalez, self.rodriguez, self.rodrigo = Paciente.objects.bulk_create([
+            Paciente(nombre='María', apellido='González Pérez', dni='V12345678',
+                     fecha_nacimiento=date(1980, 5, 1), telefono='0414-5551234'),
+            Paciente(nombre='José', apellido='Rodríguez', dni='V87654321',
+                     fecha_nacimiento=date(1975, 2, 3), telefono='0412-5559876'),
+            Paciente(nombre='Rodrigo', apellido='Suárez', dni='E5551234',
+                     fecha_nacimiento=date(1990, 8, 9)),
+        ])
+        crear_pacientes(50)
+
+    def buscar(self, texto, **params):
+        response = self.client.get('/api/pacientes/buscar/', {'q': texto, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [fila['id'] for fila in response.data]
+
+    def test_tolera_errores_de_tipeo_y_acentos(self):
+        self.assertEqual(self.buscar('gonzales')[0], self.gonzalez.id)
+        self.assertEqual(self.buscar('Rodriges')[0], self.rodriguez.id)
+        self.assertEqual(self.buscar('maria gonzalez')[0], self.gonzalez.id)
+
+    def test_prefijo_por_encima_de_coincidencia_aproximada(self):
+        # "Rodrigo" es prefijo exacto de uno y coincidencia aproximada del otro
+        self.assertEqual(self.buscar('Rodrigo')[:2], [self.rodrigo.id, self.rodriguez.id])
+
+    def test_dni_exacto_primero_y_telefono(self):
+        self.assertEqual(self.buscar('E5551234')[0], self.rodrigo.id)
+        self.assertEqual(self.buscar('5559876')[0], self.rodriguez.id)
+
+    def test_sin_resultados_y_limite(self):
+        self.assertEqual(self.buscar('xyzwq'), [])
+        self.assertEqual(len(self.buscar('Paciente', limite=5)), 5)
+
+    def test_indice_se_actualiza_al_guardar_y_eliminar(self):
+        self.buscar('gonzalez')  # Construye el índice
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo = Paciente.objects.create(nombre='Valentina', apellido='Marcano', dni='V999',
+                                            fecha_nacimiento=date(2000, 1, 1))
+        self.assertEqual(self.buscar('marcano'), [nuevo.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo.apellido = 'Salazar'
+            nuevo.save()
+        self.assertEqual(self.buscar('marcano'), [])
+        self.assertEqual(self.buscar('salazar'), [nuevo.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo.delete()
+        self.assertEqual(self.buscar('salazar'), [])
+
+    def test_cambios_de_otro_proceso_no_reconstruyen_el_indice(self):
+        self.buscar('gonzalez')
+        indice = busqueda._indice
+        # Sin índice en este proceso los cambios solo quedan registrados en el caché, como en otro worker
+        busqueda._indice = None
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                nuevo = Paciente.objects.create(nombre='Valentina', apellido='Marcano', dni='V999',
+                                                fecha_nacimiento=date(2000, 1, 1))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.rodrigo.delete()
+        finally:
+            busqueda._indice = indice
+
+        with mock.patch.object(busqueda.IndicePacientes, 'construir') as construir:
+            self.assertEqual(self.buscar('marcano'), [nuevo.id])
+            self.assertNotIn(self.rodrigo.id, self.buscar('rodrigo'))
+        construir.assert_not_called()
+
+        # Una invalidación masiva no deja cambios que aplicar: se reconstruye
+        with mock.patch.object(busqueda.IndicePacientes, 'construir', wraps=busqueda.IndicePacientes.construir) as construir:
+            busqueda.invalidar_indice_pacientes()
+            self.assertEqual(self.buscar('marcano'), [nuevo.id])
+        construir.assert_called_once()
+
+    def test_expresion_igual_a_la_del_indice(self):
+        migracion = import_module('api.migrations.0028_paciente_busqueda_sin_acentos')
+        self.assertEqual(migracion.EXPRESION, busqueda.EXPRESION_BUSQUEDA)
+
+    def test_validacion_y_permisos(self):
+        self.assertEqual(self.client.get('/api/pacientes/buscar/', {'q': 'a'}).status_code, 400)
+
+        paciente = Usuario.objects.create_user(
+            correo='paciente@clinica.com', nombre='Ana', apellido='López', password='clave123'
+        )
+        self.client.force_authenticate(paciente)
+        self.assertEqual(self.client.get('/api/pacientes/buscar/', {'q': 'gonzalez'}).status_code, 403)
+
+        self.client.force_authenticate(crear_medico().usuario)
+        self.assertEqual(self.client.get('/api/pacientes/buscar/', {'q': 'gonzalez'}).status_code, 200)
+
+
+@tag('benchmark')
+class BusquedaPacientesBenchmark(TestCase):
+    def test_busqueda_100k_pacientes(self):
+        cache.clear()
+        rng = random.Random(1)
+        Paciente.objects.bulk_create([
+            Paciente(
+                nombre=rng.choice(NOMBRES), apellido=f'{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}',
+                dni=f'V{10_000_000 + i}', telefono=f'0414-{rng.randrange(10**7):07d}',
+                fecha_nacimiento=date(1980, 1, 1),
+            )
+            for i in range(100_000)
+        ], batch_size=5000)
+        client = APIClient()
+        client.force_authenticate(crear_admin())
+
+        client.get('/api/pacientes/buscar/', {'q': 'Gonzalez'})  # Construye el índice
+
+        # Las búsquedas siguientes usan el índice ya construido
+        with mock.patch.object(busqueda.IndicePacientes, 'construir') as construir:
+            for texto in ('maria rodrigez', 'Gutierres Salasar', 'V10042424', 'Valentina Marcano Blanco'):
+                response = client.get('/api/pacientes/buscar/', {'q': texto})
+                self.assertTrue(response.data, texto)
+        construir.assert_not_called()
+
+
+class BusquedaClinicaTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        usuario_paciente = Usuario.objects.create_user(
+            correo='paciente@clinica.com', nombre='Ana', apellido='López', password='clave123'
+        )
+        self.paciente, self.otro_paciente = crear_pacientes(2)
+        self.paciente.usuario = usuario_paciente
+        self.paciente.save()
+
+        self.consulta = Consulta.objects.create(
+            paciente=self.paciente, medico=self.medico, fecha=date(2025, 3, 1),
+            motivo='Dolor de cabeza persistente desde hace dos semanas',
+        )
+        self.diagnostico = Diagnostico.objects.create(consulta=self.consulta, descripcion='Hipertensión arterial esencial')
+        self.tratamiento = Tratamiento.objects.create(
+            diagnostico=self.diagnostico, descripcion='Losartán 50 mg',
+            indicaciones='Una tableta diaria en la mañana', fecha_inicio=date(2025, 3, 1),
+        )
+        otra = Consulta.objects.create(
+            paciente=self.otro_paciente, medico=self.otro_medico, fecha=date(2025, 4, 1), motivo='Control de glicemia'
+        )
+        Diagnostico.objects.create(consulta=otra, descripcion='Diabetes mellitus tipo 2')
+        AntecedenteMedico.objects.create(
+            paciente=self.otro_paciente, alergias='Penicilina', enfermedades_cronicas='Hipertensión',
+        )
+
+    def buscar(self, usuario, **params):
+        self.client.force_authenticate(usuario)
+        return self.client.get('/api/busqueda-clinica/', params)
+
+    def resultados(self, usuario, **params):
+        response = self.buscar(usuario, **params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(fila['tipo'], fila['paciente']['id']) for fila in response.data['results']]
+
+    def test_encuentra_en_todos_los_tipos(self):
+        admin = crear_admin()
+        self.assertEqual(self.resultados(admin, q='Hipertensión'), [
+            ('antecedente', self.otro_paciente.id), ('diagnostico', self.paciente.id),
+        ])
+        self.assertEqual(self.resultados(admin, q='tableta'), [('tratamiento', self.paciente.id)])
+        self.assertEqual(self.resultados(admin, q='Penicilina'), [('antecedente', self.otro_paciente.id)])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Raíces y fragmentos solo con PostgreSQL')
+    def test_raices_en_espanol_sin_acentos_y_fragmento(self):
+        admin = crear_admin()
+        fila, = self.buscar(admin, q='dolores cabeza').data['results']
+        self.assertEqual(fila['tipo'], 'consulta')
+        self.assertIn('<b>Dolor</b>', fila['fragmento'])
+        self.assertEqual(len(self.resultados(admin, q='hipertension')), 2)
+
+    def test_alcance_por_rol(self):
+        # Cada médico solo ve a sus pacientes; el paciente solo lo suyo
+        self.assertEqual(self.resultados(self.medico.usuario, q='Hipertensión'), [('diagnostico', self.paciente.id)])
+        self.assertEqual(self.resultados(self.otro_medico.usuario, q='Hipertensión'), [('antecedente', self.otro_paciente.id)])
+        self.assertEqual(self.resultados(self.paciente.usuario, q='Diabetes'), [])
+
+        sin_perfil = Usuario.objects.create_user(correo='x@clinica.com', nombre='X', apellido='Y', password='clave123')
+        self.assertEqual(self.buscar(sin_perfil, q='Diabetes').status_code, 403)
+
+    def test_filtros_y_validacion(self):
+        admin = crear_admin()
+        self.assertEqual(self.resultados(admin, q='Hipertensión', tipo='diagnostico,tratamiento'), [('diagnostico', self.paciente.id)])
+        self.assertEqual(self.resultados(admin, q='Hipertensión', paciente_id=self.otro_paciente.id), [('antecedente', self.otro_paciente.id)])
+        self.assertEqual(self.buscar(admin, q='').status_code, 400)
+        self.assertEqual(self.buscar(admin, q='x', tipo='receta').status_code, 400)
+
+    def test_documentos_se_mantienen_al_escribir(self):
+        admin = crear_admin()
+        self.diagnostico.descripcion = 'Migraña sin aura'
+        self.diagnostico.save()
+        self.assertEqual(self.resultados(admin, q='Migraña'), [('diagnostico', self.paciente.id)])
+        self.assertEqual(self.resultados(admin, q='Hipertensión'), [('antecedente', self.otro_paciente.id)])
+
+        self.consulta.paciente = self.otro_paciente
+        self.consulta.save()
+        self.assertEqual(self.resultados(admin, q='Migraña'), [('diagnostico', self.otro_paciente.id)])
+
+        self.tratamiento.delete()
+        self.assertEqual(self.resultados(admin, q='tableta'), [])
+        consulta_id = self.consulta.id
+        self.consulta.delete()
+        self.assertFalse(DocumentoClinico.objects.filter(consulta_id=consulta_id).exists())
+
+    def test_paginacion_por_cursor(self):
+        for i in range(25):
+            Consulta.objects.create(paciente=self.paciente, medico=self.medico, fecha=date(2024, 1, 1) + timedelta(days=i),
+                                    motivo='Control de rutina')
+        self.client.force_authenticate(crear_admin())
+        primera = self.client.get('/api/busqueda-clinica/', {'q': 'rutina'}).data
+        self.assertEqual(len(primera['results']), 20)
+        segunda = self.client.get(primera['next']).data
+        self.assertEqual(len(segunda['results']), 5)
+        self.assertIsNone(segunda['next'])
+        fechas = [fila['fecha'] for fila in primera['results'] + segunda['results']]
+        self.assertEqual(fechas, sorted(fechas, reverse=True))
+
+    def test_reconstruir_tras_carga_masiva(self):
+        crear_historial(self.otro_paciente, self.otro_medico, consultas=3)  # bulk_create: sin señales
+        total = DocumentoClinico.objects.count()
+        totales = reconstruir_documentos()
+        self.assertEqual(sum(totales.values()), DocumentoClinico.objects.count())
+        self.assertEqual(DocumentoClinico.objects.count(), total + 9)
+
+
+class CalendarioCitasTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        self.usuario_paciente = Usuario.objects.create_user(
+            correo='paciente@clinica.com', nombre='Ana', apellido='López', password='clave123'
+        )
+        self.paciente, self.otro_paciente = crear_pacientes(2)
+        self.paciente.usuario = self.usuario_paciente
+        self.paciente.save()
+
+        self.lunes = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.citas = Cita.objects.bulk_create([
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=self.lunes, estado='confirmada'),
+            Cita(paciente=self.otro_paciente, medico=self.medico, fecha_hora_propuesta=self.lunes + timedelta(hours=1)),
+            Cita(paciente=self.paciente, medico=self.otro_medico, fecha_hora_propuesta=self.lunes + timedelta(days=2)),
+            # Justo en el borde final: la ventana es [inicio, fin)
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=self.lunes + timedelta(days=7)),
+        ])
+        self.ventana = {'fecha_inicio': '2030-01-07T08:00:00', 'fecha_fin': '2030-01-14T08:00:00'}
+
+    def ids(self, url, usuario, **params):
+        self.client.force_authenticate(usuario)
+        response = self.client.get(url, {**self.ventana, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [evento['id'] for evento in response.data]
+
+    def test_cada_rol_ve_su_ventana(self):
+        c = self.citas
+        self.assertEqual(self.ids('/api/citas/medico/', self.medico.usuario), [c[0].id, c[1].id])
+        self.assertEqual(self.ids('/api/citas/paciente/', self.usuario_paciente), [c[0].id, c[2].id])
+        admin = crear_admin()
+        self.assertEqual(self.ids('/api/citas/todas/', admin), [c[0].id, c[1].id, c[2].id])
+        self.assertEqual(self.ids('/api/citas/medico/', admin, medico_id=self.otro_medico.id), [c[2].id])
+        # Los nombres de FullCalendar también sirven
+        self.assertEqual(
+            self.ids('/api/citas/todas/', admin, fecha_inicio='', fecha_fin='', start='2030-01-09', end='2030-01-10'),
+            [c[2].id],
+        )
+
+    def test_formato_de_eventos(self):
+        self.client.force_authenticate(self.medico.usuario)
+        evento = self.client.get('/api/citas/medico/', self.ventana).data[0]
+        self.assertEqual(evento['title'], f'{self.paciente.nombre} {self.paciente.apellido}')
+        self.assertEqual(datetime.fromisoformat(evento['start']), self.lunes)
+        self.assertEqual(evento['backgroundColor'], '#4CAF50')
+        self.assertEqual(evento['extendedProps']['motivo'], 'Sin motivo')
+        self.assertEqual(evento['extendedProps']['medico_nombre'], 'Médico 1')
+
+        self.client.force_authenticate(self.usuario_paciente)
+        evento = self.client.get('/api/citas/paciente/', self.ventana).data[0]
+        self.assertEqual(evento['title'], 'Dr. Médico 1')
+
+    def test_ventana_obligatoria_y_acotada(self):
+        self.client.force_authenticate(crear_admin())
+        for params in ({}, {'fecha_inicio': '2030-01-07'}, {'fecha_inicio': 'ayer', 'fecha_fin': '2030-01-08'},
+                       {'fecha_inicio': '2030-01-08', 'fecha_fin': '2030-01-07'},
+                       {'fecha_inicio': '2030-01-01', 'fecha_fin': '2030-06-01'}):
+            for url in ('/api/citas/medico/', '/api/citas/todas/'):
+                self.assertEqual(self.client.get(url, params).status_code, 400, (url, params))
+        self.client.force_authenticate(self.medico.usuario)
+        self.assertEqual(self.client.get('/api/citas/todas/', self.ventana).status_code, 403)
+
+    def test_una_consulta_sin_importar_el_historial(self):
+        self.client.force_authenticate(self.medico.usuario)
+        with CaptureQueriesContext(connection) as antes:
+            self.client.get('/api/citas/medico/', self.ventana)
+        Cita.objects.bulk_create([
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=self.lunes - timedelta(days=i))
+            for i in range(1, 500)
+        ])
+        with CaptureQueriesContext(connection) as despues:
+            response = self.client.get('/api/citas/medico/', self.ventana)
+        self.assertEqual(len(despues), len(antes))
+        self.assertEqual(len(response.data), 2)
+
+
+@tag('benchmark')
+class CalendarioCitasBenchmark(TestCase):
+    def test_semana_de_un_medico_con_historial_grande(self):
+        especialidad = Especialidad.objects.create(nombre='Medicina Interna')
+        medicos = [crear_medico(n, especialidad=especialidad) for n in range(1, 21)]
+        pacientes = crear_pacientes(1000)
+        inicio = timezone.make_aware(datetime(2028, 1, 3, 8, 0))
+        Cita.objects.bulk_create([
+            Cita(paciente=pacientes[i % 1000], medico=medicos[i % 20],
+                 fecha_hora_propuesta=inicio + timedelta(minutes=30 * (i // 20)))
+            for i in range(200_000)
+        ], batch_size=5000)
+
+        client = APIClient()
+        client.force_authenticate(medicos[0].usuario)
+        for semana in (0, 14, 28):  # 10k citas por médico ≈ 30 semanas
+            desde = inicio + timedelta(weeks=semana)
+            params = {'fecha_inicio': desde.isoformat(), 'fecha_fin': (desde + timedelta(days=7)).isoformat()}
+            response = client.get('/api/citas/medico/', params)
+            self.assertEqual(len(response.data), 336)  # 7 días × 48 medias horas
+
+
+def crear_horario(medico, dias=range(5), bloques=((8, 12), (14, 18)), duracion=30):
+    return HorarioMedico.objects.bulk_create([
+        HorarioMedico(medico=medico, dia_semana=dia, hora_inicio=hora(inicio), hora_fin=hora(fin), duracion_cita=duracion)
+        for dia in dias for inicio, fin in bloques
+    ])
+
+
+class DisponibilidadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2)
+        self.paciente, = crear_pacientes(1)
+        crear_horario(self.medico, dias=[0], bloques=[(8, 12)])
+        self.lunes = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.client.force_authenticate(self.otro_medico.usuario)
+
+    def turnos(self, desde='2030-01-07', hasta='2030-01-07', medico=None):
+        response = self.client.get(f'/api/medicos/{(medico or self.medico).pk}/disponibilidad/', {'desde': desde, 'hasta': hasta})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [datetime.fromisoformat(turno['inicio']).strftime('%H:%M') for turno in response.data['turnos']]
+
+    def citar(self, hora_cita, minutos=30, estado='solicitada'):
+        h, m = map(int, hora_cita.split(':'))
+        Cita.objects.create(
+            paciente=self.paciente, medico=self.medico, estado=estado, duracion_minutos=minutos,
+            fecha_hora_propuesta=self.lunes.replace(hour=h, minute=m),
+        )
+
+    def test_horario_sin_citas(self):
+        self.assertEqual(self.turnos(), ['08:00', '08:30', '09:00', '09:30', '10:00', '10:30', '11:00', '11:30'])
+        # Martes no tiene horario; los lunes siguientes sí
+        self.assertEqual(len(self.turnos('2030-01-07', '2030-01-21')), 24)
+        self.assertEqual(self.turnos('2030-01-08', '2030-01-08'), [])
+
+    def test_citas_ocupan_su_duracion(self):
+        self.citar('09:00')
+        self.citar('10:10')  # Fuera de la rejilla: bloquea 10:00 y 10:30
+        self.citar('11:00', estado='cancelada')  # Cancelada libera el turno
+        self.citar('07:00', minutos=90)  # Empieza antes del bloque y ocupa 08:00
+        self.assertEqual(self.turnos(), ['08:30', '09:30', '11:00', '11:30'])
+
+    def test_excepciones(self):
+        ExcepcionHorario.objects.create(medico=self.medico, fecha=date(2030, 1, 7), hora_inicio=hora(11), hora_fin=hora(12))
+        self.assertEqual(self.turnos()[-1], '10:30')
+        ExcepcionHorario.objects.create(medico=self.medico, fecha=date(2030, 1, 7), motivo='Congreso')
+        self.assertEqual(self.turnos(), [])
+        self.assertEqual(len(self.turnos('2030-01-07', '2030-01-14')), 8)
+
+    def test_sin_turnos_pasados(self):
+        hoy = timezone.localdate()
+        HorarioMedico.objects.create(medico=self.otro_medico, dia_semana=hoy.weekday(), hora_inicio=hora(0), hora_fin=hora(23, 59), duracion_cita=60)
+        turnos = self.turnos(hoy.isoformat(), hoy.isoformat(), medico=self.otro_medico)
+        # Turnos de 00:00 a 22:00: solo quedan los que empiezan después de la hora actual
+        self.assertEqual(len(turnos), max(22 - timezone.localtime().hour, 0))
+
+    def test_rango_obligatorio_y_acotado(self):
+        url = f'/api/medicos/{self.medico.pk}/disponibilidad/'
+        for params in ({}, {'desde': '2030-01-07'}, {'desde': 'lunes', 'hasta': '2030-01-08'},
+                       {'desde': '2030-01-08', 'hasta': '2030-01-07'}, {'desde': '2030-01-01', 'hasta': '2030-06-01'},
+                       {'desde': '2030-02-30', 'hasta': '2030-03-01'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+            self.assertEqual(self.client.get('/api/medicos/disponibilidad/', params).status_code, 400, params)
+        self.assertEqual(self.client.get('/api/medicos/999/disponibilidad/', {'desde': '2030-01-07', 'hasta': '2030-01-07'}).status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url, {'desde': '2030-01-07', 'hasta': '2030-01-07'}).status_code, 401)
+
+    def test_resumen_de_todos_los_medicos(self):
+        self.citar('09:00')
+        response = self.client.get('/api/medicos/disponibilidad/', {'desde': '2030-01-07', 'hasta': '2030-01-14'})
+        self.assertEqual(response.status_code, 200)
+        primero, segundo = response.data
+        self.assertEqual(primero['medico'], self.medico.pk)
+        self.assertEqual(primero['total'], 15)
+        self.assertEqual(primero['por_dia'], {'2030-01-07': 7, '2030-01-14': 8})
+        self.assertEqual(datetime.fromisoformat(primero['primer_turno']), self.lunes)
+        self.assertEqual((segundo['total'], segundo['primer_turno'], segundo['por_dia']), (0, None, {}))
+
+        otra = Especialidad.objects.create(nombre='Pediatría')
+        Medico.objects.filter(pk=self.otro_medico.pk).update(especialidad=otra)
+        response = self.client.get('/api/medicos/disponibilidad/', {'desde': '2030-01-07', 'hasta': '2030-01-07', 'especialidad': otra.pk})
+        self.assertEqual([fila['medico'] for fila in response.data], [self.otro_medico.pk])
+
+    def test_consultas_constantes_con_muchos_medicos(self):
+        params = {'desde': '2030-01-07', 'hasta': '2030-02-05'}
+        with CaptureQueriesContext(connection) as antes:
+            self.client.get('/api/medicos/disponibilidad/', params)
+        especialidad = self.medico.especialidad
+        for n in range(3, 13):
+            medico = crear_medico(n, especialidad=especialidad)
+            crear_horario(medico)
+            ExcepcionHorario.objects.create(medico=medico, fecha=date(2030, 1, 8))
+            Cita.objects.create(paciente=self.paciente, medico=medico, fecha_hora_propuesta=self.lunes)
+        with CaptureQueriesContext(connection) as despues:
+            response = self.client.get('/api/medicos/disponibilidad/', params)
+        self.assertEqual(len(despues), len(antes))
+        self.assertEqual(len(response.data), 12)
+
+    def test_editar_horario_y_excepciones(self):
+        url = f'/api/medicos/{self.medico.pk}/horario/'
+        bloques = [
+            {'dia_semana': 1, 'hora_inicio': '14:00', 'hora_fin': '16:00', 'duracion_cita': 60},
+            {'dia_semana': 1, 'hora_inicio': '08:00', 'hora_fin': '10:00', 'duracion_cita': 20},
+        ]
+        self.assertEqual(self.client.put(url, bloques, format='json').status_code, 403)
+
+        self.client.force_authenticate(self.medico.usuario)
+        response = self.client.put(url, bloques, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([b['hora_inicio'] for b in response.data], ['08:00:00', '14:00:00'])
+        self.assertEqual(self.turnos('2030-01-07', '2030-01-08'), ['08:00', '08:20', '08:40', '09:00', '09:20', '09:40', '14:00', '15:00'])
+
+        solapados = bloques + [{'dia_semana': 1, 'hora_inicio': '09:00', 'hora_fin': '11:00'}]
+        self.assertEqual(self.client.put(url, solapados, format='json').status_code, 400)
+        invertido = [{'dia_semana': 2, 'hora_inicio': '11:00', 'hora_fin': '09:00'}]
+        self.assertEqual(self.client.put(url, invertido, format='json').status_code, 400)
+        self.assertEqual(HorarioMedico.objects.filter(medico=self.medico).count(), 2)
+
+        url = f'/api/medicos/{self.medico.pk}/excepciones/'
+        manana = timezone.localdate() + timedelta(days=1)
+        self.assertEqual(self.client.post(url, {'fecha': manana, 'hora_inicio': '08:00'}).status_code, 400)
+        response = self.client.post(url, {'fecha': manana, 'motivo': 'Vacaciones'})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([e['motivo'] for e in self.client.get(url).data], ['Vacaciones'])
+
+
+@tag('benchmark')
+class DisponibilidadBenchmark(TestCase):
+    def test_mes_de_trescientos_medicos(self):
+        especialidad = Especialidad.objects.create(nombre='Medicina Interna')
+        usuarios = Usuario.objects.bulk_create([
+            Usuario(correo=f'medico{n}@clinica.com', nombre='Médico', apellido=str(n)) for n in range(300)
+        ])
+        medicos = Medico.objects.bulk_create([
+            Medico(usuario=usuario, nombre='Médico', apellido=str(n), dni=f'M{n}', especialidad=especialidad)
+            for n, usuario in enumerate(usuarios)
+        ])
+        HorarioMedico.objects.bulk_create([
+            HorarioMedico(medico=medico, dia_semana=dia, hora_inicio=hora(inicio), hora_fin=hora(fin))
+            for medico in medicos for dia in range(5) for inicio, fin in ((8, 12), (14, 18))
+        ])
+        paciente, = crear_pacientes(1)
+        lunes = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        # La mitad de los turnos de cada mañana de lunes a viernes, durante cuatro semanas
+        Cita.objects.bulk_create([
+            Cita(paciente=paciente, medico=medico, fecha_hora_propuesta=lunes + timedelta(days=dia, minutes=60 * turno))
+            for medico in medicos for dia in range(26) if dia % 7 < 5 for turno in range(4)
+        ], batch_size=5000)
+
+        client = APIClient()
+        client.force_authenticate(medicos[0].usuario)
+        params = {'desde': '2030-01-07', 'hasta': '2030-02-03'}
+        response = client.get('/api/medicos/disponibilidad/', params)
+        self.assertEqual(response.data[0]['total'], 20 * 12)  # 20 días hábiles × (16 − 4) turnos
+
+
+class CitasSinSolapesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = crear_admin()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        self.paciente, self.otro_paciente = crear_pacientes(2)
+        self.cita = Cita.objects.create(
+            paciente=self.paciente, medico=self.medico, duracion_minutos=60,
+            fecha_hora_propuesta=timezone.make_aware(datetime(2030, 1, 7, 9, 0)),
+        )
+        self.client.force_authenticate(self.admin)
+
+    def reservar(self, fecha, medico=None, url='/api/admin/citas/', **extra):
+        datos = {'paciente': self.otro_paciente.pk, 'medico': (medico or self.medico).pk, 'fecha_hora_propuesta': fecha}
+        return self.client.post(url, {**datos, **extra}, format='json')
+
+    def test_rechaza_solapes_con_409(self):
+        for fecha in ('2030-01-07T09:00:00', '2030-01-07T09:45:00', '2030-01-07T08:40:00'):
+            response = self.reservar(fecha)
+            self.assertEqual(response.status_code, 409, fecha)
+            self.assertEqual(response.data['cita_en_conflicto'], self.cita.pk)
+            self.assertIn('07/01/2030 a las 09:00', response.data['error'])
+        response = self.reservar('2030-01-07T09:30:00', url='/api/citas/', estado='solicitada')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Cita.objects.count(), 1)
+
+    def test_turnos_contiguos_otro_medico_y_canceladas(self):
+        self.assertEqual(self.reservar('2030-01-07T10:00:00').status_code, 201)
+        self.assertEqual(self.reservar('2030-01-07T08:30:00').status_code, 201)
+        self.assertEqual(self.reservar('2030-01-07T09:00:00', medico=self.otro_medico).status_code, 201)
+        Cita.objects.filter(pk=self.cita.pk).update(estado='cancelada')
+        self.assertEqual(self.reservar('2030-01-07T09:00:00', url='/api/citas/', estado='solicitada').status_code, 201)
+
+    def test_paciente_recibe_409(self):
+        usuario = Usuario.objects.create_user(correo='p@clinica.com', nombre='Ana', apellido='Ruiz', password='clave123')
+        Paciente.objects.filter(pk=self.otro_paciente.pk).update(usuario=usuario)
+        self.client.force_authenticate(usuario)
+        response = self.client.post('/api/paciente/citas/', {'medico': self.medico.pk, 'fecha_hora_propuesta': '2030-01-07T09:15:00'})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post('/api/paciente/citas/', {'medico': self.medico.pk, 'fecha_hora_propuesta': '2030-01-07T11:00:00'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_editar_y_reprogramar(self):
+        otra = Cita.objects.create(
+            paciente=self.otro_paciente, medico=self.medico,
+            fecha_hora_propuesta=timezone.make_aware(datetime(2030, 1, 7, 11, 0)),
+        )
+        url = f'/api/citas/{otra.pk}/'
+        response = self.client.put(url, {'fecha_hora_propuesta': '2030-01-07T09:30:00'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.put(url, {'fecha_hora_propuesta': '2030-01-07T10:00:00'}, format='json').status_code, 200)
+        # Alargar la propia cita no choca consigo misma, pero sí con la siguiente
+        url = f'/api/citas/{self.cita.pk}/'
+        self.assertEqual(self.client.put(url, {'duracion_minutos': 90}, format='json').status_code, 409)
+        self.assertEqual(self.client.put(url, {'estado': 'cancelada'}, format='json').status_code, 200)
+        self.assertEqual(self.client.put(url, {'estado': 'solicitada'}, format='json').status_code, 200)
+
+        # Un solape previo a esta validación no impide editar el motivo ni cancelar
+        Cita.objects.filter(pk=otra.pk).update(fecha_hora_propuesta=self.cita.fecha_hora_propuesta)
+        self.assertEqual(self.client.put(url, {'motivo': 'Control'}, format='json').status_code, 200)
+        self.assertEqual(self.client.put(f'/api/citas/{otra.pk}/', {'estado': 'cancelada'}, format='json').status_code, 200)
+
+
+class SincronizacionCitasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        self.paciente, self.otro_paciente = crear_pacientes(2)
+        self.usuario_paciente = Usuario.objects.create_user(
+            correo='paciente@clinica.com', nombre='Ana', apellido='López', password='clave123'
+        )
+        Paciente.objects.filter(pk=self.paciente.pk).update(usuario=self.usuario_paciente)
+        lunes = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.citas = Cita.objects.bulk_create([
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=lunes),
+            Cita(paciente=self.otro_paciente, medico=self.medico, fecha_hora_propuesta=lunes + timedelta(hours=1)),
+            Cita(paciente=self.otro_paciente, medico=self.otro_medico, fecha_hora_propuesta=lunes),
+        ])
+        # Todo lo anterior ya estaba sincronizado hace una hora
+        Cita.objects.update(fecha_actualizacion=timezone.now() - timedelta(hours=1))
+        self.token = (timezone.now() - timedelta(minutes=30)).isoformat()
+        self.client.force_authenticate(self.medico.usuario)
+
+    def cambios(self, token=None, **params):
+        response = self.client.get('/api/citas/cambios/', {'desde': token or self.token, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [evento['id'] for evento in response.data['citas']], response.data['eliminadas']
+
+    def test_sin_cambios_no_devuelve_nada(self):
+        with self.assertNumQueries(3):  # series, citas y marcas de borrado, por índice
+            self.assertEqual(self.cambios(), ([], []))
+        response = self.client.get('/api/citas/cambios/')
+        self.assertEqual((response.data['citas'], response.data['eliminadas']), ([], []))
+        self.assertLess(datetime.fromisoformat(response.data['token']), timezone.now())
+
+    def test_altas_cambios_y_borrados(self):
+        cita = self.citas[1]
+        cita.motivo = 'Control'
+        cita.save()
+        nueva = Cita.objects.create(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=timezone.now())
+        Cita.objects.get(pk=self.citas[0].pk).delete()
+        self.assertEqual(self.cambios(), ([cita.pk, nueva.pk], [self.citas[0].pk]))
+
+        # El formato es el del feed del calendario
+        self.client.force_authenticate(self.usuario_paciente)
+        response = self.client.get('/api/citas/cambios/', {'desde': self.token})
+        self.assertEqual([evento['title'] for evento in response.data['citas']], ['Dr. Médico 1'])
+        self.assertEqual(response.data['eliminadas'], [self.citas[0].pk])
+
+    def test_cada_medico_ve_lo_suyo(self):
+        Cita.objects.get(pk=self.citas[2].pk).delete()
+        self.assertEqual(self.cambios(), ([], []))
+        admin = crear_admin()
+        self.client.force_authenticate(admin)
+        self.assertEqual(self.cambios(), ([], [self.citas[2].pk]))
+        self.assertEqual(self.cambios(medico_id=self.medico.pk), ([], []))
+        self.assertEqual(self.client.get('/api/citas/cambios/', {'desde': self.token, 'medico_id': 'x'}).status_code, 400)
+
+    def test_cita_reasignada_deja_marca_al_medico_anterior(self):
+        cita = Cita.objects.get(pk=self.citas[1].pk)
+        cita.medico = self.otro_medico
+        cita.save()
+        self.assertEqual(self.cambios(), ([], [cita.pk]))
+        self.client.force_authenticate(self.otro_medico.usuario)
+        self.assertEqual(self.cambios(), ([cita.pk], []))
+
+    def test_lote_marca_cambios(self):
+        self.client.force_authenticate(crear_admin())
+        self.client.post('/api/citas/lote/', {'ids': [self.citas[0].pk], 'estado': 'confirmada'}, format='json')
+        self.client.post('/api/citas/lote/', {'ids': [self.citas[1].pk], 'desplazar_minutos': 30}, format='json')
+        self.assertEqual(self.cambios(medico_id=self.medico.pk), ([self.citas[0].pk, self.citas[1].pk], []))
+
+    def test_token_invalido_o_vencido(self):
+        self.assertEqual(self.client.get('/api/citas/cambios/', {'desde': 'ayer'}).status_code, 400)
+        antiguo = (timezone.now() - timedelta(days=8)).isoformat()
+        self.assertEqual(self.client.get('/api/citas/cambios/', {'since': antiguo}).status_code, 410)
+        Cita.objects.bulk_create([
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=timezone.now() + timedelta(minutes=i))
+            for i in range(501)
+        ])
+        self.assertEqual(self.client.get('/api/citas/cambios/', {'desde': self.token}).status_code, 410)
+        self.client.force_authenticate(Usuario.objects.create_user(correo='x@clinica.com', nombre='X', apellido='Y', password='clave123'))
+        self.assertEqual(self.client.get('/api/citas/cambios/').status_code, 403)
+
+    def test_purga_marcas_antiguas(self):
+        vieja = CitaEliminada.objects.create(cita_id=1, medico_id=1, paciente_id=1)
+        CitaEliminada.objects.filter(pk=vieja.pk).update(fecha_eliminacion=timezone.now() - timedelta(days=30))
+        Cita.objects.get(pk=self.citas[0].pk).delete()
+        self.assertEqual(list(CitaEliminada.objects.values_list('cita_id', flat=True)), [self.citas[0].pk])
+
+
+class CalendarioIcsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.paciente, self.otro_paciente = crear_pacientes(2)
+        self.usuario_paciente = Usuario.objects.create_user(
+            correo='paciente@clinica.com', nombre='Ana', apellido='López', password='clave123'
+        )
+        Paciente.objects.filter(pk=self.paciente.pk).update(usuario=self.usuario_paciente)
+        inicio = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        self.citas = Cita.objects.bulk_create([
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=inicio, motivo='Dolor; fiebre, tos',
+                 estado='confirmada'),
+            Cita(paciente=self.otro_paciente, medico=self.medico, fecha_hora_propuesta=inicio + timedelta(hours=1),
+                 duracion_minutos=45),
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=inicio + timedelta(hours=2),
+                 estado='cancelada'),
+            Cita(paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=inicio - timedelta(days=200)),
+        ])
+        self.client.force_authenticate(self.medico.usuario)
+        self.url = self.client.get('/api/citas/suscripcion/').data['url']
+        self.client.force_authenticate(None)
+
+    def descargar(self, url=None, **cabeceras):
+        response = self.client.get(url or self.url, **cabeceras)
+        contenido = b''.join(response.streaming_content).decode() if response.status_code == 200 else ''
+        return response, contenido
+
+    def test_feed_del_medico(self):
+        response, contenido = self.descargar()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertTrue(contenido.startswith('BEGIN:VCALENDAR\r\n') and contenido.endswith('END:VCALENDAR\r\n'))
+        # Sin canceladas ni citas fuera del historial
+        self.assertEqual(contenido.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:cita-{self.citas[0].pk}@testserver', contenido)
+        self.assertIn('SUMMARY:Cita: Paciente0 Apellido0', contenido)
+        self.assertIn('DESCRIPTION:Dolor\\; fiebre\\, tos', contenido)
+        self.assertIn('STATUS:TENTATIVE', contenido)
+        fin = self.citas[1].fecha_hora_propuesta + timedelta(minutes=45)
+        self.assertIn(f"DTEND:{fin.astimezone(dt_timezone.utc):%Y%m%dT%H%M%SZ}", contenido)
+
+    def test_feed_del_paciente(self):
+        self.client.force_authenticate(self.usuario_paciente)
+        response = self.client.get('/api/citas/suscripcion/')
+        self.assertEqual(response.data['tipo'], 'paciente')
+        self.client.force_authenticate(None)
+        _, contenido = self.descargar(response.data['url'])
+        self.assertEqual(contenido.count('BEGIN:VEVENT'), 1)
+        self.assertIn('SUMMARY:Cita con Dr. Médico 1', contenido)
+        # El token del médico no abre el feed de paciente
+        self.assertEqual(self.client.get(self.url.replace('/medico/', '/paciente/')).status_code, 404)
+
+    def test_sin_cambios_responde_304_sin_leer_citas(self):
+        response, _ = self.descargar()
+        with self.assertNumQueries(4):  # suscripción y las versiones de citas, series y borrados
+            repetida = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida['ETag'], response['ETag'])
+        por_fecha = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(por_fecha.status_code, 304)
+
+        # Cambios, cancelaciones y borrados cambian la versión
+        etags = {response['ETag']}
+        for cambio in (
+            lambda: Cita.objects.get(pk=self.citas[0].pk).save(),
+            lambda: Cita.objects.filter(pk=self.citas[1].pk).update(estado='cancelada'),
+            lambda: Cita.objects.get(pk=self.citas[0].pk).delete(),
+        ):
+            cambio()
+            response, _ = self.descargar(HTTP_IF_NONE_MATCH=', '.join(etags))
+            self.assertEqual(response.status_code, 200)
+            etags.add(response['ETag'])
+
+    def test_cancelar_mueve_last_modified(self):
+        response, _ = self.descargar()
+        # La cancelación sale del feed: también quien solo envía If-Modified-Since debe recibirlo de nuevo
+        Cita.objects.filter(pk=self.citas[1].pk).update(
+            estado='cancelada', fecha_actualizacion=timezone.now() + timedelta(seconds=2),
+        )
+        por_fecha, contenido = self.descargar(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(por_fecha.status_code, 200)
+        self.assertNotIn(f'UID:cita-{self.citas[1].pk}@', contenido)
+        self.assertGreater(parse_http_date(por_fecha['Last-Modified']), parse_http_date(response['Last-Modified']))
+
+    def test_token_invalido_o_regenerado(self):
+        self.assertEqual(self.client.get('/api/citas/medico/no-existe.ics').status_code, 404)
+        self.client.force_authenticate(self.medico.usuario)
+        self.assertEqual(self.client.get('/api/citas/suscripcion/').data['url'], self.url)
+        nueva = self.client.post('/api/citas/suscripcion/').data['url']
+        self.assertNotEqual(nueva, self.url)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.descargar(nueva)[0].status_code, 200)
+        self.client.force_authenticate(crear_admin())
+        self.assertEqual(self.client.get('/api/citas/suscripcion/').status_code, 403)
+
+    def test_lineas_largas_se_pliegan_sin_partir_caracteres(self):
+        linea = _linea('DESCRIPTION', 'ñ' * 100)
+        partes = linea.split(b'\r\n ')
+        self.assertTrue(all(len(parte) <= 75 for parte in partes))
+        self.assertEqual(b''.join(partes).decode(), 'DESCRIPTION:' + 'ñ' * 100 + '\r\n')
+
+
+class SeriesCitasTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        self.paciente, self.otro_paciente = crear_pacientes(2)
+        self.usuario_paciente = Usuario.objects.create_user(
+            correo='paciente@clinica.com', nombre='Ana', apellido='López', password='clave123'
+        )
+        Paciente.objects.filter(pk=self.paciente.pk).update(usuario=self.usuario_paciente)
+        self.lunes = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        self.client.force_authenticate(self.medico.usuario)
+
+    def crear_serie(self, **datos):
+        datos = {
+            'paciente': self.paciente.pk, 'medico': self.medico.pk, 'fecha_hora_inicio': self.lunes.isoformat(),
+            'frecuencia': 'semanal', 'motivo': 'Terapia', **datos,
+        }
+        return self.client.post('/api/citas/series/', datos, format='json')
+
+    def eventos(self, ruta='/api/citas/medico/', desde='2030-01-07', hasta='2030-02-04'):
+        response = self.client.get(ruta, {'fecha_inicio': desde, 'fecha_fin': hasta})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_expansion_salta_a_la_ventana(self):
+        semanal = {
+            'fecha_hora_inicio': self.lunes, 'frecuencia': 'semanal', 'intervalo': 2, 'ocurrencias': None, 'fecha_fin': None,
+        }
+        lejos = timezone.make_aware(datetime(2045, 3, 1))
+        fechas = fechas_serie(semanal, lejos, lejos + timedelta(days=28))
+        self.assertEqual(len(fechas), 2)
+        self.assertTrue(all((fecha - self.lunes) % timedelta(weeks=2) == timedelta() for fecha in fechas))
+        self.assertTrue(all(timezone.localtime(fecha).hour == 9 for fecha in fechas))
+
+        mensual = {**semanal, 'frecuencia': 'mensual', 'intervalo': 1, 'ocurrencias': 3}
+        fechas = fechas_serie(mensual, self.lunes, self.lunes + timedelta(days=365))
+        self.assertEqual([timezone.localtime(fecha).date() for fecha in fechas], [date(2030, 1, 7), date(2030, 2, 7), date(2030, 3, 7)])
+        hasta_febrero = {**mensual, 'ocurrencias': None, 'fecha_fin': date(2030, 2, 7)}
+        self.assertEqual(len(fechas_serie(hasta_febrero, self.lunes, self.lunes + timedelta(days=365))), 2)
+
+    def test_calendarios_muestran_ocurrencias_sin_guardarlas(self):
+        response = self.crear_serie(medico=self.otro_medico.pk)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['medico'], self.medico.pk)  # El médico solo crea series propias
+        self.assertEqual(Cita.objects.count(), 0)
+
+        eventos = self.eventos()
+        self.assertEqual(len(eventos), 4)
+        self.assertTrue(all(str(evento['id']).startswith('serie-') for evento in eventos))
+        self.assertEqual(eventos[0]['extendedProps']['fecha_original'], self.lunes.isoformat())
+        self.assertEqual(eventos[0]['title'], 'Paciente0 Apellido0')
+
+        self.client.force_authenticate(self.usuario_paciente)
+        self.assertEqual(len(self.eventos('/api/citas/paciente/')), 4)
+        self.assertEqual(len(self.client.get('/api/citas/series/').data), 1)
+        self.client.force_authenticate(self.otro_medico.usuario)
+        self.assertEqual(self.eventos(), [])
+
+    def test_mover_y_cancelar_ocurrencias(self):
+        serie_id = self.crear_serie().data['id']
+        url = f'/api/citas/series/{serie_id}/ocurrencias/'
+        segunda, tercera = self.lunes + timedelta(weeks=1), self.lunes + timedelta(weeks=2)
+
+        movida = self.client.post(url, {'fecha_original': segunda.isoformat(), 'fecha_hora_propuesta': (segunda + timedelta(hours=2)).isoformat()}, format='json')
+        self.assertEqual(movida.status_code, 201, movida.data)
+        cancelada = self.client.post(url, {'fecha_original': tercera.isoformat(), 'estado': 'cancelada'}, format='json')
+        self.assertEqual(cancelada.status_code, 201, cancelada.data)
+        self.assertEqual(Cita.objects.filter(serie_id=serie_id).count(), 2)
+
+        eventos = {evento['id']: evento for evento in self.eventos()}
+        self.assertEqual(len(eventos), 4)  # dos calculadas, la movida y la cancelada
+        self.assertEqual(datetime.fromisoformat(eventos[movida.data['id']]['start']), segunda + timedelta(hours=2))
+        self.assertEqual(eventos[cancelada.data['id']]['extendedProps']['estado'], 'cancelada')
+        self.assertEqual(eventos[movida.data['id']]['extendedProps']['serie_id'], serie_id)
+
+        repetida = self.client.post(url, {'fecha_original': segunda.isoformat(), 'estado': 'cancelada'}, format='json')
+        self.assertEqual((repetida.status_code, repetida.data['cita']), (409, movida.data['id']))
+        fuera = self.client.post(url, {'fecha_original': (segunda + timedelta(hours=1)).isoformat()}, format='json')
+        self.assertEqual(fuera.status_code, 400)
+
+    def test_ocurrencias_ocupan_la_agenda(self):
+        crear_horario(self.medico, dias=[0], bloques=[(8, 12)])
+        serie_id = self.crear_serie().data['id']
+
+        turnos = self.client.get(f'/api/medicos/{self.medico.pk}/disponibilidad/', {'desde': '2030-01-14', 'hasta': '2030-01-14'})
+        self.assertNotIn((self.lunes + timedelta(weeks=1)).isoformat(), [turno['inicio'] for turno in turnos.data['turnos']])
+        self.assertEqual(len(turnos.data['turnos']), 7)
+
+        datos = {'paciente': self.otro_paciente.pk, 'medico': self.medico.pk, 'fecha_hora_propuesta': (self.lunes + timedelta(weeks=30, minutes=15)).isoformat()}
+        response = self.client.post('/api/citas/', datos, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['serie_en_conflicto'], serie_id)
+        self.assertEqual(self.crear_serie(fecha_hora_inicio=(self.lunes + timedelta(weeks=8)).isoformat(), frecuencia='mensual').status_code, 409)
+
+        # Al mover la ocurrencia el turno queda libre
+        self.client.post(f'/api/citas/series/{serie_id}/ocurrencias/', {
+            'fecha_original': (self.lunes + timedelta(weeks=30)).isoformat(),
+            'fecha_hora_propuesta': (self.lunes + timedelta(weeks=30, hours=2)).isoformat(),
+        }, format='json')
+        self.assertEqual(self.client.post('/api/citas/', datos, format='json').status_code, 201)
+
+        # El lote tampoco puede mover citas encima de una ocurrencia
+        cita = Cita.objects.create(paciente=self.otro_paciente, medico=self.medico, fecha_hora_propuesta=self.lunes - timedelta(hours=1))
+        lote = self.client.post('/api/citas/lote/', {'ids': [cita.pk], 'desplazar_minutos': 60}, format='json')
+        self.assertEqual(lote.data['resultados'][0]['resultado'], 'conflicto')
+        self.assertEqual(lote.data['resultados'][0]['serie_en_conflicto'], serie_id)
+
+    def test_validaciones(self):
+        self.assertEqual(self.crear_serie(frecuencia='mensual', fecha_hora_inicio='2030-01-31T09:00:00').status_code, 400)
+        self.assertEqual(self.crear_serie(fecha_fin='2029-12-01').status_code, 400)
+        self.assertEqual(self.crear_serie(intervalo=0).status_code, 400)
+        self.client.force_authenticate(self.usuario_paciente)
+        self.assertEqual(self.crear_serie().status_code, 403)
+
+    def test_terminar_serie(self):
+        pasado = timezone.now().replace(microsecond=0) - timedelta(weeks=3)
+        serie = SerieCita.objects.create(
+            paciente=self.paciente, medico=self.medico, fecha_hora_inicio=pasado, frecuencia='semanal',
+        )
+        self.client.force_authenticate(self.usuario_paciente)
+        self.assertEqual(self.client.delete(f'/api/citas/series/{serie.pk}/').status_code, 403)
+        self.client.force_authenticate(self.medico.usuario)
+        response = self.client.delete(f'/api/citas/series/{serie.pk}/')
+        self.assertEqual(response.status_code, 200)
+        serie.refresh_from_db()
+        self.assertEqual(serie.fecha_fin, timezone.localdate() - timedelta(days=1))
+        eventos = self.eventos(desde=(pasado - timedelta(days=1)).date().isoformat(), hasta=(pasado + timedelta(days=60)).date().isoformat())
+        self.assertEqual(len(eventos), 3)
+
+        futura = self.crear_serie().data['id']
+        self.assertEqual(self.client.delete(f'/api/citas/series/{futura}/').status_code, 200)
+        self.assertFalse(SerieCita.objects.filter(pk=futura).exists())
+
+    def test_sincronizacion_y_feed_ics(self):
+        token = (timezone.now() - timedelta(minutes=5)).isoformat()
+        serie_id = self.crear_serie().data['id']
+        self.assertEqual(self.client.get('/api/citas/cambios/', {'desde': token}).status_code, 410)
+        self.assertEqual(self.client.get('/api/citas/cambios/', {'desde': timezone.now().isoformat()}).status_code, 200)
+
+        url = self.client.get('/api/citas/suscripcion/').data['url']
+        contenido = b''.join(self.client.get(url).streaming_content).decode()
+        self.assertIn('RRULE:FREQ=WEEKLY;INTERVAL=1\r\n', contenido)
+        self.assertIn('DTSTART;TZID=America/Caracas:20300107T090000', contenido)
+        self.assertNotIn('EXDATE', contenido)
+        # RFC 5545: cada TZID usado tiene su VTIMEZONE
+        self.assertIn(
+            'BEGIN:VTIMEZONE\r\nTZID:America/Caracas\r\nBEGIN:STANDARD\r\nDTSTART:19700101T000000\r\n'
+            'TZOFFSETFROM:-0400\r\nTZOFFSETTO:-0400\r\n', contenido,
+        )
+        self.assertLess(contenido.index('END:VTIMEZONE'), contenido.index('BEGIN:VEVENT'))
+
+        self.client.post(f'/api/citas/series/{serie_id}/ocurrencias/', {
+            'fecha_original': self.lunes.isoformat(), 'estado': 'cancelada',
+        }, format='json')
+        contenido = b''.join(self.client.get(url).streaming_content).decode()
+        self.assertIn('EXDATE;TZID=America/Caracas:20300107T090000', contenido)
+
+
+class VtimezoneTests(SimpleTestCase):
+    def test_reglas_de_horario_de_verano(self):
+        contenido = vtimezone('Europe/Madrid', 2030).decode()
+        self.assertIn(
+            'BEGIN:DAYLIGHT\r\nDTSTART:19700329T020000\r\nRRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU\r\n'
+            'TZOFFSETFROM:+0100\r\nTZOFFSETTO:+0200\r\nTZNAME:CEST\r\nEND:DAYLIGHT', contenido,
+        )
+        self.assertIn('BYMONTH=10;BYDAY=-1SU\r\nTZOFFSETFROM:+0200\r\nTZOFFSETTO:+0100', contenido)
+        self.assertIn('RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=2SU', vtimezone('America/New_York', 2030).decode())
+
+
+class CitasLoteTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = crear_admin()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        self.pacientes = crear_pacientes(12)
+        inicio = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        self.citas = Cita.objects.bulk_create([
+            Cita(paciente=self.pacientes[i], medico=self.medico, fecha_hora_propuesta=inicio + timedelta(minutes=30 * i))
+            for i in range(10)
+        ] + [
+            Cita(paciente=self.pacientes[10 + i], medico=self.otro_medico, fecha_hora_propuesta=inicio + timedelta(hours=i))
+            for i in range(2)
+        ])
+        recalcular_contadores()
+        self.client.force_authenticate(self.admin)
+
+    def lote(self, ids, **datos):
+        # Los contadores se ajustan al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/citas/lote/', {'ids': ids, **datos}, format='json')
+
+    def resultados(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        return {r['id']: r['resultado'] for r in response.data['resultados']}
+
+    def assertContadoresAlDia(self):
+        contadores = dict(ContadorEstadistica.objects.values_list('clave', 'valor'))
+        recalcular_contadores()
+        self.assertEqual(contadores, dict(ContadorEstadistica.objects.values_list('clave', 'valor')))
+
+    def test_confirmar_agenda_del_dia(self):
+        ids = [cita.id for cita in self.citas]
+        Cita.objects.filter(pk=ids[0]).update(estado='confirmada')
+        recalcular_contadores()
+        response = self.lote(ids + [ids[1], 999_999], estado='confirmada')
+        self.assertEqual(response.data['actualizadas'], 11)
+        self.assertEqual([r['id'] for r in response.data['resultados']], ids + [999_999])
+        resultados = self.resultados(response)
+        self.assertEqual((resultados[ids[0]], resultados[999_999]), ('sin_cambios', 'no_encontrada'))
+        self.assertEqual(Cita.objects.filter(estado='confirmada').count(), 12)
+        self.assertContadoresAlDia()
+
+        self.lote(ids[:4], estado='cancelada')
+        self.assertEqual(Cita.objects.filter(estado='cancelada').count(), 4)
+        self.assertContadoresAlDia()
+
+    def test_consultas_constantes(self):
+        ids = [cita.id for cita in self.citas]
+        with CaptureQueriesContext(connection) as pocas:
+            self.lote(ids[:2], estado='confirmada')
+        with CaptureQueriesContext(connection) as muchas:
+            self.lote(ids[2:], estado='confirmada')
+        self.assertEqual(len(muchas), len(pocas))
+        with CaptureQueriesContext(connection) as pocas:
+            self.lote(ids[:2], desplazar_minutos=24 * 60)
+        with CaptureQueriesContext(connection) as muchas:
+            self.lote(ids[2:], desplazar_minutos=24 * 60)
+        self.assertEqual(len(muchas), len(pocas))
+
+    def test_permisos_por_cita(self):
+        propias = [cita.id for cita in self.citas if cita.medico_id == self.otro_medico.pk]
+        ajena = self.citas[0].id
+        self.client.force_authenticate(self.otro_medico.usuario)
+        resultados = self.resultados(self.lote(propias + [ajena], estado='confirmada'))
+        self.assertEqual(resultados, {propias[0]: 'actualizada', propias[1]: 'actualizada', ajena: 'sin_permiso'})
+        self.assertEqual(Cita.objects.get(pk=ajena).estado, 'solicitada')
+
+        usuario = Usuario.objects.create_user(correo='p@clinica.com', nombre='Ana', apellido='Ruiz', password='clave123')
+        Paciente.objects.filter(pk=self.pacientes[0].pk).update(usuario=usuario)
+        self.client.force_authenticate(usuario)
+        resultados = self.resultados(self.lote([self.citas[0].id, self.citas[1].id], estado='cancelada'))
+        self.assertEqual(list(resultados.values()), ['actualizada', 'sin_permiso'])
+
+    def test_reprogramar_en_bloque_sin_solapes(self):
+        ids = [cita.id for cita in self.citas[:10]]
+        # Toda la mañana media hora más tarde: las citas del lote no chocan entre sí
+        self.assertEqual(self.lote(ids, desplazar_minutos=30).data['actualizadas'], 10)
+        horas = list(Cita.objects.filter(pk__in=ids).order_by('fecha_hora_propuesta').values_list('fecha_hora_propuesta', flat=True))
+        self.assertEqual(timezone.localtime(horas[0]).strftime('%H:%M'), '08:30')
+
+        # 08:30 y 09:00 → 09:00 y 09:30, pero 09:30 sigue ocupada: la segunda choca,
+        # se queda en 09:00 y entonces la primera también choca.
+        resultados = self.resultados(self.lote(ids[:2], desplazar_minutos=30))
+        self.assertEqual(list(resultados.values()), ['conflicto', 'conflicto'])
+        response = self.lote(ids[1:2], desplazar_minutos=30)
+        self.assertEqual(response.data['resultados'][0]['cita_en_conflicto'], ids[2])
+        self.assertIn('a las 09:30', response.data['resultados'][0]['error'])
+
+        # Otro médico libre a esa hora no cuenta; una cancelada tampoco
+        Cita.objects.filter(pk=ids[2]).update(estado='cancelada')
+        self.assertEqual(self.resultados(self.lote(ids[1:2], desplazar_minutos=30)), {ids[1]: 'actualizada'})
+
+    def test_reactivar_cancelada_en_horario_ocupado(self):
+        cancelada = Cita.objects.create(
+            paciente=self.pacientes[0], medico=self.medico, estado='cancelada',
+            fecha_hora_propuesta=self.citas[0].fecha_hora_propuesta,
+        )
+        recalcular_contadores()
+        resultados = self.resultados(self.lote([cancelada.id, self.citas[1].id], estado='confirmada'))
+        self.assertEqual(resultados, {cancelada.id: 'conflicto', self.citas[1].id: 'actualizada'})
+        self.assertContadoresAlDia()
+
+    def test_validacion(self):
+        for datos in ({}, {'ids': []}, {'ids': [1]}, {'ids': [1], 'estado': 'confirmada', 'desplazar_minutos': 30},
+                      {'ids': [1], 'estado': 'perdida'}, {'ids': ['1'], 'estado': 'confirmada'},
+                      {'ids': [1], 'desplazar_minutos': 0}, {'ids': [1], 'desplazar_minutos': '30'},
+                      {'ids': list(range(201)), 'estado': 'confirmada'}):
+            self.assertEqual(self.client.post('/api/citas/lote/', datos, format='json').status_code, 400, datos)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.lote([1], estado='confirmada').status_code, 401)
+
+
+class RecordatoriosTests(TestCase):
+    def setUp(self):
+        self.medico = crear_medico(1)
+        self.paciente, self.sin_usuario = crear_pacientes(2)
+        self.usuario_paciente = Usuario.objects.create_user(
+            correo='paciente@clinica.com', nombre='Ana', apellido='López', password='clave123'
+        )
+        Paciente.objects.filter(pk=self.paciente.pk).update(usuario=self.usuario_paciente)
+        self.ahora = timezone.now().replace(microsecond=0)
+
+    def citar(self, horas, estado='confirmada', paciente=None):
+        return Cita.objects.create(
+            paciente=paciente or self.paciente, medico=self.medico, estado=estado,
+            fecha_hora_propuesta=self.ahora + timedelta(hours=horas),
+        )
+
+    def avisos(self):
+        return list(
+            Notificacion.objects.filter(usuario=self.usuario_paciente).order_by('id').values_list('metadata', flat=True)
+        )
+
+    def test_cada_tramo_una_sola_vez(self):
+        cercana, manana = self.citar(1), self.citar(5)
+        self.citar(30)
+        self.citar(3, estado='solicitada')
+        self.citar(-1)
+        self.citar(4, paciente=self.sin_usuario)
+
+        self.assertEqual(enviar_recordatorios(self.ahora), {2: 1, 24: 2})
+        self.assertEqual(self.avisos(), [
+            {'cita_id': cercana.pk, 'recordatorio': '2h'},
+            {'cita_id': manana.pk, 'recordatorio': '24h'},
+        ])
+        self.assertEqual(enviar_recordatorios(self.ahora), {2: 0, 24: 0})
+
+        # Cuatro horas después la de las 5 h (y la del paciente sin usuario) entran en el tramo de 2 h
+        self.assertEqual(enviar_recordatorios(self.ahora + timedelta(hours=4)), {2: 2, 24: 0})
+        self.assertEqual(self.avisos()[-1], {'cita_id': manana.pk, 'recordatorio': '2h'})
+        self.assertIn('Dr. Médico 1', Notificacion.objects.latest('id').mensaje)
+
+    def test_reprogramar_reinicia_los_recordatorios(self):
+        cita = self.citar(5)
+        enviar_recordatorios(self.ahora)
+        cita.fecha_hora_propuesta += timedelta(days=3)
+        cita.save()
+        self.assertIsNone(Cita.objects.get(pk=cita.pk).recordatorio_enviado)
+
+        cita.fecha_hora_propuesta -= timedelta(days=3)
+        cita.save()
+        enviar_recordatorios(self.ahora)
+        cliente = APIClient()
+        cliente.force_authenticate(crear_admin())
+        response = cliente.post('/api/citas/lote/', {'ids': [cita.pk], 'desplazar_minutos': 60}, format='json')
+        self.assertEqual(response.data['resultados'][0]['resultado'], 'actualizada', response.data)
+        self.assertIsNone(Cita.objects.get(pk=cita.pk).recordatorio_enviado)
+
+    def test_ocurrencias_de_series(self):
+        serie = SerieCita.objects.create(
+            paciente=self.paciente, medico=self.medico, fecha_hora_inicio=self.ahora + timedelta(hours=5),
+            frecuencia='semanal',
+        )
+        # Una ocurrencia cancelada es una Cita: ni ella ni la virtual reciben aviso
+        cancelada = SerieCita.objects.create(
+            paciente=self.paciente, medico=self.medico, fecha_hora_inicio=self.ahora + timedelta(hours=6),
+            frecuencia='semanal', ocurrencias=1,
+        )
+        Cita.objects.create(
+            paciente=self.paciente, medico=self.medico, estado='cancelada', serie=cancelada,
+            fecha_original=cancelada.fecha_hora_inicio, fecha_hora_propuesta=cancelada.fecha_hora_inicio,
+        )
+        SerieCita.objects.create(
+            paciente=self.paciente, medico=self.medico, fecha_hora_inicio=self.ahora + timedelta(hours=7),
+            frecuencia='semanal', estado='solicitada',
+        )
+
+        self.assertEqual(enviar_recordatorios(self.ahora), {2: 0, 24: 1})
+        primera = timezone.localtime(serie.fecha_hora_inicio).isoformat()
+        self.assertEqual(self.avisos(), [{'serie_id': serie.id, 'fecha_original': primera, 'recordatorio': '24h'}])
+        self.assertEqual(enviar_recordatorios(self.ahora), {2: 0, 24: 0})
+        self.assertEqual(enviar_recordatorios(self.ahora + timedelta(hours=4)), {2: 1, 24: 0})
+        self.assertEqual(self.avisos()[-1], {'serie_id': serie.id, 'fecha_original': primera, 'recordatorio': '2h'})
+
+        # La semana siguiente avisa la próxima ocurrencia y olvida la anotación de la pasada
+        self.assertEqual(enviar_recordatorios(self.ahora + timedelta(weeks=1)), {2: 0, 24: 1})
+        self.assertEqual(
+            list(RecordatorioSerie.objects.values_list('fecha_original', 'enviado')),
+            [(serie.fecha_hora_inicio + timedelta(weeks=1), 24)],
+        )
+
+        # Si se edita sin moverla, la ocurrencia guardada como Cita conserva el recordatorio
+        cliente = APIClient()
+        cliente.force_authenticate(self.medico.usuario)
+        response = cliente.post(f'/api/citas/series/{serie.id}/ocurrencias/', {
+            'fecha_original': (serie.fecha_hora_inicio + timedelta(weeks=1)).isoformat(), 'motivo': 'Control',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Cita.objects.get(pk=response.data['id']).recordatorio_enviado, 24)
+        self.assertEqual(enviar_recordatorios(self.ahora + timedelta(weeks=1)), {2: 0, 24: 0})
+
+    def test_lotes_acotados(self):
+        for hora_cita in range(1, 8):
+            self.citar(hora_cita)
+        # Limpieza de anotaciones de series pasadas y, por tramo, la búsqueda de
+        # series con su savepoint. Tramo de 2 h: 2 citas en un lote. Tramo de
+        # 24 h: 5 citas en lotes de 2 (3 llenos y uno vacío). Cada lote: SELECT,
+        # INSERT y UPDATE con su savepoint
+        with self.assertNumQueries(1 + 2 * 3 + 2 + 3 * 5 + 2 + 2 * 2):
+            self.assertEqual(enviar_recordatorios(self.ahora, tamano=2), {2: 2, 24: 5})
+        self.assertEqual(Notificacion.objects.filter(titulo='Recordatorio de cita').count(), 7)
+
+    def test_comando(self):
+        self.citar(1)
+        salida = StringIO()
+        call_command('enviar_recordatorios', lote=10, stdout=salida)
+        self.assertIn('2 h: 1', salida.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('enviar_recordatorios', lote=0, stdout=StringIO())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Plan de consulta de PostgreSQL')
+    def test_usa_el_indice_parcial_de_pendientes(self):
+        # Muchas citas próximas sin confirmar o ya avisadas: el índice parcial no las contiene
+        Cita.objects.bulk_create([
+            Cita(paciente=self.paciente, medico=self.medico, estado=estado, recordatorio_enviado=enviado,
+                 fecha_hora_propuesta=self.ahora + timedelta(minutes=minuto))
+            for minuto in range(0, 24 * 60, 1)
+            for estado, enviado in (('solicitada', None), ('confirmada', 2))
+        ])
+        self.citar(1)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_cita')
+        for horas in ANTICIPACIONES:
+            consulta = Cita.objects.filter(
+                estado='confirmada', fecha_hora_propuesta__gte=self.ahora,
+                fecha_hora_propuesta__lte=self.ahora + timedelta(hours=horas),
+            ).filter(
+                Q(recordatorio_enviado__isnull=True) | Q(recordatorio_enviado__gt=horas)
+            ).order_by('fecha_hora_propuesta', 'id')
+            self.assertIn('cita_recordatorio_idx', consulta.explain())
+
+
+class ListaEsperaTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.titular, self.normal, self.urgente, self.tercero = crear_pacientes(4)
+        for paciente in (self.normal, self.urgente, self.tercero):
+            paciente.usuario = Usuario.objects.create_user(
+                correo=f'{paciente.dni}@clinica.com', nombre=paciente.nombre, apellido=paciente.apellido, password='clave123'
+            )
+            paciente.save()
+        self.fecha = timezone.now().replace(microsecond=0) + timedelta(days=2)
+        self.cita = Cita.objects.create(
+            paciente=self.titular, medico=self.medico, fecha_hora_propuesta=self.fecha, estado='confirmada',
+            duracion_minutos=45,
+        )
+        self.espera_normal = EsperaCita.objects.create(paciente=self.normal, medico=self.medico)
+        self.espera_urgente = EsperaCita.objects.create(paciente=self.urgente, medico=self.medico, prioridad=1)
+        self.espera_tercero = EsperaCita.objects.create(paciente=self.tercero, medico=self.medico)
+
+    def cancelar(self):
+        self.client.force_authenticate(self.medico.usuario)
+        response = self.client.put(f'/api/citas/{self.cita.pk}/', {'estado': 'cancelada'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def oferta(self, espera):
+        espera.refresh_from_db()
+        return espera.estado, espera.cita
+
+    def test_cancelar_ofrece_el_turno_por_prioridad_y_antiguedad(self):
+        self.cancelar()
+        estado, reserva = self.oferta(self.espera_urgente)
+        self.assertEqual(estado, 'ofrecida')
+        self.assertEqual(
+            (reserva.paciente_id, reserva.fecha_hora_propuesta, reserva.duracion_minutos, reserva.estado),
+            (self.urgente.pk, self.fecha, 45, 'solicitada'),
+        )
+        self.assertEqual(self.oferta(self.espera_normal), ('esperando', None))
+        aviso = Notificacion.objects.get(usuario=self.urgente.usuario)
+        self.assertEqual(aviso.metadata, {'cita_id': reserva.pk, 'espera_id': self.espera_urgente.pk})
+
+        # Rechazar pasa el turno al más antiguo de prioridad normal
+        self.client.force_authenticate(self.urgente.usuario)
+        response = self.client.post(f'/api/citas/espera/{self.espera_urgente.pk}/responder/', {'aceptar': False}, format='json')
+        self.assertEqual(response.data['estado'], 'rechazada')
+        self.assertEqual(Cita.objects.get(pk=reserva.pk).estado, 'cancelada')
+        estado, reserva = self.oferta(self.espera_normal)
+        self.assertEqual((estado, reserva.paciente_id), ('ofrecida', self.normal.pk))
+
+        self.client.force_authenticate(self.normal.usuario)
+        response = self.client.post(f'/api/citas/espera/{self.espera_normal.pk}/responder/', {'aceptar': True}, format='json')
+        self.assertEqual(response.data['estado'], 'aceptada')
+        self.assertEqual(Cita.objects.get(pk=reserva.pk).estado, 'confirmada')
+        self.assertEqual(self.oferta(self.espera_tercero), ('esperando', None))
+
+    def test_oferta_vencida_pasa_al_siguiente(self):
+        self.cancelar()
+        self.espera_urgente.refresh_from_db()
+        self.assertLessEqual(self.espera_urgente.oferta_expira, timezone.now() + timedelta(hours=2))
+
+        self.assertEqual(vencer_ofertas(), 0)
+        self.assertEqual(vencer_ofertas(timezone.now() + timedelta(hours=3)), 1)
+        self.assertEqual(self.oferta(self.espera_urgente)[0], 'vencida')
+        self.assertEqual(self.oferta(self.espera_normal)[0], 'ofrecida')
+
+        # Responder fuera de plazo también la vence
+        EsperaCita.objects.filter(pk=self.espera_normal.pk).update(oferta_expira=timezone.now() - timedelta(minutes=1))
+        self.client.force_authenticate(self.normal.usuario)
+        response = self.client.post(f'/api/citas/espera/{self.espera_normal.pk}/responder/', {'aceptar': True}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.oferta(self.espera_tercero)[0], 'ofrecida')
+
+    def test_vencer_y_aceptar_a_la_vez(self):
+        self.cancelar()
+        leida_por_el_vencimiento = EsperaCita.objects.get(pk=self.espera_urgente.pk)
+        self.assertEqual(cerrar_oferta(EsperaCita.objects.get(pk=self.espera_urgente.pk), 'aceptada'), 'aceptada')
+        # El vencimiento llega con la oferta ya leída como 'ofrecida': no la cierra ni cancela la cita
+        self.assertIsNone(cerrar_oferta(leida_por_el_vencimiento, 'vencida'))
+        estado, reserva = self.oferta(self.espera_urgente)
+        self.assertEqual((estado, reserva.estado), ('aceptada', 'confirmada'))
+        self.assertEqual(self.oferta(self.espera_normal), ('esperando', None))
+
+        # Confirmada por otra vía antes de vencer: la oferta cuenta como aceptada
+        reserva.estado = 'cancelada'
+        reserva.save()
+        estado, otra = self.oferta(self.espera_normal)
+        Cita.objects.filter(pk=otra.pk).update(estado='confirmada')
+        self.assertEqual(vencer_ofertas(timezone.now() + timedelta(hours=3)), 0)
+        self.assertEqual(self.oferta(self.espera_normal), ('aceptada', Cita.objects.get(pk=otra.pk)))
+        self.assertEqual(Cita.objects.get(pk=otra.pk).estado, 'confirmada')
+
+    def test_retirarse_y_cancelar_en_lote(self):
+        self.client.force_authenticate(self.urgente.usuario)
+        self.assertEqual(self.client.delete(f'/api/citas/espera/{self.espera_urgente.pk}/').status_code, 200)
+        self.assertEqual(self.oferta(self.espera_urgente)[0], 'retirada')
+
+        self.client.force_authenticate(crear_admin())
+        response = self.client.post('/api/citas/lote/', {'ids': [self.cita.pk], 'estado': 'cancelada'}, format='json')
+        self.assertEqual(response.data['actualizadas'], 1)
+        self.assertEqual(self.oferta(self.espera_normal)[0], 'ofrecida')
+
+    def test_turnos_pasados_o_inminentes_no_se_ofrecen(self):
+        self.cita.fecha_hora_propuesta = timezone.now() + timedelta(minutes=10)
+        self.cita.save()
+        self.cancelar()
+        self.assertFalse(EsperaCita.objects.filter(estado='ofrecida').exists())
+
+    def test_apuntarse(self):
+        self.client.force_authenticate(self.normal.usuario)
+        response = self.client.get('/api/citas/espera/')
+        self.assertEqual([espera['id'] for espera in response.data], [self.espera_normal.pk])
+
+        otro = crear_medico(2, especialidad=self.medico.especialidad)
+        response = self.client.post('/api/citas/espera/', {'medico': otro.pk, 'prioridad': 1}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['paciente'], response.data['prioridad']), (self.normal.pk, 3))
+        response = self.client.post('/api/citas/espera/', {'medico': otro.pk}, format='json')
+        self.assertEqual(response.status_code, 409)
+
+        # El médico ve su cola en orden
+        self.client.force_authenticate(self.medico.usuario)
+        response = self.client.get('/api/citas/espera/')
+        self.assertEqual(
+            [espera['id'] for espera in response.data],
+            [self.espera_urgente.pk, self.espera_normal.pk, self.espera_tercero.pk],
+        )
+
+    def test_coste_independiente_del_tamano_de_la_cola(self):
+        pacientes = crear_pacientes(300, inicio=10)
+        EsperaCita.objects.bulk_create([EsperaCita(paciente=paciente, medico=self.medico) for paciente in pacientes])
+        Cita.objects.filter(pk=self.cita.pk).update(estado='cancelada')
+        # Cola, bloqueo del médico, agenda (citas y series), INSERT de la cita con
+        # sus contadores y resumen, UPDATE de la oferta, notificación y los savepoints
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(ofrecer_turno(self.cita), self.espera_urgente)
+        self.assertLess(len(consultas), 20)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE api_esperacita')
+            cola = EsperaCita.objects.filter(medico=self.medico, estado='esperando').order_by('prioridad', 'fecha_solicitud', 'id')[:1]
+            self.assertIn('espera_cola_idx', cola.explain())
+
+
+class ResumenAgendaTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        self.pacientes = crear_pacientes(3)
+        self.lunes = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+
+    def citar(self, horas, estado='confirmada', medico=None):
+        return Cita.objects.create(
+            paciente=self.pacientes[0], medico=medico or self.medico, estado=estado,
+            fecha_hora_propuesta=self.lunes + timedelta(hours=horas),
+        )
+
+    def filas(self):
+        return set(ResumenAgenda.objects.values_list('medico_id', 'fecha', 'estado', 'total', 'primera', 'ultima'))
+
+    def assertResumenAlDia(self):
+        incremental = self.filas()
+        recalcular_resumen_agenda()
+        self.assertEqual(incremental, self.filas())
+
+    def resumen(self, usuario, **params):
+        self.client.force_authenticate(usuario)
+        return self.client.get('/api/citas/resumen/', {'desde': '2030-01-01', 'hasta': '2030-12-31', **params})
+
+    def test_se_mantiene_al_guardar_y_eliminar(self):
+        primera, segunda = self.citar(0), self.citar(2)
+        self.citar(15, estado='solicitada')  # 23:00 del lunes, hora de la clínica
+        self.citar(16)  # ya es martes
+        self.citar(1, medico=self.otro_medico)
+        self.assertEqual(
+            ResumenAgenda.objects.values_list('total', 'primera', 'ultima').get(
+                medico=self.medico, fecha=date(2030, 1, 7), estado='confirmada'
+            ),
+            (2, primera.fecha_hora_propuesta, segunda.fecha_hora_propuesta),
+        )
+        self.assertResumenAlDia()
+
+        primera.estado = 'cancelada'
+        primera.save()
+        segunda.fecha_hora_propuesta += timedelta(days=1)
+        segunda.save()
+        self.assertFalse(ResumenAgenda.objects.filter(medico=self.medico, fecha=date(2030, 1, 7), estado='confirmada').exists())
+        self.assertResumenAlDia()
+
+        segunda.delete()
+        Cita.objects.only('id').get(pk=primera.pk).save()  # campos diferidos
+        self.assertResumenAlDia()
+
+    def test_lotes_de_citas(self):
+        citas = [self.citar(hora) for hora in range(4)] + [self.citar(1, medico=self.otro_medico)]
+        self.client.force_authenticate(crear_admin())
+        ids = [cita.pk for cita in citas]
+        self.client.post('/api/citas/lote/', {'ids': ids, 'estado': 'completada'}, format='json')
+        self.assertResumenAlDia()
+        self.client.post('/api/citas/lote/', {'ids': ids[:2], 'desplazar_minutos': 60 * 24}, format='json')
+        self.assertResumenAlDia()
+        self.client.post('/api/citas/lote/', {'ids': ids[2:], 'desplazar_minutos': 30}, format='json')
+        self.assertResumenAlDia()
+
+    def test_endpoint(self):
+        self.citar(0)
+        self.citar(3, estado='cancelada')
+        self.citar(15, estado='solicitada')
+        self.citar(24 * 40)
+        self.citar(1, medico=self.otro_medico)
+
+        with self.assertNumQueries(1):  # solo ResumenAgenda, sin importar cuántas citas haya
+            response = self.resumen(self.medico.usuario)
+        lunes = response.data['periodos'][0]
+        self.assertEqual(lunes['fecha'], '2030-01-07')
+        self.assertEqual((lunes['total'], lunes['por_estado']), (3, {'cancelada': 1, 'confirmada': 1, 'solicitada': 1}))
+        self.assertEqual(
+            (parse_datetime(lunes['primera']), parse_datetime(lunes['ultima'])),
+            (self.lunes, self.lunes + timedelta(hours=15)),
+        )
+        self.assertEqual(len(response.data['periodos']), 2)
+
+        response = self.resumen(crear_admin(), agrupar='mes')
+        self.assertEqual(
+            [(periodo['fecha'], periodo['total']) for periodo in response.data['periodos']],
+            [('2030-01-01', 4), ('2030-02-01', 1)],
+        )
+        self.assertEqual(self.resumen(self.medico.usuario, hasta='2031-06-01').status_code, 400)
+        self.assertEqual(self.resumen(self.medico.usuario, agrupar='semana').status_code, 400)
+
+        paciente = Usuario.objects.create_user(correo='p@clinica.com', nombre='P', apellido='Q', password='clave123')
+        self.assertEqual(self.resumen(paciente).status_code, 403)
+
+    def test_comando_recalcula(self):
+        Cita.objects.bulk_create([
+            Cita(paciente=self.pacientes[0], medico=self.medico, fecha_hora_propuesta=self.lunes + timedelta(days=dia))
+            for dia in range(3)
+        ])
+        salida = StringIO()
+        call_command('recalcular_estadisticas', stdout=salida)
+        self.assertIn('resumen_agenda: 3 filas', salida.getvalue())
+
+
+class VersionesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = crear_admin()
+        self.medico = crear_medico(1)
+        self.paciente = crear_pacientes(1)[0]
+        self.cita = Cita.objects.create(
+            paciente=self.paciente, medico=self.medico, fecha_hora_propuesta=timezone.make_aware(datetime(2030, 1, 7, 8, 0)),
+        )
+        self.examen = ExamenMedico.objects.create(
+            paciente=self.paciente, medico=self.medico, tipo_examen=TipoExamen.objects.create(nombre='Glicemia'),
+        )
+        self.client.force_authenticate(self.admin)
+
+    def editar_cita(self, datos, version=None):
+        cabeceras = {'HTTP_IF_MATCH': f'"{version}"'} if version else {}
+        return self.client.put(f'/api/citas/{self.cita.pk}/', datos, format='json', **cabeceras)
+
+    def test_if_match_en_citas(self):
+        response = self.editar_cita({'motivo': 'Control'}, version=1)
+        self.assertEqual((response.status_code, response['ETag'], response.data['version']), (200, '"2"', 2))
+
+        # Recepción edita con la versión 1 que tenía en pantalla: no pisa el cambio
+        response = self.editar_cita({'motivo': 'Otro motivo'}, version=1)
+        self.assertEqual((response.status_code, response.data['version'], response['ETag']), (412, 2, '"2"'))
+        self.assertEqual(Cita.objects.get(pk=self.cita.pk).motivo, 'Control')
+
+        # Sin If-Match se acepta (clientes antiguos) y también sube la versión
+        self.assertEqual(self.editar_cita({'estado': 'confirmada'}).data['version'], 3)
+        response = self.client.delete(f'/api/citas/{self.cita.pk}/', HTTP_IF_MATCH='"2"')
+        self.assertEqual(response.status_code, 412)
+        response = self.client.delete(f'/api/citas/{self.cita.pk}/', HTTP_IF_MATCH='W/"3", "9"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_escritura_condicional(self):
+        # Dos ediciones leen la versión 1; la segunda en escribir pierde
+        primera, segunda = Cita.objects.get(pk=self.cita.pk), Cita.objects.get(pk=self.cita.pk)
+        with transaction.atomic():
+            avanzar_version(primera, 1)
+            primera.motivo = 'Primera'
+            primera.save()
+        with self.assertRaises(VersionObsoleta) as error:
+            avanzar_version(segunda, 1)
+        self.assertEqual(error.exception.actual, 2)
+        self.assertEqual(Cita.objects.get(pk=self.cita.pk).version, 2)
+
+    def test_otros_cambios_suben_la_version(self):
+        self.cita.estado = 'confirmada'
+        self.cita.save()
+        self.assertEqual(Cita.objects.get(pk=self.cita.pk).version, 2)
+        self.client.post('/api/citas/lote/', {'ids': [self.cita.pk], 'desplazar_minutos': 30}, format='json')
+        self.assertEqual(Cita.objects.get(pk=self.cita.pk).version, 3)
+        self.assertEqual(self.editar_cita({'motivo': 'Tarde'}, version=2).status_code, 412)
+
+        response = self.client.get('/api/citas/todas/', {'fecha_inicio': '2030-01-07', 'fecha_fin': '2030-01-08'})
+        self.assertEqual(response.data[0]['extendedProps']['version'], 3)
+
+    def test_if_match_en_examenes(self):
+        url = f'/api/examenes/{self.examen.pk}/'
+        self.assertEqual(self.client.get(url)['ETag'], '"1"')
+        response = self.client.patch(url, {'estado': 'en_proceso'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual((response.status_code, response['ETag']), (200, '"2"'))
+        response = self.client.patch(url, {'estado': 'completado'}, format='json', HTTP_IF_MATCH='"1"')
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(ExamenMedico.objects.get(pk=self.examen.pk).estado, 'en_proceso')
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"1"').status_code, 412)
+        self.assertEqual(self.client.delete(url, HTTP_IF_MATCH='"2"').status_code, 204)
+
+
+class NotificacionesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.usuario = Usuario.objects.create_user(correo='u@clinica.com', nombre='U', apellido='V', password='clave123')
+        self.otro = Usuario.objects.create_user(correo='o@clinica.com', nombre='O', apellido='P', password='clave123')
+        Notificacion.objects.bulk_create(
+            [Notificacion(usuario=self.usuario, tipo='cita', titulo=f'Aviso {i}', mensaje='-', leida=i < 40) for i in range(45)]
+            + [Notificacion(usuario=self.otro, tipo='cita', titulo='Ajena', mensaje='-')]
+        )
+        self.client.force_authenticate(self.usuario)
+
+    def test_contador_de_no_leidas(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/mis-notificaciones/no-leidas/count/')
+        self.assertEqual(response.data, {'no_leidas': 5})
+
+        if connection.vendor == 'postgresql':
+            # Con un historial largo ya leído, el conteo no recorre la tabla
+            Notificacion.objects.bulk_create([
+                Notificacion(usuario=usuario, tipo='cita', titulo='Leída', mensaje='-', leida=True)
+                for usuario in (self.usuario, self.otro) for _ in range(1500)
+            ])
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE api_notificacion')
+            no_leidas = Notificacion.objects.filter(usuario=self.usuario, leida=False).order_by()
+            self.assertIn('notificacion_no_leidas_idx', no_leidas.explain())
+
+    def test_bandeja_paginada_mas_recientes_primero(self):
+        # Misma fecha para todas: el id desempata sin repetir ni saltar filas
+        Notificacion.objects.filter(usuario=self.usuario).update(fecha=timezone.now())
+        vistas = []
+        url = '/api/mis-notificaciones/'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 20)
+            vistas += [notificacion['id'] for notificacion in response.data['results']]
+            url = response.data['next']
+        esperadas = list(Notificacion.objects.filter(usuario=self.usuario).order_by('-fecha', '-id').values_list('id', flat=True))
+        self.assertEqual(vistas, esperadas)
+
+        response = self.client.get('/api/mis-notificaciones/', {'page_size': 5})
+        self.assertEqual([n['titulo'] for n in response.data['results']], [f'Aviso {i}' for i in range(44, 39, -1)])
+
+    def test_marcar_leidas(self):
+        no_leidas = list(Notificacion.objects.filter(usuario=self.usuario, leida=False).order_by('id'))
+        ajena = Notificacion.objects.get(usuario=self.otro)
+
+        response = self.client.patch(f'/api/notificaciones/{no_leidas[0].pk}/marcar-leida/')
+        self.assertEqual(response.data['no_leidas'], 4)
+        self.assertEqual(self.client.patch(f'/api/notificaciones/{no_leidas[0].pk}/marcar-leida/').status_code, 200)
+        self.assertEqual(self.client.patch(f'/api/notificaciones/{ajena.pk}/marcar-leida/').status_code, 404)
+
+        url = '/api/mis-notificaciones/marcar-leidas/'
+        with self.assertNumQueries(2):  # el UPDATE y el contador
+            response = self.client.post(url, {'ids': [no_leidas[1].pk, no_leidas[2].pk, ajena.pk]}, format='json')
+        self.assertEqual(response.data, {'marcadas': 2, 'no_leidas': 2})
+        self.assertFalse(Notificacion.objects.get(pk=ajena.pk).leida)
+
+        # Hasta la más reciente que vio el cliente: la que llega después sigue sin leer
+        Notificacion.objects.filter(pk=no_leidas[4].pk).update(fecha=timezone.now() + timedelta(minutes=5))
+        response = self.client.post(url, {'hasta': timezone.now().isoformat()}, format='json')
+        self.assertEqual(response.data, {'marcadas': 1, 'no_leidas': 1})
+
+        for cuerpo in ({}, {'ids': [1], 'hasta': timezone.now().isoformat()}, {'ids': ['1']}, {'hasta': 'ayer'}):
+            self.assertEqual(self.client.post(url, cuerpo, format='json').status_code, 400, cuerpo)
+
+
+class RetencionNotificacionesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.usuario = Usuario.objects.create_user(correo='r@clinica.com', nombre='R', apellido='S', password='clave123')
+        self.otro = Usuario.objects.create_user(correo='t@clinica.com', nombre='T', apellido='U', password='clave123')
+        self.ahora = timezone.now()
+        Notificacion.objects.bulk_create(
+            [Notificacion(usuario=self.usuario, tipo='cita', titulo=f'Vieja {i}', mensaje='-', leida=True, metadata={'i': i}) for i in range(25)]
+            + [Notificacion(usuario=self.otro, tipo='cita', titulo='Vieja ajena', mensaje='-', leida=True)]
+            + [Notificacion(usuario=self.usuario, tipo='cita', titulo='Vieja sin leer', mensaje='-')]
+            + [Notificacion(usuario=self.usuario, tipo='cita', titulo='Reciente', mensaje='-', leida=True)]
+        )
+        Notificacion.objects.exclude(titulo='Reciente').update(fecha=self.ahora - timedelta(days=120))
+        Notificacion.objects.filter(titulo='Reciente').update(fecha=self.ahora - timedelta(days=10))
+
+    def test_archiva_por_lotes_solo_leidas_antiguas(self):
+        originales = {n.pk: n for n in Notificacion.objects.filter(titulo__startswith='Vieja ', leida=True)}
+        avances = []
+        total = archivar_notificaciones(dias=90, tamano=10, ahora=self.ahora, al_avanzar=avances.append)
+        self.assertEqual(total, 26)
+        self.assertEqual(avances, [10, 20, 26])
+        self.assertEqual(
+            set(Notificacion.objects.values_list('titulo', flat=True)), {'Vieja sin leer', 'Reciente'},
+        )
+        for archivada in NotificacionArchivada.objects.all():
+            original = originales[archivada.pk]  # conserva el id
+            self.assertEqual(
+                (archivada.usuario_id, archivada.titulo, archivada.metadata, archivada.fecha),
+                (original.usuario_id, original.titulo, original.metadata, original.fecha),
+            )
+        self.assertEqual(archivar_notificaciones(dias=90, ahora=self.ahora), 0)
+
+    def test_lote_con_consultas_constantes(self):
+        limite = self.ahora - timedelta(days=90)
+        # Lectura, INSERT y DELETE, más el savepoint de la transacción dentro del TestCase
+        with self.assertNumQueries(5):
+            self.assertEqual(archivar_lote(limite, tamano=3), 3)
+        with self.assertNumQueries(5):
+            self.assertEqual(archivar_lote(limite, tamano=100), 23)
+        with self.assertNumQueries(3):
+            self.assertEqual(archivar_lote(limite, tamano=100), 0)
+
+    def test_endpoint_de_archivadas(self):
+        archivar_notificaciones(dias=90, ahora=self.ahora)
+        self.client.force_authenticate(self.usuario)
+        vistas = []
+        url = '/api/mis-notificaciones/archivadas/?page_size=10'
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            vistas += [n['titulo'] for n in response.data['results']]
+            url = response.data['next']
+        # Misma fecha para todas: el id desempata, más recientes primero
+        self.assertEqual(vistas, [f'Vieja {i}' for i in range(24, -1, -1)])
+        self.assertIn('fecha_archivo', response.data['results'][0])
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/mis-notificaciones/archivadas/').status_code, 401)
+
+    def test_comando(self):
+        salida = StringIO()
+        with self.settings(NOTIFICACIONES_DIAS_RETENCION=5):
+            call_command('archivar_notificaciones', lote=10, stdout=salida)
+        self.assertIn('✅ Notificaciones archivadas: 27 (leídas hace más de 5 días).', salida.getvalue())
+        self.assertEqual(list(Notificacion.objects.values_list('titulo', flat=True)), ['Vieja sin leer'])
+        for opciones in ({'lote': 0}, {'dias': -1}, {'intervalo': -1}):
+            with self.assertRaises(CommandError):
+                call_command('archivar_notificaciones', stdout=StringIO(), **opciones)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Plan de consulta de PostgreSQL')
+    def test_indice_de_candidatas(self):
+        Notificacion.objects.bulk_create([
+            Notificacion(usuario=self.usuario, tipo='cita', titulo='Sin leer', mensaje='-') for _ in range(3000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE api_notificacion')
+        candidatas = Notificacion.objects.filter(leida=True, fecha__lt=self.ahora).order_by('fecha', 'id')[:10]
+        self.assertIn('notificacion_leidas_fecha_idx', candidatas.explain())
+
+
+class DifusionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        rol_paciente = Rol.objects.create(codigo='paciente', nombre='Paciente')
+        self.pacientes = crear_pacientes(5)
+        for paciente in self.pacientes:
+            paciente.usuario = Usuario.objects.create_user(
+                correo=f'{paciente.dni}@clinica.com', nombre=paciente.nombre, apellido=paciente.apellido,
+                password='clave123', rol=rol_paciente,
+            )
+            paciente.save()
+        lunes = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+        for paciente, medico, dias, estado in (
+            (0, self.medico, 0, 'confirmada'), (0, self.medico, 7, 'confirmada'), (1, self.medico, 0, 'cancelada'),
+            (2, self.medico, 1, 'solicitada'), (3, self.otro_medico, 0, 'confirmada'),
+        ):
+            Cita.objects.create(
+                paciente=self.pacientes[paciente], medico=medico, estado=estado,
+                fecha_hora_propuesta=lunes + timedelta(days=dias, hours=paciente),
+            )
+
+    def usuarios(self, *indices):
+        return [self.pacientes[i].usuario_id for i in indices]
+
+    def test_audiencias_en_una_consulta(self):
+        casos = [
+            ({'tipo': 'pacientes_medico', 'medico_id': self.medico.pk}, self.usuarios(0, 1, 2)),
+            ({'tipo': 'citas_fecha', 'fecha': '2030-01-07'}, self.usuarios(0, 3)),  # sin la cancelada
+            ({'tipo': 'citas_fecha', 'fecha': '2030-01-07', 'medico_id': self.otro_medico.pk}, self.usuarios(3)),
+            ({'tipo': 'rol', 'rol': 'paciente'}, self.usuarios(0, 1, 2, 3, 4)),
+        ]
+        for audiencia, esperados in casos:
+            filas, _ = destinatarios(audiencia)
+            with self.assertNumQueries(1):
+                self.assertEqual([fila[0] for fila in filas], esperados, audiencia)
+
+    def test_envio_por_lotes_reanudable(self):
+        difusion = crear_difusion(
+            None, 'aviso', 'Aviso para {{ nombre }}', 'Hola {{ nombre }} {{ apellido }}, el {{ dia }} no hay consulta.',
+            {'tipo': 'rol', 'rol': 'paciente'}, {'dia': 'lunes'},
+        )
+        self.assertEqual((difusion.estado, difusion.total), ('pendiente', 5))
+
+        # Difusión bloqueada, destinatarios, bulk_create, avance y los savepoints
+        with self.assertNumQueries(6):
+            difusion = enviar_lote(difusion.pk, tamano=2)
+        self.assertEqual((difusion.estado, difusion.enviadas), ('enviando', 2))
+
+        difusion = procesar_difusion(difusion.pk, tamano=2)
+        self.assertEqual((difusion.estado, difusion.enviadas), ('completada', 5))
+        self.assertIsNone(enviar_lote(difusion.pk))
+
+        notificaciones = Notificacion.objects.filter(metadata__difusion_id=difusion.pk)
+        self.assertFalse(notificaciones.filter(mensaje__contains='{').exists())
+        self.assertEqual(sorted(notificaciones.values_list('usuario_id', flat=True)), self.usuarios(0, 1, 2, 3, 4))
+        primera = notificaciones.get(usuario_id=self.usuarios(0)[0])
+        self.assertEqual(
+            (primera.titulo, primera.mensaje), ('Aviso para Paciente0', 'Hola Paciente0 Apellido0, el lunes no hay consulta.'),
+        )
+
+    def test_endpoint(self):
+        url = '/api/notificaciones/difusion/'
+        cuerpo = {'titulo': 'Cambio de horario', 'mensaje': 'Hola {{ nombre }}', 'audiencia': {'tipo': 'rol', 'rol': 'paciente'}}
+
+        self.client.force_authenticate(self.pacientes[0].usuario)
+        self.assertEqual(self.client.post(url, cuerpo, format='json').status_code, 403)
+
+        # El médico solo escribe a sus pacientes, aunque pida otro médico
+        self.client.force_authenticate(self.medico.usuario)
+        self.assertEqual(self.client.post(url, cuerpo, format='json').status_code, 403)
+        response = self.client.post(url, {
+            **cuerpo, 'audiencia': {'tipo': 'pacientes_medico', 'medico_id': self.otro_medico.pk},
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['estado'], response.data['enviadas']), ('completada', 3))
+        self.assertEqual(len(self.client.get(url).data), 1)
+
+        self.client.force_authenticate(crear_admin())
+        # Solo marcadores: ni etiquetas ni filtros del motor de plantillas
+        for mensaje in ('{% debug %}', '{% include "admin/base.html" %}', '{{ nombre|upper }}', '{{ clave }}', '{# x #}'):
+            response = self.client.post(url, {**cuerpo, 'mensaje': mensaje}, format='json')
+            self.assertEqual(response.status_code, 400, mensaje)
+        self.assertEqual(Difusion.objects.count(), 1)
+        self.assertEqual(self.client.post(url, {**cuerpo, 'audiencia': {'tipo': 'todos'}}, format='json').status_code, 400)
+        self.assertEqual(
+            self.client.post(url, {**cuerpo, 'audiencia': {'tipo': 'citas_fecha', 'fecha': 'ayer'}}, format='json').status_code,
+            400,
+        )
+
+        # Las audiencias grandes quedan para el comando, que informa del progreso
+        with mock.patch('api.views.MAX_INMEDIATA', 2):
+            response = self.client.post(url, cuerpo, format='json')
+        self.assertEqual((response.status_code, response.data['estado'], response.data['total']), (202, 'pendiente', 5))
+        salida = StringIO()
+        call_command('enviar_difusiones', '--lote', '2', stdout=salida)
+        self.assertIn(f"Difusión {response.data['id']}: 4/5 (80%)", salida.getvalue())
+        progreso = self.client.get(f"{url}{response.data['id']}/").data
+        self.assertEqual((progreso['estado'], progreso['enviadas']), ('completada', 5))
+
+        self.client.force_authenticate(self.medico.usuario)
+        self.assertEqual(self.client.get(f"{url}{response.data['id']}/").status_code, 404)
+
+
+class EventosRegistrados(MemoriaEventos):
+    """Backend de prueba: guarda lo publicado en lugar de repartirlo."""
+
+    def __init__(self):
+        super().__init__()
+        self.publicados = []
+
+    def publicar(self, usuario_ids, tipo, datos):
+        self.publicados.append((sorted(usuario_ids), tipo, datos))
+
+
+class EventosTests(TestCase):
+    def setUp(self):
+        canal_eventos.cache_clear()
+        self.addCleanup(canal_eventos.cache_clear)
+
+    async def test_flujo_entrega_solo_los_eventos_del_usuario(self):
+        flujo = flujo_eventos(5)
+        self.assertEqual(await anext(flujo), 'retry: 5000\n\n')
+        self.assertIn('event: conectado', await anext(flujo))
+        self.assertEqual(canal_eventos().conectados(), 1)
+
+        # Se publica desde otro hilo, como una vista síncrona
+        await asyncio.to_thread(canal_eventos().publicar, [6], 'cita', {'id': 1})
+        await asyncio.to_thread(canal_eventos().publicar, [5, 6], 'cita', {'id': 2})
+        self.assertEqual(await anext(flujo), 'event: cita\ndata: {"id": 2}\n\n')
+
+        await flujo.aclose()
+        self.assertEqual(canal_eventos().conectados(), 0)
+
+    async def test_flujo_termina_al_vencer_el_token(self):
+        flujo = flujo_eventos(5, expira=time.time() + 0.05)
+        partes = [parte async for parte in flujo]
+        self.assertIn('event: expirado', partes[-1])
+        self.assertEqual(canal_eventos().conectados(), 0)
+
+    async def test_vista_exige_ticket(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/eventos/')).status_code, 401)
+        self.assertEqual((await client.get('/api/eventos/', {'ticket': 'no-es-un-ticket'})).status_code, 401)
+
+        usuario = await Usuario.objects.acreate(correo='e@clinica.com', nombre='E', apellido='F')
+        # El access token ya no se acepta en la URL, donde lo guardan los logs
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(usuario).access_token))()
+        self.assertEqual((await client.get('/api/eventos/', {'token': token})).status_code, 401)
+
+        def pedir_ticket():
+            api = APIClient()
+            api.force_authenticate(usuario)
+            return api.post('/api/eventos/ticket/').data['ticket']
+
+        ticket = await sync_to_async(pedir_ticket)()
+        response = await client.get('/api/eventos/', {'ticket': ticket})
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/event-stream'))
+        contenido = aiter(response.streaming_content)
+        self.assertEqual(await anext(contenido), b'retry: 5000\n\n')
+        self.assertIn(b'event: conectado', await anext(contenido))
+        await contenido.aclose()
+
+        # De un solo uso, y caduca a los DURACION_TICKET segundos
+        self.assertEqual((await client.get('/api/eventos/', {'ticket': ticket})).status_code, 401)
+        ticket = await sync_to_async(pedir_ticket)()
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + DURACION_TICKET + 1):
+            self.assertEqual((await client.get('/api/eventos/', {'ticket': ticket})).status_code, 401)
+
+        # Con la cabecera Authorization sigue valiendo el access token
+        response = await client.get('/api/eventos/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+        await aiter(response.streaming_content).aclose()
+
+    def test_bajo_wsgi_responde_503_sin_colgarse(self):
+        response = Client().get('/api/eventos/')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('ASGI', response.json()['error'])
+
+    @override_settings(EVENTOS_BACKEND='api.tests.EventosRegistrados')
+    def test_publica_notificaciones_y_cambios_de_estado_al_confirmar(self):
+        medico = crear_medico(1)
+        paciente = crear_pacientes(1)[0]
+        paciente.usuario = Usuario.objects.create_user(correo='p@clinica.com', nombre='P', apellido='Q', password='x')
+        paciente.save()
+        cita = Cita.objects.create(
+            paciente=paciente, medico=medico, fecha_hora_propuesta=timezone.make_aware(datetime(2030, 1, 7, 8, 0)),
+        )
+        publicados = canal_eventos().publicados
+        self.assertEqual(publicados, [])  # nada sale antes del commit
+
+        usuarios = sorted([medico.usuario_id, paciente.usuario_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.motivo = 'Control'
+            cita.save()
+        self.assertEqual(publicados, [])  # sin cambio de estado
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.estado = 'confirmada'
+            cita.save()
+        self.assertEqual([(u, tipo, datos['estado']) for u, tipo, datos in publicados], [(usuarios, 'cita', 'confirmada')])
+
+        # Los lotes usan update(), sin señales: publican ellos mismos
+        client = APIClient()
+        client.force_authenticate(crear_admin())
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post('/api/citas/lote/', {'ids': [cita.pk], 'estado': 'completada'}, format='json')
+        self.assertEqual([(u, tipo, datos['estado']) for u, tipo, datos in publicados[1:]], [(usuarios, 'cita', 'completada')])
+
+        publicados.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            notificacion = Notificacion.objects.create(usuario=paciente.usuario, tipo='cita', titulo='Hola', mensaje='-')
+        self.assertEqual(publicados, [([paciente.usuario_id], 'notificacion', {
+            'id': notificacion.pk, 'tipo': 'cita', 'titulo': 'Hola', 'fecha': notificacion.fecha,
+        })])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY requiere PostgreSQL')
+class EventosPostgresTests(TransactionTestCase):
+    async def test_reparte_entre_procesos_con_notify(self):
+        canal, otro_worker = PostgresEventos(), PostgresEventos()
+        suscripcion = canal.suscribir(7)
+        self.addCleanup(canal.detener)
+        self.assertTrue(await asyncio.to_thread(canal.escuchando.wait, 5))
+
+        # Publicado desde otra instancia, como haría otro worker
+        await sync_to_async(otro_worker.publicar)([7, 8], 'notificacion', {'id': 1})
+        self.assertEqual(await suscripcion.siguiente(5), {'tipo': 'notificacion', 'datos': {'id': 1}})
+        suscripcion.cerrar()
+        self.assertEqual(canal.conectados(), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'El bloqueo SELECT ... FOR NO KEY UPDATE requiere PostgreSQL')
+class CitasConcurrentesTests(TransactionTestCase):
+    HILOS = 16
+
+    def setUp(self):
+        self.admin = crear_admin()
+        self.medico = crear_medico(1)
+        self.otro_medico = crear_medico(2, especialidad=self.medico.especialidad)
+        self.pacientes = crear_pacientes(self.HILOS)
+
+    def reservar(self, medico, paciente, resultados, barrera=None):
+        try:
+            client = APIClient()
+            client.force_authenticate(self.admin)
+            if barrera:
+                barrera.wait()
+            response = client.post('/api/admin/citas/', {
+                'paciente': paciente.pk, 'medico': medico.pk, 'fecha_hora_propuesta': '2030-01-07T09:00:00',
+            }, format='json')
+            resultados.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_una_sola_reserva_gana(self):
+        barrera = threading.Barrier(self.HILOS)
+        resultados = []
+        hilos = [
+            threading.Thread(target=self.reservar, args=(self.medico, paciente, resultados, barrera))
+            for paciente in self.pacientes
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(30)
+        self.assertEqual(sorted(resultados), [201] + [409] * (self.HILOS - 1))
+        self.assertEqual(Cita.objects.filter(medico=self.medico).count(), 1)
+
+    def test_no_serializa_medicos_distintos(self):
+        resultados_otro, resultados_mismo = [], []
+        otro = threading.Thread(target=self.reservar, args=(self.otro_medico, self.pacientes[0], resultados_otro))
+        mismo = threading.Thread(target=self.reservar, args=(self.medico, self.pacientes[1], resultados_mismo))
+        with transaction.atomic():
+            # Agenda del médico 1 bloqueada por esta conexión, como en reserva_de_turno
+            list(Medico.objects.select_for_update(no_key=True).filter(pk=self.medico.pk))
+            mismo.start()
+            otro.start()
+            otro.join(10)
+            self.assertEqual(resultados_otro, [201])
+            mismo.join(0.5)
+            self.assertTrue(mismo.is_alive())
+        mismo.join(10)
+        self.assertEqual(resultados_mismo, [201])
+
+    def test_resumen_no_pierde_reservas_al_cancelar_en_paralelo(self):
+        inicio = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        cancelable = Cita.objects.create(paciente=self.pacientes[0], medico=self.medico, fecha_hora_propuesta=inicio)
+        reservada, errores = threading.Event(), []
+
+        def reservar():
+            try:
+                with transaction.atomic():
+                    Cita.objects.create(
+                        paciente=self.pacientes[1], medico=self.medico, fecha_hora_propuesta=inicio + timedelta(hours=1),
+                    )
+                    reservada.set()
+                    time.sleep(0.5)  # la cancelación corre mientras la reserva no ha confirmado
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        def cancelar():
+            try:
+                reservada.wait(10)
+                cita = Cita.objects.get(pk=cancelable.pk)
+                cita.estado = 'cancelada'
+                cita.save()
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=reservar), threading.Thread(target=cancelar)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(30)
+        self.assertEqual(errores, [])
+        campos = ('medico_id', 'fecha', 'estado', 'total', 'primera', 'ultima')
+        incremental = sorted(ResumenAgenda.objects.values_list(*campos))
+        recalcular_resumen_agenda()
+        self.assertEqual(incremental, sorted(ResumenAgenda.objects.values_list(*campos)))
+        self.assertIn((self.medico.pk, date(2030, 1, 7), 'solicitada', 1), [fila[:4] for fila in incremental])
+
+    def test_cambios_de_estado_opuestos_no_se_bloquean(self):
+        inicio = timezone.make_aware(datetime(2030, 1, 7, 9, 0))
+        citas = [
+            Cita.objects.create(paciente=self.pacientes[0], medico=self.medico, fecha_hora_propuesta=inicio),
+            Cita.objects.create(
+                paciente=self.pacientes[1], medico=self.otro_medico, fecha_hora_propuesta=inicio, estado='confirmada',
+            ),
+        ]
+        recalcular_contadores()
+        # Ambas transacciones guardan antes de que ninguna confirme: con los
+        # contadores dentro de la transacción, A→B y B→A se bloqueaban en orden inverso
+        barrera = threading.Barrier(2)
+        errores = []
+
+        def cambiar(cita_id, estado):
+            try:
+                with transaction.atomic():
+                    cita = Cita.objects.get(pk=cita_id)
+                    cita.estado = estado
+                    cita.save()
+                    barrera.wait(10)
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        hilos = [
+            threading.Thread(target=cambiar, args=(citas[0].pk, 'confirmada')),
+            threading.Thread(target=cambiar, args=(citas[1].pk, 'solicitada')),
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join(30)
+        self.assertEqual(errores, [])
+        contadores = dict(ContadorEstadistica.objects.values_list('clave', 'valor'))
+        recalcular_contadores()
+        self.assertEqual(contadores, dict(ContadorEstadistica.objects.values_list('clave', 'valor')))
+
+
+def sembrar_clinica():
+    """
+    Datos deterministas para la suite de presupuestos: tres usuarios (admin,
+    médico, paciente) y suficientes filas relacionadas para que un N+1 se note.
+    """
+    roles = {codigo: Rol.objects.create(codigo=codigo, nombre=codigo.title()) for codigo in ('admin', 'medico', 'paciente')}
+    admin = crear_admin()
+    admin.rol = roles['admin']
+    admin.save()
+
+    especialidades = [Especialidad.objects.create(nombre=nombre) for nombre in ('Cardiología', 'Pediatría')]
+    medicos = [crear_medico(n, especialidad=especialidades[n % 2]) for n in range(1, 4)]
+    Usuario.objects.filter(medico__in=medicos).update(rol=roles['medico'])
+    for medico in medicos:
+        crear_horario(medico)
+
+    usuario_paciente = Usuario.objects.create_user(
+        correo='paciente@clinica.com', nombre='Ana', apellido='Pérez', password='clave123', rol=roles['paciente']
+    )
+    pacientes = crear_pacientes(20)
+    paciente = pacientes[0]
+    paciente.usuario = usuario_paciente
+    paciente.save()
+
+    for i, p in enumerate(pacientes[:10]):
+        HistoriaClinica.objects.create(paciente=p)
+        AntecedenteMedico.objects.create(paciente=p, alergias='Penicilina')
+        crear_historial(p, medicos[i % 3], consultas=4, diagnosticos=2, tratamientos=2)
+
+    inicio = timezone.make_aware(datetime(2030, 1, 7, 8, 0))
+    estados = [estado for estado, _ in Cita.ESTADO_CHOICES]
+    Cita.objects.bulk_create([
+        Cita(
+            paciente=pacientes[i % 20], medico=medicos[i % 3], estado=estados[i % 4], motivo=f'Cita {i}',
+            fecha_hora_propuesta=inicio + timedelta(days=i // 8, minutes=30 * (i % 8)),
+        )
+        for i in range(60)
+    ])
+
+    # Cada lunes por la tarde, sin chocar con las citas sembradas
+    serie = SerieCita.objects.create(
+        paciente=paciente, medico=medicos[0], fecha_hora_inicio=inicio.replace(hour=18), frecuencia='semanal',
+    )
+    # Ya sincronizada: /api/citas/cambios/ no pide recargar
+    SerieCita.objects.filter(pk=serie.pk).update(fecha_actualizacion=timezone.now() - timedelta(days=1))
+    espera = EsperaCita.objects.create(paciente=paciente, medico=medicos[0], motivo='Adelantar control')
+    EsperaCita.objects.bulk_create([EsperaCita(paciente=p, medico=medicos[0]) for p in pacientes[1:6]])
+
+    tipo = TipoExamen.objects.create(nombre='Hematología completa')
+    diagnostico = Diagnostico.objects.filter(consulta__paciente=paciente).first()
+    ExamenMedico.objects.bulk_create([
+        ExamenMedico(
+            paciente=pacientes[i % 5], medico=medicos[i % 3], tipo_examen=tipo,
+            diagnostico_relacionado=diagnostico if i % 2 else None,
+        )
+        for i in range(15)
+    ])
+
+    for usuario in (admin, medicos[0].usuario, usuario_paciente):
+        Notificacion.objects.bulk_create([
+            Notificacion(usuario=usuario, tipo='cita', titulo=f'Aviso {i}', mensaje='Recordatorio', leida=i % 3 == 0)
+            for i in range(30)
+        ])
+    difusion = procesar_difusion(crear_difusion(
+        medicos[0].usuario, 'aviso', 'Cambio de horario', 'Hola {{ nombre }}, el lunes atiendo por la tarde.',
+        {'tipo': 'pacientes_medico', 'medico_id': medicos[0].pk},
+    ).pk)
+
+    Consultorio.objects.create(id=1, nombre='Consultorio Central', rif='J-12345678-9')
+    tokens = {'medico': 'token-medico', 'paciente': 'token-paciente'}
+    SuscripcionCalendario.objects.create(usuario=medicos[0].usuario, token=tokens['medico'])
+    SuscripcionCalendario.objects.create(usuario=usuario_paciente, token=tokens['paciente'])
+    recalcular_contadores()
+    recalcular_resumen_agenda()
+    reconstruir_documentos()
+
+    return {
+        'usuarios': {'admin': admin, 'medico': medicos[0].usuario, 'paciente': usuario_paciente},
+        'paciente': paciente,
+        'medico': medicos[0],
+        'consulta': Consulta.objects.filter(paciente=paciente).first(),
+        'cita': Cita.objects.filter(paciente=paciente).first(),
+        'examen': ExamenMedico.objects.first(),
+        'notificacion': Notificacion.objects.filter(usuario=usuario_paciente).first(),
+        'tokens': tokens,
+        'serie': serie,
+        'espera': espera,
+        'difusion': difusion,
+    }
+
+
+def rutas_api():
+    """Rutas de api/urls.py y consultorio/urls.py (sin duplicados ni sufijos de formato)."""
+    rutas = {}
+
+    def recorrer(patrones, prefijo):
+        for patron in patrones:
+            ruta = str(patron.pattern)
+            if isinstance(patron.pattern, RegexPattern):
+                ruta = ruta.removeprefix('^').removesuffix('$')
+            ruta = prefijo + ruta
+            if isinstance(patron, URLResolver):
+                recorrer(patron.url_patterns, ruta)
+            elif ruta.startswith('api/') and 'format' not in ruta:
+                rutas.setdefault(ruta, patron.callback)
+
+    recorrer(get_resolver().url_patterns, '')
+    return rutas
+
+
+def metodo_para(vista):
+    """GET si la vista lo admite; si no, el primer método de escritura que acepte."""
+    if hasattr(vista, 'actions'):
+        metodos = set(vista.actions)
+    elif hasattr(vista, 'cls'):
+        metodos = {m for m in vista.cls.http_method_names if hasattr(vista.cls, m)}
+    else:
+        metodos = {'get'}
+    return next(m for m in ('get', 'post', 'put', 'patch', 'delete') if m in metodos)
+
+
+@tag('presupuesto')
+class PresupuestoEndpointsTests(TestCase):
+    """
+    Recorre todas las rutas de api/urls.py y consultorio/urls.py como admin,
+    médico y paciente, y compara consultas SQL, tiempo y código de estado con
+    los presupuestos de api/presupuestos_rendimiento.json.
+
+        python manage.py test api --tag presupuesto
+
+    Funciona con Postgres o con SQLite (DB_ENGINE=django.db.backends.sqlite3);
+    el archivo guarda una sección por motor (connection.vendor) y solo se
+    compara con la del motor en uso. Para registrar de nuevo los presupuestos
+    de ese motor tras un cambio intencional:
+
+        REGISTRAR_PRESUPUESTOS=1 python manage.py test api --tag presupuesto
+    """
+    # El tiempo varía entre máquinas: se permite MARGEN veces lo registrado más HOLGURA_MS
+    MARGEN = float(os.environ.get('PRESUPUESTO_MARGEN', 3))
+    HOLGURA_MS = float(os.environ.get('PRESUPUESTO_HOLGURA_MS', 50))
+    REINTENTOS = 3
+    # Parámetros obligatorios de algunas rutas, para medir la respuesta real y no un 400
+    PARAMETROS_CONSULTA = {
+        'api/pacientes/buscar/': 'q=Paciente1',
+        'api/busqueda-clinica/': 'q=Motivo',
+        'api/citas/medico/': 'fecha_inicio=2030-01-07&fecha_fin=2030-01-14',
+        'api/citas/paciente/': 'fecha_inicio=2030-01-07&fecha_fin=2030-01-14',
+        'api/citas/todas/': 'fecha_inicio=2030-01-07&fecha_fin=2030-01-14',
+        'api/citas/resumen/': 'desde=2030-01-01&hasta=2030-12-31',
+        'api/citas/cambios/': f"desde={(timezone.now() - timedelta(hours=1)):%Y-%m-%dT%H:%M:%SZ}",
+        'api/medicos/disponibilidad/': 'desde=2030-01-07&hasta=2030-02-05',
+        'api/medicos/(?P<pk>[^/.]+)/disponibilidad/': 'desde=2030-01-07&hasta=2030-02-05',
+    }
+
+    # Streams que no terminan mientras el cliente siga conectado (ver EventosTests)
+    RUTAS_SIN_PRESUPUESTO = {'api/eventos/'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datos = sembrar_clinica()
+
+    def valor_parametro(self, ruta, nombre):
+        datos = self.datos
+        if nombre == 'pk':
+            recurso = ruta.split('/')[1]
+            return {
+                'pacientes': datos['paciente'], 'medicos': datos['medico'],
+                'consultas': datos['consulta'], 'examenes': datos['examen'],
+            }[recurso].pk
+        if nombre == 'token':
+            return datos['tokens']['medico' if '/medico/' in ruta else 'paciente']
+        return {
+            'paciente_id': datos['paciente'].pk,
+            'consulta_id': datos['consulta'].pk,
+            'examen_id': datos['examen'].pk,
+            'cita_id': datos['cita'].pk,
+            'notificacion_id': datos['notificacion'].pk,
+            'serie_id': datos['serie'].pk,
+            'espera_id': datos['espera'].pk,
+            'difusion_id': datos['difusion'].pk,
+        }[nombre]
+
+    def url_concreta(self, ruta):
+        def sustituir(match):
+            return str(self.valor_parametro(ruta, match.group(1)))
+        url = re.sub(r'\(\?P<(\w+)>[^)]*\)', sustituir, ruta)  # re_path del router
+        url = re.sub(r'<(?:\w+:)?(\w+)>', sustituir, url)  # path()
+        parametros = self.PARAMETROS_CONSULTA.get(ruta)
+        return f'/{url}?{parametros}' if parametros else f'/{url}'
+
+    def medir(self):
+        resultados = {}
+        self.peticiones = {}
+        rutas = rutas_api()
+        for rol, usuario in self.datos['usuarios'].items():
+            client = APIClient(raise_request_exception=False)
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(usuario).access_token}')
+            for ruta, vista in sorted(rutas.items()):
+                if ruta in self.RUTAS_SIN_PRESUPUESTO:
+                    continue
+                metodo = metodo_para(vista).upper()
+                clave = f'{rol} {metodo} /{ruta}'
+                self.peticiones[clave] = (client, metodo, ruta)
+                resultados[clave] = self.medir_peticion(client, metodo, ruta)
+        return resultados
+
+    def medir_peticion(self, client, metodo, ruta):
+        cache.clear()
+        # Cada petición se deshace para que el orden no influya en las demás
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                response = client.generic(metodo, self.url_concreta(ruta), '{}', 'application/json')
+                if response.streaming:
+                    b''.join(response.streaming_content)  # el trabajo ocurre al consumir el cuerpo
+                ms = (time.perf_counter() - inicio) * 1000
+            transaction.set_rollback(True)
+        return {'estado': response.status_code, 'consultas': len(ctx.captured_queries), 'ms': round(ms, 1)}
+
+    def test_endpoints_dentro_del_presupuesto(self):
+        resultados = self.medir()
+
+        # Cada motor tiene su sección: en SQLite no se compara con lo medido en Postgres
+        with open(ARCHIVO_PRESUPUESTOS, encoding='utf-8') as archivo:
+            por_motor = json.load(archivo)
+
+        if os.environ.get('REGISTRAR_PRESUPUESTOS'):
+            por_motor[connection.vendor] = resultados
+            with open(ARCHIVO_PRESUPUESTOS, 'w', encoding='utf-8') as archivo:
+                json.dump(por_motor, archivo, indent=2, ensure_ascii=False, sort_keys=True)
+                archivo.write('\n')
+            return
+
+        presupuestos = por_motor.get(connection.vendor, {})
+
+        errores = []
+        for clave, medido in sorted(resultados.items()):
+            presupuesto = presupuestos.get(clave)
+            if presupuesto is None:
+                errores.append(f'{clave}: sin presupuesto registrado (ejecutar con REGISTRAR_PRESUPUESTOS=1)')
+                continue
+            if medido['estado'] != presupuesto['estado']:
+                errores.append(f"{clave}: estado {medido['estado']}, registrado {presupuesto['estado']}")
+            if medido['consultas'] > presupuesto['consultas']:
+                errores.append(f"{clave}: {medido['consultas']} consultas SQL, presupuesto {presupuesto['consultas']}")
+            limite_ms = presupuesto['ms'] * self.MARGEN + self.HOLGURA_MS
+            if medido['ms'] > limite_ms:
+                # Una sola muestra puede caer en una pausa del GC: se repite antes de fallar
+                medido['ms'] = min(self.medir_peticion(*self.peticiones[clave])['ms'] for _ in range(self.REINTENTOS))
+            if medido['ms'] > limite_ms:
+                errores.append(f"{clave}: {medido['ms']} ms, límite {limite_ms:.1f} ms")
+        self.assertFalse(errores, '\n' + '\n'.join(errores))
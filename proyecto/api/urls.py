@@ -17,10 +17,12 @@ urlpatterns = [
     # === Nuevos endpoints para administrador ===
     path('admin/usuarios/', views.crear_usuario_admin, name='crear_usuario_admin'),
     path('admin/roles/', views.listar_roles, name='listar_roles'),
+    path('estadisticas/', views.estadisticas_dashboard, name='estadisticas'),
     # =========================================
 
     path('especialidades/', views.EspecialidadListCreate.as_view()),
     path('historia-clinica/paciente/<int:paciente_id>/', views.historia_clinica_paciente_detalles),
+    path('busqueda-clinica/', views.busqueda_clinica, name='busqueda_clinica'),
     #path('diagnosticos/', views.crear_diagnostico),
     path('diagnosticos/consulta/<int:consulta_id>/', views.obtener_diagnostico_por_consulta),
     path('diagnosticos/paciente/<int:paciente_id>/', views.obtener_diagnosticos_por_paciente),
@@ -50,11 +52,31 @@ urlpatterns = [
     path('citas/paciente/', views.obtener_citas_por_paciente, name='citas_por_paciente'),
     # api/urls.py
     path('citas/todas/', views.listar_todas_citas, name='listar_todas_citas'),
+    path('citas/lote/', views.actualizar_citas_lote, name='actualizar_citas_lote'),
+    path('citas/cambios/', views.sincronizar_citas, name='sincronizar_citas'),
+    path('citas/resumen/', views.resumen_agenda, name='resumen_agenda'),
+    path('citas/suscripcion/', views.suscripcion_calendario, name='suscripcion_calendario'),
+    path('citas/series/', views.series_citas, name='series_citas'),
+    path('citas/series/<int:serie_id>/', views.gestionar_serie, name='gestionar_serie'),
+    path('citas/series/<int:serie_id>/ocurrencias/', views.modificar_ocurrencia, name='modificar_ocurrencia'),
+    path('citas/espera/', views.lista_espera, name='lista_espera'),
+    path('citas/espera/<int:espera_id>/', views.gestionar_espera, name='gestionar_espera'),
+    path('citas/espera/<int:espera_id>/responder/', views.responder_oferta_espera, name='responder_oferta_espera'),
+    path('citas/medico/<slug:token>.ics', views.calendario_ics, {'tipo': 'medico'}, name='calendario_ics_medico'),
+    path('citas/paciente/<slug:token>.ics', views.calendario_ics, {'tipo': 'paciente'}, name='calendario_ics_paciente'),
     path('antecedentes/<int:paciente_id>/', views.AntecedenteMedicoDetail.as_view(), name='antecedentes-detail'),
     # api/urls.py
     path('citas/<int:cita_id>/', views.gestionar_cita, name='gestionar_cita'),
     # api/urls.py
     path('notificaciones/', views.crear_notificacion, name='crear_notificacion'),
+    path('notificaciones/difusion/', views.difusiones, name='difusiones'),
+    path('notificaciones/difusion/<int:difusion_id>/', views.detalle_difusion, name='detalle_difusion'),
     path('mis-notificaciones/', views.mis_notificaciones, name='mis_notificaciones'),
+    path('mis-notificaciones/archivadas/', views.notificaciones_archivadas, name='notificaciones_archivadas'),
+    path('mis-notificaciones/no-leidas/count/', views.contar_no_leidas, name='contar_no_leidas'),
+    path('mis-notificaciones/marcar-leidas/', views.marcar_notificaciones_leidas, name='marcar_notificaciones_leidas'),
+    path('notificaciones/<int:notificacion_id>/marcar-leida/', views.marcar_notificacion_leida, name='marcar_notificacion_leida'),
+    path('eventos/', views.eventos, name='eventos'),
+    path('eventos/ticket/', views.ticket_eventos, name='ticket_eventos'),
 ]
 urlpatterns += router.urls
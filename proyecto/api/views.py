@@ -1,15 +1,37 @@
 # api/views.py
+import copy
+import os
 from rest_framework import viewsets, permissions, generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes, action
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, action
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.generics import ListCreateAPIView
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
-from django.db import connection
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Medico, Paciente, Consulta, Especialidad, HistoriaClinica, Diagnostico, Tratamiento, Usuario, Rol,Cita,TipoExamen, AntecedenteMedico, Notificacion
+from .models import Medico, Paciente, Consulta, Especialidad, HistoriaClinica, Diagnostico, Tratamiento, Usuario, Rol,Cita,TipoExamen, AntecedenteMedico, Notificacion, DocumentoClinico, HorarioMedico, CitaEliminada, SuscripcionCalendario, SerieCita, EsperaCita, Difusion, NotificacionArchivada, RecordatorioSerie
+from .pagination import CursorPaginacion
+from .busqueda import LIMITE_RESULTADOS, buscar_pacientes
+from .busqueda_clinica import buscar_documentos, documentos_visibles, serializar_resultados
+from .calendario import VentanaInvalida, eventos_calendario, ventana_desde_parametros
+from .calendario_ics import citas_del_feed, generar_ics, series_del_feed, token_calendario, ventana_del_feed, version_feed
+from .citas_lote import LoteInvalido, aplicar_lote, leer_lote
+from .concurrencia import (
+    EdicionVersionadaMixin, VersionObsoleta, avanzar_version, etag_version, respuesta_version_obsoleta, version_esperada,
+)
+from .difusion import MAX_INMEDIATA, DifusionInvalida, crear_difusion, procesar_difusion
+from .disponibilidad import (
+    CitaSolapada, RangoInvalido, rango_desde_parametros, reserva_de_serie, reserva_de_turno, resumen_por_dia,
+    serializar_turnos, turnos_libres,
+)
+from .series import es_ocurrencia
+from .estadisticas import obtener_estadisticas
+from .historia import obtener_historia_clinica, version_historia
+from .eventos import DURACION_TICKET, emitir_ticket, flujo_eventos, publicar, usuario_del_stream
+from .lista_espera import cerrar_oferta
+from .resumen_agenda import leer_resumen, parametros_resumen
+from .sincronizacion import SincronizacionExpirada, TokenInvalido, cambios_citas, leer_token, nuevo_token
 from .serializers import (
     MedicoSerializer, 
     PacienteSerializer, 
@@ -19,13 +41,23 @@ from .serializers import (
     DiagnosticoSerializer, 
     TratamientoSerializer,
     RegistroSerializer,
-    CitaSerializer, ExamenMedicoSerializer, ExamenMedico,TipoExamenSerializer, AntecedenteMedicoSerializer, NotificacionSerializer
+    CitaSerializer, ExamenMedicoSerializer, ExamenMedico,TipoExamenSerializer, AntecedenteMedicoSerializer, NotificacionSerializer,
+    HorarioMedicoSerializer, ExcepcionHorarioSerializer, SerieCitaSerializer, EsperaCitaSerializer, DifusionSerializer,
+    NotificacionArchivadaSerializer,
 
 )
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from django.urls import reverse
 from django.shortcuts import get_object_or_404
 from django.conf import settings
-from datetime import datetime
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from datetime import datetime, timedelta
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth.models import User
 
 # === VISTAS DE AUTENTICACIÓN Y USUARIOS ===
@@ -252,6 +284,19 @@ def crear_usuario_admin(request):
         return Response({'error': f'Error al crear el usuario: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def estadisticas_dashboard(request):
+    """
+    Solo para admins: totales y desgloses del panel de administración.
+    Se sirven desde contadores mantenidos por señales, no recorriendo las tablas.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'No tienes permiso para ver esta información.'}, status=403)
+
+    return Response(obtener_estadisticas(), status=status.HTTP_200_OK)
+
+
 # === VIEWSETS PARA MODELOS ===
 
 class EsAdminOPublico(permissions.BasePermission):
@@ -269,6 +314,7 @@ class MedicoViewSet(viewsets.ModelViewSet):
     queryset = Medico.objects.select_related('especialidad').all()
     serializer_class = MedicoSerializer
     permission_classes = [EsAdminOPublico]  # GET para todos, POST/PUT/DELETE solo para admin
+    cursor_ordering = ('id',)
 
     # Opcional: Si quieres que solo los autenticados vean la lista, usa esto en su lugar:
     # permission_classes = [permissions.IsAuthenticated]
@@ -290,14 +336,148 @@ class MedicoViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(medicos, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def disponibilidad(self, request, pk=None):
+        """
+        Turnos libres del médico entre ?desde= y ?hasta= (fechas incluidas):
+        su horario semanal menos citas no canceladas y excepciones.
+        """
+        medico = self.get_object()
+        try:
+            desde, hasta = rango_desde_parametros(request.query_params)
+        except RangoInvalido as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        turnos = turnos_libres([medico.pk], desde, hasta)[medico.pk]
+        return Response({
+            'medico': medico.pk,
+            'desde': desde,
+            'hasta': hasta,
+            'turnos': serializar_turnos(turnos),
+        })
+
+    @action(detail=False, methods=['get'], url_path='disponibilidad', url_name='disponibilidad-general',
+            permission_classes=[IsAuthenticated])
+    def disponibilidad_general(self, request):
+        """
+        Resumen de turnos libres por día de todos los médicos (o de una
+        ?especialidad=) entre ?desde= y ?hasta=, para elegir médico y fecha.
+        """
+        try:
+            desde, hasta = rango_desde_parametros(request.query_params)
+        except RangoInvalido as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        medicos = Medico.objects.order_by('id')
+        especialidad = request.query_params.get('especialidad')
+        if especialidad:
+            if not especialidad.isdigit():
+                return Response({'error': 'El parámetro especialidad debe ser un id.'}, status=status.HTTP_400_BAD_REQUEST)
+            medicos = medicos.filter(especialidad_id=especialidad)
+        medicos = list(medicos.values('id', 'nombre', 'apellido', 'especialidad_id', 'especialidad__nombre'))
+
+        turnos = turnos_libres([medico['id'] for medico in medicos], desde, hasta)
+        return Response([
+            {
+                'medico': medico['id'],
+                'nombre': medico['nombre'],
+                'apellido': medico['apellido'],
+                'especialidad': {'id': medico['especialidad_id'], 'nombre': medico['especialidad__nombre']},
+                **resumen_por_dia(turnos[medico['id']]),
+            }
+            for medico in medicos
+        ])
+
+    def _puede_editar_horario(self, request, medico):
+        return request.user.is_staff or medico.usuario_id == request.user.id
+
+    @action(detail=True, methods=['get', 'put'], permission_classes=[IsAuthenticated])
+    def horario(self, request, pk=None):
+        """
+        GET: bloques semanales del médico.
+        PUT: reemplaza todos los bloques (solo el propio médico o un administrador).
+        """
+        medico = self.get_object()
+        if request.method == 'GET':
+            return Response(HorarioMedicoSerializer(medico.horarios.all(), many=True).data)
+
+        if not self._puede_editar_horario(request, medico):
+            return Response({'error': 'No puedes modificar el horario de otro médico.'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = HorarioMedicoSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        bloques = sorted(serializer.validated_data, key=lambda b: (b['dia_semana'], b['hora_inicio']))
+        for anterior, siguiente in zip(bloques, bloques[1:]):
+            if anterior['dia_semana'] == siguiente['dia_semana'] and siguiente['hora_inicio'] < anterior['hora_fin']:
+                return Response({'error': 'Los bloques de un mismo día no pueden solaparse.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            medico.horarios.all().delete()
+            HorarioMedico.objects.bulk_create([HorarioMedico(medico=medico, **bloque) for bloque in bloques])
+        return Response(HorarioMedicoSerializer(medico.horarios.all(), many=True).data)
+
+    @action(detail=True, methods=['get', 'post'], permission_classes=[IsAuthenticated])
+    def excepciones(self, request, pk=None):
+        """
+        GET: ausencias del médico desde hoy.
+        POST: registra una ausencia (solo el propio médico o un administrador).
+        """
+        medico = self.get_object()
+        if request.method == 'GET':
+            proximas = medico.excepciones_horario.filter(fecha__gte=timezone.localdate())
+            return Response(ExcepcionHorarioSerializer(proximas, many=True).data)
+
+        if not self._puede_editar_horario(request, medico):
+            return Response({'error': 'No puedes modificar el horario de otro médico.'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = ExcepcionHorarioSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(medico=medico)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 class PacienteViewSet(viewsets.ModelViewSet):
     queryset = Paciente.objects.all()
     serializer_class = PacienteSerializer
+    cursor_ordering = ('id',)
+
+    @action(detail=False, methods=['get'], url_path='buscar', permission_classes=[IsAuthenticated])
+    def buscar(self, request):
+        """
+        Búsqueda aproximada de pacientes por nombre, apellido, DNI o teléfono.
+        Tolera errores de tipeo y ordena por similitud (ver api/busqueda.py).
+        Parámetros: q (mínimo 2 caracteres), limite (máximo 100).
+        """
+        if not request.user.is_staff:
+            try:
+                request.user.medico
+            except Medico.DoesNotExist:
+                return Response(
+                    {'error': 'Solo administradores y médicos pueden buscar pacientes.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+        texto = request.query_params.get('q', '').strip()
+        if len(texto) < 2:
+            return Response(
+                {'error': 'El parámetro q debe tener al menos 2 caracteres.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limite = min(int(request.query_params.get('limite', LIMITE_RESULTADOS)), 100)
+        except ValueError:
+            return Response({'error': 'El parámetro limite debe ser un número.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        pacientes = buscar_pacientes(texto, max(limite, 1))
+        datos = PacienteSerializer(pacientes, many=True).data
+        for fila, paciente in zip(datos, pacientes):
+            fila['similitud'] = round(paciente.similitud, 3)
+        return Response(datos)
 
 
 class ConsultaViewSet(viewsets.ModelViewSet):
-    queryset = Consulta.objects.select_related('paciente', 'medico').all()
+    queryset = ConsultaSerializer.setup_eager_loading(Consulta.objects.all())
     serializer_class = ConsultaSerializer
+    cursor_ordering = ('-fecha', '-id')  # Más recientes primero (índice fecha, id)
 
 
 class EspecialidadListCreate(generics.ListCreateAPIView):
@@ -305,12 +485,64 @@ class EspecialidadListCreate(generics.ListCreateAPIView):
     serializer_class = EspecialidadSerializer
 
 
+class PaginacionBusquedaClinica(CursorPaginacion):
+    opcional = False
+    page_size = 20
+    max_page_size = 100
+    ordering = ('-fecha', '-id')  # Índice documento_fecha_id_idx
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def busqueda_clinica(request):
+    """
+    Búsqueda de texto completo en motivos de consulta, diagnósticos,
+    tratamientos y antecedentes (ver api/busqueda_clinica.py).
+
+    Parámetros: q (obligatorio), tipo (uno o varios separados por coma),
+    paciente_id. Resultados paginados por cursor, más recientes primero, con
+    un fragmento del texto y las coincidencias marcadas con <b>.
+    Administradores ven todo; médicos, sus pacientes; pacientes, lo suyo.
+    """
+    documentos = documentos_visibles(request.user)
+    if documentos is None:
+        return Response({'error': 'No tienes permiso para ver esta información.'}, status=status.HTTP_403_FORBIDDEN)
+
+    texto = request.query_params.get('q', '').strip()
+    if not texto:
+        return Response({'error': 'El parámetro q es obligatorio.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    tipos = [tipo for tipo in request.query_params.get('tipo', '').split(',') if tipo]
+    if tipos:
+        validos = dict(DocumentoClinico.TIPO_CHOICES)
+        if any(tipo not in validos for tipo in tipos):
+            return Response(
+                {'error': f"Tipo inválido. Opciones: {', '.join(validos)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        documentos = documentos.filter(tipo__in=tipos)
+
+    paciente_id = request.query_params.get('paciente_id')
+    if paciente_id:
+        try:
+            documentos = documentos.filter(paciente_id=int(paciente_id))
+        except ValueError:
+            return Response({'error': 'El parámetro paciente_id debe ser un número.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    documentos = buscar_documentos(documentos.select_related('paciente').defer('vector'), texto)
+    paginador = PaginacionBusquedaClinica()
+    pagina = paginador.paginate_queryset(documentos, request)
+    return paginador.get_paginated_response(serializar_resultados(pagina, texto))
+
+
 # === VISTAS PARA HISTORIA CLÍNICA Y DIAGNÓSTICOS ===
 
 @api_view(['GET'])
 def historia_clinica_paciente(request, paciente_id):
     try:
-        historia = HistoriaClinica.objects.get(paciente__id=paciente_id)
+        historia = HistoriaClinicaSerializer.setup_eager_loading(
+            HistoriaClinica.objects.all()
+        ).get(paciente__id=paciente_id)
         serializer = HistoriaClinicaSerializer(historia)
         return Response(serializer.data)
     except HistoriaClinica.DoesNotExist:
@@ -323,156 +555,31 @@ def historia_clinica_paciente(request, paciente_id):
 @api_view(['GET'])
 def historia_clinica_paciente_detalles(request, paciente_id):
     """
-    Obtiene la historia clínica con todas las consultas, diagnósticos y tratamientos usando SQL directo
+    Obtiene la historia clínica con todas las consultas, diagnósticos y tratamientos.
+    Cada nivel se consulta por separado y se anida en memoria (ver api/historia.py).
+
+    El documento se cachea por paciente y versión; la versión va en el ETag, así
+    que si el cliente ya tiene la última (If-None-Match) se responde 304 sin
+    reconstruirlo.
     """
     try:
-        with connection.cursor() as cursor:
-            # Ejecutamos la consulta SQL incluyendo tratamientos Y SUS INDICACIONES
-            cursor.execute("""
-                SELECT 
-                    pa.id as paciente_id,
-                    pa.nombre as paciente_nombre,
-                    pa.apellido as paciente_apellido,
-                    pa.dni as paciente_dni,
-                    pa.fecha_nacimiento as paciente_fecha_nacimiento,
-                    pa.telefono as paciente_telefono,
-                    pa.direccion as paciente_direccion,
-                    hc.id as historia_id,
-                    hc.fecha_inicio as historia_fecha_inicio,
-                    hc.observaciones as historia_observaciones,
-                    con.id as consulta_id,
-                    con.fecha as consulta_fecha,
-                    con.motivo as consulta_motivo,
-                    med.id as medico_id,
-                    med.nombre as medico_nombre,
-                    med.apellido as medico_apellido,
-                    med.dni as medico_dni,
-                    med.telefono as medico_telefono,
-                    med.especialidad_id as medico_especialidad,
-                    diag.id as diagnostico_id,
-                    diag.descripcion as diagnostico_descripcion,
-                    diag.fecha as diagnostico_fecha,
-                    trat.id as tratamiento_id,
-                    trat.descripcion as tratamiento_descripcion,
-                    trat.indicaciones as tratamiento_indicaciones,  -- ¡Campo que faltaba!
-                    trat.duracion_dias as tratamiento_duracion_dias,
-                    trat.fecha_inicio as tratamiento_fecha_inicio
-                FROM public.api_paciente as pa 
-                LEFT JOIN public.api_historiaclinica as hc ON pa.id = hc.paciente_id
-                INNER JOIN public.api_consulta as con ON pa.id = con.paciente_id
-                INNER JOIN public.api_medico as med ON con.medico_id = med.id
-                LEFT JOIN public.api_diagnostico as diag ON con.id = diag.consulta_id
-                LEFT JOIN public.api_tratamiento as trat ON diag.id = trat.diagnostico_id
-                WHERE pa.id = %s
-                ORDER BY con.fecha DESC, diag.fecha DESC, trat.fecha_inicio DESC
-            """, [paciente_id])
-            
-            rows = cursor.fetchall()
-            
-            if not rows:
-                return Response({"error": "Este paciente no tiene historia clínica."}, status=404)
-            
-            # Procesamos los resultados
-            paciente_data = None
-            consultas_dict = {}
-            diagnosticos_dict = {}  # Para rastrear diagnósticos y sus tratamientos
-            
-            for row in rows:
-                # Datos del paciente (solo del primer registro)
-                if paciente_data is None:
-                    paciente_data = {
-                        'id': row[0],
-                        'nombre': row[1] if row[1] else '',
-                        'apellido': row[2] if row[2] else '',
-                        'dni': row[3] if row[3] else '',
-                        'fecha_nacimiento': row[4],
-                        'telefono': row[5] if row[5] else '',
-                        'direccion': row[6] if row[6] else ''
-                    }
-                
-                # Datos de la historia clínica
-                historia_data = {
-                    'id': row[7],
-                    'fecha_inicio': row[8],
-                    'observaciones': row[9] if row[9] else ''
-                }
-                
-                # Verificar que la consulta exista
-                if row[10] is None:
-                    continue
-                    
-                # Datos de la consulta
-                consulta_id = row[10]
-                if consulta_id not in consultas_dict:
-                    consultas_dict[consulta_id] = {
-                        'id': consulta_id,
-                        'paciente': paciente_id,
-                        'medico': row[13],
-                        'fecha': row[11],
-                        'motivo': row[12] if row[12] else '',
-                        'paciente_detalle': paciente_data,
-                        'medico_detalle': {
-                            'id': row[13],
-                            'nombre': row[14] if row[14] else '',
-                            'apellido': row[15] if row[15] else '',
-                            'dni': row[16] if row[16] else '',
-                            'telefono': row[17] if row[17] else '',
-                            'especialidad': row[18]
-                        },
-                        'diagnosticos': []
-                    }
-                
-                # Agregar diagnóstico si existe
-                if row[19] is not None:  # diagnostico_id existe
-                    diagnostico_id = row[19]
-                    diagnostico_key = f"{consulta_id}_{diagnostico_id}"
-                    
-                    # Verificar si el diagnóstico ya existe en esta consulta
-                    diagnostico_exists = any(
-                        d['id'] == diagnostico_id 
-                        for d in consultas_dict[consulta_id]['diagnosticos']
-                    )
-                    
-                    if not diagnostico_exists:
-                        diagnosticos_dict[diagnostico_key] = {
-                            'id': diagnostico_id,
-                            'descripcion': row[20] if row[20] else '',
-                            'fecha': row[21],
-                            'tratamientos': []
-                        }
-                        consultas_dict[consulta_id]['diagnosticos'].append(diagnosticos_dict[diagnostico_key])
-                    
-                    # Agregar tratamiento si existe
-                    if row[22] is not None:  # tratamiento_id existe
-                        tratamiento = {
-                            'id': row[22],
-                            'descripcion': row[23] if row[23] else '',  # tratamiento_descripcion
-                            'indicaciones': row[24] if row[24] else '', # tratamiento_indicaciones (¡Campo que faltaba!)
-                            'duracion_dias': row[25],  # tratamiento_duracion_dias
-                            'fecha_inicio': row[26]     # tratamiento_fecha_inicio
-                        }
-                        
-                        # Verificar que el diagnóstico exista en el diccionario
-                        if diagnostico_key in diagnosticos_dict:
-                            # Evitar duplicados de tratamientos
-                            tratamiento_exists = any(
-                                t['id'] == tratamiento['id'] 
-                                for t in diagnosticos_dict[diagnostico_key]['tratamientos']
-                            )
-                            if not tratamiento_exists:
-                                diagnosticos_dict[diagnostico_key]['tratamientos'].append(tratamiento)
-            
-            # Construir la respuesta final
-            response_data = {
-                'id': historia_data['id'],
-                'fecha_inicio': historia_data['fecha_inicio'],
-                'observaciones': historia_data['observaciones'],
-                'paciente_detalle': paciente_data,
-                'consultas': list(consultas_dict.values())
-            }
-            
-            return Response(response_data)
-            
+        version = version_historia(paciente_id)
+        etag = f'"historia-{paciente_id}-{version}"'
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if etag in [valor.strip() for valor in if_none_match.split(',')]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        version, response_data = obtener_historia_clinica(paciente_id, version)
+        if response_data is None:
+            return Response({"error": "Este paciente no tiene historia clínica."}, status=404)
+
+        response = Response(response_data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'  # El navegador siempre revalida con el ETag
+        return response
+
     except Exception as e:
         return Response({"error": f"Error al procesar la solicitud: {str(e)}"}, status=500)
 
@@ -490,13 +597,14 @@ def crear_diagnostico(request):
 
 @api_view(['GET'])
 def obtener_diagnostico_por_consulta(request, consulta_id):
-    """Obtener diagnóstico por ID de consulta"""
-    try:
-        diagnostico = Diagnostico.objects.get(consulta_id=consulta_id)
-        serializer = DiagnosticoSerializer(diagnostico)
-        return Response(serializer.data)
-    except Diagnostico.DoesNotExist:
+    """Obtener el diagnóstico más reciente de una consulta"""
+    diagnostico = Diagnostico.objects.prefetch_related('tratamientos').filter(
+        consulta_id=consulta_id
+    ).order_by('-fecha', '-id').first()
+    if diagnostico is None:
         return Response({"error": "Diagnóstico no encontrado"}, status=404)
+    serializer = DiagnosticoSerializer(diagnostico)
+    return Response(serializer.data)
 
 
 @api_view(['GET'])
@@ -505,7 +613,7 @@ def obtener_diagnosticos_por_paciente(request, paciente_id):
     try:
         diagnosticos = Diagnostico.objects.filter(
             consulta__paciente_id=paciente_id
-        ).select_related('consulta')
+        ).select_related('consulta').prefetch_related('tratamientos')
         serializer = DiagnosticoSerializer(diagnosticos, many=True)
         return Response(serializer.data)
     except Exception as e:
@@ -651,6 +759,23 @@ class CitaSerializer(serializers.ModelSerializer):
         read_only_fields = ('paciente', 'estado', 'fecha_solicitud')
 """
 
+def respuesta_cita_solapada(error):
+    return Response(
+        {'error': str(error), **error.detalle()},
+        status=status.HTTP_409_CONFLICT
+    )
+
+
+def guardar_cita(serializer, **extra):
+    """serializer.save() de una cita dentro de reserva_de_turno (ver api/disponibilidad.py)."""
+    anterior = serializer.instance
+    cita = copy.copy(anterior) if anterior else Cita()
+    for campo, valor in {**serializer.validated_data, **extra}.items():
+        setattr(cita, campo, valor)
+    with reserva_de_turno(cita, anterior):
+        return serializer.save(**extra)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def crear_cita_paciente(request):
@@ -713,22 +838,28 @@ def crear_cita_paciente(request):
 
     # Opcional: Validar que la fecha no sea en el pasado
     from django.utils import timezone
+    if timezone.is_naive(fecha_hora_propuesta):
+        fecha_hora_propuesta = timezone.make_aware(fecha_hora_propuesta)
     if fecha_hora_propuesta < timezone.now():
         return Response({'error': 'La fecha de la cita no puede ser en el pasado.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Crear la cita
+    # Crear la cita si el médico tiene libre ese horario
     try:
-        cita = Cita.objects.create(
+        cita = Cita(
             paciente=paciente,
             medico=medico,
             fecha_hora_propuesta=fecha_hora_propuesta,
             motivo=motivo,
             estado='solicitada'  # Estado inicial
         )
+        with reserva_de_turno(cita):
+            cita.save()
 
         # Serializar y devolver la cita creada
         serializer = CitaSerializer(cita)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+    except CitaSolapada as e:
+        return respuesta_cita_solapada(e)
     except Exception as e:
         return Response({'error': f'Error al crear la cita: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -812,30 +943,40 @@ def crear_cita_admin(request):
 
     # Opcional: Validar que la fecha no sea en el pasado
     from django.utils import timezone
+    if timezone.is_naive(fecha_hora_propuesta):
+        fecha_hora_propuesta = timezone.make_aware(fecha_hora_propuesta)
     if fecha_hora_propuesta < timezone.now():
         return Response({'error': 'La fecha de la cita no puede ser en el pasado.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Crear la cita
+    # Crear la cita si el médico tiene libre ese horario
     try:
-        cita = Cita.objects.create(
+        cita = Cita(
             paciente=paciente,
             medico=medico,
             fecha_hora_propuesta=fecha_hora_propuesta,
             motivo=motivo,
             estado='solicitada'  # Estado inicial por defecto, puede ser confirmada directamente por admin
         )
+        with reserva_de_turno(cita):
+            cita.save()
 
         # Serializar y devolver la cita creada
         serializer = CitaSerializer(cita)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+    except CitaSolapada as e:
+        return respuesta_cita_solapada(e)
     except Exception as e:
         return Response({'error': f'Error al crear la cita: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# Lo que anida ExamenMedicoSerializer: paciente, médico (con especialidad), tipo y diagnóstico
+EXAMENES_CON_RELACIONES = ExamenMedico.objects.select_related(
+    'paciente', 'medico__especialidad', 'tipo_examen', 'diagnostico_relacionado'
+).prefetch_related('diagnostico_relacionado__tratamientos')
+
+
 class ExamenMedicoListCreate(generics.ListCreateAPIView):
-    queryset = ExamenMedico.objects.all().select_related(
-        'paciente', 'medico', 'tipo_examen', 'diagnostico_relacionado'
-    )
+    queryset = EXAMENES_CON_RELACIONES.all()
     serializer_class = ExamenMedicoSerializer
     permission_classes = [IsAuthenticated]
 
@@ -847,10 +988,15 @@ class ExamenMedicoListCreate(generics.ListCreateAPIView):
         except Medico.DoesNotExist:
             raise serializers.ValidationError("El usuario no tiene un perfil de médico asociado.")
 
-class ExamenMedicoDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ExamenMedico.objects.all()
+class ExamenMedicoDetail(EdicionVersionadaMixin, generics.RetrieveUpdateDestroyAPIView):
+    """
+    GET devuelve el ETag de la versión; PUT/PATCH/DELETE con If-Match
+    responden 412 si el examen cambió entretanto (ver api/concurrencia.py).
+    """
+    queryset = EXAMENES_CON_RELACIONES.all()
     serializer_class = ExamenMedicoSerializer
     permission_classes = [IsAuthenticated]
+    recurso_versionado = 'El examen'
 
 class ExamenesPorPaciente(generics.ListAPIView):
     serializer_class = ExamenMedicoSerializer
@@ -858,9 +1004,10 @@ class ExamenesPorPaciente(generics.ListAPIView):
 
     def get_queryset(self):
         paciente_id = self.kwargs['paciente_id']
-        return ExamenMedico.objects.filter(paciente_id=paciente_id).order_by('-fecha_solicitud')
+        return EXAMENES_CON_RELACIONES.filter(paciente_id=paciente_id).order_by('-fecha_solicitud')
 
 # Vista para descargar archivos
+@api_view(['GET'])
 def descargar_archivo_examen(request, examen_id):
     examen = get_object_or_404(ExamenMedico, id=examen_id)
     if not examen.archivo_resultado:
@@ -879,7 +1026,7 @@ class TipoExamenListCreate(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]  # O [IsAdminUser] si solo admins pueden crear
 
 class DiagnosticoList(generics.ListCreateAPIView):
-    queryset = Diagnostico.objects.all()
+    queryset = Diagnostico.objects.prefetch_related('tratamientos')
     serializer_class = DiagnosticoSerializer
 
 @api_view(['GET'])
@@ -922,25 +1069,22 @@ def buscar_medico_por_dni(request):
 @permission_classes([IsAuthenticated])
 def obtener_citas_por_medico(request):
     """
-    Devuelve las citas del médico autenticado.
+    Devuelve las citas del médico autenticado como eventos de FullCalendar.
     Si el usuario es admin, puede ver todas las citas o filtrar por médico.
-    Filtros opcionales: fecha_inicio, fecha_fin, medico_id (solo para admin)
+    Obligatorios: fecha_inicio y fecha_fin (la ventana visible del calendario).
+    Opcional: medico_id (solo para admin).
     """
-    # Variables para filtrar
-    fecha_inicio_str = request.query_params.get('fecha_inicio', None)
-    fecha_fin_str = request.query_params.get('fecha_fin', None)
-    medico_id = request.query_params.get('medico_id', None)
-
-    # Inicializar el queryset
-    citas = Cita.objects.all().select_related('paciente', 'medico')
+    citas = Cita.objects.all()
+    series = SerieCita.objects.all()
 
     # Lógica según el tipo de usuario
     if request.user.is_staff:
         # Admin: puede ver todas las citas
+        medico_id = request.query_params.get('medico_id', None)
         if medico_id:
             try:
-                medico_id = int(medico_id)
-                citas = citas.filter(medico_id=medico_id)
+                citas = citas.filter(medico_id=int(medico_id))
+                series = series.filter(medico_id=int(medico_id))
             except (ValueError, TypeError):
                 return Response(
                     {'error': 'El parámetro medico_id debe ser un número válido.'},
@@ -949,71 +1093,27 @@ def obtener_citas_por_medico(request):
     else:
         # Médico regular: solo ve sus citas
         try:
-            medico = request.user.medico
-            citas = citas.filter(medico=medico)
+            citas = citas.filter(medico=request.user.medico)
+            series = series.filter(medico=request.user.medico)
         except Medico.DoesNotExist:
             return Response(
                 {'error': 'El usuario no tiene un perfil de médico asociado.'},
                 status=status.HTTP_403_FORBIDDEN
             )
 
-    # Aplicar filtros de fecha
-    if fecha_inicio_str:
-        try:
-            fecha_inicio = datetime.fromisoformat(fecha_inicio_str)
-            citas = citas.filter(fecha_hora_propuesta__gte=fecha_inicio)
-        except ValueError:
-            return Response(
-                {'error': 'Formato de fecha_inicio inválido. Usa ISO 8601 (ej: 2025-08-01T08:00:00).'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-    if fecha_fin_str:
-        try:
-            fecha_fin = datetime.fromisoformat(fecha_fin_str)
-            citas = citas.filter(fecha_hora_propuesta__lte=fecha_fin)
-        except ValueError:
-            return Response(
-                {'error': 'Formato de fecha_fin inválido. Usa ISO 8601 (ej: 2025-08-31T18:00:00).'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-    # Ordenar por fecha
-    citas = citas.order_by('fecha_hora_propuesta')
-
-    # Serializar manualmente para FullCalendar
-    eventos = []
-    for cita in citas:
-        eventos.append({
-            'id': cita.id,
-            'title': f"{cita.paciente.nombre} {cita.paciente.apellido}",
-            'start': cita.fecha_hora_propuesta.isoformat(),
-            'end': cita.fecha_hora_propuesta.isoformat(),  # Puedes ajustar duración si lo deseas
-            'extendedProps': {
-                'motivo': cita.motivo or 'Sin motivo',
-                'estado': cita.estado,
-                'paciente_id': cita.paciente.id,
-                'paciente_nombre': f"{cita.paciente.nombre} {cita.paciente.apellido}",
-                'medico_id': cita.medico.id,
-                'medico_nombre': f"{cita.medico.nombre} {cita.medico.apellido}",
-            },
-            'backgroundColor': (
-                '#4CAF50' if cita.estado == 'confirmada' else
-                '#FF9800' if cita.estado == 'solicitada' else
-                '#F44336' if cita.estado == 'cancelada' else
-                '#9E9E9E'
-            ),
-            'borderColor': '#000',
-            'textColor': '#fff',
-        })
+    try:
+        inicio, fin = ventana_desde_parametros(request.query_params)
+    except VentanaInvalida as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response(eventos, status=status.HTTP_200_OK)
+    return Response(eventos_calendario(citas, inicio, fin, 'medico', series=series), status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def obtener_citas_por_paciente(request):
     """
-    Devuelve las citas del paciente autenticado.
+    Devuelve las citas del paciente autenticado dentro de la ventana
+    fecha_inicio/fecha_fin (obligatoria).
     """
     try:
         paciente = request.user.paciente
@@ -1023,40 +1123,140 @@ def obtener_citas_por_paciente(request):
             status=status.HTTP_403_FORBIDDEN
         )
 
-    citas = Cita.objects.filter(paciente=paciente).select_related('medico').order_by('fecha_hora_propuesta')
-
-    eventos = []
-    for cita in citas:
-        eventos.append({
-            'id': cita.id,
-            'title': f"Dr. {cita.medico.nombre} {cita.medico.apellido}",
-            'start': cita.fecha_hora_propuesta.isoformat(),
-            'end': (cita.fecha_hora_propuesta).isoformat(),
-            'extendedProps': {
-                'motivo': cita.motivo,
-                'estado': cita.estado,
-                'medico_id': cita.medico.id,
-            },
-            'backgroundColor': (
-                '#4CAF50' if cita.estado == 'confirmada' else
-                '#FF9800' if cita.estado == 'solicitada' else
-                '#F44336' if cita.estado == 'cancelada' else
-                '#9E9E9E'
-            ),
-            'borderColor': '#000'
-        })
+    try:
+        inicio, fin = ventana_desde_parametros(request.query_params)
+    except VentanaInvalida as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    citas = Cita.objects.filter(paciente=paciente)
+    series = SerieCita.objects.filter(paciente=paciente)
+    return Response(eventos_calendario(citas, inicio, fin, 'paciente', series=series), status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def sincronizar_citas(request):
+    """
+    Cambios en las citas desde el token ?desde= (o ?since=): citas nuevas o
+    modificadas como eventos de FullCalendar e ids eliminados, más el token
+    para la siguiente llamada. Sin token solo devuelve el token inicial: el
+    calendario lo pide antes de cargar su ventana.
+    Admin: todas o las de ?medico_id=; médico y paciente: las suyas.
+    """
+    user = request.user
+    citas = Cita.objects.all()
+    eliminadas = CitaEliminada.objects.all()
+    series = SerieCita.objects.all()
+    vista = 'medico'
+    if user.is_staff:
+        medico_id = request.query_params.get('medico_id')
+        if medico_id:
+            if not medico_id.isdigit():
+                return Response({'error': 'El parámetro medico_id debe ser un número válido.'}, status=status.HTTP_400_BAD_REQUEST)
+            citas = citas.filter(medico_id=medico_id)
+            eliminadas = eliminadas.filter(medico_id=medico_id)
+            series = series.filter(medico_id=medico_id)
+    elif hasattr(user, 'medico'):
+        citas = citas.filter(medico=user.medico)
+        eliminadas = eliminadas.filter(medico_id=user.medico.pk)
+        series = series.filter(medico=user.medico)
+    elif hasattr(user, 'paciente'):
+        vista = 'paciente'
+        citas = citas.filter(paciente=user.paciente)
+        eliminadas = eliminadas.filter(paciente_id=user.paciente.pk)
+        series = series.filter(paciente=user.paciente)
+    else:
+        return Response({'error': 'No tienes citas que sincronizar.'}, status=status.HTTP_403_FORBIDDEN)
 
-    return Response(eventos, status=status.HTTP_200_OK)
+    token = request.query_params.get('desde') or request.query_params.get('since')
+    if not token:
+        return Response({'token': nuevo_token(), 'citas': [], 'eliminadas': []})
+    try:
+        desde = leer_token(token)
+    except TokenInvalido as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        return Response(cambios_citas(citas, eliminadas, desde, vista, series=series))
+    except SincronizacionExpirada as e:
+        return Response({'error': str(e)}, status=status.HTTP_410_GONE)
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def suscripcion_calendario(request):
+    """
+    URL .ics para suscribir la agenda en Google Calendar, Outlook o el móvil.
+    GET la devuelve (creándola la primera vez); POST genera una nueva y la
+    anterior deja de funcionar.
+    """
+    user = request.user
+    if hasattr(user, 'medico'):
+        tipo = 'medico'
+    elif hasattr(user, 'paciente'):
+        tipo = 'paciente'
+    else:
+        return Response({'error': 'Solo médicos y pacientes tienen calendario.'}, status=status.HTTP_403_FORBIDDEN)
+
+    token = token_calendario(user, regenerar=request.method == 'POST')
+    url = request.build_absolute_uri(reverse(f'calendario_ics_{tipo}', kwargs={'token': token}))
+    return Response({'url': url, 'tipo': tipo})
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def calendario_ics(request, tipo, token):
+    """
+    Feed iCalendar de las citas de un médico o paciente; el token de la URL
+    es la credencial. Responde 304 si la agenda no cambió desde el ETag o la
+    fecha que envía el cliente, sin leer las citas; si cambió, el archivo se
+    genera en streaming.
+    """
+    suscripcion = SuscripcionCalendario.objects.filter(token=token).select_related(f'usuario__{tipo}').first()
+    dueno = getattr(suscripcion.usuario, tipo, None) if suscripcion else None
+    if dueno is None:
+        return Response({'error': 'Calendario no encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+
+    if tipo == 'medico':
+        propias = Cita.objects.filter(medico=dueno)
+        eliminadas = CitaEliminada.objects.filter(medico_id=dueno.pk)
+        series = series_del_feed(SerieCita.objects.filter(medico=dueno))
+        nombre = f'Agenda Dr. {dueno.nombre} {dueno.apellido}'
+    else:
+        propias = Cita.objects.filter(paciente=dueno)
+        eliminadas = CitaEliminada.objects.filter(paciente_id=dueno.pk)
+        series = series_del_feed(SerieCita.objects.filter(paciente=dueno))
+        nombre = 'Mis citas médicas'
+
+    citas = citas_del_feed(propias)
+    etag, ultima = version_feed(ventana_del_feed(propias), eliminadas, series)
+    ultima = int(ultima.timestamp()) if ultima else None
+    response = get_conditional_response(request, etag=etag, last_modified=ultima)
+    if response is None:
+        response = StreamingHttpResponse(
+            generar_ics(citas, nombre, tipo, request.get_host().split(':')[0], series=series),
+            content_type='text/calendar; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'inline; filename="citas-{tipo}.ics"'
+    response['ETag'] = etag
+    if ultima:
+        response['Last-Modified'] = http_date(ultima)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 class CitaListCreate(ListCreateAPIView):
-    queryset = Cita.objects.all().select_related('paciente', 'medico')
+    queryset = Cita.objects.all().select_related('paciente', 'medico__especialidad')
     serializer_class = CitaSerializer
     permission_classes = [IsAuthenticated]
 
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except CitaSolapada as e:
+            return respuesta_cita_solapada(e)
+
     def perform_create(self, serializer):
-        # El paciente y médico ya vienen en los datos
-        # Puedes agregar lógica adicional si lo necesitas
-        serializer.save()
+        # El paciente y médico ya vienen en los datos; se rechaza si el turno está ocupado
+        guardar_cita(serializer)
 
 from .models import Cita
 
@@ -1064,35 +1264,18 @@ from .models import Cita
 @permission_classes([IsAuthenticated])
 def listar_todas_citas(request):
     """
-    Solo para admins: devuelve todas las citas del sistema.
+    Solo para admins: devuelve las citas de todo el sistema dentro de la
+    ventana fecha_inicio/fecha_fin (obligatoria).
     """
     if not request.user.is_staff:
         return Response({'error': 'No tienes permiso para ver esta información.'}, status=403)
 
-    citas = Cita.objects.all().select_related('paciente', 'medico')
-    eventos = []
-    for cita in citas:
-        eventos.append({
-            'id': cita.id,
-            'title': f"{cita.paciente.nombre} {cita.paciente.apellido}",
-            'start': cita.fecha_hora_propuesta.isoformat(),
-            'end': cita.fecha_hora_propuesta.isoformat(),
-            'extendedProps': {
-                'motivo': cita.motivo,
-                'estado': cita.estado,
-                'paciente_id': cita.paciente.id,
-                'medico_id': cita.medico.id,
-                'medico_nombre': f"{cita.medico.nombre} {cita.medico.apellido}",
-            },
-            'backgroundColor': (
-                '#4CAF50' if cita.estado == 'confirmada' else
-                '#FF9800' if cita.estado == 'solicitada' else
-                '#F44336' if cita.estado == 'cancelada' else
-                '#9E9E9E'
-            ),
-            'borderColor': '#000',
-        })
-    return Response(eventos, status=200)
+    try:
+        inicio, fin = ventana_desde_parametros(request.query_params)
+    except VentanaInvalida as e:
+        return Response({'error': str(e)}, status=400)
+
+    return Response(eventos_calendario(Cita.objects.all(), inicio, fin, 'admin', series=SerieCita.objects.all()), status=200)
 
 class AntecedenteMedicoDetail(generics.RetrieveUpdateAPIView):
     """
@@ -1161,20 +1344,332 @@ def gestionar_cita(request, cita_id):
     if request.method == 'DELETE':
         if not puede_eliminar:
             return Response({'error': 'No tienes permiso para eliminar esta cita.'}, status=403)
-        cita.delete()
+        try:
+            with transaction.atomic():
+                avanzar_version(cita, version_esperada(request, cita))
+                cita.delete()
+        except VersionObsoleta as e:
+            return respuesta_version_obsoleta(e, 'La cita')
         return Response({'message': 'Cita eliminada correctamente.'}, status=200)
 
     # === PUT ===
+    # Con If-Match: "<version>" responde 412 si otro cambio se adelantó (api/concurrencia.py)
     if request.method == 'PUT':
         if not puede_editar:
             return Response({'error': 'No tienes permiso para editar esta cita.'}, status=403)
 
         serializer = CitaSerializer(cita, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
+            try:
+                with transaction.atomic():
+                    avanzar_version(cita, version_esperada(request, cita))
+                    guardar_cita(serializer)
+            except VersionObsoleta as e:
+                return respuesta_version_obsoleta(e, 'La cita')
+            except CitaSolapada as e:
+                return respuesta_cita_solapada(e)
+            response = Response(serializer.data)
+            response['ETag'] = etag_version(cita.version)
+            return response
         return Response(serializer.errors, status=400)
     
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def actualizar_citas_lote(request):
+    """
+    Confirma, cancela o reprograma varias citas en una sola petición.
+    Cuerpo: {"ids": [...], "estado": "confirmada"} o {"ids": [...], "desplazar_minutos": 30}.
+    Responde con el resultado de cada id (ver api/citas_lote.py).
+    """
+    try:
+        ids, estado, desplazamiento = leer_lote(request.data)
+    except LoteInvalido as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    resultados = aplicar_lote(request.user, ids, estado=estado, desplazamiento=desplazamiento)
+    return Response({
+        'actualizadas': sum(1 for r in resultados if r['resultado'] == 'actualizada'),
+        'resultados': resultados,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def resumen_agenda(request):
+    """
+    Citas por día (?agrupar=dia) o mes (?agrupar=mes) y estado entre ?desde=
+    y ?hasta= (fechas incluidas, hasta un año), con el primer y último turno,
+    para los gráficos del panel. El médico ve su agenda; el admin la de toda
+    la clínica o la de ?medico_id=. Sale de ResumenAgenda, no de contar citas.
+    """
+    user = request.user
+    try:
+        desde, hasta, agrupar = parametros_resumen(request.query_params)
+    except RangoInvalido as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if user.is_staff:
+        medico_id = request.query_params.get('medico_id')
+        if medico_id and not medico_id.isdigit():
+            return Response({'error': 'El parámetro medico_id debe ser un número válido.'}, status=status.HTTP_400_BAD_REQUEST)
+        medico_id = int(medico_id) if medico_id else None
+    elif hasattr(user, 'medico'):
+        medico_id = user.medico.pk
+    else:
+        return Response({'error': 'Solo médicos y administradores ven el resumen de agenda.'}, status=status.HTTP_403_FORBIDDEN)
+
+    return Response({
+        'medico_id': medico_id,
+        'desde': desde,
+        'hasta': hasta,
+        'agrupar': agrupar,
+        'periodos': leer_resumen(desde, hasta, medico_id=medico_id, agrupar=agrupar),
+    })
+
+
+def series_visibles(user):
+    """Series que ve el usuario, con el mismo criterio que sus citas (None si ninguna)."""
+    if user.is_staff:
+        return SerieCita.objects.all()
+    if hasattr(user, 'medico'):
+        return SerieCita.objects.filter(medico=user.medico)
+    if hasattr(user, 'paciente'):
+        return SerieCita.objects.filter(paciente=user.paciente)
+    return None
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def series_citas(request):
+    """
+    Citas periódicas (semanales o mensuales). Las ocurrencias no se guardan:
+    aparecen en los calendarios y cuentan como ocupadas al reservar.
+    GET: series del usuario (admin: todas o las de ?medico_id=).
+    POST: crea una serie (admin, o el médico para sí mismo). Responde 409 si
+    alguna ocurrencia del primer año choca con otra cita del médico.
+    """
+    user = request.user
+    if request.method == 'GET':
+        series = series_visibles(user)
+        if series is None:
+            return Response({'error': 'No tienes citas.'}, status=status.HTTP_403_FORBIDDEN)
+        medico_id = request.query_params.get('medico_id')
+        if user.is_staff and medico_id:
+            if not medico_id.isdigit():
+                return Response({'error': 'El parámetro medico_id debe ser un número válido.'}, status=status.HTTP_400_BAD_REQUEST)
+            series = series.filter(medico_id=medico_id)
+        return Response(SerieCitaSerializer(series.order_by('fecha_hora_inicio', 'id'), many=True).data)
+
+    if not (user.is_staff or hasattr(user, 'medico')):
+        return Response({'error': 'Solo administradores y médicos pueden crear series de citas.'}, status=status.HTTP_403_FORBIDDEN)
+    serializer = SerieCitaSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    extra = {} if user.is_staff else {'medico': user.medico}
+    serie = SerieCita(**{**serializer.validated_data, **extra})
+    try:
+        with reserva_de_serie(serie):
+            serializer.save(**extra)
+    except CitaSolapada as e:
+        return respuesta_cita_solapada(e)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def gestionar_serie(request, serie_id):
+    """
+    GET: la serie. DELETE: la termina; desde hoy no hay más ocurrencias. Las
+    pasadas y las citas ya guardadas (ocurrencias movidas) se conservan. Una
+    serie que aún no empezó se borra.
+    """
+    series = series_visibles(request.user)
+    serie = series.filter(pk=serie_id).first() if series is not None else None
+    if serie is None:
+        return Response({'error': 'Serie no encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+    if request.method == 'GET':
+        return Response(SerieCitaSerializer(serie).data)
+
+    if not (request.user.is_staff or serie.medico.usuario_id == request.user.pk):
+        return Response({'error': 'No tienes permiso para terminar esta serie.'}, status=status.HTTP_403_FORBIDDEN)
+    hoy = timezone.localdate()
+    if timezone.localdate(serie.fecha_hora_inicio) >= hoy:
+        serie.delete()
+        return Response({'message': 'Serie eliminada.'})
+    serie.fecha_fin = min(serie.fecha_fin or hoy, hoy - timedelta(days=1))
+    serie.save(update_fields=['fecha_fin', 'fecha_actualizacion'])
+    return Response({'message': 'Serie terminada.', 'fecha_fin': serie.fecha_fin})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def modificar_ocurrencia(request, serie_id):
+    """
+    Mueve, cancela o edita una ocurrencia de la serie: se guarda como Cita
+    (con serie y fecha_original) y desde entonces se gestiona como cualquier
+    cita en /api/citas/<id>/. Cuerpo: fecha_original (obligatoria) y los
+    campos que cambian (fecha_hora_propuesta, duracion_minutos, estado, motivo).
+    """
+    series = series_visibles(request.user)
+    serie = series.filter(pk=serie_id).first() if series is not None else None
+    if serie is None:
+        return Response({'error': 'Serie no encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+
+    fecha_original = parse_datetime(str(request.data.get('fecha_original') or ''))
+    if fecha_original is None:
+        return Response({'error': 'fecha_original es obligatoria (ISO 8601).'}, status=status.HTTP_400_BAD_REQUEST)
+    if timezone.is_naive(fecha_original):
+        fecha_original = timezone.make_aware(fecha_original)
+    if not es_ocurrencia(serie, fecha_original):
+        return Response({'error': 'fecha_original no es una ocurrencia de la serie.'}, status=status.HTTP_400_BAD_REQUEST)
+    guardada = Cita.objects.filter(serie=serie, fecha_original=fecha_original).values_list('pk', flat=True).first()
+    if guardada:
+        return Response(
+            {'error': 'Esa ocurrencia ya se modificó; edítala como cita.', 'cita': guardada},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    cita = Cita(
+        paciente_id=serie.paciente_id, medico_id=serie.medico_id, fecha_hora_propuesta=fecha_original,
+        duracion_minutos=serie.duracion_minutos, motivo=serie.motivo, estado=serie.estado,
+        serie=serie, fecha_original=fecha_original,
+    )
+    serializer = CitaSerializer(cita, data=request.data, partial=True)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    for campo in ('fecha_hora_propuesta', 'duracion_minutos', 'estado', 'motivo'):
+        if campo in serializer.validated_data:
+            setattr(cita, campo, serializer.validated_data[campo])
+    if cita.fecha_hora_propuesta == fecha_original:
+        # Sigue a la misma hora: conserva el recordatorio ya enviado de la ocurrencia
+        cita.recordatorio_enviado = RecordatorioSerie.objects.filter(
+            serie=serie, fecha_original=fecha_original
+        ).values_list('enviado', flat=True).first()
+    try:
+        with reserva_de_turno(cita):
+            with transaction.atomic():
+                cita.save()
+    except CitaSolapada as e:
+        return respuesta_cita_solapada(e)
+    except IntegrityError:
+        return Response({'error': 'Esa ocurrencia ya se modificó; edítala como cita.'}, status=status.HTTP_409_CONFLICT)
+    return Response(CitaSerializer(cita).data, status=status.HTTP_201_CREATED)
+
+
+def esperas_visibles(user):
+    """Entradas de lista de espera que ve el usuario (None si ninguna)."""
+    if user.is_staff:
+        return EsperaCita.objects.all()
+    if hasattr(user, 'medico'):
+        return EsperaCita.objects.filter(medico=user.medico)
+    if hasattr(user, 'paciente'):
+        return EsperaCita.objects.filter(paciente=user.paciente)
+    return None
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def lista_espera(request):
+    """
+    Lista de espera por médico: al cancelarse una cita futura, el turno se
+    ofrece al primero de la cola (ver api/lista_espera.py).
+    GET: entradas activas del usuario; el médico ve su cola en orden.
+    POST: el paciente se apunta con un médico ({"medico": id, "motivo": ...}).
+    Admin y médicos indican también paciente y pueden fijar la prioridad.
+    """
+    user = request.user
+    esperas = esperas_visibles(user)
+    if esperas is None:
+        return Response({'error': 'No tienes acceso a la lista de espera.'}, status=status.HTTP_403_FORBIDDEN)
+
+    if request.method == 'GET':
+        esperas = esperas.filter(estado__in=['esperando', 'ofrecida'])
+        medico_id = request.query_params.get('medico_id')
+        if user.is_staff and medico_id:
+            if not medico_id.isdigit():
+                return Response({'error': 'El parámetro medico_id debe ser un número válido.'}, status=status.HTTP_400_BAD_REQUEST)
+            esperas = esperas.filter(medico_id=medico_id)
+        esperas = esperas.select_related('paciente').order_by('medico_id', 'prioridad', 'fecha_solicitud', 'id')
+        return Response(EsperaCitaSerializer(esperas, many=True).data)
+
+    serializer = EsperaCitaSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    extra = {}
+    if hasattr(user, 'paciente') and not user.is_staff:
+        # El paciente se apunta a sí mismo y con prioridad normal
+        extra = {'paciente': user.paciente, 'prioridad': 3}
+    elif hasattr(user, 'medico') and not user.is_staff:
+        extra = {'medico': user.medico}
+    datos = {**serializer.validated_data, **extra}
+    if 'paciente' not in datos or 'medico' not in datos:
+        return Response({'error': 'Indica el paciente y el médico.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    activa = EsperaCita.objects.filter(
+        paciente=datos['paciente'], medico=datos['medico'], estado__in=['esperando', 'ofrecida'],
+    ).exists()
+    if not activa:
+        try:
+            with transaction.atomic():
+                serializer.save(**extra)
+        except IntegrityError:
+            activa = True
+    if activa:
+        return Response({'error': 'El paciente ya está en la lista de espera de este médico.'}, status=status.HTTP_409_CONFLICT)
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def gestionar_espera(request, espera_id):
+    """
+    GET: la entrada. DELETE: el paciente sale de la lista; si tenía un turno
+    ofrecido sin aceptar, el turno pasa al siguiente.
+    """
+    esperas = esperas_visibles(request.user)
+    espera = esperas.select_related('paciente', 'cita').filter(pk=espera_id).first() if esperas is not None else None
+    if espera is None:
+        return Response({'error': 'Entrada de lista de espera no encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+    if request.method == 'GET':
+        return Response(EsperaCitaSerializer(espera).data)
+
+    if espera.estado not in ('esperando', 'ofrecida'):
+        return Response({'error': 'La entrada ya no está activa.'}, status=status.HTTP_409_CONFLICT)
+    if cerrar_oferta(espera, 'retirada') is None:
+        return Response({'error': 'La entrada ya no está activa.'}, status=status.HTTP_409_CONFLICT)
+    return Response({'message': 'Salida de la lista de espera.'})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def responder_oferta_espera(request, espera_id):
+    """
+    El paciente acepta ({"aceptar": true}) o rechaza el turno ofrecido. Al
+    aceptarlo la cita queda confirmada; al rechazarlo o si el plazo ya
+    terminó, el turno pasa al siguiente de la cola.
+    """
+    user = request.user
+    if not hasattr(user, 'paciente'):
+        return Response({'error': 'Solo el paciente puede responder la oferta.'}, status=status.HTTP_403_FORBIDDEN)
+    espera = EsperaCita.objects.select_related('cita').filter(pk=espera_id, paciente=user.paciente).first()
+    if espera is None:
+        return Response({'error': 'Entrada de lista de espera no encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+
+    aceptar = request.data.get('aceptar')
+    if not isinstance(aceptar, bool):
+        return Response({'error': 'El campo aceptar debe ser true o false.'}, status=status.HTTP_400_BAD_REQUEST)
+    if espera.estado != 'ofrecida':
+        return Response({'error': 'No tienes un turno ofrecido en esta entrada.'}, status=status.HTTP_409_CONFLICT)
+    if espera.oferta_expira <= timezone.now():
+        cerrar_oferta(espera, 'vencida')
+        return Response({'error': 'El plazo para aceptar el turno terminó.'}, status=status.HTTP_409_CONFLICT)
+
+    if cerrar_oferta(espera, 'aceptada' if aceptar else 'rechazada') is None:
+        # La cerró a la vez otra petición o el vencimiento de ofertas
+        return Response({'error': 'La oferta ya se cerró.'}, status=status.HTTP_409_CONFLICT)
+    return Response(EsperaCitaSerializer(espera).data)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def crear_notificacion(request):
@@ -1193,24 +1688,219 @@ def crear_notificacion(request):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class PaginacionNotificaciones(CursorPaginacion):
+    opcional = False
+    page_size = 20
+    max_page_size = 100
+    ordering = ('-fecha', '-id')  # Índice notificacion_bandeja_idx
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def mis_notificaciones(request):
-    notificaciones = Notificacion.objects.filter(usuario=request.user).order_by('-fecha')
-    serializer = NotificacionSerializer(notificaciones, many=True)
-    return Response(serializer.data)
+    """
+    Bandeja de notificaciones del usuario, más recientes primero, paginada
+    por cursor sobre notificacion_bandeja_idx: cada página cuesta lo mismo
+    sin importar cuántas notificaciones acumule el usuario.
+    """
+    notificaciones = Notificacion.objects.filter(usuario=request.user)
+    paginador = PaginacionNotificaciones()
+    pagina = paginador.paginate_queryset(notificaciones, request)
+    return paginador.get_paginated_response(NotificacionSerializer(pagina, many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notificaciones_archivadas(request):
+    """
+    Notificaciones leídas que `manage.py archivar_notificaciones` sacó de la
+    bandeja por antigüedad. Solo se consultan a petición, con la misma
+    paginación por cursor, sobre archivada_bandeja_idx.
+    """
+    archivadas = NotificacionArchivada.objects.filter(usuario=request.user)
+    paginador = PaginacionNotificaciones()
+    pagina = paginador.paginate_queryset(archivadas, request)
+    return paginador.get_paginated_response(NotificacionArchivadaSerializer(pagina, many=True).data)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def difusiones(request):
+    """
+    Notificación con plantilla a toda una audiencia (ver api/difusion.py).
+    GET: difusiones enviadas; el admin ve todas, el médico las suyas.
+    POST: {"titulo", "mensaje", "tipo", "variables", "audiencia"}. Las
+    plantillas solo admiten marcadores: {{ nombre }} y {{ apellido }} del
+    destinatario más las variables; cualquier otra sintaxis es un 400. La audiencia puede ser los pacientes de
+    un médico, los usuarios de un rol o los pacientes con citas en una fecha;
+    el médico solo escribe a sus propios pacientes.
+    Hasta MAX_INMEDIATA destinatarios se envía al momento (201); con más,
+    responde 202 y la envía `manage.py enviar_difusiones`. El progreso se
+    consulta en /api/notificaciones/difusion/<id>/.
+    """
+    user = request.user
+    es_medico = hasattr(user, 'medico') and not user.is_staff
+    if not (user.is_staff or es_medico):
+        return Response({'error': 'Solo médicos y administradores envían difusiones.'}, status=status.HTTP_403_FORBIDDEN)
+
+    if request.method == 'GET':
+        enviadas = Difusion.objects.all() if user.is_staff else Difusion.objects.filter(autor=user)
+        paginador = CursorPaginacion()
+        pagina = paginador.paginate_queryset(enviadas, request)
+        if pagina is not None:
+            return paginador.get_paginated_response(DifusionSerializer(pagina, many=True).data)
+        return Response(DifusionSerializer(enviadas.order_by('-id'), many=True).data)
+
+    serializer = DifusionSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    datos = serializer.validated_data
+    audiencia = datos['audiencia']
+    if es_medico:
+        if not isinstance(audiencia, dict) or audiencia.get('tipo') == 'rol':
+            return Response({'error': 'Los médicos solo pueden escribir a sus pacientes.'}, status=status.HTTP_403_FORBIDDEN)
+        audiencia = {**audiencia, 'medico_id': user.medico.pk}
+
+    try:
+        difusion = crear_difusion(
+            user, datos.get('tipo'), datos['titulo'], datos['mensaje'], audiencia, datos.get('variables'),
+        )
+    except DifusionInvalida as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if difusion.total > MAX_INMEDIATA:
+        return Response(DifusionSerializer(difusion).data, status=status.HTTP_202_ACCEPTED)
+    difusion = procesar_difusion(difusion.pk) or difusion
+    return Response(DifusionSerializer(difusion).data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def detalle_difusion(request, difusion_id):
+    """Estado y progreso (enviadas de total) de una difusión."""
+    difusion = Difusion.objects.filter(pk=difusion_id).first()
+    if difusion is None or not (request.user.is_staff or difusion.autor_id == request.user.pk):
+        return Response({'error': 'Difusión no encontrada.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(DifusionSerializer(difusion).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def contar_no_leidas(request):
+    """
+    Número de notificaciones sin leer, para la campana del menú. Se cuenta
+    sobre el índice parcial notificacion_no_leidas_idx, que solo contiene las
+    no leídas: el coste no crece con el historial ya leído.
+    """
+    no_leidas = Notificacion.objects.filter(usuario=request.user, leida=False).count()
+    return Response({'no_leidas': no_leidas})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def ticket_eventos(request):
+    """
+    Ticket de un solo uso para abrir /api/eventos/?ticket=... desde
+    EventSource, que no puede enviar la cabecera Authorization. Así el
+    access token no viaja en la URL ni queda en los logs de acceso.
+    """
+    return Response({'ticket': emitir_ticket(request.user), 'expira_en': DURACION_TICKET})
+
+
+@require_GET
+async def eventos(request):
+    """
+    Canal de eventos en tiempo real (Server-Sent Events): notificaciones
+    nuevas y cambios de estado de las citas del usuario. Se autentica con un
+    ticket de /api/eventos/ticket/ en ``?ticket=`` o con el access token en
+    la cabecera Authorization.
+
+    Es una vista asíncrona: bajo un servidor ASGI (uvicorn, ver
+    proyecto/asgi.py) cada conexión inactiva es una corrutina esperando en
+    su cola, no un hilo. Bajo WSGI Django consumiría el stream entero antes
+    de enviar nada y el worker quedaría ocupado hasta que venciera: se
+    responde 503 en lugar de colgarse.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'El canal de eventos necesita un servidor ASGI (uvicorn proyecto.asgi:application).'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    usuario, expira = await usuario_del_stream(request)
+    if usuario is None:
+        return JsonResponse({'error': 'Ticket o token inválido o ausente.'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    response = StreamingHttpResponse(flujo_eventos(usuario.pk, expira), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # que nginx no acumule el stream
+    return response
+
+def _no_leidas_tras_marcar(usuario, marcadas):
+    """
+    Número de no leídas tras marcar ``marcadas`` (contado sobre
+    notificacion_no_leidas_idx). Si cambió, se envía también a las otras
+    pestañas del usuario por el canal de eventos.
+    """
+    no_leidas = Notificacion.objects.filter(usuario=usuario, leida=False).count()
+    if marcadas:
+        publicar([usuario.pk], 'no_leidas', {'no_leidas': no_leidas})
+    return no_leidas
+
 
 @api_view(['PATCH'])
 @permission_classes([IsAuthenticated])
 def marcar_notificacion_leida(request, notificacion_id):
     """
-    Marca una notificación como leída
+    Marca una notificación como leída con un UPDATE y devuelve el nuevo
+    número de no leídas.
     """
-    try:
-        notificacion = Notificacion.objects.get(id=notificacion_id, usuario=request.user)
-    except Notificacion.DoesNotExist:
+    notificacion = Notificacion.objects.filter(id=notificacion_id, usuario=request.user)
+    marcadas = notificacion.filter(leida=False).update(leida=True)
+    if not marcadas and not notificacion.exists():
         return Response({'error': 'Notificación no encontrada'}, status=404)
+    no_leidas = _no_leidas_tras_marcar(request.user, marcadas)
+    return Response({'message': 'Notificación marcada como leída', 'no_leidas': no_leidas})
+
 
-    notificacion.leida = True
-    notificacion.save()
-    return Response({'message': 'Notificación marcada como leída'})
\ No newline at end of file
+# Ids por petición en marcar_notificaciones_leidas; para más, usar "hasta"
+MAX_IDS_LEIDAS = 1000
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def marcar_notificaciones_leidas(request):
+    """
+    Marca varias notificaciones del usuario como leídas con un solo UPDATE:
+    {"ids": [...]} o {"hasta": "2030-01-07T10:00:00Z"} (todas las recibidas
+    hasta ese momento; el cliente envía la fecha de la más reciente que
+    mostró, así no marca las que llegaron después). Devuelve cuántas se
+    marcaron y el nuevo número de no leídas.
+    """
+    ids, hasta = request.data.get('ids'), request.data.get('hasta')
+    if (ids is None) == (hasta is None):
+        return Response({'error': 'Indica ids o hasta (solo uno).'}, status=status.HTTP_400_BAD_REQUEST)
+
+    notificaciones = Notificacion.objects.filter(usuario=request.user)
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return Response({'error': 'ids debe ser una lista de números.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > MAX_IDS_LEIDAS:
+            return Response(
+                {'error': f'Como máximo {MAX_IDS_LEIDAS} ids por petición; usa hasta para marcar todas.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        notificaciones = notificaciones.filter(id__in=ids)
+    else:
+        try:
+            hasta = parse_datetime(str(hasta))
+        except ValueError:
+            hasta = None
+        if hasta is None:
+            return Response({'error': 'Formato de hasta inválido. Usa ISO 8601.'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(hasta):
+            hasta = timezone.make_aware(hasta)
+        notificaciones = notificaciones.filter(fecha__lte=hasta)
+
+    marcadas = notificaciones.filter(leida=False).update(leida=True)
+    return Response({'marcadas': marcadas, 'no_leidas': _no_leidas_tras_marcar(request.user, marcadas)})
\ No newline at end of file
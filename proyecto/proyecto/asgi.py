@@ -3,6 +3,20 @@ ASGI config for proyecto project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+/api/eventos/ (Server-Sent Events) necesita un servidor ASGI para mantener
+las conexiones abiertas sin un hilo por cliente. Bajo WSGI (gunicorn sin
+worker de uvicorn, ``manage.py runserver``) esa ruta responde 503. Para
+servir toda la API por ASGI (uvicorn está en requirements.txt):
+
+    uvicorn proyecto.asgi:application --host 0.0.0.0 --port 8000
+
+o, con varios procesos bajo gunicorn:
+
+    gunicorn proyecto.asgi:application -k uvicorn.workers.UvicornWorker -w 4
+
+Con varios workers, EVENTOS_BACKEND=api.eventos.PostgresEventos y una
+caché compartida (CACHE_BACKEND), donde se anotan los tickets ya usados.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
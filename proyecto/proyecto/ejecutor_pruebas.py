@@ -0,0 +1,22 @@
+# proyecto/ejecutor_pruebas.py
+from django.test.runner import DiscoverRunner
+
+# Etiquetas que solo se ejecutan si se piden con --tag
+EXCLUIDAS_POR_DEFECTO = {
+    'benchmark',    # cargan cientos de miles de filas
+    'presupuesto',  # comparan tiempos registrados en otra máquina (api/presupuestos_rendimiento.json)
+}
+
+
+class EjecutorPruebas(DiscoverRunner):
+    """
+    Igual que el ejecutor de Django, pero sin las pruebas marcadas con las
+    etiquetas de EXCLUIDAS_POR_DEFECTO. Se ejecutan pidiéndolas, p. ej.
+    ``python manage.py test api --tag benchmark``.
+    """
+
+    def __init__(self, *args, tags=None, exclude_tags=None, **kwargs):
+        excluidas = EXCLUIDAS_POR_DEFECTO - set(tags or ())
+        if excluidas:
+            exclude_tags = {*(exclude_tags or ()), *excluidas}
+        super().__init__(*args, tags=tags, exclude_tags=exclude_tags, **kwargs)
@@ -64,19 +64,53 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'proyecto.wsgi.application'
 
+# `manage.py test` omite las pruebas @tag('benchmark') y @tag('presupuesto'); se piden con --tag
+TEST_RUNNER = 'proyecto.ejecutor_pruebas.EjecutorPruebas'
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-DATABASES = {
+DB_ENGINE = config('DB_ENGINE', default='django.db.backends.postgresql')
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    # Desarrollo local y suite de rendimiento sin servidor: DB_ENGINE=django.db.backends.sqlite3
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST'),
+            'PORT': config('DB_PORT', cast=int),
+        }
+    }
+
+# Cache
+# En producción con varios workers conviene un caché compartido, p. ej.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache y CACHE_LOCATION=redis://...
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': config('DB_NAME'),
-        'USER': config('DB_USER'),
-        'PASSWORD': config('DB_PASSWORD'),
-        'HOST': config('DB_HOST'),
-        'PORT': config('DB_PORT', cast=int),
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='sistema-medico'),
     }
 }
 
+# Eventos en tiempo real (api/eventos.py)
+# MemoriaEventos reparte dentro del proceso: basta con un solo worker ASGI.
+# Con varios workers usar api.eventos.PostgresEventos (LISTEN/NOTIFY).
+# Requiere servir con uvicorn (ver proyecto/asgi.py); bajo WSGI responde 503.
+EVENTOS_BACKEND = config('EVENTOS_BACKEND', default='api.eventos.MemoriaEventos')
+
+# Retención de notificaciones (api/retencion.py): las leídas con más de estos
+# días pasan a NotificacionArchivada con `manage.py archivar_notificaciones`
+NOTIFICACIONES_DIAS_RETENCION = config('NOTIFICACIONES_DIAS_RETENCION', default=90, cast=int)
+
 # Password validation
 #  https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -99,6 +133,9 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # Paginación por cursor: solo se aplica si el cliente envía ?cursor= o ?page_size=
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CursorPaginacion',
+    'PAGE_SIZE': 50,
 }
 
 # JWT Settings